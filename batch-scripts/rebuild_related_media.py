@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Rebuild Related Media"
+_script_description = """Use this script to precompute the related media for
+all published media items (see mediadrop.model.related_media).
+
+Specify your ini config file as the first argument to this script.
+
+Media pages compute missing entries on demand so running this script is
+optional. It is useful after an upgrade or to refresh all entries at a time
+with little traffic (e.g. from cron)."""
+DEBUG = False
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+
+from pylons import app_globals
+
+
+def main(parser, options, args):
+    from mediadrop.model import DBSession, Media
+    index = app_globals.related_media
+    media_ids = [row[0] for row in Media.query.published().order_by(None).values(Media.id)]
+    print 'Computing related media for %d media items' % len(media_ids)
+    for media_id in media_ids:
+        media = Media.query.get(media_id)
+        related_ids = index.update(media)
+        if DEBUG:
+            print 'media %d: %r' % (media_id, related_ids)
+        # do not keep all media instances in the session
+        DBSession.expunge_all()
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option(
+        '--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    if len(cmd.args) < 1:
+        print 'usage: %s <ini>' % sys.argv[0]
+        sys.exit(1)
+    DEBUG = cmd.options.debug
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Recount Media Counters"
+_script_description = """Use this script to recompute the stored media and
+comment counters of all tags, categories, podcasts and media items (see
+mediadrop.model.counters).
+
+Specify your ini config file as the first argument to this script.
+
+The counters are updated automatically whenever media or comments are changed.
+Run this script to repair the counters after the database was modified
+directly and periodically (e.g. from cron) to update the published media
+counts of media with scheduled publish dates."""
+DEBUG = False
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import sys
+
+
+def main(parser, options, args):
+    from mediadrop.model import DBSession
+    from mediadrop.model.counters import recount_all
+    recount_all(DBSession.connection())
+    DBSession.commit()
+    if DEBUG:
+        print 'Recomputed all media and comment counters'
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option(
+        '--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    load_app(cmd)
+    if len(cmd.args) < 1:
+        print 'usage: %s <ini>' % sys.argv[0]
+        sys.exit(1)
+    DEBUG = cmd.options.debug
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from mediadrop.lib.cli_commands import LoadAppCommand, load_app
+
+_script_name = "Run Benchmarks"
+_script_description = """Use this script to measure the performance of
+MediaDrop with a synthetic media library (see mediadrop.benchmarks).
+
+Specify your ini config file as the first argument to this script. Use a
+dedicated database (SQLite or a local MySQL server, see "sqlalchemy.url")
+which was initialized with "paster setup-app" as the generated media items
+are never removed.
+
+    run_benchmarks.py bench.ini --generate=100k --save-baseline=base.json
+    run_benchmarks.py bench.ini --baseline=base.json
+
+The script prints latency percentiles, SQL query counts and the peak RSS per
+scenario. It exits with status 1 if the run is slower, runs more queries or
+uses more memory than the given baseline."""
+DEBUG = False
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import logging
+import os
+import sys
+
+
+def main(parser, options, args):
+    from paste.deploy import loadapp
+    from mediadrop.benchmarks import (BenchmarkRunner, compare_results,
+        default_scenarios, format_report, LibraryGenerator, load_results,
+        save_results, SCALES)
+    from mediadrop.model import DBSession, Media
+
+    if options.generate:
+        nr_media = dict(SCALES).get(options.generate.lower()) or int(options.generate)
+        generator = LibraryGenerator(seed=options.seed)
+        generator.generate(nr_media)
+        if DEBUG:
+            print 'Generated %d media items' % nr_media
+
+    app = loadapp('config:' + os.path.abspath(args[0]))
+    scenarios = default_scenarios(seed=options.seed)
+    if options.scenarios:
+        names = set(options.scenarios.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario.name in names]
+    results = dict(nr_media=Media.query.count())
+    DBSession.close()
+
+    runner = BenchmarkRunner(app, DBSession.bind, repeat=options.repeat)
+    results.update(runner.run(scenarios))
+    print 'media items: %d' % results['nr_media']
+    print format_report(results)
+
+    if options.save_baseline:
+        save_results(options.save_baseline, results)
+    if options.baseline:
+        baseline = load_results(options.baseline)
+        try:
+            regressions = compare_results(results, baseline)
+        except ValueError, e:
+            print >> sys.stderr, 'ERROR: %s' % e
+            sys.exit(2)
+        if regressions:
+            print >> sys.stderr, 'REGRESSIONS:'
+            for regression in regressions:
+                print >> sys.stderr, '  ' + regression
+            sys.exit(1)
+        print 'no regressions compared to %s' % options.baseline
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option(
+        '--debug',
+        action='store_true',
+        dest='debug',
+        help='Write debug output to STDOUT.',
+        default=False
+    )
+    cmd.parser.add_option(
+        '--generate',
+        dest='generate',
+        help='Add a synthetic library before the benchmark (1k, 100k, 1m or a number of media items).',
+        default=None
+    )
+    cmd.parser.add_option(
+        '--seed',
+        type='int',
+        dest='seed',
+        help='Seed for the library generation and the sampled URLs.',
+        default=42
+    )
+    cmd.parser.add_option(
+        '--repeat',
+        type='int',
+        dest='repeat',
+        help='Number of measured requests per URL.',
+        default=5
+    )
+    cmd.parser.add_option(
+        '--scenarios',
+        dest='scenarios',
+        help='Comma separated names of the scenarios to run (default: all).',
+        default=None
+    )
+    cmd.parser.add_option(
+        '--baseline',
+        dest='baseline',
+        help='Compare the results with this baseline file.',
+        default=None
+    )
+    cmd.parser.add_option(
+        '--save-baseline',
+        dest='save_baseline',
+        help='Store the results in this file.',
+        default=None
+    )
+    load_app(cmd)
+    if len(cmd.args) < 1:
+        print 'usage: %s <ini>' % sys.argv[0]
+        sys.exit(1)
+    DEBUG = cmd.options.debug
+    if DEBUG:
+        logging.getLogger('mediadrop.benchmarks').setLevel(logging.INFO)
+    main(cmd.parser, cmd.options, cmd.args)
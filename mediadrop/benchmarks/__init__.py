@@ -0,0 +1,27 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Benchmarks
+
+Reproducible performance measurements for MediaDrop:
+
+1. :class:`~mediadrop.benchmarks.library.LibraryGenerator` creates a
+   synthetic library (1k, 100k or 1M media) in the configured database
+   (SQLite or MySQL).
+2. :class:`~mediadrop.benchmarks.runner.BenchmarkRunner` requests the URLs
+   of the :func:`~mediadrop.benchmarks.scenarios.default_scenarios` from the
+   complete WSGI stack in the same process and records latency percentiles
+   and SQL query counts per scenario as well as the peak RSS.
+3. :func:`~mediadrop.benchmarks.runner.compare_results` compares a run with
+   a stored baseline.
+
+``batch-scripts/run_benchmarks.py`` combines these steps.
+"""
+
+from mediadrop.benchmarks.library import *
+from mediadrop.benchmarks.runner import *
+from mediadrop.benchmarks.scenarios import *
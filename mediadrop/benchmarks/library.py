@@ -0,0 +1,236 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Synthetic Media Libraries
+
+:class:`LibraryGenerator` fills the configured database with a reproducible
+(seeded) library of published and unpublished media including files, tags,
+categories, podcasts and comments.
+
+Categories and podcasts are few so they are created through the models (e.g.
+:meth:`Category.example`) which keeps the category closure table up to date.
+Media, files, tags and comments are inserted in batches without the ORM:
+``Media.example`` flushes every item and looks up a free slug which would
+take hours for a million media items. All counters are recomputed at the end
+(see :func:`mediadrop.model.counters.recount_all`).
+"""
+
+from datetime import datetime, timedelta
+import logging
+import random
+
+from sqlalchemy import sql
+
+from mediadrop.lib.storage import RemoteURLStorage
+from mediadrop.model import (Author, Category, DBSession,
+    get_available_slug, Media, Podcast, slugify)
+from mediadrop.model.comments import comments
+from mediadrop.model.counters import recount_all
+from mediadrop.model.media import (media, media_categories, media_files,
+    media_tags)
+from mediadrop.model.tags import tags
+
+
+__all__ = ['LibraryGenerator', 'SCALES', 'WORDS']
+
+log = logging.getLogger(__name__)
+
+# number of media items per named scale
+SCALES = (
+    ('1k', 1000),
+    ('100k', 100000),
+    ('1m', 1000000),
+)
+
+# titles, descriptions and tags are built from these words so the search
+# scenario finds a predictable share of the library
+WORDS = (
+    u'amazing', u'animal', u'autumn', u'banana', u'beach', u'bicycle',
+    u'bridge', u'camera', u'castle', u'chess', u'city', u'cloud', u'concert',
+    u'cooking', u'dance', u'desert', u'dragon', u'engine', u'festival',
+    u'forest', u'garden', u'guitar', u'harbor', u'history', u'island',
+    u'jungle', u'kitchen', u'lake', u'lecture', u'library', u'lighthouse',
+    u'market', u'meadow', u'mountain', u'museum', u'night', u'ocean',
+    u'orchestra', u'painting', u'piano', u'planet', u'puzzle', u'rain',
+    u'river', u'robot', u'rocket', u'science', u'snow', u'soccer', u'space',
+    u'spring', u'storm', u'summer', u'sunset', u'theater', u'tiger',
+    u'train', u'travel', u'tutorial', u'valley', u'village', u'volcano',
+    u'waterfall', u'winter', u'workshop', u'zebra',
+)
+
+class LibraryGenerator(object):
+    """Insert a synthetic library into the database of ``DBSession``.
+
+    :param seed: Seed of the random number generator (the same seed and
+        size always produce the same library, dates are relative to the
+        time of the generation).
+    :param batch_size: Number of media items inserted per transaction.
+    """
+    published_ratio = 0.9
+    podcast_ratio = 0.1
+    max_tags_per_media = 5
+    max_comments_per_media = 5
+
+    def __init__(self, seed=42, batch_size=1000):
+        self.seed = seed
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+    def generate(self, nr_media):
+        """Add ``nr_media`` media items (and all related objects).
+
+        :returns: The ids of the generated media.
+        """
+        category_ids = self._create_categories(max(5, min(200, nr_media // 500)))
+        podcast_ids = self._create_podcasts(max(1, min(100, nr_media // 1000)))
+        tag_ids = self._create_tags(max(len(WORDS), min(20000, nr_media // 10)))
+        storage_id = DBSession.query(RemoteURLStorage).first().id
+        DBSession.commit()
+
+        first_id = (DBSession.query(sql.func.max(Media.id)).scalar() or 0) + 1
+        media_ids = range(first_id, first_id + nr_media)
+        for start in range(0, nr_media, self.batch_size):
+            batch = media_ids[start:start + self.batch_size]
+            self._insert_media(batch, category_ids, podcast_ids, tag_ids, storage_id)
+            DBSession.commit()
+            log.info('inserted %d/%d media', start + len(batch), nr_media)
+        recount_all(DBSession.connection())
+        DBSession.commit()
+        return media_ids
+
+    def _words(self, nr_words):
+        return u' '.join(self.random.choice(WORDS) for i in range(nr_words))
+
+    def _create_categories(self, nr_categories):
+        roots = []
+        category_ids = []
+        for i in range(nr_categories):
+            name = u'%s %d' % (self._words(1).title(), i)
+            # a quarter of the categories are top level categories
+            if i % 4 == 0:
+                parent = None
+            else:
+                parent = self.random.choice(roots)
+            category = Category.example(name=name, parent_id=parent and parent.id)
+            if parent is None:
+                roots.append(category)
+            category_ids.append(category.id)
+        return category_ids
+
+    def _create_podcasts(self, nr_podcasts):
+        podcast_ids = []
+        for i in range(nr_podcasts):
+            podcast = Podcast()
+            podcast.title = self._words(2).title()
+            podcast.slug = get_available_slug(Podcast, podcast.title)
+            podcast.description = self._words(30)
+            podcast.author = Author(u'Podcaster %d' % i, u'podcast%d@site.example' % i)
+            DBSession.add(podcast)
+            DBSession.flush()
+            podcast_ids.append(podcast.id)
+        return podcast_ids
+
+    def _create_tags(self, nr_tags):
+        names = []
+        for i in range(nr_tags):
+            if i < len(WORDS):
+                names.append(WORDS[i])
+            else:
+                names.append(u'%s %d' % (self.random.choice(WORDS), i))
+        existing = set()
+        for chunk in _chunks(names, 500):
+            query = sql.select([tags.c.name]).where(tags.c.name.in_(chunk))
+            existing.update(name for (name,) in DBSession.execute(query))
+        rows = [dict(name=name, slug=slugify(name)) for name in names
+                if name not in existing]
+        if rows:
+            DBSession.execute(tags.insert(), rows)
+        tag_ids = []
+        for chunk in _chunks(names, 500):
+            query = sql.select([tags.c.id]).where(tags.c.name.in_(chunk))
+            tag_ids.extend(tag_id for (tag_id,) in DBSession.execute(query))
+        return tag_ids
+
+    def _insert_media(self, media_ids, category_ids, podcast_ids, tag_ids, storage_id):
+        rnd = self.random
+        media_rows = []
+        file_rows = []
+        tag_rows = []
+        category_rows = []
+        comment_rows = []
+        for media_id in media_ids:
+            created_on = self.now - timedelta(seconds=rnd.randint(3600, 3 * 365 * 86400))
+            published = rnd.random() < self.published_ratio
+            title = self._words(rnd.randint(2, 6)).title()
+            description = self._words(rnd.randint(10, 60))
+            views = int(rnd.paretovariate(1.2)) * 10
+            media_rows.append(dict(
+                id=media_id,
+                type=u'video',
+                slug=u'media-%d' % media_id,
+                podcast_id=(rnd.random() < self.podcast_ratio) and rnd.choice(podcast_ids) or None,
+                reviewed=published,
+                encoded=True,
+                publishable=published,
+                created_on=created_on,
+                modified_on=created_on,
+                publish_on=published and created_on or None,
+                title=title,
+                subtitle=None,
+                description=u'<p>%s</p>' % description,
+                description_plain=description,
+                duration=rnd.randint(10, 3600),
+                views=views,
+                likes=views // 20,
+                dislikes=views // 100,
+                popularity_points=views // 20,
+                popularity_likes=views // 20,
+                popularity_dislikes=views // 100,
+                author_name=u'Author %d' % rnd.randint(1, 500),
+                author_email=u'author@site.example',
+            ))
+            for i in range(rnd.randint(1, 2)):
+                file_rows.append(dict(
+                    media_id=media_id,
+                    storage_id=storage_id,
+                    type=u'video',
+                    container=i and u'webm' or u'mp4',
+                    display_name=u'media-%d-%d.%s' % (media_id, i, i and u'webm' or u'mp4'),
+                    unique_id=u'http://media.example/%d/%d' % (media_id, i),
+                    size=rnd.randint(10**6, 10**9),
+                    created_on=created_on,
+                    modified_on=created_on,
+                ))
+            for tag_id in rnd.sample(tag_ids, rnd.randint(0, self.max_tags_per_media)):
+                tag_rows.append(dict(media_id=media_id, tag_id=tag_id))
+            for category_id in rnd.sample(category_ids, rnd.randint(1, 2)):
+                category_rows.append(dict(media_id=media_id, category_id=category_id))
+            for i in range(rnd.randint(0, self.max_comments_per_media)):
+                comment_on = created_on + timedelta(seconds=rnd.randint(60, 86400))
+                comment_rows.append(dict(
+                    media_id=media_id,
+                    subject=u'Re: %s' % title[:90],
+                    created_on=comment_on,
+                    modified_on=comment_on,
+                    reviewed=True,
+                    publishable=rnd.random() < 0.9,
+                    author_name=u'Commenter %d' % rnd.randint(1, 5000),
+                    author_email=u'commenter@site.example',
+                    author_ip=rnd.randint(1, 2**32 - 1),
+                    body=self._words(rnd.randint(5, 40)),
+                ))
+        DBSession.execute(media.insert(), media_rows)
+        for table, rows in ((media_files, file_rows), (media_tags, tag_rows),
+                            (media_categories, category_rows), (comments, comment_rows)):
+            if rows:
+                DBSession.execute(table.insert(), rows)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,197 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import json
+import logging
+import resource
+import time
+
+from sqlalchemy import event
+from webtest import TestApp
+
+from mediadrop.model import DBSession
+
+
+__all__ = ['BenchmarkRunner', 'compare_results', 'format_report',
+    'load_results', 'ScenarioResult', 'save_results']
+
+log = logging.getLogger(__name__)
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process (in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ScenarioResult(object):
+    """Latencies (in milliseconds) and query counts of all measured requests
+    of one scenario."""
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.queries = []
+        self.errors = []
+
+    def add(self, url, status, duration, nr_queries):
+        self.latencies.append(duration * 1000)
+        self.queries.append(nr_queries)
+        if status >= 400:
+            self.errors.append('%s: %d' % (url, status))
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        index = int(round((len(latencies) - 1) * percent / 100.0))
+        return latencies[index]
+
+    def as_dict(self):
+        requests = len(self.latencies)
+        return dict(
+            requests=requests,
+            mean_ms=requests and sum(self.latencies) / requests or 0,
+            p50_ms=self.percentile(50),
+            p95_ms=self.percentile(95),
+            p99_ms=self.percentile(99),
+            queries_mean=requests and float(sum(self.queries)) / requests or 0,
+            queries_max=max(self.queries or [0]),
+            errors=len(self.errors),
+        )
+
+
+class BenchmarkRunner(object):
+    """Request the URLs of :class:`~mediadrop.benchmarks.scenarios.Scenario`
+    instances from the WSGI app in this process.
+
+    :param app: The full WSGI stack (e.g. from ``paste.deploy.loadapp``).
+    :param engine: SQLAlchemy engine of the app (queries are counted).
+    :param repeat: Number of measured rounds over the URLs of a scenario.
+    :param warmup: Number of rounds before the measurement (fills caches).
+    :param admin_credentials: User name and password for admin scenarios.
+    """
+    def __init__(self, app, engine, repeat=5, warmup=1,
+                 admin_credentials=(u'admin', u'admin')):
+        self.wsgi_app = _report_errors(app)
+        self.app = TestApp(self.wsgi_app, lint=False)
+        self.admin_app = None
+        self.repeat = repeat
+        self.warmup = warmup
+        self.admin_credentials = admin_credentials
+        self._nr_queries = 0
+        event.listen(engine, 'before_cursor_execute', self._count_query)
+        # only connections which are checked out later report their queries
+        DBSession.close()
+
+    def _count_query(self, *args):
+        self._nr_queries += 1
+
+    def _admin_app(self):
+        if self.admin_app is None:
+            self.admin_app = TestApp(self.wsgi_app, lint=False)
+            user_name, password = self.admin_credentials
+            self.admin_app.post('/login/submit',
+                {'login': user_name, 'password': password}, status='*')
+        return self.admin_app
+
+    def request(self, app, url):
+        """Request ``url`` and return the status code, the duration (in
+        seconds) and the number of executed SQL statements."""
+        self._nr_queries = 0
+        started = time.time()
+        response = app.get(url, status='*', expect_errors=True)
+        duration = time.time() - started
+        return response.status_int, duration, self._nr_queries
+
+    def run_scenario(self, scenario):
+        app = scenario.admin and self._admin_app() or self.app
+        result = ScenarioResult(scenario.name)
+        for i in range(self.warmup):
+            for url in scenario.urls:
+                self.request(app, url)
+        for i in range(self.repeat):
+            for url in scenario.urls:
+                status, duration, nr_queries = self.request(app, url)
+                result.add(url, status, duration, nr_queries)
+        for error in sorted(set(result.errors)):
+            log.warning('%s: %s', scenario.name, error)
+        return result
+
+    def run(self, scenarios):
+        """Run all scenarios and return the results as dict (see
+        :func:`save_results`)."""
+        results = dict(scenarios={})
+        for scenario in scenarios:
+            log.info('running scenario %s', scenario.name)
+            results['scenarios'][scenario.name] = self.run_scenario(scenario).as_dict()
+        results['peak_rss_kb'] = peak_rss_kb()
+        return results
+
+
+def _report_errors(app):
+    # webtest asks the error middleware to raise exceptions but a server
+    # error should count as failed request instead of aborting the run
+    def error_reporting_app(environ, start_response):
+        environ.pop('paste.throw_errors', None)
+        return app(environ, start_response)
+    return error_reporting_app
+
+def save_results(path, results):
+    with open(path, 'wb') as results_fp:
+        json.dump(results, results_fp, indent=2, sort_keys=True)
+
+def load_results(path):
+    with open(path, 'rb') as results_fp:
+        return json.load(results_fp)
+
+def compare_results(results, baseline, latency_tolerance=0.2, min_latency_delta=2.0,
+                    rss_tolerance=0.1):
+    """Return a list of regressions of ``results`` compared to ``baseline``.
+
+    A scenario regressed if its median or 95th percentile latency is more
+    than ``latency_tolerance`` (relative) and ``min_latency_delta`` (ms)
+    slower or if any request executed more SQL statements than the worst
+    request of the baseline. The peak RSS may grow by ``rss_tolerance``.
+
+    :raises ValueError: If the baseline was recorded for a different library.
+    """
+    if baseline.get('nr_media') != results.get('nr_media'):
+        raise ValueError('baseline was recorded with %s media, this run used %s' %
+            (baseline.get('nr_media'), results.get('nr_media')))
+    regressions = []
+    for name, base in sorted(baseline['scenarios'].items()):
+        current = results['scenarios'].get(name)
+        if current is None:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            limit = base[key] * (1 + latency_tolerance)
+            if (current[key] > limit) and (current[key] - base[key] > min_latency_delta):
+                regressions.append('%s: %s is %.1f ms (baseline: %.1f ms)' %
+                    (name, key[:3], current[key], base[key]))
+        if current['queries_max'] > base['queries_max']:
+            regressions.append('%s: up to %d queries per request (baseline: %d)' %
+                (name, current['queries_max'], base['queries_max']))
+        if current['errors'] > base['errors']:
+            regressions.append('%s: %d failed requests (baseline: %d)' %
+                (name, current['errors'], base['errors']))
+    base_rss = baseline.get('peak_rss_kb')
+    if base_rss and results['peak_rss_kb'] > base_rss * (1 + rss_tolerance):
+        regressions.append('peak RSS is %d KB (baseline: %d KB)' %
+            (results['peak_rss_kb'], base_rss))
+    return regressions
+
+def format_report(results):
+    """Return the results as plain text table."""
+    header = '%-12s %6s %9s %9s %9s %9s %9s %7s' % ('scenario', 'reqs',
+        'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors')
+    lines = [header, '-' * len(header)]
+    for name, result in sorted(results['scenarios'].items()):
+        lines.append('%-12s %6d %9.1f %9.1f %9.1f %9.1f %9.1f %7d' % (name,
+            result['requests'], result['mean_ms'], result['p50_ms'],
+            result['p95_ms'], result['p99_ms'], result['queries_mean'],
+            result['errors']))
+    lines.append('')
+    lines.append('peak RSS: %d KB' % results['peak_rss_kb'])
+    return '\n'.join(lines) + '\n'
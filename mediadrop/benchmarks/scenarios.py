@@ -0,0 +1,77 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import random
+from urllib import urlencode
+
+from sqlalchemy import sql
+
+from mediadrop.benchmarks.library import WORDS
+from mediadrop.model import Category, DBSession, Media
+from mediadrop.model.settings_snapshot import current_settings
+
+
+__all__ = ['default_scenarios', 'Scenario']
+
+class Scenario(object):
+    """A named list of URLs which are requested in turn.
+
+    :param admin: True to request the URLs as logged in administrator.
+    """
+    def __init__(self, name, urls, admin=False):
+        self.name = name
+        self.urls = list(urls)
+        self.admin = admin
+
+    def __repr__(self):
+        return '<Scenario: %s (%d urls)>' % (self.name, len(self.urls))
+
+
+def default_scenarios(sample_size=10, seed=42):
+    """Return the standard scenarios for the library in the database.
+
+    Media and categories are sampled with the given seed so the same library
+    always results in the same URLs."""
+    rnd = random.Random(seed)
+    media_slugs = _sample_media_slugs(rnd, sample_size)
+    category_slugs = [slug for (slug,) in
+        DBSession.query(Category.slug).order_by(Category.id)]
+    category_slugs = rnd.sample(category_slugs, min(sample_size, len(category_slugs)))
+    api_key = current_settings().get('api_secret_key') or u''
+
+    def api_url(**params):
+        params['api_key'] = api_key
+        return '/api/media/index?' + urlencode(params)
+
+    return [
+        Scenario('explore', ['/']),
+        Scenario('library', ['/media', '/media?page=2', '/media?page=50',
+            '/media?show=popular', '/media?show=featured']),
+        Scenario('search', ['/media?' + urlencode({'q': word.encode('utf-8')})
+            for word in rnd.sample(WORDS, sample_size)]),
+        Scenario('view', ['/media/%s' % slug for slug in media_slugs]),
+        Scenario('api', [api_url(), api_url(limit=50),
+            api_url(limit=50, order='views desc'), api_url(offset=1000)]),
+        Scenario('feeds', ['/sitemap.xml', '/mrss.xml', '/latest.xml',
+            '/featured.xml']),
+        Scenario('categories', ['/categories/%s' % slug for slug in category_slugs]),
+        Scenario('admin', ['/admin', '/admin/media', '/admin/media?page=5',
+            '/admin/comments', '/admin/comments?page=5'], admin=True),
+    ]
+
+def _sample_media_slugs(rnd, sample_size):
+    # pick random ids instead of loading all ids of a huge library
+    low, high = DBSession.query(sql.func.min(Media.id), sql.func.max(Media.id)).one()
+    if low is None:
+        return []
+    candidates = rnd.sample(xrange(low, high + 1), min(sample_size * 4, high - low + 1))
+    query = Media.query.published()\
+        .filter(Media.id.in_(candidates))\
+        .order_by(Media.id)\
+        .with_entities(Media.slug)
+    slugs = [slug for (slug,) in query]
+    return slugs[:sample_size]
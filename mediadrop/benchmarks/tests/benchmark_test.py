@@ -0,0 +1,85 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import copy
+
+from pythonic_testcase import *
+
+from mediadrop.benchmarks import (compare_results, default_scenarios,
+    LibraryGenerator, ScenarioResult)
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import Category, DBSession, Media, Tag
+
+
+class LibraryGeneratorTest(DBTestCase):
+    def test_generates_library_with_consistent_counters(self):
+        nr_media = Media.query.count()
+        media_ids = LibraryGenerator(seed=1, batch_size=7).generate(20)
+
+        assert_length(20, media_ids)
+        assert_equals(nr_media + 20, Media.query.count())
+        media = Media.query.get(media_ids[-1])
+        assert_not_equals(0, len(media.files))
+        assert_not_equals(0, len(media.categories))
+        assert_equals(media.comments.count(), media.comment_count)
+        for category in Category.query:
+            expected = Media.query.filter(Media.categories.contains(category)).count()
+            assert_equals(expected, category.media_count)
+        assert_not_equals(0, Tag.query.count())
+
+    def test_scenarios_use_generated_media(self):
+        LibraryGenerator(seed=1).generate(20)
+        DBSession.commit()
+
+        scenarios = dict((scenario.name, scenario) for scenario in default_scenarios(sample_size=3))
+        assert_length(3, scenarios['view'].urls)
+        for url in scenarios['view'].urls:
+            slug = url.split('/')[-1]
+            assert_true(Media.query.published().filter(Media.slug == slug).count())
+        assert_true(scenarios['admin'].admin)
+
+
+class CompareResultsTest(PythonicTestCase):
+    def setUp(self):
+        result = ScenarioResult('view')
+        for duration in (0.010, 0.011, 0.012, 0.020):
+            result.add('/media/foo', 200, duration, 5)
+        self.baseline = dict(nr_media=1000, peak_rss_kb=100000,
+            scenarios={'view': result.as_dict()})
+
+    def test_accepts_identical_results(self):
+        assert_equals([], compare_results(self.baseline, self.baseline))
+
+    def test_reports_regressions(self):
+        results = copy.deepcopy(self.baseline)
+        results['scenarios']['view']['p50_ms'] *= 2
+        results['scenarios']['view']['queries_max'] += 1
+        results['peak_rss_kb'] *= 2
+
+        regressions = compare_results(results, self.baseline)
+        assert_length(3, regressions)
+
+    def test_ignores_small_absolute_latency_changes(self):
+        results = copy.deepcopy(self.baseline)
+        results['scenarios']['view']['p50_ms'] += 1.5
+        assert_equals([], compare_results(results, self.baseline))
+
+    def test_rejects_baseline_of_different_library(self):
+        results = copy.deepcopy(self.baseline)
+        results['nr_media'] = 100000
+        assert_raises(ValueError, lambda: compare_results(results, self.baseline))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LibraryGeneratorTest))
+    suite.addTest(unittest.makeSuite(CompareResultsTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
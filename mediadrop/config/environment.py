@@ -10,6 +10,7 @@ import os
 
 from formencode.api import get_localedir as get_formencode_localedir
 from genshi.filters.i18n import Translator
+from paste.deploy.converters import asbool, asint
 import pylons
 from pylons.configuration import PylonsConfig
 from sqlalchemy import engine_from_config
@@ -66,11 +67,14 @@ def load_environment(global_conf, app_conf):
         translations = Translator(pylons.translator)
         translations.setup(template)
 
-    # Create the Genshi TemplateLoader
+    # Create the Genshi TemplateLoader. Parsed templates are cached, checking
+    # the template files for changes on every render is only needed during
+    # development.
+    auto_reload = config.get('templates.auto_reload', config.get('debug', False))
     globals_.genshi_loader = TemplateLoader(
         search_path=paths['templates'] + plugin_mgr.template_loaders(),
-        auto_reload=True,
-        max_cache_size=100,
+        auto_reload=asbool(auto_reload),
+        max_cache_size=asint(config.get('templates.cache_size', 100)),
         callback=enable_i18n_for_template,
     )
 
@@ -6,8 +6,10 @@
 # See LICENSE.txt in the main project directory, for more information.
 """Pylons middleware initialization"""
 
+import atexit
 import logging
 import os
+import re
 import threading
 
 from beaker.middleware import SessionMiddleware
@@ -33,6 +35,9 @@ import tw.api
 from mediadrop import monkeypatch_method
 from mediadrop.config.environment import load_environment
 from mediadrop.lib.auth import add_auth
+from mediadrop.lib.metrics import add_default_collectors, MetricsMiddleware
+from mediadrop.lib.page_cache import PageCacheMiddleware
+from mediadrop.lib.profiling import ProfilingMiddleware
 from mediadrop.migrations.util import MediaDropMigrator
 from mediadrop.model import metadata, DBSession
 from mediadrop.plugin import events
@@ -61,6 +66,8 @@ class PylonsApp(_PylonsApp):
             }
         else:
             request.settings = self.globals.settings
+        if self.globals.ingest_pipeline is not None:
+            self.globals.ingest_pipeline.start()
 
 def setup_prefix_middleware(app, global_conf, proxy_prefix):
     """Add prefix middleware.
@@ -252,6 +259,38 @@ def setup_db_sanity_checks(app, config):
     return DBSanityCheckingMiddleware(app, check_for_leaked_connections=check_for_leaked_connections,
                                       enable_pessimistic_disconnect_handling=enable_pessimistic_disconnect_handling)
 
+def setup_profiling_middleware(app, config):
+    profiler = config['pylons.app_globals'].profiler
+    if profiler is None:
+        return app
+    profiler.instrument(metadata.bind)
+    atexit.register(profiler.shutdown)
+    return ProfilingMiddleware(app, profiler)
+
+def setup_page_cache_middleware(app, config):
+    app_globals = config['pylons.app_globals']
+    if app_globals.page_cache is None:
+        return app
+    return PageCacheMiddleware(app, app_globals.page_cache,
+        app_globals.settings_store, app_globals.view_dedup)
+
+def setup_metrics_middleware(app, config):
+    app_globals = config['pylons.app_globals']
+    registry = app_globals.metrics
+    if registry is None:
+        return app
+    add_default_collectors(registry, app_globals, metadata.bind)
+    # the values of exiting worker processes are merged into the totals
+    atexit.register(registry.flush)
+    return MetricsMiddleware(app, registry,
+        path=config.get('metrics.path', '/metrics'),
+        token=config.get('metrics.token') or None,
+    )
+
+# Sitemaps are streamed (see mediadrop.lib.sitemaps) but paste.gzipper
+# buffers the whole response before compressing it.
+UNCOMPRESSED_PATHS = re.compile(r'^/(sitemap\d*|mrss)\.xml$')
+
 def setup_gzip_middleware(app, global_conf):
     """Make paste.gzipper middleware with a monkeypatch to exempt SWFs.
 
@@ -259,6 +298,7 @@ def setup_gzip_middleware(app, global_conf):
     extra compression and it also breaks Flowplayer 3.2.3, and
     potentially others.
 
+    Streamed sitemaps (:data:`UNCOMPRESSED_PATHS`) are not compressed at all.
     """
     @monkeypatch_method(gzipper.GzipResponse)
     def gzip_start_response(self, status, headers, exc_info=None):
@@ -278,7 +318,12 @@ def setup_gzip_middleware(app, global_conf):
         self.headers = headers
         self.status = status
         return self.buffer.write
-    return gzipper.make_gzip_middleware(app, global_conf)
+    gzip_app = gzipper.make_gzip_middleware(app, global_conf)
+    def gzip_unless_streamed(environ, start_response):
+        if UNCOMPRESSED_PATHS.match(environ.get('PATH_INFO', '')):
+            return app(environ, start_response)
+        return gzip_app(environ, start_response)
+    return gzip_unless_streamed
 
 def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     """Create a Pylons WSGI application and return it
@@ -318,6 +363,28 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
     if db_is_current:
         events.Environment.database_ready()
 
+    # views spooled by a previous process (e.g. before a restart) are written
+    # now (before a prefork server forks its workers), pending views are
+    # spooled on shutdown.
+    view_counter = config['pylons.app_globals'].view_counter
+    if db_is_current:
+        view_counter.replay_spool()
+    atexit.register(view_counter.shutdown)
+    atexit.register(config['pylons.app_globals'].view_dedup.shutdown)
+    # thumbnail jobs which were not finished by the previous process (processed
+    # right away, the worker pool is only created by the forked processes)
+    thumbnail_queue = config['pylons.app_globals'].thumbnail_queue
+    if thumbnail_queue is not None:
+        thumbnail_queue.replay()
+        atexit.register(thumbnail_queue.shutdown)
+    # media files which were not completely stored by the previous process
+    # (the worker threads are started by the first request of each process)
+    ingest_pipeline = config['pylons.app_globals'].ingest_pipeline
+    if ingest_pipeline is not None:
+        if db_is_current:
+            ingest_pipeline.replay()
+        atexit.register(ingest_pipeline.shutdown)
+
     # The Pylons WSGI app
     app = PylonsApp(config=config)
 
@@ -365,6 +432,9 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
             app = StatusCodeRedirect(app, errors=(400, 401, 403, 404, 500),
                                      path=error_path)
 
+    # Serve complete pages to anonymous visitors if the page cache is enabled
+    app = setup_page_cache_middleware(app, config)
+
     # Cleanup the DBSession only after errors are handled
     app = DBSessionRemoverMiddleware(app)
 
@@ -373,6 +443,10 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
 
     app = setup_db_sanity_checks(app, config)
 
+    # Collect per-action timings if profiling is enabled (static files are
+    # not profiled)
+    app = setup_profiling_middleware(app, config)
+
     if asbool(static_files):
         # Serve static files from our public directory
         public_app = StaticURLParser(config['pylons.paths']['static_files'])
@@ -402,6 +476,9 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
 
         app = Cascade([public_app, static_urlmap, app])
 
+    # Record request latency/status codes and serve the metrics if enabled
+    app = setup_metrics_middleware(app, config)
+
     if asbool(config.get('enable_gzip', 'true')):
         app = setup_gzip_middleware(app, global_conf)
 
@@ -213,6 +213,7 @@ def add_routes(map):
         'admin/comments',
         'admin/media',
         'admin/podcasts',
+        'admin/profiling',
         'admin/settings',
     ])
 
@@ -6,7 +6,6 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 from pylons import request, tmpl_context
-from sqlalchemy import orm
 
 from mediadrop.forms.admin.categories import CategoryForm, CategoryRowForm
 from mediadrop.lib.auth import has_permission
@@ -44,7 +43,6 @@ class CategoriesController(BaseController):
         """
         categories = Category.query\
             .order_by(Category.name)\
-            .options(orm.undefer('media_count'))\
             .populated_tree()
 
         return dict(
@@ -9,11 +9,11 @@ Media Admin Controller
 """
 
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from formencode import Invalid, validators
 from pylons import request, tmpl_context
-from sqlalchemy import orm
+from pylons.controllers.util import abort
 
 from mediadrop.forms.admin import SearchForm, ThumbForm
 from mediadrop.forms.admin.media import AddFileForm, EditFileForm, MediaForm, UpdateStatusForm
@@ -24,9 +24,11 @@ from mediadrop.lib.decorators import (autocommit, expose, expose_xhr,
     observable, paginate, validate, validate_xhr)
 from mediadrop.lib.helpers import redirect, url_for
 from mediadrop.lib.i18n import _
-from mediadrop.lib.storage import add_new_media_file, UserStorageError
+from mediadrop.lib.storage import (add_new_media_file, storage_sessions,
+    UserStorageError)
+from mediadrop.lib.storage.pipeline import ingest_status
 from mediadrop.lib.templating import render
-from mediadrop.lib.thumbnails import thumb_path, thumb_paths, create_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs, delete_thumbs
+from mediadrop.lib.thumbnails import thumb_path, thumb_paths, queue_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs, delete_thumbs
 from mediadrop.model import (Author, Category, Media, Podcast, Tag, fetch_row,
     get_available_slug, slugify)
 from mediadrop.model.meta import DBSession
@@ -46,7 +48,7 @@ class MediaController(BaseController):
     allow_only = has_permission('edit')
 
     @expose_xhr('admin/media/index.html', 'admin/media/index-table.html')
-    @paginate('media', items_per_page=15)
+    @paginate('media', items_per_page=15, keyset=True)
     @observable(events.Admin.MediaController.index)
     def index(self, page=1, search=None, filter=None, podcast=None,
               category=None, tag=None, **kwargs):
@@ -73,7 +75,7 @@ class MediaController(BaseController):
         """
         group = request.perm.user.groups[0].group_name
         user = request.perm.user.display_name
-        media = Media.query.options(orm.undefer('comment_count_published'))
+        media = Media.query
 
         if group != 'admins':
             media = media.filter(Media.author_name == user)
@@ -85,10 +87,7 @@ class MediaController(BaseController):
                          .order_by(Media.publish_on.desc(),
                                    Media.modified_on.desc())
         else:
-            media = media.order_by(Media.views3 + Media.views6 +
-                                   Media.views9 + Media.views12 +
-                                   Media.views15 + Media.views18 +
-                                   Media.views21 + Media.views24.desc())
+            media = media.order_by_trending(timedelta(hours=24))
 
         if filter == 'unreviewed':
             media = media.reviewed(False)
@@ -303,6 +302,9 @@ class MediaController(BaseController):
             file_id
                 The :attr:`~mediadrop.model.media.MediaFile.id` for the newly
                 created file.
+            file_status_url
+                Poll this URL for the status of the file (the file is stored
+                in the background if an ingest pipeline is configured).
             edit_form
                 The rendered XHTML :class:`~mediadrop.forms.admin.media.EditFileForm`
                 for this file.
@@ -350,6 +352,8 @@ class MediaController(BaseController):
             success = True,
             media_id = media.id,
             file_id = media_file.id,
+            file_status_url = url_for(action='file_status', id=media.id,
+                file_id=media_file.id),
             file_type = media_file.type,
             edit_form = edit_form_xhtml,
             status_form = status_form_xhtml,
@@ -363,6 +367,25 @@ class MediaController(BaseController):
         return data
 
 
+    @expose('json')
+    @observable(events.Admin.MediaController.file_status)
+    def file_status(self, id, file_id, **kwargs):
+        """Return the ingest status of a media file.
+
+        :param id: Media ID
+        :type id: :class:`int`
+        :param file_id: The :attr:`~mediadrop.model.media.MediaFile.id`
+        :type file_id: :class:`int`
+        :rtype: JSON dict
+        :returns: See :func:`mediadrop.lib.storage.pipeline.ingest_status`
+        """
+        media = fetch_row(Media, id)
+        file_id = int(file_id)
+        for media_file in media.files:
+            if media_file.id == file_id:
+                return ingest_status(media_file)
+        abort(404)
+
     @expose('json', request_method='POST')
     @autocommit
     @observable(events.Admin.MediaController.edit_file)
@@ -574,7 +597,7 @@ class MediaController(BaseController):
 
         try:
             # Create JPEG thumbs
-            create_thumbs_for(media, kwargs['file'].file, kwargs['file'].filename)
+            queue_thumbs_for(media, kwargs['file'].file, kwargs['file'].filename)
             success = True
             message = None
         except IOError, e:
@@ -702,8 +725,10 @@ class MediaController(BaseController):
                     self._publish_media(m)
             rows = render_rows(media)
         elif type == 'delete':
-            for m in media:
-                self._delete_media(m)
+            engines = set(file.storage for m in media for file in m.files)
+            with storage_sessions(engines):
+                for m in media:
+                    self._delete_media(m)
         else:
             success = False
 
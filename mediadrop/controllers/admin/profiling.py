@@ -0,0 +1,38 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pylons import app_globals, response
+from webob.exc import HTTPNotFound
+
+from mediadrop.lib.auth import has_permission
+from mediadrop.lib.base import BaseController
+from mediadrop.lib.decorators import expose
+from mediadrop.lib.helpers import redirect
+
+
+class ProfilingController(BaseController):
+    """Admin access to the request profiling report"""
+    allow_only = has_permission('admin')
+
+    def _profiler(self):
+        profiler = app_globals.profiler
+        if profiler is None:
+            raise HTTPNotFound()
+        return profiler
+
+    @expose()
+    def index(self, **kwargs):
+        """Return the aggregated timings of all profiled actions as text."""
+        report = self._profiler().report()
+        response.content_type = 'text/plain'
+        return report
+
+    @expose(request_method='POST')
+    def reset(self, **kwargs):
+        """Discard all collected timings."""
+        self._profiler().reset()
+        redirect(action='index')
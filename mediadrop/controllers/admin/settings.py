@@ -143,14 +143,9 @@ class SettingsController(BaseSettingsController):
         Updates the popularity for every media item based on the submitted
         values.
         """
+        # saving the settings replaces the settings snapshot so
+        # ".util.calculate_popularity()" uses the new values already.
         self._save(popularity_form, values=kwargs)
-        # ".util.calculate_popularity()" uses the popularity settings from
-        # the request.settings which are only updated when a new request
-        # comes in.
-        # update the settings manually so the popularity is actually updated
-        # correctly.
-        for key in ('popularity_decay_exponent', 'popularity_decay_lifetime'):
-            request.settings[key] = kwargs['popularity.'+key]
         for m in Media.query:
             m.update_popularity()
             DBSession.add(m)
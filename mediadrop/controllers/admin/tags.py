@@ -6,7 +6,6 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 from pylons import request, tmpl_context
-from sqlalchemy import orm
 
 from mediadrop.forms.admin.tags import TagForm, TagRowForm
 from mediadrop.lib.auth import has_permission
@@ -45,7 +44,6 @@ class TagsController(BaseController):
 
         """
         tags = DBSession.query(Tag)\
-            .options(orm.undefer('media_count'))\
             .order_by(Tag.name)
 
         return dict(
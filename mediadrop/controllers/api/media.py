@@ -14,11 +14,14 @@ from sqlalchemy import orm, sql
 
 from mediadrop.controllers.api import APIException, get_order_by, require_api_key_if_necessary
 from mediadrop.lib import helpers
+from mediadrop.lib.auth.query_result_proxy import QueryResultProxy
 from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import expose, expose_xhr, observable, paginate, validate
 from mediadrop.lib.helpers import get_featured_category, url_for, url_for_media
+from mediadrop.lib.paginate import cached_count, decode_cursor, encode_cursor
 from mediadrop.lib.thumbnails import thumb
 from mediadrop.model import Category, Media, Podcast, Tag, fetch_row, get_available_slug
+from mediadrop.model.media_listing import FEED_RELATIONS, load_media_relations
 from mediadrop.model.meta import DBSession
 from mediadrop.plugin import events
 
@@ -35,11 +38,27 @@ order_columns = {
     'popularity': Media.popularity_points,
     'description': Media.description,
     'description_plain': Media.description_plain,
-    'comment_count': 'comment_count_published %s'
+    'comment_count': 'comment_count_published %s',
+    'modified_on': Media.modified_on,
 }
 
+# orderings which can be continued with a cursor (see get_keyset_order)
+keyset_columns = ('publish_on', 'popularity', 'modified_on')
+
 AUTHERROR = "Authentication Error"
 INVALIDFORMATERROR = "Invalid format (%s). Only json and mrss are supported"
+INVALIDCURSORERROR = "Invalid cursor"
+
+def get_keyset_order(order):
+    """Return a ``(column, descending)`` tuple if the given (valid) order
+    can be used for keyset pagination, otherwise None."""
+    if not order:
+        order_col, order_dir = 'publish_on', 'desc'
+    else:
+        order_col, order_dir = unicode(order).strip().lower().split(' ')
+    if order_col not in keyset_columns:
+        return None
+    return order_columns[order_col], (order_dir == 'desc')
 
 class MediaController(BaseController):
     """
@@ -52,7 +71,8 @@ class MediaController(BaseController):
     def index(self, type=None, podcast=None, tag=None, category=None, search=None,
               max_age=None, min_age=None, order=None, offset=0, limit=10,
               published_after=None, published_before=None, featured=False,
-              id=None, slug=None, include_embed=False, format="json", **kwargs):
+              id=None, slug=None, include_embed=False, format="json",
+              cursor=None, **kwargs):
         """Query for a list of media.
 
         :param type:
@@ -107,6 +127,13 @@ class MediaController(BaseController):
             next 50 and so on.
         :type offset: int
 
+        :param cursor:
+            The ``next_cursor`` of a previous response to fetch the results
+            after that response. This is faster than a big offset but only
+            supported when ordering by publish_on, popularity or modified_on
+            without a search. The offset is ignored.
+        :type cursor: unicode or None
+
         :param limit:
             Number of results to return in each query. Defaults to 10.
             The maximum allowed value defaults to 50 and is set via
@@ -144,7 +171,8 @@ class MediaController(BaseController):
         :returns: The returned dict has the following fields:
 
             count (int)
-                The total number of results that match this query.
+                The total number of results that match this query (this
+                number may be cached for a short time).
             media (list of dicts)
                 A list of **media_info** dicts, as generated by the
                 :meth:`_info <mediadrop.controllers.api.media.MediaController._info>`
@@ -153,15 +181,17 @@ class MediaController(BaseController):
                 **Note**: unless the 'include_embed' option is specified,
                 The returned **media_info** dicts will not include the
                 'embed' entry.
+            next_cursor (unicode or None)
+                Pass this as ``cursor`` to fetch the next results (only for
+                orderings which support cursors and if there may be more
+                results).
 
         """
 
         if format not in ("json", "mrss"):
             return dict(error= INVALIDFORMATERROR % format)
 
-        query = Media.query\
-            .published()\
-            .options(orm.undefer('comment_count_published'))
+        query = Media.query.published()
 
         # Basic filters
         if id:
@@ -210,25 +240,45 @@ class MediaController(BaseController):
             if featured_cat:
                 query = query.in_category(featured_cat)
 
-        # Preload podcast slugs so we don't do n+1 queries
-        podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug))
+        # Orderings with a unique tiebreaker can be continued with a cursor
+        keyset_order = (not search) and get_keyset_order(order) or None
+        if keyset_order:
+            column, descending = keyset_order
+            query = QueryResultProxy(query).keyset(column,
+                descending=descending, tiebreaker=Media.id)
+        count = cached_count(query)
 
         # Rudimentary pagination support
         start = int(offset)
-        end = start + min(int(limit), int(request.settings['api_media_max_results']))
+        limit = min(int(limit), int(request.settings['api_media_max_results']))
+        if cursor and keyset_order:
+            position = decode_cursor(cursor, column.key)
+            if position is None:
+                return dict(error=INVALIDCURSORERROR)
+            start, key = position
+            items = query.seek(key)[0:limit]
+        else:
+            items = query[start:start + limit]
 
         if format == "mrss":
             request.override_template = "sitemaps/mrss.xml"
             return dict(
-                media = query[start:end],
+                media = load_media_relations(items, FEED_RELATIONS),
                 title = "Media Feed",
             )
 
-        media = [self._info(m, podcast_slugs, include_embed) for m in query[start:end]]
+        next_cursor = None
+        if keyset_order and items and (len(items) == limit):
+            next_cursor = encode_cursor(column.key, start + len(items),
+                query.key_of(items[-1]))
+        # Load categories and podcasts of all items so we don't do n+1 queries
+        items = load_media_relations(items, ('categories', 'podcast'))
+        media = [self._info(m, include_embed=include_embed) for m in items]
 
         return dict(
             media = media,
-            count = query.count(),
+            count = count,
+            next_cursor = next_cursor,
         )
 
 
@@ -356,8 +406,7 @@ class MediaController(BaseController):
         elif podcast_slugs:
             podcast_slug = podcast_slugs[media.podcast_id]
         else:
-            podcast_slug = DBSession.query(Podcast.slug)\
-                .filter_by(id=media.podcast_id).scalar()
+            podcast_slug = media.podcast.slug
 
         thumbs = {}
         for size in config['thumb_sizes'][media._thumb_dir].iterkeys():
@@ -7,14 +7,16 @@
 
 from pylons import request, response, tmpl_context as c
 from pylons.controllers.util import abort
-from sqlalchemy import orm
 
 from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import (beaker_cache, expose, observable,
     paginate, validate)
-from mediadrop.lib.helpers import content_type_for_response, url_for, viewable_media
+from mediadrop.lib.helpers import (content_type_for_response,
+    keyset_library_controls, url_for, viewable_media)
 from mediadrop.lib.i18n import _
-from mediadrop.model import Category, Media, fetch_row
+from mediadrop.lib.page_cache import cache_page, CATEGORIES, MEDIA_LISTINGS
+from mediadrop.model import Media
+from mediadrop.model.category_tree import category_tree
 from mediadrop.plugin import events
 from mediadrop.validation import LimitFeedItemsValidator
 
@@ -34,23 +36,16 @@ class CategoriesController(BaseController):
         """Load all our category data before each request."""
         BaseController.__before__(self, *args, **kwargs)
 
-        c.categories = Category.query\
-            .order_by(Category.name)\
-            .options(orm.undefer('media_count_published'))\
-            .populated_tree()
-
-        counts = dict((cat.id, cat.media_count_published)
-                      for cat, depth in c.categories.traverse())
-        c.category_counts = counts.copy()
-        for cat, depth in c.categories.traverse():
-            count = counts[cat.id]
-            if count:
-                for ancestor in cat.ancestors():
-                    c.category_counts[ancestor.id] += count
-
         category_slug = request.environ['pylons.routes_dict'].get('slug', None)
+        tree = category_tree(category_slug or None)
+        c.categories = tree.roots
+        c.category_counts = tree.counts
+        c.category_tree_version = tree.version
+
         if category_slug:
-            c.category = fetch_row(Category, slug=category_slug)
+            c.category = tree.by_slug(category_slug)
+            if c.category is None:
+                abort(404)
             c.breadcrumb = c.category.ancestors()
             c.breadcrumb.append(c.category)
 
@@ -72,25 +67,29 @@ class CategoriesController(BaseController):
         latest = viewable_media(latest)[:5]
         popular = viewable_media(popular.exclude(latest))[:5]
 
+        cache_page(MEDIA_LISTINGS, CATEGORIES)
         return dict(
             latest = latest,
             popular = popular,
         )
 
     @expose('categories/more.html')
-    @paginate('media', items_per_page=20)
+    @paginate('media', items_per_page=20, keyset=True)
     @observable(events.CategoriesController.more)
     def more(self, slug, order, page=1, **kwargs):
         media = Media.query.published()\
             .in_category(c.category)
 
         if order == 'latest':
+            show = 'latest'
             media = media.order_by(Media.publish_on.desc())
         else:
+            show = 'popular'
             media = media.order_by(Media.popularity_points.desc())
 
+        cache_page(MEDIA_LISTINGS, CATEGORIES)
         return dict(
-            media = viewable_media(media),
+            media = keyset_library_controls(viewable_media(media), show),
             order = order,
         )
 
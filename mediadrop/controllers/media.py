@@ -14,10 +14,9 @@ import os.path
 from akismet import Akismet
 from paste.fileapp import FileApp
 from paste.util import mimeparse
-from pylons import config, request, response
+from pylons import app_globals, config, request, response
 from pylons.controllers.util import abort, forward
-from sqlalchemy import orm, sql, or_
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import or_
 from webob.exc import HTTPNotAcceptable, HTTPNotFound
 
 from mediadrop import USER_AGENT
@@ -29,10 +28,14 @@ from mediadrop.lib.email import send_comment_notification
 from mediadrop.lib.helpers import (filter_vulgarity, redirect, url_for,
     viewable_media)
 from mediadrop.lib.i18n import _
+from mediadrop.lib.page_cache import cache_page, CATEGORIES, MEDIA_LISTINGS
+from mediadrop.lib.paginate import cached_count
 from mediadrop.lib.services import Facebook
 from mediadrop.lib.templating import render
+from mediadrop.lib.view_dedup import visitor_token
 from mediadrop.model import (DBSession, fetch_row, Media, MediaFile, Comment,
-    Tag, Category, AuthorWithIP, Podcast, User, Views_Counter)
+    Tag, AuthorWithIP, Podcast, User)
+from mediadrop.model.category_tree import category_tree
 from mediadrop.plugin import events
 
 log = logging.getLogger(__name__)
@@ -44,7 +47,7 @@ class MediaController(BaseController):
     """
 
     @expose('media/index.html')
-    @paginate('media', items_per_page=10)
+    @paginate('media', items_per_page=10, keyset=True)
     @observable(events.MediaController.index)
     def index(self, page=1, show='latest', q=None, tag=None, **kwargs):
         """List media with pagination.
@@ -93,9 +96,13 @@ class MediaController(BaseController):
                 ])
 
         media = viewable_media(media)
+        if not q:
+            # search results are ordered by relevance
+            media = helpers.keyset_library_controls(media, show)
+        cache_page(MEDIA_LISTINGS)
         return dict(
             media = media,
-            result_count = media.count(),
+            result_count = cached_count(media),
             search_query = q,
             show = show,
             tag = tag,
@@ -105,7 +112,6 @@ class MediaController(BaseController):
     def tags(self, **kwargs):
         """Display a listing of all tags."""
         tags = Tag.query\
-            .options(orm.undefer('media_count_published'))\
             .filter(Tag.media_count_published > 0)
         return dict(
             tags = tags,
@@ -155,20 +161,21 @@ class MediaController(BaseController):
                 (url_for(controller='/sitemaps', action='latest'), _(u'Latest RSS')),
             ])
 
+        cache_page(MEDIA_LISTINGS, CATEGORIES)
         return dict(
             featured = featured,
             latest = latest,
             popular = popular,
-            categories = Category.query.populated_tree(),
+            categories = category_tree().roots,
         )
 
     @expose()
     def random(self, **kwargs):
         """Redirect to a randomly selected media item."""
-        # TODO: Implement something more efficient than ORDER BY RAND().
-        #       This method does a full table scan every time.
-        random_query = Media.query.published().order_by(sql.func.random())
-        media = viewable_media(random_query).first()
+        def load_viewable_media(media_id):
+            query = Media.query.published().filter(Media.id == media_id)
+            return viewable_media(query).first()
+        media = app_globals.random_media.pick(load_viewable_media)
 
         if media is None:
             redirect(action='explore')
@@ -217,27 +224,16 @@ class MediaController(BaseController):
             if url_for() != url_for(podcast_slug=media.podcast.slug):
                 redirect(podcast_slug=media.podcast.slug)
 
-        views = Views_Counter.query.filter(Views_Counter.media_id == media.id)
-        #csrf = kwargs['environ']['paste.cookies'][0]['csrftoken'].value
-        #views = views.filter(Views_Counter.csrftoken == csrf)
-        views = views.all()
-
-        if not views:
-            try:
-                temp = Views_Counter()
-                temp.media_id = media.id
-                temp.csrftoken = csrf
-                print(temp)
-                print(vars(temp))
-                DBSession.add(temp)
-                DBSession.commit()
-            except:
-                DBSession.rollback()
+        app_globals.view_dedup.page_viewed(media.id, visitor_token(request))
 
         if request.settings['comments_engine'] == 'facebook':
             response.facebook = Facebook(request.settings['facebook_appid'])
 
-        related_media = viewable_media(Media.query.related(media))[:6]
+        related_query = app_globals.related_media.query(media)
+        related_media = viewable_media(related_query)[:6]
+        # related media may be outdated until the cached page expires
+        cache_page(media, media.podcast, *media.categories,
+            viewed_media_id=media.id)
         # TODO: finish implementation of different 'likes' buttons
         #       e.g. the default one, plus a setting to use facebook.
         return dict(
@@ -253,28 +249,22 @@ class MediaController(BaseController):
     @autocommit
     @observable(events.MediaController.final_view)
     def final_view(self,id,**kwargs):
-        print('hello')
+        """Count a view once the player reported that playback started.
+
+        A view is only counted once per visitor within ``views.dedup_ttl``
+        seconds (one hour) and only after the visitor opened the media page, see
+        :class:`mediadrop.lib.view_dedup.ViewDeduplicator`. The view is only
+        recorded in the buffered view counter, see
+        :class:`mediadrop.lib.view_counter.BufferedViewCounter`. The media row
+        itself is updated in batches by the next flush.
+        """
         try:
-            csrf = kwargs['environ']['paste.cookies'][0]['csrftoken'].value
-#                                     .filter(Views_Counter.csrftoken==csrf)\
-            temp = Views_Counter.query.filter(Views_Counter.media_id==id)\
-                                      .filter(Views_Counter.validated==False)
-            print(csrf)
-            if temp:
-                temp = temp.one()
-                media = fetch_row(Media, id=id)
-                try:
-                    media.increment_views3()
-                    media.increment_views()
-                    DBSession.commit()
-                except OperationalError:
-                    DBSession.rollback()
-                    return dict(success=False)
-
-                temp.validated = True
-                DBSession.flush()
-        except:
+            media_id = int(id)
+        except ValueError:
+            return dict(success=False)
+        if not app_globals.view_dedup.claim(media_id, visitor_token(request)):
             return dict(success=False)
+        app_globals.view_counter.record(media_id)
         return dict(success=True)
 
     @expose('players/iframe.html')
@@ -6,7 +6,6 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 from pylons import request, response
-from sqlalchemy import orm
 
 from mediadrop.lib.auth.util import viewable_media
 from mediadrop.lib import helpers
@@ -14,7 +13,10 @@ from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import (beaker_cache, expose, observable,
     paginate, validate)
 from mediadrop.lib.helpers import content_type_for_response, url_for, redirect
+from mediadrop.lib.page_cache import cache_page, MEDIA_LISTINGS, PODCASTS
+from mediadrop.lib.paginate import cached_count
 from mediadrop.model import Media, Podcast, fetch_row
+from mediadrop.model.media_listing import iter_with_relations, latest_episode_ids
 from mediadrop.plugin import events
 from mediadrop.validation import LimitFeedItemsValidator
 
@@ -40,18 +42,31 @@ class PodcastsController(BaseController):
                 The :class:`~mediadrop.model.podcasts.Podcast` instance
 
         """
-        podcasts = Podcast.query\
-            .options(orm.undefer('media_count_published'))\
-            .all()
+        podcasts = Podcast.query.all()
 
         if len(podcasts) == 1:
             redirect(action='view', slug=podcasts[0].slug)
 
-        podcast_episodes = {}
+        # the latest episodes of all podcasts with just two queries
+        episode_ids = latest_episode_ids([p.id for p in podcasts], 4)
+        all_ids = [id for ids in episode_ids.values() for id in ids]
+        episodes = []
+        if all_ids:
+            episode_query = Media.query.filter(Media.id.in_(all_ids))\
+                .order_by(Media.publish_on.desc())
+            episodes = viewable_media(episode_query)[:len(all_ids)]
+
+        podcast_episodes = dict((podcast, []) for podcast in podcasts)
+        podcasts_by_id = dict((podcast.id, podcast) for podcast in podcasts)
+        for media in episodes:
+            podcast_episodes[podcasts_by_id[media.podcast_id]].append(media)
         for podcast in podcasts:
-            episode_query = podcast.media.published().order_by(Media.publish_on.desc())
-            podcast_episodes[podcast] = viewable_media(episode_query)[:4]
+            if len(podcast_episodes[podcast]) < len(episode_ids[podcast.id]):
+                # some of the latest episodes are not viewable for this user
+                episode_query = podcast.media.published().order_by(Media.publish_on.desc())
+                podcast_episodes[podcast] = viewable_media(episode_query)[:4]
 
+        cache_page(MEDIA_LISTINGS, PODCASTS)
         return dict(
             podcasts = podcasts,
             podcast_episodes = podcast_episodes,
@@ -59,7 +74,7 @@ class PodcastsController(BaseController):
 
 
     @expose('podcasts/view.html')
-    @paginate('episodes', items_per_page=10)
+    @paginate('episodes', items_per_page=10, keyset=True)
     @observable(events.PodcastsController.view)
     def view(self, slug, page=1, show='latest', **kwargs):
         """View a podcast and the media that belongs to it.
@@ -84,16 +99,18 @@ class PodcastsController(BaseController):
         episodes, show = helpers.filter_library_controls(episodes, show)
 
         episodes = viewable_media(episodes)
+        episodes = helpers.keyset_library_controls(episodes, show)
 
         if request.settings['rss_display'] == 'True':
             response.feed_links.append(
                (url_for(action='feed'), podcast.title)
             )
 
+        cache_page(MEDIA_LISTINGS, podcast)
         return dict(
             podcast = podcast,
             episodes = episodes,
-            result_count = episodes.count(),
+            result_count = cached_count(episodes),
             show = show,
         )
 
@@ -138,5 +155,5 @@ class PodcastsController(BaseController):
 
         return dict(
             podcast = podcast,
-            episodes = episodes,
+            episodes = iter_with_relations(episodes, ('files', 'tags')),
         )
@@ -9,21 +9,27 @@
 Sitemaps Controller
 """
 import logging
-import math
 import os
 
 from formencode import validators
 from paste.fileapp import FileApp
-from pylons import config, request, response
+from pylons import app_globals, config, request, response
 from pylons.controllers.util import abort, forward
+from sqlalchemy import sql
 from webob.exc import HTTPNotFound
 
 from mediadrop.plugin import events
+from mediadrop.lib.auth.permission_system import MediaDropPermissionSystem
 from mediadrop.lib.base import BaseController
 from mediadrop.lib.decorators import expose, beaker_cache, observable, validate
 from mediadrop.lib.helpers import (content_type_for_response, 
     get_featured_category, url_for, viewable_media)
-from mediadrop.model import Media
+from mediadrop.lib.paginate import decode_cursor, encode_cursor
+from mediadrop.lib.sitemaps import iter_media, serialize_chunks, StreamingResponse
+from mediadrop.lib.templating import render
+from mediadrop.model import DBSession, Media
+from mediadrop.model.media_listing import (FEED_RELATIONS,
+    iter_with_relations, load_media_relations)
 from mediadrop.validation import LimitFeedItemsValidator
 
 log = logging.getLogger(__name__)
@@ -33,6 +39,33 @@ log = logging.getLogger(__name__)
 crossdomain_app = None
 
 
+def _feed_items(media, limit, skip, after):
+    """Return the feed items after the ``after`` cursor (or ``skip`` items)
+    and the url of the next items (see :class:`mediadrop.lib.paginate.KeysetPage`).
+
+    Feeds are ordered by publish date so deep positions can be fetched with
+    ``WHERE publish_on < last_publish_on`` instead of an OFFSET."""
+    if not hasattr(media, 'keyset'):
+        return dict(media=iter_with_relations(media, FEED_RELATIONS), next_url=None)
+    media.keyset(Media.publish_on, descending=True, tiebreaker=Media.id)
+    position = after and decode_cursor(after, 'publish_on')
+    if position:
+        skip, key = position
+        media.seek(key)
+    elif skip > 0:
+        media.offset(skip)
+    if limit is None:
+        return dict(media=iter_with_relations(media, FEED_RELATIONS), next_url=None)
+
+    items = load_media_relations(media[0:limit], FEED_RELATIONS)
+    next_url = None
+    if items and (len(items) == limit):
+        cursor = encode_cursor('publish_on', skip + len(items),
+            media.key_of(items[-1]))
+        next_url = url_for(limit=limit, after=cursor, qualified=True)
+    return dict(media=items, next_url=next_url)
+
+
 class SitemapsController(BaseController):
     """
     Sitemap generation
@@ -42,8 +75,7 @@ class SitemapsController(BaseController):
         'page': validators.Int(if_empty=None, if_missing=None, if_invalid=None), 
         'limit': validators.Int(if_empty=10000, if_missing=10000, if_invalid=10000)
     })
-    @beaker_cache(expire=60 * 60 * 4)
-    @expose('sitemaps/google.xml')
+    @expose()
     @observable(events.SitemapsController.google)
     def google(self, page=None, limit=10000, **kwargs):
         """Generate a sitemap which contains googles Video Sitemap information.
@@ -52,6 +84,10 @@ class SitemapsController(BaseController):
         on how many media items are in the database, and the values of the
         page and limit params.
 
+        Each page contains the media with ids from ``page * limit`` up to
+        (but excluding) ``(page + 1) * limit`` so pages can be generated
+        without OFFSET queries (and stored on disk as shards).
+
         :param page: Page number, defaults to 1.
         :type page: int
         :param page: max records to display on page, defaults to 10000.
@@ -64,14 +100,20 @@ class SitemapsController(BaseController):
         response.content_type = \
             content_type_for_response(['application/xml', 'text/xml'])
 
-        media = viewable_media(Media.query.published())
-
+        shards = app_globals.sitemap_shards
+        use_shards = (shards is not None) and (limit == shards.shard_size)
+        media_query = Media.query.published()
         if page is None:
-            if media.count() > limit:
-                return dict(pages=math.ceil(media.count() / float(limit)))
+            max_id = DBSession.query(sql.func.max(Media.id)).scalar() or 0
+            if max_id >= limit:
+                pages = (max_id // limit) + 1
+                return self._render('sitemaps/google.xml', dict(pages=pages))
         else:
             page = int(page)
-            media = media.offset(page * limit).limit(limit)
+            media_query = media_query.filter(sql.and_(
+                Media.id >= page * limit,
+                Media.id < (page + 1) * limit,
+            ))
 
         if page:
             links = []
@@ -83,39 +125,66 @@ class SitemapsController(BaseController):
                 url_for(controller='/categories', qualified=True),
             ]
 
-        return dict(
-            media = media,
+        shard_name = None
+        if use_shards and (page is not None):
+            shard_name = shards.google_shard_name(page)
+        return self._render('sitemaps/google.xml', dict(
+            media = iter_media(self._viewable_media(media_query, use_shards)),
             page = page,
             links = links,
-        )
+        ), shard_name=shard_name)
 
-    @beaker_cache(expire=60 * 60, query_args=True)
-    @expose('sitemaps/mrss.xml')
+    @expose()
     @observable(events.SitemapsController.mrss)
     def mrss(self, **kwargs):
         """Generate a media rss (mRSS) feed of all the sites media."""
         if request.settings['sitemaps_display'] != 'True':
             abort(404)
 
-
         response.content_type = content_type_for_response(
             ['application/rss+xml', 'application/xml', 'text/xml'])
 
-        media = viewable_media(Media.query.published())
-
-        return dict(
+        # the shard contains the feed for anonymous users without any
+        # query parameters, everything else is rendered per request
+        use_shards = (app_globals.sitemap_shards is not None) and not request.params
+        media = iter_media(self._viewable_media(Media.query.published(), use_shards))
+        return self._render('sitemaps/mrss.xml', dict(
             media = media,
             title = 'MediaRSS Sitemap',
-        )
+        ), shard_name=use_shards and 'mrss.xml' or None)
+
+    def _viewable_media(self, media_query, anonymous=False):
+        """Filter ``media_query`` by the permissions of the current user (or
+        of anonymous users if the result is stored on disk for everyone)."""
+        if not anonymous:
+            return viewable_media(media_query)
+        perm = MediaDropPermissionSystem.permissions_for_user(None, config)
+        return perm.permission_system.filter_restricted_items(media_query,
+            u'view', perm)
+
+    def _render(self, template, tmpl_vars, shard_name=None):
+        """Render the template incrementally into the response (or into the
+        given sitemap shard which is served afterwards)."""
+        stream = render(template, tmpl_vars)
+        if shard_name is None:
+            return StreamingResponse(serialize_chunks(stream, method='xml'))
+        shards = app_globals.sitemap_shards
+        with shards.lock(shard_name):
+            shard_fp = shards.open(shard_name)
+            if shard_fp is None:
+                shard_fp = shards.build(shard_name,
+                    serialize_chunks(stream, method='xml'))
+        return shards.iter_file(shard_fp)
 
     @validate(validators={
         'limit': LimitFeedItemsValidator(),
-        'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0)
+        'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0),
+        'after': validators.UnicodeString(if_empty=None, if_missing=None),
     })
     @beaker_cache(expire=60 * 3)
     @expose('sitemaps/mrss.xml')
     @observable(events.SitemapsController.latest)
-    def latest(self, limit=None, skip=0, **kwargs):
+    def latest(self, limit=None, skip=0, after=None, **kwargs):
         """Generate a media rss (mRSS) feed of all the sites media."""
         if request.settings['rss_display'] != 'True':
             abort(404)
@@ -125,25 +194,20 @@ class SitemapsController(BaseController):
 
         media_query = Media.query.published().order_by(Media.publish_on.desc())
         media = viewable_media(media_query)
-        if limit is not None:
-            media = media.limit(limit)
-
-        if skip > 0:
-            media = media.offset(skip)
-
         return dict(
-            media = media,
             title = 'Latest Media',
+            **_feed_items(media, limit, skip, after)
         )
 
     @validate(validators={
         'limit': LimitFeedItemsValidator(),
-        'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0)
+        'skip': validators.Int(if_empty=0, if_missing=0, if_invalid=0),
+        'after': validators.UnicodeString(if_empty=None, if_missing=None),
     })
     @beaker_cache(expire=60 * 3)
     @expose('sitemaps/mrss.xml')
     @observable(events.SitemapsController.featured)
-    def featured(self, limit=None, skip=0, **kwargs):
+    def featured(self, limit=None, skip=0, after=None, **kwargs):
         """Generate a media rss (mRSS) feed of the sites featured media."""
         if request.settings['rss_display'] != 'True':
             abort(404)
@@ -155,15 +219,9 @@ class SitemapsController(BaseController):
             .published()\
             .order_by(Media.publish_on.desc())
         media = viewable_media(media_query)
-        if limit is not None:
-            media = media.limit(limit)
-
-        if skip > 0:
-            media = media.offset(skip)
-
         return dict(
-            media = media,
             title = 'Featured Media',
+            **_feed_items(media, limit, skip, after)
         )
 
     @expose()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+import re
+
+from pylons import app_globals
+from pythonic_testcase import *
+from sqlalchemy import event
+
+from mediadrop.controllers.sitemaps import SitemapsController
+from mediadrop.lib.sitemaps import SitemapShards, StreamingResponse
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.model import DBSession, Media, Setting
+
+
+class SitemapsControllerTest(ControllerTestCase):
+    def setUp(self):
+        super(SitemapsControllerTest, self).setUp()
+        setting = DBSession.query(Setting).filter(Setting.key == u'sitemaps_display').one()
+        setting.value = u'True'
+        DBSession.commit()
+        self.media = Media.query.published().order_by(Media.id).all()
+        self.shard_dir = os.path.join(self.env_dir, 'sitemaps')
+
+    def tearDown(self):
+        app_globals.sitemap_shards = None
+        super(SitemapsControllerTest, self).tearDown()
+
+    def _call(self, request_uri):
+        request = self.init_fake_request(server_name='server.example',
+            request_uri=request_uri)
+        return self.call_controller(SitemapsController, request)
+
+    def _urls(self, body):
+        return [self._media_url(media) for media in self.media
+                if self._media_url(media) in body]
+
+    def _media_url(self, media):
+        return 'http://server.example:80/media/%s' % media.slug
+
+    def test_streams_google_sitemap(self):
+        response = self._call('/sitemap.xml')
+        assert_equals(200, response.status_int)
+        assert_contains('<urlset', response.body)
+        assert_contains('http://server.example:80/categories', response.body)
+        assert_not_equals([], self._urls(response.body))
+
+    def test_streaming_response_restores_request_context(self):
+        request = self.init_fake_request(server_name='server.example',
+            request_uri='/sitemap.xml')
+        self._inject_url_generator_for_request(request)
+        from pylons import url
+        response = StreamingResponse(url.current() for i in range(2))
+        assert_equals(['/sitemap.xml', '/sitemap.xml'], list(response))
+
+    def test_returns_sitemap_index_for_large_libraries(self):
+        max_id = max(media.id for media in self.media)
+        response = self._call('/sitemap.xml?limit=%d' % max_id)
+        assert_contains('<sitemapindex', response.body)
+        assert_contains('/sitemap1.xml', response.body)
+
+        response = self._call('/sitemap.xml?limit=%d&page=1' % max_id)
+        assert_equals([self._media_url(self.media[-1])], self._urls(response.body))
+
+    def test_can_continue_feed_after_cursor(self):
+        latest = Media.query.published().order_by(Media.publish_on.desc(),
+            Media.id.desc()).all()
+        response = self._call('/latest.xml?limit=2')
+        assert_equals(200, response.status_int)
+        match = re.search(r'href="([^"]+)" rel="next"', response.body)
+        assert_not_none(match)
+        next_url = match.group(1).replace('&amp;', '&')
+
+        response = self._call(next_url.replace('http://server.example:80', ''))
+        urls = re.findall(r'<link>([^<]+/media/[^<]+)</link>', response.body)
+        assert_equals([self._media_url(media) for media in latest[2:4]], urls)
+
+    def test_feed_queries_do_not_depend_on_number_of_items(self):
+        queries = []
+        event.listen(DBSession.bind, 'before_cursor_execute',
+            lambda *args: queries.append(args[2]))
+        def feed_queries(limit):
+            # start with an empty session so no relation is loaded already
+            DBSession.close()
+            del queries[:]
+            response = self._call('/latest.xml?limit=%d' % limit)
+            assert_length(limit, re.findall(r'<link>[^<]+/media/[^<]+</link>', response.body))
+            return len(queries)
+        # load settings, permissions etc. (responses are cached so every url
+        # is only used once)
+        self._call('/latest.xml?limit=2')
+        self._call('/latest.xml?limit=2&skip=0')
+
+        assert_equals(feed_queries(1), feed_queries(3))
+
+    def test_can_store_sitemap_shards_on_disk(self):
+        app_globals.sitemap_shards = SitemapShards(self.shard_dir, shard_size=10000)
+        response = self._call('/sitemap.xml?page=0')
+        shard_path = os.path.join(self.shard_dir, 'google-0.xml')
+        assert_true(os.path.exists(shard_path))
+        assert_equals(open(shard_path, 'rb').read(), response.body)
+
+        # changes to media invalidate the shard containing that media (once
+        # other processes can see the changes)
+        media = self.media[0]
+        media.title = u'New Title'
+        DBSession.flush()
+        assert_true(os.path.exists(shard_path))
+        DBSession.rollback()
+        assert_true(os.path.exists(shard_path))
+
+        media = Media.query.get(self.media[0].id)
+        media.title = u'New Title'
+        DBSession.commit()
+        assert_false(os.path.exists(shard_path))
+
+    def test_shards_built_before_invalidation_are_outdated(self):
+        shards = SitemapShards(self.shard_dir)
+        shards.invalidate('mrss.xml')
+        def chunks():
+            yield 'old'
+            # a media item is changed while the shard is built
+            shards.invalidate('mrss.xml')
+        shards.build('mrss.xml', chunks()).close()
+        assert_none(shards.open('mrss.xml'))
+
+        assert_equals(['new'], list(shards.iter_file(shards.build('mrss.xml', ['new']))))
+        assert_equals(['new'], list(shards.iter_file(shards.open('mrss.xml'))))
+
+    def test_streams_mrss_feed(self):
+        response = self._call('/mrss.xml')
+        assert_equals(200, response.status_int)
+        assert_not_equals([], self._urls(response.body))
+
+    def test_serves_mrss_feed_from_shard(self):
+        app_globals.sitemap_shards = SitemapShards(self.shard_dir, shard_size=10000)
+        response = self._call('/mrss.xml')
+        shard_path = os.path.join(self.shard_dir, 'mrss.xml')
+        assert_true(os.path.exists(shard_path))
+        assert_equals(open(shard_path, 'rb').read(), response.body)
+        assert_not_equals([], self._urls(response.body))
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SitemapsControllerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
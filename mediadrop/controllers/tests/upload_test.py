@@ -10,10 +10,12 @@ from StringIO import StringIO
 
 import simplejson
 from pythonic_testcase import *
+from webob.exc import HTTPNotFound
 
 from mediadrop.lib.attribute_dict import AttrDict
+from mediadrop.lib.storage import add_new_media_file
 from mediadrop.lib.test import ControllerTestCase
-from mediadrop.model import fetch_row, Media
+from mediadrop.model import DBSession, fetch_row, Media
 from mediadrop.players import AbstractFlashPlayer, FlowPlayer
 
 
@@ -65,9 +67,14 @@ class UploadControllerTest(ControllerTestCase):
         
         assert_equals(200, response.status_int)
         assert_equals('application/json', response.headers['Content-Type'])
-        assert_equals({'redirect': '/upload/success', 'success': True}, 
-                      simplejson.loads(response.body))
-        self._assert_succesful_media_upload()
+        data = simplejson.loads(response.body)
+        media = self._assert_succesful_media_upload()
+        media_file = media.files[0]
+        status_url = '/upload/status?file_id=%d&token=%s' % (media_file.id,
+            media_file.meta[u'upload_token'])
+        assert_equals({'redirect': '/upload/success', 'success': True,
+                       'status_url': status_url},
+                      data)
     
     def test_can_submit_upload_with_plain_html_form(self):
         request = self.init_fake_request(method='POST', request_uri='/upload/submit', 
@@ -77,6 +84,28 @@ class UploadControllerTest(ControllerTestCase):
         self._assert_succesful_media_upload()
 
 
+    def _uploaded_file_id(self):
+        upload = AttrDict(filename=u'awesome-song.mp3', file=StringIO('fake mp3'))
+        media_file = add_new_media_file(Media.example(), file=upload)
+        media_file.meta[u'upload_token'] = u'secret'
+        DBSession.commit()
+        return media_file.id
+
+    def test_can_poll_status_with_upload_token(self):
+        request = self.init_fake_request(method='GET',
+            request_uri='/upload/status?file_id=%d&token=secret' % self._uploaded_file_id())
+        response = self._upload(request)
+        assert_equals('done', simplejson.loads(response.body)['state'])
+
+    def test_status_requires_upload_token(self):
+        from mediadrop.controllers.upload import UploadController
+        file_id = self._uploaded_file_id()
+        self.init_fake_request(method='GET', request_uri='/upload/status')
+        controller = UploadController()
+        assert_raises(HTTPNotFound,
+            lambda: controller.status(file_id=file_id, token=u'invalid'))
+
+
 import unittest
 
 def suite():
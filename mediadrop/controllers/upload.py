@@ -5,6 +5,8 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+from uuid import uuid4
+
 import simplejson as json
 from mediadrop.lib.i18n import N_
 from pylons import request, tmpl_context
@@ -14,11 +16,14 @@ from tw.forms import SingleSelectField
 from mediadrop.forms.uploader import UploadForm
 from mediadrop.lib import email
 from mediadrop.lib.base import BaseController
+from mediadrop.lib.compat import compare_digest
 from mediadrop.lib.decorators import autocommit, expose, observable, validate
 from mediadrop.lib.helpers import redirect, url_for
 from mediadrop.lib.storage import add_new_media_file
+from mediadrop.lib.storage.pipeline import ingest_status
 from mediadrop.lib.thumbnails import create_default_thumbs_for, has_thumbs
-from mediadrop.model import Author, DBSession, get_available_slug, Media, Podcast
+from mediadrop.model import (Author, DBSession, get_available_slug, Media,
+    MediaFile, Podcast)
 from mediadrop.plugin import events
 
 import logging
@@ -110,6 +115,10 @@ class UploadController(BaseController):
                 bool
             redirect
                 If valid, the redirect url for the upload successful page.
+            status_url
+                Poll this URL for the status of the uploaded file (see
+                :meth:`status`), it contains a random token which is only
+                known to the uploader.
 
         """
         if 'validate' in kwargs:
@@ -142,9 +151,13 @@ class UploadController(BaseController):
                     None, kwargs['file'], kwargs['podcast_include']
                 )
                 email.send_media_notification(media_obj)
+                media_file = media_obj.files[0]
+                token = media_file.meta[u'upload_token'] = unicode(uuid4().hex)
                 data = dict(
                     success = True,
-                    redirect = url_for(action='success')
+                    redirect = url_for(action='success'),
+                    status_url = url_for(action='status', file_id=media_file.id,
+                        token=token),
                 )
 
         return data
@@ -176,6 +189,25 @@ class UploadController(BaseController):
         # Redirect to success page!
         redirect(action='success')
 
+    @expose('json')
+    @observable(events.UploadController.status)
+    def status(self, file_id, token=u'', **kwargs):
+        """Return the ingest status of an uploaded file.
+
+        :param token: The upload token from the ``status_url`` returned by
+            :meth:`submit_async` (anonymous uploaders share the same user).
+        :rtype: JSON dict
+        :returns: See :func:`mediadrop.lib.storage.pipeline.ingest_status`
+        """
+        media_file = MediaFile.query.get(int(file_id))
+        if media_file is None:
+            abort(404)
+        upload_token = media_file.meta.get(u'upload_token', None)
+        if not (upload_token and compare_digest(
+                upload_token.encode('utf-8'), token.encode('utf-8'))):
+            abort(404)
+        return ingest_status(media_file)
+
     @expose('upload/success.html')
     @observable(events.UploadController.success)
     def success(self, **kwargs):
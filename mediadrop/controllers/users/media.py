@@ -4,7 +4,6 @@ from datetime import datetime
 
 from formencode import Invalid, validators
 from pylons import request, tmpl_context
-from sqlalchemy import orm
 
 from mediadrop.forms.admin import SearchForm, ThumbForm
 from mediadrop.forms.admin.media import AddFileForm, EditFileForm, MediaForm, UpdateStatusForm
@@ -19,7 +18,7 @@ from mediadrop.lib.i18n import _
 from mediadrop.lib.storage import add_new_media_file, UserStorageError
 from mediadrop.lib.templating import render
 from mediadrop.lib.thumbnails import (thumb_path, thumb_paths,
-                                      create_thumbs_for,
+                                      queue_thumbs_for,
                                       create_default_thumbs_for,
                                       has_thumbs, has_default_thumbs,
                                       delete_thumbs)
@@ -68,7 +67,7 @@ class MediaController(BaseController):
         """
         user = request.perm.user.display_name
 
-        media = Media.query.options(orm.undefer('comment_count_published'))
+        media = Media.query
         media = media.filter(Media.author_name == user)
 
         if search:
@@ -388,7 +387,7 @@ class MediaController(BaseController):
 
         try:
             # Create JPEG thumbs
-            create_thumbs_for(media, kwargs['file'].file, kwargs['file'].filename)
+            queue_thumbs_for(media, kwargs['file'].file, kwargs['file'].filename)
             success = True
             message = None
         except IOError, e:
@@ -9,7 +9,6 @@ import os
 import logging
 
 from pylons import request, tmpl_context
-from sqlalchemy import orm
 
 from mediadrop.forms.admin import ThumbForm
 from mediadrop.forms.admin.podcasts import PodcastForm
@@ -20,7 +19,7 @@ from mediadrop.lib.decorators import (autocommit, expose, expose_xhr,
 from mediadrop.lib.helpers import redirect, url_for
 from mediadrop.lib.i18n import _
 from mediadrop.lib.thumbnails import (create_default_thumbs_for,
-                                      create_thumbs_for, delete_thumbs)
+                                      queue_thumbs_for, delete_thumbs)
 from mediadrop.model import Author, Podcast, fetch_row, get_available_slug
 from mediadrop.model.meta import DBSession
 from mediadrop.plugin import events
@@ -51,7 +50,6 @@ class PodcastsController(BaseController):
         user = request.perm.user.display_name
         group = request.perm.user.groups[0].group_name
         podcasts = DBSession.query(Podcast)\
-            .options(orm.undefer('media_count'))\
             .order_by(Podcast.title)
 
         podcasts = podcasts.filter(Podcast.author_name == user)
@@ -215,7 +213,7 @@ class PodcastsController(BaseController):
 
         try:
             # Create JPEG thumbs
-            create_thumbs_for(podcast, thumb.file, thumb.filename)
+            queue_thumbs_for(podcast, thumb.file, thumb.filename)
             success = True
             message = None
         except IOError, e:
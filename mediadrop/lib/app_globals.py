@@ -9,6 +9,14 @@
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from mediadrop.lib.metrics import MetricsRegistry
+from mediadrop.lib.paginate import CountCache
+from mediadrop.lib.profiling import Profiler
+from mediadrop.lib.random_media import RandomMediaPicker
+from mediadrop.lib.thumbnail_queue import ThumbnailQueue
+from mediadrop.lib.view_counter import BufferedViewCounter
+from mediadrop.lib.view_dedup import ViewDeduplicator
+
 
 __all__ = ['is_object_registered', 'Globals']
 
@@ -28,10 +36,53 @@ class Globals(object):
         'app_globals' variable
 
         """
-        self.cache = cache = CacheManager(**parse_cache_config_options(config))
-        self.settings_cache = cache.get_cache('app_settings',
-                                              expire=3600,
-                                              type='memory')
+        self.cache = CacheManager(**parse_cache_config_options(config))
+        # optional Prometheus-style metrics (see mediadrop.lib.metrics)
+        self.metrics = MetricsRegistry.from_config(config)
+        # all settings, reloaded when the settings version changes
+        # (see mediadrop.model.settings_snapshot)
+        from mediadrop.model.settings_snapshot import SettingsStore
+        self.settings_store = SettingsStore.from_config(config)
+        # resolved groups/permissions per user (see mediadrop.lib.auth.permission_cache)
+        from mediadrop.lib.auth.permission_cache import PermissionCache
+        self.permission_cache = PermissionCache.from_config(config)
+        # write-behind buffer for media views (see mediadrop.lib.view_counter)
+        self.view_counter = BufferedViewCounter.from_config(config)
+        # counts a view once per media and visitor (see mediadrop.lib.view_dedup)
+        self.view_dedup = ViewDeduplicator.from_config(config)
+        # in-memory list of published media ids for MediaController.random
+        self.random_media = RandomMediaPicker.from_config(config)
+        # precomputed ids of related media (see mediadrop.model.related_media)
+        from mediadrop.model.related_media import RelatedMediaIndex
+        self.related_media = RelatedMediaIndex.from_config(config)
+        # recounts published media counters after publish dates (see mediadrop.model.counters)
+        from mediadrop.model.counters import PublishDateWatcher
+        self.publish_dates = PublishDateWatcher.from_config(config)
+        # category tree with published media counts (see mediadrop.model.category_tree)
+        from mediadrop.model.category_tree import CategoryTreeCache
+        self.category_tree = CategoryTreeCache.from_config(config)
+        # total item counts of paginated queries (see mediadrop.lib.paginate)
+        self.pagination_counts = CountCache.from_config(config)
+        # chosen player and rendered markup per media (see mediadrop.players.cache)
+        from mediadrop.players.cache import PlayerCache
+        self.player_cache = PlayerCache.from_config(config)
+        # rendered template fragments (see mediadrop.lib.fragments)
+        from mediadrop.lib.fragments import FragmentCache
+        self.fragment_cache = FragmentCache.from_config(config, self.cache)
+        # optional complete pages for anonymous visitors (see mediadrop.lib.page_cache)
+        from mediadrop.lib.page_cache import PageCache
+        self.page_cache = PageCache.from_config(config, self.cache)
+        # optional pre-built sitemap files (see mediadrop.lib.sitemaps)
+        from mediadrop.lib.sitemaps import SitemapShards
+        self.sitemap_shards = SitemapShards.from_config(config)
+        # background thumbnail generation (see mediadrop.lib.thumbnail_queue)
+        self.thumbnail_queue = ThumbnailQueue.from_config(config,
+            self.metrics, self.page_cache, self.fragment_cache)
+        # background storage of new media files (see mediadrop.lib.storage.pipeline)
+        from mediadrop.lib.storage.pipeline import IngestPipeline
+        self.ingest_pipeline = IngestPipeline.from_config(config)
+        # optional per-action request profiling (see mediadrop.lib.profiling)
+        self.profiler = Profiler.from_config(config)
 
         # We'll store the primary translator here for sharing between requests
         self.primary_language = None
@@ -39,8 +90,4 @@ class Globals(object):
 
     @property
     def settings(self):
-        def fetch_settings():
-            from mediadrop.model import DBSession, Setting
-            settings_dict = dict(DBSession.query(Setting.key, Setting.value))
-            return settings_dict
-        return self.settings_cache.get(createfunc=fetch_settings, key=None)
+        return self.settings_store.snapshot().values
@@ -28,6 +28,16 @@ class IPermissionPolicy(object):
     
     def access_condition_for_query(self, query, permission, perm):
         return None
+    
+    def allowed_ids_for_query(self, query, permission, perm):
+        """Return the primary keys of all items ``perm`` may access (or None).
+        
+        Policies which can not express their restrictions as an SQL condition
+        (see ``access_condition_for_query()``) can return a precomputed
+        allow-list instead (e.g. ids stored per group in a separate table).
+        The permission system then filters the query in SQL instead of
+        checking every single item in Python."""
+        return None
 
 
 class InsufficientPermissionsError(Exception):
@@ -5,6 +5,9 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import pylons
+
+from mediadrop.lib.app_globals import is_object_registered
 from mediadrop.lib.auth.api import IPermissionPolicy
 from mediadrop.lib.auth.permission_system import PermissionPolicies
 from mediadrop.model import DBSession, Permission
@@ -15,8 +18,15 @@ __all__ = ['GroupBasedPermissionsPolicy']
 class GroupBasedPermissionsPolicy(IPermissionPolicy):
     @property
     def permissions(self):
-        db_permissions = DBSession.query(Permission).all()
-        return tuple([permission.permission_name for permission in db_permissions])
+        def load_permission_names():
+            db_permissions = DBSession.query(Permission).all()
+            return [permission.permission_name for permission in db_permissions]
+        cache = None
+        if is_object_registered(pylons.app_globals):
+            cache = getattr(pylons.app_globals, 'permission_cache', None)
+        if cache is None:
+            return tuple(load_permission_names())
+        return cache.all_permission_names(load_permission_names)
     
     def _permissions(self, perm):
         if 'permissions' not in perm.data:
@@ -0,0 +1,184 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Per-identity cache of resolved groups and permissions.
+
+Resolving the permissions for a request needs several queries (the user, its
+groups, the meta groups and the permissions of every group) though the answer
+is the same for most requests (especially for anonymous users). The
+:class:`PermissionCache` stores the group ids and permission names per user id
+(``None`` for anonymous users).
+
+Every flush which changes a user, group or permission increments the version
+in the ``permissions_version`` table (see the observers at the end of this
+module). Entries are only valid for the version they were resolved with. The
+cache reads that single row on every lookup (at most once every
+``permissions.check_interval`` seconds if configured) so changes made by other
+processes are visible immediately. :func:`invalidate_permissions` discards all
+entries of this process.
+"""
+
+import threading
+import time
+import weakref
+
+from paste.deploy.converters import asint
+from sqlalchemy import event, sql
+from sqlalchemy.orm import object_session
+
+from mediadrop.model.auth import permissions_version
+from mediadrop.model.meta import DBSession
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['invalidate_permissions', 'PermissionCache', 'PermissionCacheEntry']
+
+_generation_lock = threading.Lock()
+_generation = [0]
+
+def current_generation():
+    return _generation[0]
+
+def invalidate_permissions():
+    """Invalidate all cached permissions (in all caches of this process)."""
+    with _generation_lock:
+        _generation[0] += 1
+
+def load_version(connection=None):
+    """Return the current permissions version (0 if there is no version
+    row)."""
+    connection = connection or DBSession
+    version = connection.execute(
+        sql.select([permissions_version.c.version], permissions_version.c.id == 1)
+    ).scalar()
+    return version or 0
+
+def increment_version(connection):
+    result = connection.execute(permissions_version.update().
+        where(permissions_version.c.id == 1).
+        values(version=permissions_version.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(permissions_version.insert().values(id=1, version=1))
+
+
+class PermissionCacheEntry(object):
+    __slots__ = ('generation', 'expires', 'group_ids', 'permission_names')
+
+    def __init__(self, generation, expires, group_ids, permission_names):
+        self.generation = generation
+        self.expires = expires
+        self.group_ids = group_ids
+        self.permission_names = permission_names
+
+
+class PermissionCache(object):
+    """Cache the resolved group ids and permission names per user.
+
+    :param ttl: Seconds after which an entry is resolved again. ``0``
+        disables the cache.
+    :param max_entries: The cache is cleared once it contains that many
+        users.
+    :param check_interval: Number of seconds between two checks of the
+        permissions version (``0`` checks on every lookup).
+    """
+    def __init__(self, ttl=60, max_entries=10000, check_interval=0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._entries = {}
+        self._all_permissions = None
+        self._version = None
+        self._next_check = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            ttl=asint(config.get('permissions.cache_ttl', 60)),
+            max_entries=asint(config.get('permissions.cache_size', 10000)),
+            check_interval=asint(config.get('permissions.check_interval', 0)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def version(self):
+        """Return the current version of the users, groups and permissions.
+
+        Read it before resolving the permissions and pass it to :meth:`set`
+        so entries resolved while another process changed the permissions
+        are never valid for the new version."""
+        now = self._now()
+        version = self._version
+        if (version is None) or (now >= self._next_check):
+            version = load_version()
+            self._version = version
+            self._next_check = now + self.check_interval
+        return (current_generation(), version)
+
+    def _is_valid(self, entry, version):
+        return (entry is not None) and \
+            (entry.generation == version) and \
+            (entry.expires > self._now())
+
+    def get(self, user_id, version=None):
+        """Return the :class:`PermissionCacheEntry` for the given user id
+        (``None`` for anonymous users) or None if it is not cached."""
+        entry = self._entries.get(user_id)
+        if not self._is_valid(entry, version or self.version()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def set(self, user_id, group_ids, permission_names, version=None):
+        entry = PermissionCacheEntry(version or self.version(),
+            self._now() + self.ttl, frozenset(group_ids),
+            frozenset(permission_names))
+        if self.ttl <= 0:
+            return entry
+        if len(self._entries) >= self.max_entries:
+            self._entries = {}
+        self._entries[user_id] = entry
+        return entry
+
+    def all_permission_names(self, load):
+        """Return the names of all permissions. ``load()`` is called to fetch
+        the names if they are not cached."""
+        version = self.version()
+        entry = self._all_permissions
+        if not self._is_valid(entry, version):
+            names = tuple(load())
+            entry = PermissionCacheEntry(version,
+                self._now() + self.ttl, None, names)
+            if self.ttl > 0:
+                self._all_permissions = entry
+        return entry.permission_names
+
+
+# sessions which changed users, groups or permissions in their current flush
+_changed_sessions = weakref.WeakKeyDictionary()
+
+@observes(
+    events.User.after_insert, events.User.after_update, events.User.after_delete,
+    events.Group.after_insert, events.Group.after_update, events.Group.after_delete,
+    events.Permission.after_insert, events.Permission.after_update,
+    events.Permission.after_delete,
+)
+def _invalidate_permission_cache(instance):
+    session = object_session(instance) or DBSession()
+    _changed_sessions[session] = True
+    invalidate_permissions()
+
+def _increment_version(session, flush_context):
+    if _changed_sessions.pop(session, None) is not None:
+        increment_version(session.connection())
+
+event.listen(DBSession, 'after_flush_postexec', _increment_version)
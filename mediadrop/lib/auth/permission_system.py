@@ -9,14 +9,18 @@ import re
 
 from pylons.controllers.util import abort
 from sqlalchemy import or_
+from sqlalchemy.orm import class_mapper
 
 from mediadrop.lib.auth.api import PermissionSystem, UserPermissions
+# registers the observers which invalidate cached permissions
+import mediadrop.lib.auth.permission_cache
 from mediadrop.lib.auth.query_result_proxy import QueryResultProxy, StaticQuery
 from mediadrop.model import DBSession, Group, User
 from mediadrop.plugin.abc import AbstractClass, abstractmethod
 
 
-__all__ = ['MediaDropPermissionSystem', 'PermissionPolicies']
+__all__ = ['CachedUserPermissions', 'MediaDropPermissionSystem',
+    'PermissionPolicies']
 
 class PermissionPolicies(AbstractClass):
     @abstractmethod
@@ -45,6 +49,55 @@ class PermissionPolicies(AbstractClass):
         return map(policy_from_name, policy_names)
 
 
+def _anonymous_user():
+    user = User()
+    user.display_name = u'Anonymous User'
+    user.user_name = u'anonymous'
+    user.email_address = 'invalid@mediadrop.example'
+    return user
+
+def _permission_cache(config):
+    app_globals = config.get('pylons.app_globals')
+    return getattr(app_globals, 'permission_cache', None)
+
+
+class CachedUserPermissions(UserPermissions):
+    """:class:`UserPermissions` built from a cached
+    :class:`~mediadrop.lib.auth.permission_cache.PermissionCacheEntry`.
+
+    The user and the groups are only loaded from the database when they are
+    actually accessed. The permission names are stored in ``data`` where the
+    :class:`~mediadrop.lib.auth.group_based_policy.GroupBasedPermissionsPolicy`
+    expects them.
+    """
+    def __init__(self, user_id, permission_system, group_ids, permission_names,
+                 user=None, groups=None):
+        self.user_id = user_id
+        self.group_ids = group_ids
+        self.permission_system = permission_system
+        self.data = {'permissions': permission_names}
+        self._user = user
+        self._groups = groups
+
+    @property
+    def user(self):
+        if self._user is None:
+            if self.user_id is not None:
+                self._user = DBSession.query(User).filter(User.id==self.user_id).first()
+            if self._user is None:
+                self._user = _anonymous_user()
+        return self._user
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            groups = ()
+            if self.group_ids:
+                groups = Group.query.filter(Group.group_id.in_(self.group_ids))
+            self._groups = set(groups)
+        return self._groups
+
+
 class MediaDropPermissionSystem(PermissionSystem):
     def __init__(self, config):
         policies = PermissionPolicies.configured_policies(config)
@@ -54,18 +107,32 @@ class MediaDropPermissionSystem(PermissionSystem):
     def permissions_for_request(cls, environ, config):
         identity = environ.get('repoze.who.identity', {})
         user_id = identity.get('repoze.who.userid')
+        cache = _permission_cache(config)
+        version = cache and cache.version()
+        entry = cache and cache.get(user_id, version)
+        if entry is not None:
+            return CachedUserPermissions(user_id, cls(config), entry.group_ids,
+                entry.permission_names)
+
         user = None
         if user_id is not None:
             user = DBSession.query(User).filter(User.id==user_id).first()
-        return cls.permissions_for_user(user, config)
+        perm = cls.permissions_for_user(user, config)
+        if cache is None or (user_id is not None and user is None):
+            return perm
+        permission_names = set()
+        for group in perm.groups:
+            permission_names.update([p.permission_name for p in group.permissions])
+        entry = cache.set(user_id, [group.group_id for group in perm.groups],
+            permission_names, version)
+        return CachedUserPermissions(user_id, perm.permission_system,
+            entry.group_ids, entry.permission_names, user=perm.user,
+            groups=perm.groups)
     
     @classmethod
     def permissions_for_user(cls, user, config):
         if user is None:
-            user = User()
-            user.display_name = u'Anonymous User'
-            user.user_name = u'anonymous'
-            user.email_address = 'invalid@mediadrop.example'
+            user = _anonymous_user()
             anonymous_group = Group.by_name(u'anonymous')
             groups = filter(None, [anonymous_group])
         else:
@@ -77,6 +144,11 @@ class MediaDropPermissionSystem(PermissionSystem):
         if self._can_apply_access_restrictions_to_query(query, permission_name):
             return self._apply_access_restrictions_to_query(query, permission_name, perm)
         
+        allowed_ids = self._allowed_ids_for_query(query, permission_name, perm)
+        if allowed_ids is not None:
+            return self._apply_access_restrictions_to_query(query, permission_name,
+                perm, allowed_ids=allowed_ids)
+        
         can_access_item = \
             lambda item: perm.contains_permission(permission_name, item.resource)
         return QueryResultProxy(query, filter_=can_access_item)
@@ -91,10 +163,27 @@ class MediaDropPermissionSystem(PermissionSystem):
                 return False
         return True
     
-    def _apply_access_restrictions_to_query(self, query, permission_name, perm):
+    def _allowed_ids_for_query(self, query, permission_name, perm):
+        """Return a dict which maps all policies which can not add SQL
+        conditions to their allow-lists or None if any of these policies does
+        not provide an allow-list."""
+        allowed_ids = {}
+        for policy in self.policies_for_permission(permission_name):
+            if policy.can_apply_access_restrictions_to_query(query, permission_name):
+                continue
+            ids = policy.allowed_ids_for_query(query, permission_name, perm)
+            if ids is None:
+                return None
+            allowed_ids[policy] = ids
+        return allowed_ids
+    
+    def _apply_access_restrictions_to_query(self, query, permission_name, perm, allowed_ids=None):
         conditions = []
         for policy in self.policies_for_permission(permission_name):
-            result = policy.access_condition_for_query(query, permission_name, perm)
+            if allowed_ids and (policy in allowed_ids):
+                result = self._allow_list_condition(query, allowed_ids[policy])
+            else:
+                result = policy.access_condition_for_query(query, permission_name, perm)
             if result == True:
                 return QueryResultProxy(query)
             elif result == False:
@@ -113,4 +202,12 @@ class MediaDropPermissionSystem(PermissionSystem):
             return StaticQuery([])
         restricted_query = query.distinct().filter(or_(*conditions))
         return QueryResultProxy(restricted_query)
+    
+    def _allow_list_condition(self, query, ids):
+        if len(ids) == 0:
+            # this policy does not grant access to any item
+            return None
+        mapper = class_mapper(query.column_descriptions[0]['type'])
+        primary_key = mapper.primary_key[0]
+        return primary_key.in_(list(ids))
 
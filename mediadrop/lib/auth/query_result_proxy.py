@@ -6,18 +6,35 @@
 # the GPLv3 or (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+from datetime import datetime
+
+from sqlalchemy import and_, or_
 
 __all__ = ['QueryResultProxy', 'StaticQuery']
 
 class QueryResultProxy(object):
+    """Wrap a query so that items can be filtered by a Python callable.
+
+    Without ``filter_`` counting and slicing are done by the database. With a
+    filter all rows up to the requested position have to be checked but the
+    proxy never keeps more than one chunk of rows in memory for that.
+
+    Deep positions (e.g. sitemaps, large page numbers) should use
+    :meth:`keyset` so rows are fetched with ``WHERE key > last_key`` instead
+    of increasing OFFSETs.
+    """
     def __init__(self, query, start=0, filter_=None, default_fetch=10):
         self.query = query
+        self._start = start
         self._items_retrieved = start
         self._items_returned = 0
         self._limit = None
         self._filter = filter_
         self._default_fetch = default_fetch
         self._prefetched_items = []
+        self._count = None
+        self._keyset = None
+        self._last_key = None
     
     def fetch(self, n=1):
         assert n >= 1
@@ -51,10 +68,107 @@ class QueryResultProxy(object):
         return items
     
     def _fetch(self, n):
-        fetched_items = self.query.offset(self._items_retrieved).limit(n).all()
+        query = self._chunk_query(self._items_retrieved, self._last_key)
+        fetched_items = query.limit(n).all()
         self._items_retrieved += len(fetched_items)
+        if fetched_items and (self._keyset is not None):
+            self._last_key = self.key_of(fetched_items[-1])
         return fetched_items
     
+    def _chunk_query(self, items_retrieved, last_key):
+        if (self._keyset is None) or (last_key is None):
+            return self.query.offset(items_retrieved)
+        column, descending, tiebreaker = self._keyset
+        after = descending and (lambda c, v: c < v) or (lambda c, v: c > v)
+        if tiebreaker is None:
+            return self.query.filter(after(column, last_key))
+        value, tiebreaker_value = last_key
+        return self.query.filter(or_(
+            after(column, value),
+            and_(column == value, after(tiebreaker, tiebreaker_value)),
+        ))
+    
+    def _scan(self, chunk_size=1000):
+        """Yield all items accepted by the filter (starting at the initial
+        offset) without changing the state of the proxy and without keeping
+        more than one chunk of rows in memory."""
+        items_retrieved = self._start
+        last_key = None
+        while True:
+            query = self._chunk_query(items_retrieved, last_key)
+            chunk = query.limit(chunk_size).all()
+            for item in chunk:
+                if (self._filter is None) or self._filter(item):
+                    yield item
+            if len(chunk) < chunk_size:
+                return
+            items_retrieved += len(chunk)
+            if self._keyset is not None:
+                last_key = self.key_of(chunk[-1])
+    
+    def keyset(self, column, after=None, descending=False, tiebreaker=None):
+        """Order by ``column`` and fetch consecutive chunks with
+        ``WHERE column > last_key`` instead of an OFFSET.
+        
+        ``column`` must be unique unless a unique ``tiebreaker`` column (e.g.
+        the primary key) is given. In that case keys are ``(value, tiebreaker)``
+        tuples (see :meth:`key_of`).
+        
+        The previous ordering of the query is replaced. If ``after`` is given
+        only items after that key are returned (e.g. the last item of the
+        previous page) so no OFFSET is necessary at all."""
+        assert (self._items_returned == 0) and (self._keyset is None)
+        self._keyset = (column, descending, tiebreaker)
+        columns = [column]
+        if tiebreaker is not None:
+            columns.append(tiebreaker)
+        if descending:
+            orderings = [c.desc() for c in columns]
+        else:
+            orderings = [c.asc() for c in columns]
+        self.query = self.query.order_by(None).order_by(*orderings)
+        if after is not None:
+            self.seek(after)
+        return self
+    
+    def seek(self, after):
+        """Only return items after the given key (see :meth:`keyset`)."""
+        assert self._keyset is not None
+        assert (self._items_returned == 0) and (self._items_retrieved == self._start)
+        self.query = self._chunk_query(0, after)
+        self._count = None
+        return self
+    
+    @property
+    def keyset_column(self):
+        "The column passed to :meth:`keyset` (None if not ordered by keyset)."
+        if self._keyset is None:
+            return None
+        return self._keyset[0]
+    
+    def cache_key(self):
+        """Return a string which identifies the items of this query (e.g. to
+        cache the number of items) or None if the items depend on the Python
+        filter.
+        
+        Datetime parameters are ignored as these are usually just "now" (e.g.
+        ``Media.query.published()``)."""
+        if self._filter is not None:
+            return None
+        statement = self.query.statement
+        params = statement.compile().params
+        params = sorted((name, value) for name, value in params.items()
+                        if not isinstance(value, datetime))
+        return '%s|%r|%r|%r' % (statement, params, self._start, self._limit)
+    
+    def key_of(self, item):
+        """Return the keyset key of the given item."""
+        column, descending, tiebreaker = self._keyset
+        key = getattr(item, column.key)
+        if tiebreaker is None:
+            return key
+        return (key, getattr(item, tiebreaker.key))
+    
     def more_available(self):
         if len(self._prefetched_items) == 0:
             next_items = self.fetch(n=1)
@@ -83,52 +197,76 @@ class QueryResultProxy(object):
             return items[0]
         raise StopIteration
     
-    def _prefetch_all(self):
-        # yes, that's very inefficient but works for now
-        prefetched_items = []
-        def _prefetch():
-            next_items = self.fetch(n=1000)
-            self._items_returned -= len(next_items)
-            prefetched_items.extend(next_items)
-            prefetched_items.extend(self._prefetched_items)
-            self._prefetched_items = []
-            return (len(next_items) == 1000)
-        while _prefetch():
-            pass
-        self._prefetched_items = prefetched_items
+    def __nonzero__(self):
+        if self._filter is None:
+            return len(self) > 0
+        return (self._items_returned > 0) or self.more_available()
     
     def __len__(self):
-        if self.more_available():
-            self._prefetch_all()
-        return self._items_returned + len(self._prefetched_items)
+        if self._count is None:
+            self._count = self._compute_count()
+        return self._count
     count = __len__
     
+    def _compute_count(self):
+        if self._filter is None:
+            # without a Python filter the database can count the items
+            count = max(self.query.count() - self._start, 0)
+            if self._limit is not None:
+                count = min(count, self._limit)
+            return count
+        count = 0
+        for item in self._scan():
+            count += 1
+            if count == self._limit:
+                break
+        return count
+    
     def __getitem__(self, key):
         def is_slice(item):
             return hasattr(key, 'indices')
         
-        if is_slice(key):
+        if not is_slice(key):
+            raise TypeError
+        start, stop, step = key.start, key.stop, key.step
+        if (start or 0) < 0 or (stop is None) or (stop < 0):
+            # negative indices require the number of items
             start, stop, step = key.indices(len(self))
-            # TODO: if start < self._items_returned
-            index_start = start - self._items_returned
-            index_stop = index_start + (stop - start)
-            
-            # TODO: support step
-            return self._prefetched_items[index_start:index_stop]
-        raise TypeError
+        start = start or 0
+        if self._limit is not None:
+            stop = min(stop, self._limit)
+        if stop <= start:
+            return []
+        
+        if self._filter is None:
+            query = self.query.offset(self._start + start).limit(stop - start)
+            items = query.all()
+        else:
+            items = []
+            for i, item in enumerate(self._scan()):
+                if i >= stop:
+                    break
+                if i >= start:
+                    items.append(item)
+        if step not in (None, 1):
+            items = items[::step]
+        return items
     
     def limit(self, n):
         n = int(n)
         assert n >= 1
         self._limit = n
+        self._count = None
         return self
     
     def offset(self, n):
         n = int(n)
         assert n >= 0
-        assert self._items_retrieved == 0
+        assert self._items_retrieved == self._start
         assert self._items_returned == 0
+        self._start = n
         self._items_retrieved = n
+        self._count = None
         return self
 
 
@@ -139,6 +139,37 @@ class FilteringRestrictedItemsTest(DBTestCase):
         assert_equals(1, results.count())
         assert_equals(self.private_media, results.first())
     
+    def test_policies_can_provide_allow_lists_instead_of_conditions(self):
+        test_self = self
+        class FakePolicy(IPermissionPolicy):
+            permissions = (u'view', )
+            
+            def permits(self, permission, user_permissions, resource):
+                raise AssertionError('items must be filtered in SQL')
+            
+            def allowed_ids_for_query(self, query, permission, perm):
+                return set([test_self.public_media.id])
+        self.permission_system.policies = [FakePolicy()]
+        
+        results = self._media_query_results(u'view')
+        assert_none(results._filter)
+        assert_equals(1, results.count())
+        assert_equals(self.public_media, results.first())
+    
+    def test_uses_python_filter_if_any_policy_can_not_restrict_the_query(self):
+        class FakePolicy(IPermissionPolicy):
+            permissions = (u'view', )
+            
+            def allowed_ids_for_query(self, query, permission, perm):
+                return set()
+        self.permission_system.policies = [
+            FakePolicy(),
+            self._fake_view_policy(lambda media: (u'public' in media.slug)),
+        ]
+        results = self._media_query_results(u'view')
+        assert_not_none(results._filter)
+        assert_equals(1, results.count())
+    
     # --- helpers -------------------------------------------------------------
     
     def _media_query_results(self, permission):
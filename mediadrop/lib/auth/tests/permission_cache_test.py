@@ -0,0 +1,97 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pythonic_testcase import *
+from sqlalchemy import event
+
+from mediadrop.lib.auth.permission_cache import increment_version, PermissionCache
+from mediadrop.lib.auth.permission_system import MediaDropPermissionSystem
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model.auth import Group, groups_permissions, Permission, User
+from mediadrop.model.meta import DBSession
+
+
+class PermissionCacheTest(DBTestCase):
+    def setUp(self):
+        super(PermissionCacheTest, self).setUp()
+        self.cache = PermissionCache(check_interval=60)
+        self.pylons_config['pylons.app_globals'].permission_cache = self.cache
+        self.queries = []
+        event.listen(DBSession.bind, 'before_cursor_execute', self._count_query)
+
+    def _count_query(self, *args):
+        self.queries.append(args[2])
+
+    def _permissions_for(self, user_id=None):
+        environ = {}
+        if user_id is not None:
+            environ['repoze.who.identity'] = {'repoze.who.userid': user_id}
+        return MediaDropPermissionSystem.permissions_for_request(environ, self.pylons_config)
+
+    def test_does_not_query_the_database_for_cached_users(self):
+        user = User.example()
+        user_id = user.id
+        DBSession.commit()
+        assert_true(self._permissions_for(user_id).contains_permission(u'view'))
+
+        self.queries = []
+        perm = self._permissions_for(user_id)
+        assert_true(perm.contains_permission(u'view'))
+        assert_false(perm.contains_permission(u'admin'))
+        assert_equals([], self.queries)
+        assert_equals(1, self.cache.hits)
+
+    def test_anonymous_users_share_one_entry(self):
+        anonymous = Group.by_name(u'anonymous')
+        self._permissions_for(None)
+        self._permissions_for(None)
+
+        assert_equals([None], self.cache._entries.keys())
+        assert_equals(set([anonymous.group_id]), self._permissions_for(None).group_ids)
+        assert_equals(2, self.cache.hits)
+
+    def test_invalidates_entries_when_permissions_change(self):
+        anonymous = Group.by_name(u'anonymous')
+        assert_false(self._permissions_for(None).contains_permission(u'edit'))
+
+        edit = DBSession.query(Permission).filter(Permission.permission_name == u'edit').one()
+        anonymous.permissions.append(edit)
+        DBSession.commit()
+        assert_true(self._permissions_for(None).contains_permission(u'edit'))
+
+    def test_notices_changes_of_other_processes(self):
+        self.cache.check_interval = 0
+        anonymous = Group.by_name(u'anonymous')
+        assert_false(self._permissions_for(None).contains_permission(u'edit'))
+
+        # another process changed the permissions
+        edit = DBSession.query(Permission).filter(Permission.permission_name == u'edit').one()
+        DBSession.execute(groups_permissions.insert().values(
+            group_id=anonymous.group_id, permission_id=edit.permission_id))
+        increment_version(DBSession)
+        DBSession.commit()
+        assert_true(self._permissions_for(None).contains_permission(u'edit'))
+
+    def test_loads_user_lazily(self):
+        user = User.example()
+        user_id = user.id
+        DBSession.commit()
+        self._permissions_for(user_id)
+
+        perm = self._permissions_for(user_id)
+        assert_equals(user_id, perm.user.id)
+        assert_contains(Group.by_name(u'authenticated'), perm.groups)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PermissionCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
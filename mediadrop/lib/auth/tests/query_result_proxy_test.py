@@ -182,6 +182,19 @@ class QueryResultProxyTest(PythonicTestCase):
         self.proxy = QueryResultProxy(self.query, filter_=filter_)
         assert_length(3, self.proxy)
     
+    def test_does_not_materialize_items_when_counting(self):
+        filter_ = lambda item: item.activity >= 2
+        self.proxy = QueryResultProxy(self.query, filter_=filter_)
+        assert_length(3, self.proxy)
+        assert_equals([], self.proxy._prefetched_items)
+        assert_equals(['baz'], self._next_names(n=1))
+    
+    def test_length_respects_offset_and_limit(self):
+        self.proxy = QueryResultProxy(self.query).offset(1).limit(3)
+        assert_length(3, self.proxy)
+        self.proxy = QueryResultProxy(self.query).offset(3)
+        assert_length(2, self.proxy)
+    
     def test_can_specify_how_many_items_should_be_fetched_by_default(self):
         self.proxy = QueryResultProxy(self.query, default_fetch=3)
         self.proxy.more_available()
@@ -196,7 +209,32 @@ class QueryResultProxyTest(PythonicTestCase):
         
         assert_equals(['baz', 'quux', 'quuux'], self._names(self.proxy[2:5]))
     
-    # TODO: slice before start
+    def test_supports_slicing_with_filter(self):
+        filter_ = lambda item: item.activity % 2 == 0
+        self.proxy = QueryResultProxy(self.query, filter_=filter_)
+        assert_equals(['baz', 'quuux'], self._names(self.proxy[1:3]))
+        assert_equals(['quuux'], self._names(self.proxy[-1:]))
+    
+    def test_can_slice_before_current_position(self):
+        assert_equals(['foo', 'bar'], self._next_names(n=2))
+        assert_equals(['bar', 'baz'], self._names(self.proxy[1:3]))
+    
+    # --- keyset pagination ----------------------------------------------------
+    
+    def test_can_fetch_items_with_keyset(self):
+        self.proxy = QueryResultProxy(self.query, default_fetch=2).keyset(User.id)
+        assert_equals(['foo', 'bar', 'baz', 'quux', 'quuux'], self._names(self.proxy))
+        assert_equals(5, self.proxy._last_key)
+    
+    def test_can_start_after_given_key(self):
+        filter_ = lambda item: item.activity != 3
+        self.proxy = QueryResultProxy(self.query, filter_=filter_).\
+            keyset(User.id, after=2)
+        assert_equals(['baz', 'quuux'], self._names(self.proxy))
+        
+        self.proxy = QueryResultProxy(self.query).keyset(User.id, after=4, descending=True)
+        assert_length(3, self.proxy)
+        assert_equals(['bar', 'foo'], self._names(self.proxy[1:3]))
 
 import unittest
 def suite():
@@ -14,7 +14,7 @@ import time
 import urllib2
 
 from paste.deploy.converters import asbool
-from pylons import app_globals, config, request, response, tmpl_context
+from pylons import config, request, response, tmpl_context
 from pylons.controllers import WSGIController
 from pylons.controllers.util import abort
 from tw.forms.fields import ContainerMixin as _ContainerMixin
@@ -24,6 +24,7 @@ from mediadrop.lib.auth import ControllerProtector, has_permission, Predicate
 from .resource_delivery import Scripts, Stylesheets
 from mediadrop.lib.i18n import setup_global_translator
 from mediadrop.model import DBSession, Setting
+from mediadrop.model.counters import check_publish_dates
 
 __all__ = [
     'BareBonesController',
@@ -82,6 +83,8 @@ class BareBonesController(WSGIController):
         response.facebook = None
         response.warnings = []
         request.perm = request.environ['mediadrop.perm']
+        # listings must not show media counts from before a publish date
+        check_publish_dates()
 
         action_method = getattr(self, kwargs['action'], None)
         # The expose decorator sets the exposed attribute on controller
@@ -230,25 +233,12 @@ class BaseSettingsController(BaseController):
             if setting.value != value:
                 setting.value = value
                 DBSession.add(setting)
+        # The flush increments the settings version so this process uses the
+        # new settings at once and other processes after
+        # "settings.check_interval" seconds
+        # (see mediadrop.model.settings_snapshot).
         DBSession.flush()
 
-        # Clear the settings cache unless there are multiple processes.
-        # We have no way of notifying the other processes that they need
-        # to clear their caches too, so we've just gotta let it play out
-        # until all the caches expire.
-        if not request.environ.get('wsgi.multiprocess', False):
-            app_globals.settings_cache.clear()
-        else:
-            # uWSGI provides an automagically included module
-            # that we can use to call a graceful restart of all
-            # the uwsgi processes.
-            # http://projects.unbit.it/uwsgi/wiki/uWSGIReload
-            try:
-                import uwsgi
-                uwsgi.reload()
-            except ImportError:
-                pass
-
     def _display(self, form, values=None, action=None):
         """Return the template variables for display of the form.
 
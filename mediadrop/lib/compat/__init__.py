@@ -10,6 +10,7 @@ __all__ = [
     'all',
     'any',
     'chain',
+    'compare_digest',
     'defaultdict',
     'inet_aton',
     'max',
@@ -279,3 +280,17 @@ def inet_aton(ip_string):
     #     http://bugs.python.org/issue1008086
     # This wrapper ensures the result is always truncated to the first 32 bits.
     return _inet_aton(ip_string)[:4]
+
+try:
+    from hmac import compare_digest
+except ImportError:
+    # added in Python 2.7.7
+    def compare_digest(a, b):
+        """Return a == b in a time which does not depend on the number of
+        matching characters."""
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
@@ -20,7 +20,9 @@ from pylons.decorators.cache import create_cache_key, _make_dict_from_args
 from pylons.decorators.util import get_pylons
 from webob.exc import HTTPException, HTTPMethodNotAllowed
 
+from mediadrop.lib.metrics import inc_metric
 from mediadrop.lib.paginate import paginate
+from mediadrop.lib.profiling import record_cache_access
 from mediadrop.lib.templating import render
 
 __all__ = [
@@ -510,9 +512,11 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         else:
             cache_expire = expire
 
+        created = []
         def create_func():
             log.debug("Creating new cache copy with key: %s, type: %s",
                       cache_key, type)
+            created.append(True)
             result = func(*args, **kwargs)
             # This is one of the two changes to the stock beaker_cache
             # decorator
@@ -529,6 +533,9 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         response = my_cache.get_value(cache_key, createfunc=create_func,
                                       expiretime=cache_expire,
                                       starttime=starttime)
+        record_cache_access(hit=not created)
+        inc_metric('mediadrop_cache_requests_total', cache=namespace,
+            result=created and 'miss' or 'hit')
         if cache_response:
             glob_response = pylons.response
             glob_response.headerlist = [header for header in response['headers']
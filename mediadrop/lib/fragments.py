@@ -0,0 +1,152 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Fragment Cache
+
+Some parts of a page (the category navigation, media grid tiles, comment
+lists) are mostly static but were rendered by Genshi on every request.
+
+:func:`cached_fragment` stores the serialized markup of such a fragment in
+the beaker cache (``mediadrop.fragments`` namespace). The key is built from
+the fragment name and a declared set of dependencies, e.g. the id and
+``modified_on`` of a media item or the ``version`` of the
+:class:`~mediadrop.model.category_tree.CategoryTree`. The current locale, the
+request base (scheme, host, script name) and the settings version are always
+part of the key.
+
+Fragments used by templates are separate template files (a ``py:def`` can
+not be serialized on its own) which are rendered with
+:func:`cached_template`::
+
+    ${h.cached_template('media/_tile.html', (m.id, m.modified_on), m=m)}
+
+The fragment is inserted as serialized markup so ``py:match`` templates of
+the including template are not applied to its contents.
+"""
+
+from genshi import Markup, QName, Stream
+from genshi.core import END, END_NS, START, START_NS
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals
+
+from mediadrop.lib.compat import md5
+from mediadrop.lib.profiling import record_cache_access
+from mediadrop.lib.templating import render as render_template, render_stream
+from mediadrop.lib.util import current_locale, request_base
+
+
+__all__ = ['cached_fragment', 'cached_template', 'current_fragment_cache',
+    'FragmentCache', 'serialize_fragment']
+
+XHTML_NAMESPACE = u'http://www.w3.org/1999/xhtml'
+
+class FragmentCache(object):
+    """Store rendered fragments in a beaker cache.
+
+    :param cache_manager: The beaker ``CacheManager`` (``app_globals.cache``).
+    :param expire: Number of seconds after which fragments are rendered again
+        (even if none of their dependencies changed).
+    :param enabled: False renders every fragment (useful for development).
+    """
+    namespace = 'mediadrop.fragments'
+
+    def __init__(self, cache_manager, expire=600, enabled=True):
+        self.cache_manager = cache_manager
+        self.expire = expire
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config, cache_manager):
+        enabled = asbool(config.get('cache_enabled', True)) and \
+            asbool(config.get('fragments.enabled', True))
+        return cls(cache_manager,
+            expire=asint(config.get('fragments.expire', 600)),
+            enabled=enabled,
+        )
+
+    def key(self, name, dependencies):
+        from mediadrop.model.settings_snapshot import current_settings
+        parts = (dependencies, current_locale(), request_base(),
+                 current_settings().version)
+        return '%s:%s' % (name, md5(repr(parts)).hexdigest())
+
+    def fragment(self, name, dependencies, render, expire=None):
+        """Return the cached markup for the fragment (calling ``render`` if
+        it is not cached yet)."""
+        if not self.enabled:
+            return Markup(serialize_fragment(render()))
+        rendered = []
+        def create():
+            rendered.append(True)
+            return serialize_fragment(render())
+        cache = self.cache_manager.get_cache(self.namespace)
+        markup = cache.get_value(self.key(name, dependencies),
+            createfunc=create, expiretime=expire or self.expire)
+        if rendered:
+            self.misses += 1
+        else:
+            self.hits += 1
+        record_cache_access(hit=not rendered)
+        return Markup(markup)
+
+    def clear(self):
+        self.cache_manager.get_cache(self.namespace).clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def serialize_fragment(result):
+    """Return the given Genshi stream (or markup) as unicode string (Genshi
+    ``Markup`` can not be pickled)."""
+    if hasattr(result, 'render'):
+        result = render_stream(Stream(_strip_xhtml_namespace(result)))
+    if hasattr(result, '__html__'):
+        return unicode(result.__html__())
+    return unicode(result)
+
+def _strip_xhtml_namespace(stream):
+    """Remove the XHTML namespace from all elements so the serializer does not
+    add a namespace declaration to the root elements of the fragment."""
+    for kind, data, pos in stream:
+        if kind is START_NS or kind is END_NS:
+            continue
+        if (kind is START) and (data[0].namespace == XHTML_NAMESPACE):
+            data = (QName(data[0].localname), data[1])
+        elif (kind is END) and (data.namespace == XHTML_NAMESPACE):
+            data = QName(data.localname)
+        yield kind, data, pos
+
+def current_fragment_cache():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'fragment_cache', None)
+
+def cached_fragment(name, dependencies, render, expire=None):
+    """Return the markup produced by ``render()`` for the given dependencies.
+
+    :param name: Name of the fragment (e.g. ``'media-tile'``).
+    :param dependencies: A tuple of values the fragment depends on (its
+        ``repr`` is used in the key).
+    :param render: A callable which returns a Genshi stream or markup.
+    :param expire: Optional number of seconds after which the fragment is
+        rendered again (default: ``fragments.expire``).
+    :rtype: :class:`genshi.Markup`
+    """
+    cache = current_fragment_cache()
+    if cache is None:
+        return Markup(serialize_fragment(render()))
+    return cache.fragment(name, dependencies, render, expire=expire)
+
+def cached_template(template, dependencies, expire=None, **tmpl_vars):
+    """Render the given template (with ``tmpl_vars``) as cached fragment
+    (see :func:`cached_fragment`, the template name is used as fragment
+    name)."""
+    return cached_fragment(template, dependencies,
+        lambda: render_template(template, tmpl_vars), expire=expire)
@@ -29,6 +29,7 @@ from webhelpers.html.converters import format_paragraphs
 from mediadrop.lib.auth import viewable_media
 from mediadrop.lib.compat import any, md5
 from mediadrop.lib.filesize import format_filesize
+from mediadrop.lib.fragments import cached_fragment, cached_template
 from mediadrop.lib.i18n import (N_, _, format_date, format_datetime, 
     format_decimal, format_time)
 from mediadrop.lib.thumbnails import thumb, thumb_url
@@ -47,6 +48,8 @@ from mediadrop.plugin.events import (meta_description, meta_keywords,
 __all__ = [
     # Imports that should be exported:
     'any',
+    'cached_fragment',
+    'cached_template',
     'clean_xhtml',
     'current_url',
     'config', # is this appropriate to export here?
@@ -102,6 +105,7 @@ __all__ = [
     'gravatar_from_email',
     'is_admin',
     'js',
+    'keyset_library_controls',
     'mediadrop_version',
     'pick_any_media_file',
     'pick_podcast_media_file',
@@ -301,6 +305,20 @@ def filter_library_controls(query, show='latest'):
             query = query.in_category(featured_cat)
     return query, show
 
+def keyset_library_controls(media, show='latest'):
+    """Order viewable media for :func:`filter_library_controls` by keyset
+    (with the media id as tiebreaker) so the paginator can link to the next
+    page with a cursor instead of an OFFSET (see
+    :class:`mediadrop.lib.paginate.KeysetPage`)."""
+    from mediadrop.model import Media
+    column = {
+        'latest': Media.publish_on,
+        'popular': Media.popularity_points,
+    }.get(show)
+    if (column is not None) and hasattr(media, 'keyset'):
+        media.keyset(column, descending=True, tiebreaker=Media.id)
+    return media
+
 def has_permission(permission_name):
     """Return True if the logged in user has the given permission.
 
@@ -0,0 +1,595 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Metrics
+
+Opt-in (``metrics.enabled = true``) counters, gauges and fixed bucket
+histograms which are exposed in the Prometheus text exposition format at
+``metrics.path`` (default: ``/metrics``).
+
+The endpoint requires the bearer token configured as ``metrics.token``
+(``Authorization: Bearer <token>``). Without a token only requests from the
+local host are answered.
+
+The default metrics (see :func:`declare_default_metrics`) cover request
+latency per route and status codes (:class:`MetricsMiddleware`), the
+SQLAlchemy connection pool, cache hits of the settings store, the
+``beaker_cache`` namespaces and the fragment cache, view counter flushes,
+uploads and thumbnail jobs.
+
+Prefork servers (e.g. uwsgi) run several worker processes with separate
+metrics. Every process writes its values to a JSON file in ``metrics.dir``
+(at most every ``metrics.flush_interval`` seconds) and the process which
+answers a scrape adds up the files of all processes. Counters and histograms
+of processes which exited are merged into an archive file so totals never
+decrease, their gauges are dropped.
+"""
+
+import errno
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals
+
+from mediadrop.lib.compat import compare_digest
+from mediadrop.lib.profiling import ClosingIterator
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = ['add_default_collectors', 'Counter', 'current_metrics',
+    'declare_default_metrics', 'Gauge',
+    'Histogram', 'inc_metric', 'MetricsMiddleware', 'MetricsRegistry']
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Metric(object):
+    """Base class for metrics with a fixed set of label names.
+
+    Values are kept per process: a forked child process starts without the
+    values of its parent (which are reported by the parent itself)."""
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError('%s requires the labels %r' % (self.name, self.labels))
+        return tuple(unicode(labels[name]) for name in self.labels)
+
+    def _process_values(self):
+        # must be called with the lock held
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._values = {}
+        return self._values
+
+    def samples(self):
+        """Return a dict which maps label values (tuples) to values."""
+        with self._lock:
+            return dict((key, _copy(value))
+                        for key, value in self._process_values().items())
+
+    def merge(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def zero(self):
+        return 0
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._process_values()
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Set the total of this process (for values which are counted
+        elsewhere, see :meth:`MetricsRegistry.add_collector`)."""
+        key = self._key(labels)
+        with self._lock:
+            self._process_values()[key] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._process_values()[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._process_values()
+            values[key] = values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Count observed values in fixed buckets.
+
+    A value is stored as list: the number of values per bucket (plus one
+    overflow bucket) followed by the sum of all values."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        with self._lock:
+            values = self._process_values()
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def zero(self):
+        return [0] * (len(self.buckets) + 2)
+
+    def merge(self, target, key, value):
+        if len(value) != len(self.buckets) + 2:
+            # written by a process with different buckets
+            return
+        counts = target.get(key)
+        if counts is None:
+            target[key] = list(value)
+            return
+        for index, count in enumerate(value):
+            counts[index] += count
+
+
+class MetricsRegistry(object):
+    """A set of named metrics.
+
+    :param directory: Directory shared by all worker processes on this host
+        (None disables the aggregation across processes).
+    :param flush_interval: Minimum number of seconds between two writes of
+        the values of this process (see :meth:`maybe_flush`).
+    """
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        # names in the order of registration
+        self._names = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._next_flush = 0
+        self._pid = None
+        self._filename = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Return a registry with the default metrics if ``metrics.enabled``
+        is set (None otherwise)."""
+        if not asbool(config.get('metrics.enabled', False)):
+            return None
+        directory = config.get('metrics.dir', None)
+        if directory is None and config.get('pylons.cache_dir'):
+            directory = os.path.join(config['pylons.cache_dir'], 'metrics')
+        registry = cls(
+            directory=directory or None,
+            flush_interval=asint(config.get('metrics.flush_interval', 5)),
+        )
+        declare_default_metrics(registry)
+        return registry
+
+    # --- declaring ------------------------------------------------------------
+    def register(self, metric):
+        """Add the metric (or return the metric which was registered with the
+        same name already)."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.type != metric.type:
+                    raise ValueError('%s is registered as %s already' %
+                        (metric.name, existing.type))
+                return existing
+            self._metrics[metric.name] = metric
+            self._names.append(metric.name)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets=buckets))
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def add_collector(self, collector):
+        """Call ``collector(registry)`` before the values are written or
+        exposed (e.g. to set gauges or counters which are tracked by other
+        objects of this process)."""
+        self._collectors.append(collector)
+
+    # --- aggregation ----------------------------------------------------------
+    def _run_collectors(self):
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception:
+                log.exception('metrics collector %r failed', collector)
+
+    def snapshot(self):
+        """Return the values of this process as dict (name -> samples)."""
+        self._run_collectors()
+        return dict((name, metric.samples())
+                    for name, metric in self._metrics.items())
+
+    def _process_filename(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            # a random suffix so a later process with the same pid does not
+            # overwrite the values of this process
+            self._pid = pid
+            self._filename = os.path.join(self.directory,
+                'process-%d-%s.json' % (pid, uuid.uuid4().hex[:8]))
+        return self._filename
+
+    def flush(self):
+        """Write the values of this process to ``directory``."""
+        if self.directory is None:
+            return
+        self._next_flush = time.time() + self.flush_interval
+        filename = self._process_filename()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            _write_json(filename, _serialize(self.snapshot()))
+        except (IOError, OSError):
+            log.exception('unable to write metrics to %s', filename)
+
+    def maybe_flush(self):
+        """Write the values of this process if the last write is older than
+        ``flush_interval`` seconds."""
+        if (self.directory is not None) and (time.time() >= self._next_flush):
+            self.flush()
+
+    def collect(self):
+        """Return the values of all processes (name -> samples)."""
+        totals = self.snapshot()
+        if self.directory is None or not os.path.isdir(self.directory):
+            return totals
+        own_filename = self._process_filename()
+        with _DirectoryLock(self.directory):
+            archive_path = os.path.join(self.directory, 'archive.json')
+            archive = {}
+            self._merge(archive, _read_json(archive_path) or {})
+            archive_changed = False
+            for filename in glob.glob(os.path.join(self.directory, 'process-*.json')):
+                if filename == own_filename:
+                    continue
+                values = _read_json(filename)
+                if _is_alive(_pid_of(filename)):
+                    if values is not None:
+                        self._merge(totals, values)
+                    continue
+                if values is not None:
+                    self._merge(archive, values, types=('counter', 'histogram'))
+                    archive_changed = True
+                _remove(filename)
+            if archive_changed:
+                _write_json(archive_path, _serialize(archive))
+        self._merge(totals, archive)
+        return totals
+
+    def _merge(self, totals, values, types=None):
+        for name, samples in values.items():
+            metric = self._metrics.get(name)
+            if metric is None or (types and metric.type not in types):
+                continue
+            target = totals.setdefault(name, {})
+            if isinstance(samples, dict):
+                samples = samples.items()
+            for key, value in samples:
+                metric.merge(target, tuple(key), value)
+
+    def exposition(self):
+        """Return the values of all processes in the Prometheus text
+        exposition format."""
+        totals = self.collect()
+        lines = []
+        for name in self._names:
+            metric = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, _escape_help(metric.help)))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            samples = totals.get(name)
+            if not samples and not metric.labels:
+                samples = {(): metric.zero()}
+            for key, value in sorted((samples or {}).items()):
+                labels = zip(metric.labels, key)
+                if metric.type != 'histogram':
+                    lines.append(_sample(name, labels, value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(_sample(name + '_bucket',
+                        labels + [('le', _format_bound(bound))], cumulative))
+                lines.append(_sample(name + '_sum', labels, value[-1]))
+                lines.append(_sample(name + '_count', labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def declare_default_metrics(registry):
+    """Add the metrics which are collected by MediaDrop itself."""
+    registry.histogram('mediadrop_request_duration_seconds',
+        'Time to handle a request (including the response body).', ['route'])
+    registry.counter('mediadrop_requests_total',
+        'Number of handled requests.', ['route', 'status'])
+    registry.gauge('mediadrop_db_pool_size',
+        'Number of connections in the SQLAlchemy pool.')
+    registry.gauge('mediadrop_db_pool_checked_out',
+        'Number of connections which are in use.')
+    registry.gauge('mediadrop_db_pool_overflow',
+        'Number of connections above the pool size.')
+    registry.counter('mediadrop_cache_requests_total',
+        'Number of cache lookups.', ['cache', 'result'])
+    registry.counter('mediadrop_views_flushed_total',
+        'Number of views which were written to the database.')
+    registry.counter('mediadrop_view_counter_flushes_total',
+        'Number of view counter flushes.')
+    registry.gauge('mediadrop_views_pending',
+        'Number of buffered views which were not written yet.')
+    registry.counter('mediadrop_uploads_total',
+        'Number of new media files.', ['source'])
+    registry.counter('mediadrop_upload_bytes_total',
+        'Size of uploaded media files.')
+    registry.histogram('mediadrop_thumbnail_job_duration_seconds',
+        'Time to create the thumbnails of a media item or podcast.',
+        ['result'], buckets=JOB_BUCKETS)
+
+
+def add_default_collectors(registry, globals_, engine):
+    """Report the state of the connection pool of ``engine`` and of the
+    caches and the view counter in ``globals_`` (the ``app_globals``)."""
+    def collect_pool(registry):
+        pool = engine.pool
+        # only a QueuePool (not used for SQLite) knows its size
+        if not hasattr(pool, 'checkedout'):
+            return
+        registry['mediadrop_db_pool_size'].set(pool.size())
+        registry['mediadrop_db_pool_checked_out'].set(pool.checkedout())
+        # SQLAlchemy counts the overflow from -size
+        registry['mediadrop_db_pool_overflow'].set(max(pool.overflow(), 0))
+
+    def collect_caches(registry):
+        cache_requests = registry['mediadrop_cache_requests_total']
+        caches = (('settings', globals_.settings_store),
+                  ('fragments', globals_.fragment_cache),
+                  ('pages', globals_.page_cache))
+        for name, cache in caches:
+            if cache is None:
+                continue
+            cache_requests.set(cache.hits, cache=name, result='hit')
+            cache_requests.set(cache.misses, cache=name, result='miss')
+
+    def collect_views(registry):
+        registry['mediadrop_views_pending'].set(globals_.view_counter.pending)
+
+    for collector in (collect_pool, collect_caches, collect_views):
+        registry.add_collector(collector)
+
+
+class MetricsMiddleware(object):
+    """Serve the metrics at ``path`` and record the latency and status code
+    of all other requests.
+
+    :param token: Bearer token which is required to read the metrics. If no
+        token is set only requests from the local host are allowed.
+    """
+    local_addresses = ('127.0.0.1', '::1')
+
+    def __init__(self, app, registry, path='/metrics', token=None):
+        self.app = app
+        self.registry = registry
+        self.path = path
+        self.token = token
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.path:
+            return self.serve_metrics(environ, start_response)
+        started = time.time()
+        status = []
+        def _start_response(status_line, headers, exc_info=None):
+            status[:] = [status_line.split(' ', 1)[0]]
+            return start_response(status_line, headers, exc_info)
+        try:
+            result = self.app(environ, _start_response)
+        except:
+            self._finish(environ, started, status or ['500'])
+            raise
+        return ClosingIterator(result,
+            lambda: self._finish(environ, started, status))
+
+    def _finish(self, environ, started, status):
+        routing_args = environ.get('wsgiorg.routing_args')
+        route = routing_args and routing_args[1] or None
+        if route and route.get('controller'):
+            route_name = '%s/%s' % (route['controller'], route.get('action'))
+        else:
+            route_name = 'other'
+        registry = self.registry
+        registry['mediadrop_request_duration_seconds'].observe(
+            time.time() - started, route=route_name)
+        registry['mediadrop_requests_total'].inc(route=route_name,
+            status=status and status[0] or 'unknown')
+        registry.maybe_flush()
+
+    def is_authorized(self, environ):
+        if not self.token:
+            return environ.get('REMOTE_ADDR') in self.local_addresses
+        authorization = environ.get('HTTP_AUTHORIZATION', '')
+        if not authorization.startswith('Bearer '):
+            return False
+        return compare_digest(authorization[7:].strip(), self.token)
+
+    def serve_metrics(self, environ, start_response):
+        if not self.is_authorized(environ):
+            headers = [('Content-Type', 'text/plain')]
+            if self.token:
+                headers.append(('WWW-Authenticate', 'Bearer realm="metrics"'))
+            start_response('401 Unauthorized', headers)
+            return ['Unauthorized\n']
+        body = self.registry.exposition()
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-cache'),
+        ])
+        return [body]
+
+
+def current_metrics():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'metrics', None)
+
+def inc_metric(name, amount=1, **labels):
+    """Increment the counter ``name`` (if metrics are enabled)."""
+    registry = current_metrics()
+    if registry is not None:
+        registry[name].inc(amount, **labels)
+
+
+@observes(events.ViewCounter.flushed)
+def _count_flushed_views(deltas):
+    registry = current_metrics()
+    if registry is not None:
+        registry['mediadrop_view_counter_flushes_total'].inc()
+        registry['mediadrop_views_flushed_total'].inc(sum(deltas.values()))
+
+
+class _DirectoryLock(object):
+    """Exclusive lock (between processes) for the archive of a metrics
+    directory."""
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'archive.lock')
+        self._fp = None
+
+    def __enter__(self):
+        self._fp = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+        self._fp.close()
+        self._fp = None
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+def _serialize(values):
+    # JSON has no tuple keys: samples are stored as [[label values], value]
+    return dict((name, [[list(key), value] for key, value in samples.items()])
+                for name, samples in values.items())
+
+def _write_json(path, data):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as json_fp:
+        json.dump(data, json_fp)
+    os.rename(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path, 'rb') as json_fp:
+            return json.load(json_fp)
+    except (IOError, ValueError):
+        return None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _pid_of(filename):
+    try:
+        return int(os.path.basename(filename).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+def _is_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _format_bound(bound):
+    if isinstance(bound, basestring):
+        return bound
+    return _format_value(float(bound))
+
+def _sample(name, labels, value):
+    if not labels:
+        return '%s %s' % (name, _format_value(value))
+    label_text = ','.join('%s="%s"' % (label, _escape_label(unicode(label_value)))
+                          for label, label_value in labels)
+    return (u'%s{%s} %s' % (name, label_text, _format_value(value))).encode('utf-8')
@@ -0,0 +1,383 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Page Cache
+
+Anonymous visitors see the same public pages (the front page, the media
+library, media, category and podcast pages). :class:`PageCacheMiddleware`
+serves these pages from the beaker cache (``mediadrop.pages`` namespace)
+without running the authentication, the controller or the templates.
+
+Only GET/HEAD requests without an auth or session cookie are cached and only
+responses of controller actions which called :func:`cache_page`. The key is
+built from the URL (including the query string), the locale and the settings
+version.
+
+Every page is tagged with the objects it depends on, e.g. a media page
+depends on its media item (``media:<id>``), its podcast and its categories
+while the library depends on all media (:data:`MEDIA_LISTINGS`). The mapper
+observers at the end of this module purge a tag when a media item, comment,
+category or podcast is changed, a changed setting purges all pages. The tags
+are purged once the transaction was committed.
+
+A purge replaces the random token of the tag (in the ``mediadrop.page_tags``
+namespace): a cached page is only served while the tokens it was stored with
+are current. This works with every beaker backend but pages are shared (and
+purged) across processes only with a shared backend (e.g. ``file`` or
+``ext:memcached``). Every purge also replaces the purge generation: a page is
+not stored if the generation changed while it was rendered (it might contain
+purged data but the tokens read afterwards are current).
+
+Cached pages have an ``ETag`` so browsers can revalidate them with a
+conditional GET (``304 Not Modified``).
+"""
+
+from uuid import uuid4
+
+from paste.deploy.converters import asbool, asint
+from paste.response import header_value
+from pylons import app_globals, request
+from sqlalchemy.orm import object_session
+from webob import Request
+
+from mediadrop.lib.compat import md5
+from mediadrop.lib.view_dedup import visitor_token
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['cache_page', 'CachedPage', 'CATEGORIES', 'current_page_cache',
+    'MEDIA_LISTINGS', 'PageCache', 'PageCacheMiddleware', 'PODCASTS']
+
+# tags of pages which list media, show the category tree or list podcasts
+MEDIA_LISTINGS = 'media'
+CATEGORIES = 'categories'
+PODCASTS = 'podcasts'
+# every page is tagged so a single purge removes all pages
+ALL_PAGES = '*'
+
+ENVIRON_KEY = 'mediadrop.page_cache.dependencies'
+# key of the purge generation in the tags namespace (tags never start with '#')
+GENERATION_KEY = '#generation'
+
+def tag_for(dependency):
+    """Return the tag for a model instance (e.g. ``'media:42'``) or the
+    given string."""
+    if isinstance(dependency, basestring):
+        return dependency
+    return '%s:%d' % (dependency.__class__.__name__.lower(), dependency.id)
+
+
+class CachedPage(object):
+    """A complete response which is valid as long as the ``tokens`` of its
+    tags are current."""
+    def __init__(self, status, headers, body, tokens, media_id=None):
+        self.etag = md5(body).hexdigest()
+        headers = [(name, value) for (name, value) in headers
+                   if name.lower() not in ('content-length', 'etag')]
+        headers.append(('Content-Length', str(len(body))))
+        headers.append(('ETag', '"%s"' % self.etag))
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.tokens = tokens
+        self.media_id = media_id
+
+
+class PageDependencies(object):
+    """Collects the tags of the response of the current request (see
+    :func:`cache_page`)."""
+    def __init__(self):
+        self.cacheable = False
+        self.tags = set([ALL_PAGES])
+        self.media_id = None
+
+
+class PageCache(object):
+    """Store complete pages in a beaker cache.
+
+    :param cache_manager: The beaker ``CacheManager`` (``app_globals.cache``).
+    :param expire: Number of seconds after which a page is rendered again
+        (even if it was not purged).
+    :param private_cookies: Names of cookies which identify a user or a
+        session, requests with one of these cookies are never cached.
+    """
+    namespace = 'mediadrop.pages'
+    tags_namespace = 'mediadrop.page_tags'
+
+    def __init__(self, cache_manager, expire=300,
+                 private_cookies=('authtkt', 'beaker.session.id')):
+        self.cache_manager = cache_manager
+        self.expire = expire
+        self.private_cookies = frozenset(private_cookies)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config, cache_manager):
+        """Return a :class:`PageCache` (or None if ``page_cache.enabled`` is
+        not set)."""
+        enabled = asbool(config.get('cache_enabled', True)) and \
+            asbool(config.get('page_cache.enabled', False))
+        if not enabled:
+            return None
+        session_cookie = config.get('beaker.session.key', 'beaker.session.id')
+        return cls(cache_manager,
+            expire=asint(config.get('page_cache.expire', 300)),
+            private_cookies=('authtkt', session_cookie),
+        )
+
+    def _pages(self):
+        return self.cache_manager.get_cache(self.namespace)
+
+    def _tags(self):
+        return self.cache_manager.get_cache(self.tags_namespace)
+
+    def is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        return not self.private_cookies.intersection(request.cookies)
+
+    def key(self, environ, settings):
+        """Return the key of the page requested in ``environ`` for the given
+        :class:`~mediadrop.model.settings_snapshot.SettingsSnapshot`."""
+        parts = (environ.get('wsgi.url_scheme'), environ.get('HTTP_HOST'),
+                 environ.get('SCRIPT_NAME'), environ.get('PATH_INFO'),
+                 environ.get('QUERY_STRING'), settings.get('primary_language'),
+                 settings.version)
+        return md5(repr(parts)).hexdigest()
+
+    def get(self, key):
+        """Return the :class:`CachedPage` for ``key`` or None if it is not
+        cached or one of its tags was purged."""
+        pages = self._pages()
+        try:
+            page = pages.get(key, expiretime=self.expire)
+        except KeyError:
+            page = None
+        if (page is not None) and not self._is_current(page.tokens):
+            pages.remove_value(key)
+            page = None
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def generation(self):
+        """Return the current purge generation (taken before a page is
+        rendered, see :meth:`put`)."""
+        tags = self._tags()
+        try:
+            return tags.get(GENERATION_KEY)
+        except KeyError:
+            generation = uuid4().hex
+            tags.put(GENERATION_KEY, generation)
+            return generation
+
+    def put(self, key, status, headers, body, dependencies, generation):
+        """Store the response and return it as :class:`CachedPage`.
+
+        The page is not stored if anything was purged since ``generation``
+        was taken (before the page was rendered)."""
+        tags = self._tags()
+        tokens = {}
+        for tag in dependencies.tags:
+            try:
+                tokens[tag] = tags.get(tag)
+            except KeyError:
+                tokens[tag] = uuid4().hex
+                tags.put(tag, tokens[tag])
+        page = CachedPage(status, headers, body, tokens, dependencies.media_id)
+        # the tokens are read first: purge() replaces the generation before
+        # the tokens of the tags
+        if self.generation() == generation:
+            self._pages().put(key, page, expiretime=self.expire)
+        return page
+
+    def _is_current(self, tokens):
+        tags = self._tags()
+        for tag, token in tokens.iteritems():
+            try:
+                if tags.get(tag) != token:
+                    return False
+            except KeyError:
+                return False
+        return True
+
+    def purge(self, *tags):
+        """Remove all pages which are tagged with one of the given tags."""
+        cache = self._tags()
+        cache.put(GENERATION_KEY, uuid4().hex)
+        for tag in tags:
+            cache.put(tag, uuid4().hex)
+
+    def clear(self):
+        """Remove all pages."""
+        self.purge(ALL_PAGES)
+        self.hits = 0
+        self.misses = 0
+
+
+class PageCacheMiddleware(object):
+    """Serve cached pages and store cacheable responses.
+
+    :param settings_store: The
+        :class:`~mediadrop.model.settings_snapshot.SettingsStore` (the
+        middleware runs outside of the Pylons app so ``app_globals`` is not
+        available).
+    :param view_dedup: The :class:`~mediadrop.lib.view_dedup.ViewDeduplicator`
+        which is notified when a cached media page is served.
+    """
+    def __init__(self, app, page_cache, settings_store, view_dedup):
+        self.app = app
+        self.page_cache = page_cache
+        self.settings_store = settings_store
+        self.view_dedup = view_dedup
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if not self.page_cache.is_cacheable_request(request):
+            return self.app(environ, start_response)
+        key = self.page_cache.key(environ, self.settings_store.snapshot())
+        page = self.page_cache.get(key)
+        if page is not None:
+            if page.media_id is not None:
+                # the view is only counted after the final_view request
+                self.view_dedup.page_viewed(page.media_id, visitor_token(request))
+            return self._respond(request, page, start_response)
+
+        generation = self.page_cache.generation()
+        dependencies = environ[ENVIRON_KEY] = PageDependencies()
+        response = {}
+        def store_response(status, headers, exc_info=None):
+            is_cacheable = dependencies.cacheable \
+                and (exc_info is None) \
+                and (request.method == 'GET') \
+                and status.startswith('200 ') \
+                and (header_value(headers, 'set-cookie') is None)
+            if not is_cacheable:
+                return start_response(status, headers, exc_info)
+            response['status'] = status
+            response['headers'] = headers
+            return response.setdefault('body', []).append
+
+        result = self.app(environ, store_response)
+        if not response:
+            return result
+        try:
+            response['body'].extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        page = self.page_cache.put(key, response['status'], response['headers'],
+            ''.join(response['body']), dependencies, generation)
+        return self._respond(request, page, start_response)
+
+    def _respond(self, request, page, start_response):
+        if page.etag in request.if_none_match:
+            headers = [(name, value) for (name, value) in page.headers
+                       if name.lower() in ('cache-control', 'etag', 'expires', 'vary')]
+            start_response('304 Not Modified', headers)
+            return []
+        start_response(page.status, list(page.headers))
+        if request.method == 'HEAD':
+            return []
+        return [page.body]
+
+
+def current_page_cache():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'page_cache', None)
+
+def cache_page(*dependencies, **kwargs):
+    """Allow the page cache to store the response of the current request.
+
+    Nothing happens if the page cache is disabled or the visitor is logged
+    in (or has a session).
+
+    :param dependencies: Model instances (media, categories, podcasts) and
+        tags (e.g. :data:`MEDIA_LISTINGS`) the page depends on.
+    :param viewed_media_id: Id of the media item which is shown on the page
+        (its page views are also recorded when the page is served from the
+        cache).
+    """
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(request):
+        return
+    page = request.environ.get(ENVIRON_KEY)
+    if page is None:
+        return
+    page.cacheable = True
+    page.tags.update(tag_for(dependency) for dependency in dependencies
+                     if dependency is not None)
+    if kwargs.get('viewed_media_id') is not None:
+        page.media_id = kwargs['viewed_media_id']
+
+class _PendingPurge(object):
+    """Purge the tags of all changes of a transaction after it was committed
+    (another process could cache the old data again otherwise)."""
+    def __init__(self, page_cache):
+        self.page_cache = page_cache
+        self.tags = set()
+
+    def __eq__(self, other):
+        return isinstance(other, _PendingPurge) and \
+            (self.page_cache is other.page_cache)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __call__(self):
+        self.page_cache.purge(*self.tags)
+
+def _purge(instance, *tags):
+    page_cache = current_page_cache()
+    if page_cache is None:
+        return
+    from mediadrop.model.meta import after_commit, DBSession
+    session = object_session(instance) or DBSession()
+    pending = after_commit(session, _PendingPurge(page_cache))
+    pending.tags.update(tags)
+
+
+@observes(events.Media.after_insert, events.Media.after_update,
+    events.Media.after_delete)
+def _media_changed(instance):
+    tags = [MEDIA_LISTINGS]
+    if instance.id is not None:
+        tags.append(tag_for(instance))
+    _purge(instance, *tags)
+
+@observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+    events.MediaFile.after_delete)
+def _media_file_changed(instance):
+    if instance.media_id is not None:
+        _purge(instance, 'media:%d' % instance.media_id)
+
+@observes(events.Comment.after_insert, events.Comment.after_update,
+    events.Comment.after_delete)
+def _comment_changed(instance):
+    if instance.media_id is not None:
+        _purge(instance, 'media:%d' % instance.media_id)
+
+@observes(events.Category.after_insert, events.Category.after_update,
+    events.Category.after_delete)
+def _category_changed(instance):
+    _purge(instance, CATEGORIES, tag_for(instance))
+
+@observes(events.Podcast.after_insert, events.Podcast.after_update,
+    events.Podcast.after_delete)
+def _podcast_changed(instance):
+    _purge(instance, PODCASTS, tag_for(instance))
+
+@observes(events.Setting.after_insert, events.Setting.after_update,
+    events.Setting.after_delete)
+def _setting_changed(instance):
+    _purge(instance, ALL_PAGES)
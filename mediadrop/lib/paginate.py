@@ -5,10 +5,17 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+import base64
+from datetime import datetime
 import inspect
+import threading
+import time
 import warnings
 
-from pylons import request, tmpl_context
+from paste.deploy.converters import asint
+from pylons import app_globals, request, tmpl_context
+import simplejson
+from sqlalchemy.orm.query import Query
 from webhelpers.paginate import get_wrapper
 from webob.multidict import MultiDict
 from webhelpers.paginate import Page
@@ -83,7 +90,8 @@ def partial(*args, **create_time_kwds):
         return func(*args, **kwds)
     return curried_function
 
-def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
+def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None,
+             keyset=False):
     """Paginate a given collection.
 
     Duplicates and extends the functionality of :func:`tg.decorators.paginate` to:
@@ -129,6 +137,13 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
       items_first_page
         the number of items to be rendered on the first page. Defaults to the
         value of ``items_per_page``
+      keyset
+        if True, the total number of items is taken from the
+        :class:`CountCache` and pages link to the next page with an opaque
+        "<prefix>cursor" parameter if the collection is ordered by
+        :meth:`~mediadrop.lib.auth.query_result_proxy.QueryResultProxy.keyset`.
+        Such requests are served by a :class:`KeysetPage` (without OFFSET).
+        The "page" parameter still works as before.
 
     """
     prefix = ""
@@ -136,13 +151,15 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
         prefix = name + "_"
     own_parameters = dict(
         page="%spage" % prefix,
-        items_per_page="%sitems_per_page" % prefix
+        items_per_page="%sitems_per_page" % prefix,
+        cursor="%scursor" % prefix,
         )
     #@decorator
     def _d(f):
         @wraps(f)
         def _w(*args, **kwargs):
             page = int(kwargs.pop(own_parameters["page"], 1))
+            cursor = kwargs.pop(own_parameters["cursor"], None)
             real_items_per_page = int(
                     kwargs.pop(
                             own_parameters['items_per_page'],
@@ -175,23 +192,42 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
 
                 collection = res[name]
 
+                item_count = None
+                keyset_column = None
+                if keyset:
+                    item_count = cached_count(collection)
+                    keyset_column = getattr(collection, 'keyset_column', None)
+
                 # Use CustomPage if our extra custom arg was provided
                 if items_first_page is not None:
                     page_class = CustomPage
                 else:
                     page_class = Page
 
-                page = page_class(
-                    collection,
-                    page,
-                    items_per_page=real_items_per_page,
-                    items_first_page=items_first_page,
-                    **additional_parameters.dict_of_lists()
-                    )
-                # wrap the pager so that it will render
-                # the proper page-parameter
-                page.pager = partial(page.pager,
-                        page_param=own_parameters["page"])
+                if cursor and (keyset_column is not None) and \
+                        (items_first_page is None):
+                    page = KeysetPage(
+                        collection,
+                        cursor,
+                        items_per_page=real_items_per_page,
+                        item_count=item_count,
+                        **additional_parameters.dict_of_lists()
+                        )
+                else:
+                    page = page_class(
+                        collection,
+                        page,
+                        items_per_page=real_items_per_page,
+                        items_first_page=items_first_page,
+                        item_count=item_count,
+                        **additional_parameters.dict_of_lists()
+                        )
+                    if keyset_column is not None:
+                        page.next_cursor = next_cursor(collection, page)
+                    # wrap the pager so that it will render
+                    # the proper page-parameter
+                    page.pager = partial(page.pager,
+                            page_param=own_parameters["page"])
                 res[name] = page
                 # this is a bit strange - it appears
                 # as if c returns an empty
@@ -405,3 +441,196 @@ class CustomPage(Page):
         # This is a subclass of the 'list' type. Initialise the list now.
         list.__init__(self, self.items)
 
+
+
+# --- keyset pagination --------------------------------------------------------
+# Deep pages with OFFSET get linearly slower because the database has to skip
+# all previous rows. Instead the "next" links of keyset ordered collections
+# contain the sort key of the last item on the current page (as an opaque
+# cursor) so the next page can be fetched with "WHERE key < last_key".
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.strftime(_DATETIME_FORMAT)}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.strptime(value['dt'], _DATETIME_FORMAT)
+    return value
+
+def encode_cursor(column_name, position, key):
+    """Return an opaque string which contains the keyset ``key`` of an item
+    (see :meth:`~mediadrop.lib.auth.query_result_proxy.QueryResultProxy.key_of`)
+    and the ``position`` of the following item (e.g. the page number).
+
+    Returns None if the key contains NULL values (which can not be compared
+    in SQL)."""
+    values = isinstance(key, tuple) and list(key) or [key]
+    if None in values:
+        return None
+    data = [column_name, position, [_encode_value(v) for v in values]]
+    return base64.urlsafe_b64encode(simplejson.dumps(data)).rstrip('=')
+
+def decode_cursor(cursor, column_name):
+    """Return a ``(position, key)`` tuple for the given cursor or None if the
+    cursor is invalid or was created for a different column."""
+    try:
+        cursor = str(cursor)
+        cursor += '=' * (-len(cursor) % 4)
+        name, position, values = simplejson.loads(base64.urlsafe_b64decode(cursor))
+        values = [_decode_value(v) for v in values]
+        position = int(position)
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        return None
+    if (name != column_name) or (len(values) not in (1, 2)):
+        return None
+    if len(values) == 1:
+        return position, values[0]
+    return position, tuple(values)
+
+def next_cursor(collection, page):
+    """Return the cursor for the page after the given :class:`Page` (or None
+    if this is the last page)."""
+    if (not page.next_page) or (len(page.items) == 0):
+        return None
+    key = collection.key_of(page.items[-1])
+    return encode_cursor(collection.keyset_column.key, page.next_page, key)
+
+
+class KeysetPage(list):
+    """A page of items after a cursor (see :func:`encode_cursor`).
+
+    Provides the same attributes as :class:`webhelpers.paginate.Page` which
+    are used by the templates. Previous pages are linked by page number, the
+    next page is linked with the ``next_cursor``.
+
+    :param collection: A
+        :class:`~mediadrop.lib.auth.query_result_proxy.QueryResultProxy`
+        ordered by :meth:`keyset`.
+    :param cursor: The cursor of the requested page. An invalid cursor
+        returns the first page.
+    :param item_count: The (approximate) total number of items.
+    """
+    def __init__(self, collection, cursor, items_per_page=20, item_count=None,
+                 **kwargs):
+        self.kwargs = kwargs
+        self.original_collection = collection
+        self.collection = collection
+        self.items_per_page = items_per_page
+        if item_count is None:
+            item_count = len(collection)
+        self.item_count = item_count
+
+        column_name = collection.keyset_column.key
+        position = decode_cursor(cursor, column_name)
+        self.page = 1
+        if position is not None:
+            self.page, key = position
+            self.page = max(self.page, 1)
+            collection.seek(key)
+        # fetch one more item to know if there is a next page
+        items = collection.fetch(items_per_page + 1)
+        self.items = items[:items_per_page]
+        has_next_page = len(items) > items_per_page
+
+        if self.items:
+            self.first_page = 1
+            # the item count may be approximate (or outdated)
+            self.page_count = max(
+                ((self.item_count - 1) / self.items_per_page) + 1,
+                self.page + int(has_next_page))
+            self.last_page = self.page_count
+            self.first_item = (self.page - 1) * items_per_page + 1
+            self.last_item = self.first_item + len(self.items) - 1
+            self.previous_page = (self.page > 1) and (self.page - 1) or None
+            self.next_page = has_next_page and (self.page + 1) or None
+        else:
+            self.first_page = None
+            self.page_count = 0
+            self.last_page = None
+            self.first_item = None
+            self.last_item = None
+            self.previous_page = None
+            self.next_page = None
+        self.next_cursor = next_cursor(collection, self)
+        list.__init__(self, self.items)
+
+
+class CountCache(object):
+    """Cache the total number of items of paginated queries.
+
+    Keys are built by
+    :meth:`~mediadrop.lib.auth.query_result_proxy.QueryResultProxy.cache_key`
+    which ignores datetime parameters so counts can be up to ``ttl`` seconds
+    old.
+
+    :param ttl: Number of seconds a count is cached. ``0`` disables the cache.
+    :param max_entries: The cache is cleared once it contains that many
+        counts.
+    """
+    def __init__(self, ttl=60, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            ttl=asint(config.get('pagination.count_cache_ttl', 60)),
+            max_entries=asint(config.get('pagination.count_cache_size', 1000)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def get(self, key, count):
+        """Return the cached count for ``key`` (calling ``count()`` if it is
+        not cached)."""
+        entry = self._entries.get(key)
+        if (entry is not None) and (entry[0] > self._now()):
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = count()
+        if self.ttl > 0:
+            with self._lock:
+                if len(self._entries) >= self.max_entries:
+                    self._entries = {}
+                self._entries[key] = (self._now() + self.ttl, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+def _current_count_cache():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'pagination_counts', None)
+
+def cached_count(collection):
+    """Return the number of items in the collection (from the
+    :class:`CountCache` if possible)."""
+    from mediadrop.lib.auth.query_result_proxy import QueryResultProxy
+    if isinstance(collection, Query):
+        count = collection.count
+        collection = QueryResultProxy(collection)
+    else:
+        count = lambda: len(collection)
+    cache = _current_count_cache()
+    cache_key = getattr(collection, 'cache_key', None)
+    if (cache is None) or (cache_key is None):
+        return count()
+    key = cache_key()
+    if key is None:
+        return count()
+    return cache.get(key, count)
@@ -0,0 +1,347 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Request Profiling
+
+Opt-in instrumentation (``profiling.enabled = true``) which records for every
+request to a controller action:
+
+- the wall time (including a streamed response body),
+- the number of SQL statements and the time spent executing them (through
+  the ``before_cursor_execute``/``after_cursor_execute`` engine events),
+- the time spent serializing templates (see
+  :func:`mediadrop.lib.templating.render_stream`),
+- cache hits and misses of the ``beaker_cache`` decorator and the fragment
+  cache (see :func:`record_cache_access`).
+
+Statements which are executed ``profiling.repeated_statements`` times or more
+within one request (usually an N+1 query pattern) are reported per action.
+
+The results are aggregated in-process per ``controller/action`` in fixed
+bucket histograms. :meth:`Profiler.report` returns a text report which is
+available at ``/admin/profiling`` (for admins) and optionally written to
+``profiling.report_file`` on shutdown.
+"""
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals
+
+
+__all__ = ['ActionStats', 'ClosingIterator', 'current_profile', 'Histogram',
+    'Profiler', 'ProfilingMiddleware', 'record_cache_access', 'RequestProfile',
+    'timed_section']
+
+log = logging.getLogger(__name__)
+
+class Histogram(object):
+    """Count observed values in fixed buckets.
+
+    :param buckets: Sorted upper bounds of the buckets. Values above the last
+        bound are counted in an additional overflow bucket.
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent):
+        """Return the upper bound of the bucket which contains the given
+        percentile (None for the overflow bucket or without values)."""
+        if not self.count:
+            return None
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                break
+        if index < len(self.buckets):
+            return self.buckets[index]
+        return None
+
+    @property
+    def mean(self):
+        return self.count and (float(self.sum) / self.count) or 0
+
+
+# upper bounds in milliseconds (wall time) and number of statements
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+class RequestProfile(object):
+    """Measurements of a single request."""
+    def __init__(self):
+        self.started = time.time()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = {}
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._sections = {}
+
+    def statement_executed(self, statement, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated_statements(self, threshold):
+        return dict((statement, count) for statement, count
+                    in self.statements.items() if count >= threshold)
+
+
+class ActionStats(object):
+    """Aggregated measurements of all requests for one action."""
+    def __init__(self):
+        self.requests = 0
+        self.wall_time = Histogram(TIME_BUCKETS)
+        self.sql_count = Histogram(QUERY_BUCKETS)
+        self.sql_time = Histogram(TIME_BUCKETS)
+        self.template_time = Histogram(TIME_BUCKETS)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # statement -> highest number of executions within one request
+        self.repeated_statements = {}
+
+    def add(self, profile, wall_time, threshold):
+        self.requests += 1
+        self.wall_time.observe(wall_time * 1000)
+        self.sql_count.observe(profile.sql_count)
+        self.sql_time.observe(profile.sql_time * 1000)
+        self.template_time.observe(profile.template_time * 1000)
+        self.cache_hits += profile.cache_hits
+        self.cache_misses += profile.cache_misses
+        for statement, count in profile.repeated_statements(threshold).items():
+            previous = self.repeated_statements.get(statement, 0)
+            self.repeated_statements[statement] = max(previous, count)
+
+
+class Profiler(object):
+    """Aggregate the :class:`RequestProfile` of all requests per action.
+
+    :param repeated_statements: Report statements which were executed this
+        many times (or more) within one request.
+    :param report_file: Optional path, the report is written to that file on
+        shutdown.
+    """
+    def __init__(self, repeated_statements=5, report_file=None):
+        self.repeated_statements = repeated_statements
+        self.report_file = report_file
+        self.actions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._instrumented = set()
+
+    @classmethod
+    def from_config(cls, config):
+        """Return a profiler if ``profiling.enabled`` is set (None otherwise)."""
+        if not asbool(config.get('profiling.enabled', False)):
+            return None
+        return cls(
+            repeated_statements=asint(config.get('profiling.repeated_statements', 5)),
+            report_file=config.get('profiling.report_file') or None,
+        )
+
+    # --- collecting -----------------------------------------------------------
+    def instrument(self, engine):
+        """Listen to the cursor events of the given SQLAlchemy engine."""
+        from sqlalchemy import event
+        if engine in self._instrumented:
+            return
+        self._instrumented.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'profile', None) is not None:
+            self._local.statement_start = time.time()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = getattr(self._local, 'profile', None)
+        started = getattr(self._local, 'statement_start', None)
+        if (profile is None) or (started is None):
+            return
+        self._local.statement_start = None
+        profile.statement_executed(statement, time.time() - started)
+
+    @property
+    def current(self):
+        return getattr(self._local, 'profile', None)
+
+    def start(self):
+        profile = RequestProfile()
+        self._local.profile = profile
+        return profile
+
+    def discard(self, profile):
+        if getattr(self._local, 'profile', None) is profile:
+            self._local.profile = None
+
+    def finish(self, profile, action):
+        """Add the profile to the statistics of the given action."""
+        self.discard(profile)
+        wall_time = time.time() - profile.started
+        with self._lock:
+            stats = self.actions.get(action)
+            if stats is None:
+                stats = self.actions[action] = ActionStats()
+            stats.add(profile, wall_time, self.repeated_statements)
+        repeated = profile.repeated_statements(self.repeated_statements)
+        for statement, count in repeated.items():
+            log.debug('%s: statement executed %d times: %s', action, count, statement)
+
+    def reset(self):
+        with self._lock:
+            self.actions = {}
+
+    # --- reporting ------------------------------------------------------------
+    def report(self):
+        """Return the aggregated statistics as plain text."""
+        def ms(value):
+            if value is None:
+                return '>%d' % TIME_BUCKETS[-1]
+            return '%d' % value
+        lines = []
+        header = '%-40s %7s %7s %7s %7s %7s %7s %7s %9s' % ('action', 'reqs',
+            'p50 ms', 'p95 ms', 'sql', 'sql ms', 'tmpl ms', 'hits', 'misses')
+        lines.append(header)
+        lines.append('-' * len(header))
+        with self._lock:
+            actions = sorted(self.actions.items(),
+                key=lambda item: -item[1].wall_time.sum)
+            for action, stats in actions:
+                lines.append('%-40s %7d %7s %7s %7.1f %7.1f %7.1f %7d %9d' % (
+                    action[:40], stats.requests,
+                    ms(stats.wall_time.percentile(50)),
+                    ms(stats.wall_time.percentile(95)),
+                    stats.sql_count.mean, stats.sql_time.mean,
+                    stats.template_time.mean,
+                    stats.cache_hits, stats.cache_misses))
+            for action, stats in actions:
+                if not stats.repeated_statements:
+                    continue
+                lines.append('')
+                lines.append('Repeated statements in %s:' % action)
+                repeated = sorted(stats.repeated_statements.items(),
+                    key=lambda item: -item[1])
+                for statement, count in repeated:
+                    lines.append('  %5dx %s' % (count, ' '.join(statement.split())))
+        return '\n'.join(lines) + '\n'
+
+    def shutdown(self):
+        if not self.report_file:
+            return
+        try:
+            with open(self.report_file, 'w') as report_fp:
+                report_fp.write(self.report())
+        except IOError:
+            log.exception('unable to write profiling report')
+
+
+class ProfilingMiddleware(object):
+    """Profile every request which is routed to a controller action."""
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        profile = self.profiler.start()
+        try:
+            result = self.app(environ, start_response)
+        except:
+            self._finish(profile, environ)
+            raise
+        return ClosingIterator(result, lambda: self._finish(profile, environ))
+
+    def _finish(self, profile, environ):
+        routing_args = environ.get('wsgiorg.routing_args')
+        route = routing_args and routing_args[1] or None
+        if not route or not route.get('controller'):
+            self.profiler.discard(profile)
+            return
+        action = '%s/%s' % (route['controller'], route.get('action'))
+        self.profiler.finish(profile, action)
+
+
+class ClosingIterator(object):
+    """Wrap a WSGI response and call ``on_close()`` after the server closed
+    the response (i.e. after the body was sent)."""
+    def __init__(self, result, on_close):
+        self._result = result
+        self._iterator = iter(result)
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._iterator.next()
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            self._on_close()
+
+
+def current_profiler():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'profiler', None)
+
+def current_profile():
+    """Return the :class:`RequestProfile` of the current request (None if
+    profiling is disabled)."""
+    profiler = current_profiler()
+    if profiler is None:
+        return None
+    return profiler.current
+
+@contextmanager
+def timed_section(name):
+    """Add the time spent in the block to the ``<name>_time`` attribute of
+    the current profile. Nested sections with the same name are only counted
+    once."""
+    profile = current_profile()
+    if (profile is None) or profile._sections.get(name):
+        yield
+        return
+    profile._sections[name] = True
+    started = time.time()
+    try:
+        yield
+    finally:
+        profile._sections[name] = False
+        duration = time.time() - started
+        setattr(profile, name + '_time', getattr(profile, name + '_time') + duration)
+
+def record_cache_access(hit):
+    profile = current_profile()
+    if profile is None:
+        return
+    if hit:
+        profile.cache_hits += 1
+    else:
+        profile.cache_misses += 1
@@ -0,0 +1,192 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Constant-time selection of random media.
+
+``ORDER BY RAND()`` needs a full table scan for every request. Instead the ids
+of all published media are kept in a compact in-memory array so a random
+item can be picked in O(1). The array is refreshed incrementally by the
+``events.Media`` mapper observers and rebuilt completely after
+``refresh_interval`` seconds (other processes might have changed media) or
+when a scheduled publish date (``publish_on``/``publish_until``) is reached.
+
+Every pick is verified with a primary key lookup which also applies the
+permission checks. If the picked media is rejected another id is tried.
+"""
+
+from datetime import datetime
+import random
+import threading
+import time
+
+from paste.deploy.converters import asint
+from pylons import app_globals
+
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['RandomMediaPicker']
+
+class RandomMediaPicker(object):
+    """Pick random published media without scanning the media table.
+
+    :param refresh_interval: Number of seconds after which the list of media
+        ids is rebuilt from the database.
+    :param max_tries: How many ids are tried before :meth:`pick` gives up
+        (e.g. because the current user may not view the picked media).
+    """
+    def __init__(self, refresh_interval=600, max_tries=5, random_=None):
+        self.refresh_interval = refresh_interval
+        self.max_tries = max_tries
+        self._random = random_ or random.Random()
+        self._lock = threading.Lock()
+        self._ids = None
+        self._positions = {}
+        self._loaded_at = None
+        self._next_change = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            refresh_interval=asint(config.get('random_media.refresh_interval', 600)),
+            max_tries=asint(config.get('random_media.max_tries', 5)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def __len__(self):
+        return len(self._ids or ())
+
+    def __contains__(self, media_id):
+        return media_id in self._positions
+
+    # --- loading --------------------------------------------------------------
+    def needs_refresh(self):
+        if self._ids is None:
+            return True
+        if self._now() - self._loaded_at >= self.refresh_interval:
+            return True
+        return (self._next_change is not None) and (self._next_change <= datetime.now())
+
+    def refresh(self):
+        """Rebuild the list of published media ids from the database."""
+        from mediadrop.model import Media
+        now = datetime.now()
+        rows = Media.query.published().order_by(None).\
+            values(Media.id, Media.publish_until)
+        ids = []
+        next_change = None
+        for media_id, publish_until in rows:
+            ids.append(media_id)
+            next_change = _earliest(next_change, publish_until)
+        scheduled = Media.query.order_by(None).filter(Media.publishable == True).\
+            filter(Media.reviewed == True).filter(Media.encoded == True).\
+            filter(Media.publish_on > now).\
+            values(Media.publish_on)
+        for (publish_on,) in scheduled:
+            next_change = _earliest(next_change, publish_on)
+
+        with self._lock:
+            self._ids = ids
+            self._positions = dict((media_id, i) for i, media_id in enumerate(ids))
+            self._loaded_at = self._now()
+            self._next_change = next_change
+
+    # --- incremental updates --------------------------------------------------
+    def add(self, media_id):
+        with self._lock:
+            if (self._ids is None) or (media_id in self._positions):
+                return
+            self._positions[media_id] = len(self._ids)
+            self._ids.append(media_id)
+
+    def discard(self, media_id):
+        with self._lock:
+            position = self._positions.pop(media_id, None)
+            if position is None:
+                return
+            # swap with the last id so removal is O(1) and the array stays dense
+            last_id = self._ids.pop()
+            if last_id != media_id:
+                self._ids[position] = last_id
+                self._positions[last_id] = position
+
+    def media_changed(self, media):
+        """Update the list of ids after ``media`` was inserted or updated."""
+        if self._ids is None:
+            return
+        if media.is_published and (media.id is not None):
+            self.add(media.id)
+            self._schedule(media.publish_until)
+        else:
+            self.discard(media.id)
+            if media.publishable and media.reviewed and media.encoded:
+                self._schedule(media.publish_on)
+
+    def _schedule(self, change_time):
+        if (change_time is not None) and (change_time > datetime.now()):
+            with self._lock:
+                self._next_change = _earliest(self._next_change, change_time)
+
+    def _random_id(self):
+        # discard() may shrink the list between reading its length and
+        # indexing it
+        with self._lock:
+            if not self._ids:
+                return None
+            return self._ids[self._random.randrange(len(self._ids))]
+
+    # --- public API -----------------------------------------------------------
+    def pick(self, load_media):
+        """Return a random media item (or None).
+
+        :param load_media: A callable which loads the media for the given id.
+            It must return None if the media is not published anymore or the
+            current user may not view the media.
+        """
+        if self.needs_refresh():
+            self.refresh()
+        for attempt in range(self.max_tries):
+            media_id = self._random_id()
+            if media_id is None:
+                return None
+            # The id is not discarded if it is rejected: usually the current
+            # user is just not allowed to view that media. Ids of media which
+            # were unpublished by other processes vanish on the next refresh.
+            media = load_media(media_id)
+            if media is not None:
+                return media
+        return None
+
+
+def _earliest(current, candidate):
+    if candidate is None:
+        return current
+    if (current is None) or (candidate < current):
+        return candidate
+    return current
+
+
+def _current_picker():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'random_media', None)
+
+@observes(events.Media.after_insert, events.Media.after_update)
+def _media_saved(instance):
+    picker = _current_picker()
+    if picker is not None:
+        picker.media_changed(instance)
+
+@observes(events.Media.after_delete)
+def _media_deleted(instance):
+    picker = _current_picker()
+    if picker is not None:
+        picker.discard(instance.id)
@@ -0,0 +1,260 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Streaming generation of sitemaps and media feeds.
+
+Sitemaps can contain thousands of media items so they are not rendered into a
+single string. Media is loaded in chunks (using keyset iteration) and the XML
+is written incrementally to the WSGI response.
+
+Optionally (``sitemaps.shard_dir``) the generated XML is stored on disk in
+shards of ``sitemaps.shard_size`` media ids. A shard is regenerated only
+after a media item within its id range was changed (once the change was
+committed) or when it is older than ``sitemaps.shard_max_age`` seconds
+(publish dates in the future). A lock file per shard ensures that only one
+process rebuilds it.
+"""
+
+from contextlib import contextmanager
+import os
+import tempfile
+import time
+
+import pylons
+from paste.deploy.converters import asint
+from sqlalchemy.orm import object_session
+
+from mediadrop.lib.app_globals import is_object_registered
+from mediadrop.model import DBSession
+from mediadrop.model.meta import after_commit
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = [
+    'iter_media',
+    'serialize_chunks',
+    'SitemapShards',
+    'StreamingResponse',
+]
+
+PYLONS_GLOBALS = ('app_globals', 'cache', 'config', 'request', 'response',
+    'session', 'tmpl_context', 'translator', 'url')
+
+class StreamingResponse(object):
+    """WSGI app_iter which iterates over ``chunks`` within the request
+    context of the current request.
+
+    Pylons removes the request globals (and the DBSession) as soon as the
+    action returns so the globals are captured on creation and restored for
+    each chunk.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._context = []
+        for name in PYLONS_GLOBALS:
+            proxy = getattr(pylons, name)
+            if is_object_registered(proxy):
+                self._context.append((proxy, proxy._current_obj()))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        for proxy, obj in self._context:
+            proxy._push_object(obj)
+        try:
+            return self._chunks.next()
+        finally:
+            for proxy, obj in reversed(self._context):
+                proxy._pop_object(obj)
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        DBSession.remove()
+
+
+def serialize_chunks(stream, method='xml', buffer_size=64*1024):
+    """Serialize the Genshi ``stream`` incrementally and yield UTF-8 encoded
+    chunks of (roughly) ``buffer_size`` bytes."""
+    buffered = []
+    size = 0
+    for text in stream.serialize(method=method):
+        buffered.append(text)
+        size += len(text)
+        if size >= buffer_size:
+            yield u''.join(buffered).encode('utf-8')
+            buffered = []
+            size = 0
+    if buffered:
+        yield u''.join(buffered).encode('utf-8')
+
+
+def iter_media(media, chunk_size=100):
+    """Iterate over the (viewable) media in chunks ordered by id.
+
+    Only one chunk of media is kept in memory and each chunk is loaded with
+    ``WHERE id > <last id>`` instead of an increasing OFFSET. The relations
+    used by the feed templates are loaded for a whole chunk at once.
+
+    :param media: The result of
+        :func:`mediadrop.lib.auth.util.viewable_media` (or any other
+        :class:`~mediadrop.lib.auth.query_result_proxy.QueryResultProxy`).
+    """
+    from mediadrop.model import Media
+    from mediadrop.model.media_listing import FEED_RELATIONS, iter_with_relations
+    if not hasattr(media, 'keyset'):
+        # StaticQuery, the items are in memory already
+        for item in media:
+            yield item
+        return
+    media.keyset(Media.id)
+    for item in iter_with_relations(media, FEED_RELATIONS, chunk_size):
+        yield item
+
+
+class SitemapShards(object):
+    """Pre-built sitemap files on disk.
+
+    :param directory: Where the shards are stored.
+    :param shard_size: Number of media ids per Google sitemap shard.
+    :param max_age: Seconds after which a shard is regenerated even without
+        any changes to the media (needed for scheduled publishing).
+    """
+    def __init__(self, directory, shard_size=10000, max_age=24*60*60):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.max_age = max_age
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the configured shards or None if the feature is disabled."""
+        directory = config.get('sitemaps.shard_dir')
+        if not directory:
+            return None
+        return cls(directory,
+            shard_size=asint(config.get('sitemaps.shard_size', 10000)),
+            max_age=asint(config.get('sitemaps.shard_max_age', 24*60*60)),
+        )
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def google_shard_name(self, page):
+        return 'google-%d.xml' % page
+
+    def page_for(self, media_id):
+        return media_id // self.shard_size
+
+    def _marker_path(self, name):
+        return self.path('.%s.invalidated' % name)
+
+    @contextmanager
+    def lock(self, name):
+        """Hold an exclusive lock for the shard ``name`` so only one process
+        rebuilds it (if the platform supports ``fcntl``)."""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        with open(self.path('.%s.lock' % name), 'a') as lock_fp:
+            if fcntl is not None:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_fp.fileno(), fcntl.LOCK_UN)
+
+    def open(self, name):
+        """Return the shard ``name`` opened for reading or None if it does not
+        exist or is outdated."""
+        try:
+            shard_fp = open(self.path(name), 'rb')
+        except IOError:
+            return None
+        mtime = os.fstat(shard_fp.fileno()).st_mtime
+        try:
+            invalidated = os.stat(self._marker_path(name)).st_mtime
+        except OSError:
+            invalidated = 0
+        if (mtime < invalidated) or (time.time() - mtime >= self.max_age):
+            shard_fp.close()
+            return None
+        return shard_fp
+
+    def build(self, name, chunks):
+        """Write ``chunks`` to the shard ``name`` and return the new shard
+        opened for reading.
+
+        The data is written to a temporary file first which is renamed
+        afterwards so other processes never see partial shards. The shard
+        gets the time the build was started as modification time: if it was
+        invalidated in the meantime it is outdated immediately.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        started = time.time()
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s-' % name, dir=self.directory)
+        shard_fp = os.fdopen(fd, 'w+b')
+        try:
+            for chunk in chunks:
+                shard_fp.write(chunk)
+            shard_fp.flush()
+            os.utime(tmp_path, (started, started))
+            os.rename(tmp_path, self.path(name))
+        except:
+            shard_fp.close()
+            os.remove(tmp_path)
+            raise
+        shard_fp.seek(0)
+        return shard_fp
+
+    def iter_file(self, shard_fp, chunk_size=64*1024):
+        """Iterate over the contents of the (open) shard and close it."""
+        try:
+            while True:
+                chunk = shard_fp.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            shard_fp.close()
+
+    def invalidate(self, *names):
+        if not os.path.exists(self.directory):
+            return
+        for name in names:
+            # the marker outdates shards which are being built right now
+            with open(self._marker_path(name), 'a'):
+                os.utime(self._marker_path(name), None)
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+    def media_changed(self, media):
+        if media.id is None:
+            return
+        page = self.page_for(media.id)
+        after_commit(object_session(media) or DBSession(), self.invalidate,
+            self.google_shard_name(page), 'mrss.xml')
+
+
+@observes(events.Media.after_insert, events.Media.after_update,
+          events.Media.after_delete)
+def _invalidate_sitemap_shards(instance):
+    if not is_object_registered(pylons.app_globals):
+        return
+    shards = getattr(pylons.app_globals, 'sitemap_shards', None)
+    if shards is not None:
+        # other processes must not rebuild the shard before the changes are
+        # visible to them
+        shards.media_changed(instance)
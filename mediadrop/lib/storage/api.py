@@ -9,22 +9,26 @@ import logging
 import os
 import re
 
-from cStringIO import StringIO
+from contextlib import contextmanager
 from operator import attrgetter
-from urllib2 import URLError, urlopen
+from urllib2 import URLError
+
+from sqlalchemy.orm.attributes import instance_state
 
 from mediadrop.lib.compat import defaultdict, SEEK_END
 from mediadrop.lib.decorators import memoize
 from mediadrop.lib.filetypes import guess_container_format, guess_media_type
 from mediadrop.lib.i18n import _
-from mediadrop.lib.thumbnails import (create_thumbs_for, has_thumbs,
+from mediadrop.lib.metrics import inc_metric
+from mediadrop.lib.thumbnails import (has_thumbs, queue_thumbs_for,
     has_default_thumbs)
+from mediadrop.lib.util import request_cache
 from mediadrop.lib.xhtml import clean_xhtml
 from mediadrop.plugin.abc import (AbstractClass, abstractmethod,
     abstractproperty)
 
-__all__ = ['add_new_media_file', 'sort_engines', 'CannotTranscode', 
-    'FileStorageEngine', 'StorageError', 'StorageEngine', 
+__all__ = ['add_new_media_file', 'sort_engines', 'storage_sessions',
+    'CannotTranscode', 'FileStorageEngine', 'StorageError', 'StorageEngine',
     'UnsuitableEngineError', 'UserStorageError',
 ]
 
@@ -208,6 +212,19 @@ class StorageEngine(AbstractClass):
 
         """
 
+    @contextmanager
+    def session(self):
+        """Group several operations (e.g. :meth:`delete` calls) so that
+        engines can reuse one connection to the storage backend::
+
+            with engine.session():
+                for unique_id in unique_ids:
+                    engine.delete(unique_id)
+
+        The default implementation does nothing.
+        """
+        yield
+
     def transcode(self, media_file):
         """Transcode an existing MediaFile.
 
@@ -235,6 +252,32 @@ class StorageEngine(AbstractClass):
 
         """
 
+    def cached_uris(self, media_file):
+        """Return :meth:`get_uris` for the given file, generated only once per
+        request.
+
+        Player selection, templates and the API often ask for the URIs of the
+        same file several times while rendering a single page or feed.
+
+        :type media_file: :class:`~mediadrop.model.media.MediaFile`
+        :param media_file: The associated media file object.
+        :rtype: list
+        :returns: All :class:`StorageURI` tuples for this file.
+
+        """
+        memo = request_cache('storage_uris')
+        if (memo is None) or _has_changes(self) or _has_changes(media_file):
+            return self.get_uris(media_file)
+        key = (self.id, media_file.id, media_file.media.slug)
+        uris = memo.get(key)
+        if uris is None:
+            uris = self.get_uris(media_file)
+            memo[key] = uris
+        return list(uris)
+
+def _has_changes(instance):
+    return (instance.id is None) or instance_state(instance).modified
+
 class FileStorageEngine(StorageEngine):
     """
     Helper subclass that parses file uploads for basic metadata.
@@ -338,6 +381,12 @@ def add_new_media_file(media, file=None, url=None):
     :raises StorageError: If the input file or URL cannot be
         stored with any of the registered storage engines.
 
+    If an ingest pipeline is configured (see
+    :mod:`mediadrop.lib.storage.pipeline`) the upload is only spooled to
+    disk and the returned media file is still pending (it has no
+    ``unique_id`` yet). Storing, post-processing, thumbnail creation and
+    transcoding happen in the background then.
+
     """
     sorted_engines = enabled_engines()
     for engine in sorted_engines:
@@ -368,61 +417,93 @@ def add_new_media_file(media, file=None, url=None):
 
     media.files.append(mf)
     DBSession.flush()
+    inc_metric('mediadrop_uploads_total', source=(file is not None) and 'file' or 'url')
+    if (file is not None) and mf.size:
+        inc_metric('mediadrop_upload_bytes_total', mf.size)
+
+    pipeline = _ingest_pipeline()
+    if pipeline is not None:
+        update_media_from_meta(media, mf, meta)
+        if 'thumbnail_file' in meta:
+            create_thumbs_from_meta(media, meta)
+        pipeline.submit(mf, file=file, url=url, meta=meta)
+        return mf
+
+    store_media_file(mf, file=file, url=url, meta=meta)
+    update_media_from_meta(media, mf, meta)
+    create_thumbs_from_meta(media, meta)
+    DBSession.flush()
 
-    unique_id = engine.store(media_file=mf, file=file, url=url, meta=meta)
+    engine.postprocess(mf)
+    transcode_media_file(mf, sorted_engines)
+    return mf
+
+def _ingest_pipeline():
+    import pylons
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(pylons.app_globals):
+        return None
+    return getattr(pylons.app_globals, 'ingest_pipeline', None)
+
+def store_media_file(media_file, file=None, url=None, meta=None):
+    """Store the file with the media file's storage engine and set the
+    ``unique_id``.
+
+    :raises StorageError: If the engine did not return a unique ID.
+    """
+    engine = media_file.storage
+    unique_id = engine.store(media_file=media_file, file=file, url=url, meta=meta)
 
     if unique_id:
-        mf.unique_id = unique_id
-    elif not mf.unique_id:
+        media_file.unique_id = unique_id
+    elif not media_file.unique_id:
         raise StorageError('Engine %r returned no unique ID.', engine)
 
+def update_media_from_meta(media, media_file, meta):
+    """Fill in missing media attributes using the metadata returned by
+    :meth:`StorageEngine.parse`."""
     if not media.duration and meta.get('duration', 0):
         media.duration = meta['duration']
     if not media.description and meta.get('description'):
         media.description = clean_xhtml(meta['description'])
     if not media.title:
-        media.title = meta.get('title', None) or mf.display_name
+        media.title = meta.get('title', None) or media_file.display_name
     if media.type is None:
-        media.type = mf.type
+        media.type = media_file.type
 
+def create_thumbs_from_meta(media, meta):
+    """Create thumbnails from the ``thumbnail_file`` or ``thumbnail_url``
+    returned by :meth:`StorageEngine.parse` (unless the media has custom
+    thumbnails already)."""
     if ('thumbnail_url' in meta or 'thumbnail_file' in meta) \
     and (not has_thumbs(media) or has_default_thumbs(media)):
         thumb_file = meta.get('thumbnail_file', None)
 
-        if thumb_file is not None:
-            thumb_filename = thumb_file.filename
-        else:
-            thumb_url = meta['thumbnail_url']
-            thumb_filename = os.path.basename(thumb_url)
-
-            # Download the image to a buffer and wrap it as a file-like object
-            try:
-                temp_img = urlopen(thumb_url)
-                thumb_file = StringIO(temp_img.read())
-                temp_img.close()
-            except URLError, e:
-                log.exception(e)
-
-        if thumb_file is not None:
-            create_thumbs_for(media, thumb_file, thumb_filename)
-            thumb_file.close()
-
-    DBSession.flush()
-
-    engine.postprocess(mf)
-
-    # Try to transcode the file.
+        # Remote thumbnails are downloaded by the thumbnail workers (or
+        # right away if no thumbnail queue is configured).
+        try:
+            if thumb_file is not None:
+                queue_thumbs_for(media, thumb_file, thumb_file.filename)
+                thumb_file.close()
+            else:
+                queue_thumbs_for(media, url=meta['thumbnail_url'])
+        except URLError, e:
+            log.exception(e)
+
+def transcode_media_file(media_file, sorted_engines=None):
+    """Ask all enabled engines (in order) to transcode the media file until
+    one engine agrees."""
+    if sorted_engines is None:
+        sorted_engines = enabled_engines()
     for engine in sorted_engines:
         try:
-            engine.transcode(mf)
-            log.debug('Engine %r has agreed to transcode %r', engine, mf)
+            engine.transcode(media_file)
+            log.debug('Engine %r has agreed to transcode %r', engine, media_file)
             break
         except CannotTranscode:
-            log.debug('Engine %r unsuitable for transcoding %r', engine, mf)
+            log.debug('Engine %r unsuitable for transcoding %r', engine, media_file)
             continue
 
-    return mf
-
 def sort_engines(engines):
     """Yield a topological sort of the given list of engines.
 
@@ -471,6 +552,17 @@ def sort_engines(engines):
         for engine in output_instances:
             yield engine
 
+@contextmanager
+def storage_sessions(engines):
+    """Open a :meth:`StorageEngine.session` for all given engines."""
+    engines = list(engines)
+    if not engines:
+        yield
+        return
+    with engines[0].session():
+        with storage_sessions(engines[1:]):
+            yield
+
 def get_file_size(file):
     if hasattr(file, 'fileno'):
         size = os.fstat(file.fileno())[6]
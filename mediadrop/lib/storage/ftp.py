@@ -5,18 +5,23 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
+from contextlib import contextmanager
 import logging
+import posixpath
+import socket
+import threading
 import time
 import os
 
-from ftplib import FTP, all_errors as ftp_errors
+from ftplib import FTP, all_errors as ftp_errors, error_perm
 from urllib2 import HTTPError, urlopen
 
 from formencode import Invalid
 
 from mediadrop.lib.compat import sha1
 from mediadrop.lib.i18n import N_, _
-from mediadrop.lib.storage.api import FileStorageEngine, safe_file_name
+from mediadrop.lib.storage.api import (FileStorageEngine, get_file_size,
+    safe_file_name)
 from mediadrop.lib.uri import StorageURI
 
 log = logging.getLogger(__name__)
@@ -35,6 +40,92 @@ from mediadrop.forms.admin.storage.ftp import FTPStorageForm
 class FTPUploadError(Invalid):
     pass
 
+class FTPConnectionPool(object):
+    """Keep FTP connections open so that consecutive uploads/deletes do not
+    need a new TCP connection and login each time.
+
+    :param max_idle: Maximum number of idle connections per server/user.
+    :param check_after: Connections which were idle for more than this many
+        seconds are checked with a ``NOOP`` command before they are reused.
+    :param max_idle_time: Idle connections are closed after this many
+        seconds (most FTP servers drop idle clients after a few minutes).
+    :param timeout: Socket timeout for new connections.
+    """
+    def __init__(self, max_idle=4, check_after=10, max_idle_time=120, timeout=60):
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.max_idle_time = max_idle_time
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _now(self):
+        return time.time()
+
+    def connect(self, server, username, password):
+        """Open a new connection (``server`` may contain a port number)."""
+        host, port = server, 0
+        if server.count(':') == 1:
+            host, port = server.split(':')
+        ftp = FTP(timeout=self.timeout)
+        ftp.connect(host, int(port))
+        ftp.login(username, password)
+        ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        ftp.pool_key = (server, username, password)
+        ftp.home_dir = ftp.pwd()
+        ftp.current_dir = ftp.home_dir
+        return ftp
+
+    def acquire(self, server, username, password):
+        """Return an idle (and working) connection or open a new one."""
+        key = (server, username, password)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                ftp, released_at = idle.pop()
+            idle_time = self._now() - released_at
+            if ftp.sock is None or idle_time > self.max_idle_time:
+                _close(ftp)
+                continue
+            if idle_time > self.check_after:
+                try:
+                    ftp.voidcmd('NOOP')
+                except ftp_errors:
+                    _close(ftp)
+                    continue
+            return ftp
+        return self.connect(server, username, password)
+
+    def release(self, ftp, broken=False):
+        """Return a connection to the pool (or close it if ``broken``)."""
+        if not broken:
+            with self._lock:
+                idle = self._idle.setdefault(ftp.pool_key, [])
+                if len(idle) < self.max_idle:
+                    idle.append((ftp, self._now()))
+                    return
+        _close(ftp)
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for ftp, released_at in connections:
+                _close(ftp)
+
+def _close(ftp):
+    if ftp.sock is None:
+        return
+    try:
+        ftp.quit()
+    except ftp_errors:
+        ftp.close()
+
+ftp_pool = FTPConnectionPool()
+
 class FTPStorage(FileStorageEngine):
 
     engine_type = u'FTPStorage'
@@ -79,22 +170,21 @@ class FTPStorage(FileStorageEngine):
         file_name = safe_file_name(media_file, file.filename)
 
         file_url = os.path.join(self._data[HTTP_DOWNLOAD_URI], file_name)
-        upload_dir = self._data[FTP_UPLOAD_DIR]
         stor_cmd = 'STOR ' + file_name
 
-        ftp = self._connect()
         try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.storbinary(stor_cmd, file.file)
-
-            # Raise a FTPUploadError if the file integrity check fails
-            # TODO: Delete the file if the integrity check fails
-            self._verify_upload_integrity(file.file, file_url)
-            ftp.quit()
+            with self._connection() as ftp:
+                self._change_dir(ftp)
+                # the hash is computed while the file is sent to the server
+                file_hash = sha1()
+                ftp.storbinary(stor_cmd, file.file, callback=file_hash.update)
+
+                # Raise a FTPUploadError if the file integrity check fails
+                # TODO: Delete the file if the integrity check fails
+                self._verify_upload_integrity(ftp, file_name,
+                    get_file_size(file.file), file_hash.hexdigest(), file_url)
         except ftp_errors, e:
             log.exception(e)
-            ftp.quit()
             msg = _('Could not upload the file from your FTP server: %s')\
                 % e.message
             raise FTPUploadError(msg, None, None)
@@ -111,19 +201,30 @@ class FTPStorage(FileStorageEngine):
         :returns: True if successful, False if an error occurred.
 
         """
-        upload_dir = self._data[FTP_UPLOAD_DIR]
-        ftp = self._connect()
         try:
-            if upload_dir:
-                ftp.cwd(upload_dir)
-            ftp.delete(unique_id)
-            ftp.quit()
+            with self._connection() as ftp:
+                self._change_dir(ftp)
+                ftp.delete(unique_id)
             return True
         except ftp_errors, e:
             log.exception(e)
-            ftp.quit()
             return False
 
+    @contextmanager
+    def session(self):
+        """Use the same FTP connection for all operations within the block."""
+        if hasattr(self, '_ftp_session'):
+            yield
+            return
+        self._ftp_session = None
+        try:
+            yield
+        finally:
+            ftp = self._ftp_session
+            del self._ftp_session
+            if ftp is not None:
+                ftp_pool.release(ftp)
+
     def get_uris(self, media_file):
         """Return a list of URIs from which the stored file can be accessed.
 
@@ -141,17 +242,58 @@ class FTPStorage(FileStorageEngine):
             uris.append(StorageURI(media_file, 'rtmp', uid, rtmp_server))
         return uris
 
-    def _connect(self):
-        """Open a connection to the FTP server."""
-        data = self._data
-        return FTP(data[FTP_SERVER], data[FTP_USERNAME], data[FTP_PASSWORD])
+    @contextmanager
+    def _connection(self):
+        """Return a pooled connection to the FTP server (or the connection
+        of the current :meth:`session`)."""
+        in_session = hasattr(self, '_ftp_session')
+        ftp = in_session and self._ftp_session or None
+        if ftp is None:
+            data = self._data
+            ftp = ftp_pool.acquire(data[FTP_SERVER], data[FTP_USERNAME],
+                data[FTP_PASSWORD])
+        broken = False
+        try:
+            yield ftp
+        except ftp_errors:
+            broken = True
+            raise
+        finally:
+            if in_session and not broken:
+                self._ftp_session = ftp
+            else:
+                if in_session:
+                    self._ftp_session = None
+                ftp_pool.release(ftp, broken=broken)
+
+    def _change_dir(self, ftp):
+        """Change to the upload directory (relative to the login directory)
+        unless the (reused) connection is there already."""
+        upload_dir = ftp.home_dir
+        if self._data[FTP_UPLOAD_DIR]:
+            upload_dir = posixpath.normpath(
+                posixpath.join(ftp.home_dir, self._data[FTP_UPLOAD_DIR]))
+        if ftp.current_dir != upload_dir:
+            ftp.cwd(upload_dir)
+            ftp.current_dir = upload_dir
+
+    retry_delay = 3
+    """Seconds to wait before the uploaded file is downloaded again."""
 
-    def _verify_upload_integrity(self, file, file_url):
-        """Download the given file from the URL and compare the SHA1s.
+    def _verify_upload_integrity(self, ftp, file_name, file_size, file_hash, file_url):
+        """Compare the size of the uploaded file and (optionally) download it
+        from the URL and compare the SHA1s.
 
-        :type file: :class:`cgi.FieldStorage`
-        :param file: A freshly uploaded file object, that has just been
-            sent to the FTP server.
+        :param ftp: The FTP connection used for the upload.
+
+        :type file_name: str
+        :param file_name: The name of the uploaded file on the FTP server.
+
+        :type file_size: int
+        :param file_size: The size of the original file.
+
+        :type file_hash: str
+        :param file_hash: The hex SHA1 of the original file.
 
         :type file_url: str
         :param file_url: A publicly accessible URL where the uploaded file
@@ -160,42 +302,62 @@ class FTPStorage(FileStorageEngine):
         :returns: `True` if the integrity check succeeds or is disabled.
 
         :raises FTPUploadError: If the file cannot be downloaded after
-            the max number of retries, or if the the downloaded file
+            the max number of retries, or if the the uploaded file
             doesn't match the original.
 
         """
+        try:
+            remote_size = ftp.size(file_name)
+        except error_perm:
+            # SIZE is not supported by every FTP server
+            remote_size = None
+        if remote_size is not None and remote_size != file_size:
+            raise FTPUploadError(_corrupted_upload_message(), None, None)
+
         max_tries = int(self._data[FTP_MAX_INTEGRITY_RETRIES])
         if max_tries < 1:
             return True
 
-        file.seek(0)
-        orig_hash = sha1(file.read()).hexdigest()
-
         # Try to download the file. Increase the number of retries, or the
         # timeout duration, if the server is particularly slow.
         # eg: Akamai usually takes 3-15 seconds to make an uploaded file
         #     available over HTTP.
         for i in xrange(max_tries):
             try:
-                temp_file = urlopen(file_url)
-                dl_hash = sha1(temp_file.read()).hexdigest()
-                temp_file.close()
+                dl_hash = _hash_url(file_url)
             except HTTPError, http_err:
                 # Don't raise the exception now, wait until all attempts fail
-                time.sleep(3)
+                time.sleep(self.retry_delay)
             else:
                 # If the downloaded file matches, success! Otherwise, we can
                 # be pretty sure that it got corrupted during FTP transfer.
-                if orig_hash == dl_hash:
+                if file_hash == dl_hash:
                     return True
                 else:
-                    msg = _('The file transferred to your FTP server is '\
-                            'corrupted. Please try again.')
-                    raise FTPUploadError(msg, None, None)
+                    raise FTPUploadError(_corrupted_upload_message(), None, None)
 
         # Raise the exception from the last download attempt
         msg = _('Could not download the file from your FTP server: %s')\
             % http_err.message
         raise FTPUploadError(msg, None, None)
 
+def _corrupted_upload_message():
+    return _('The file transferred to your FTP server is '\
+             'corrupted. Please try again.')
+
+def _hash_url(url, chunk_size=64*1024):
+    """Download the URL and return the hex SHA1 of the contents (without
+    keeping the whole file in memory)."""
+    url_hash = sha1()
+    remote_file = urlopen(url)
+    try:
+        while True:
+            chunk = remote_file.read(chunk_size)
+            if not chunk:
+                break
+            url_hash.update(chunk)
+    finally:
+        remote_file.close()
+    return url_hash.hexdigest()
+
 FileStorageEngine.register(FTPStorage)
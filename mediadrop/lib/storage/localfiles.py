@@ -16,7 +16,7 @@ from mediadrop.forms.admin.storage.localfiles import LocalFileStorageForm
 from mediadrop.lib.i18n import N_
 from mediadrop.lib.storage.api import safe_file_name, FileStorageEngine
 from mediadrop.lib.uri import StorageURI
-from mediadrop.lib.util import delete_files, url_for
+from mediadrop.lib.util import delete_files, url_for, url_template
 
 class LocalFileStorage(FileStorageEngine):
 
@@ -84,9 +84,7 @@ class LocalFileStorage(FileStorageEngine):
         uris = []
 
         # Remotely accessible URL
-        url = url_for(controller='/media', action='serve', id=media_file.id,
-                      slug=media_file.media.slug, container=media_file.container,
-                      qualified=True)
+        url = self._serve_url(media_file)
         uris.append(StorageURI(media_file, 'http', url, None))
 
         # An optional streaming RTMP URI
@@ -95,9 +93,7 @@ class LocalFileStorage(FileStorageEngine):
             uris.append(StorageURI(media_file, 'rtmp', media_file.unique_id, rtmp_server_uri))
 
         # Remotely *download* accessible URL
-        url = url_for(controller='/media', action='serve', id=media_file.id,
-                      slug=media_file.media.slug, container=media_file.container,
-                      qualified=True, download=1)
+        url = self._serve_url(media_file, download=1)
         uris.append(StorageURI(media_file, 'download', url, None))
 
         # Internal file URI that will be used by MediaController.serve
@@ -106,6 +102,20 @@ class LocalFileStorage(FileStorageEngine):
 
         return uris
 
+    def _serve_url(self, media_file, **kwargs):
+        """Return the URL of :meth:`MediaController.serve` for the given file.
+
+        The URL is built from a template so a feed with thousands of files does
+        not need a Routes generation for each of them.
+        """
+        slug, container = media_file.media.slug, media_file.container
+        if (slug is None) or (container is None):
+            return url_for(controller='/media', action='serve', id=media_file.id,
+                           slug=slug, container=container, qualified=True, **kwargs)
+        template = url_template(('id', 'slug', 'container'),
+            controller='/media', action='serve', qualified=True, **kwargs)
+        return template(id=media_file.id, slug=slug, container=container)
+
     def _get_path(self, unique_id):
         """Return the local file path for the given unique ID.
 
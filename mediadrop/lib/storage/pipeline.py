@@ -0,0 +1,480 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Background ingestion of new media files.
+
+Storing a large upload (copying it to the media directory or sending it to an
+FTP server), post-processing and transcoding can take minutes. With an
+:class:`IngestPipeline` :func:`mediadrop.lib.storage.add_new_media_file` only
+parses the input, copies the upload to a spool directory and creates a
+*pending* :class:`~mediadrop.model.media.MediaFile` (without ``unique_id``).
+Worker threads run the remaining stages afterwards:
+
+    store, postprocess, thumbnails, transcode
+
+Every stage is retried a few times before the job fails. The state of a job
+and the time taken by every stage are stored in the media file's meta data
+(``ingest_*`` keys) so the status can be polled from any process (see
+:meth:`IngestPipeline.status`). Upload progress of running jobs is only
+available in the process running the job.
+
+Jobs are stored as JSON files next to the spooled uploads so unfinished jobs
+are picked up again after a restart (see :meth:`IngestPipeline.replay`). A
+job is claimed by renaming its file so every job is processed by one process
+only. The worker threads are started by the first request of each (forked)
+server process (see :meth:`IngestPipeline.start`).
+"""
+
+import errno
+import glob
+import json
+import logging
+import os
+import Queue
+import shutil
+import threading
+import time
+
+from paste.deploy.converters import asint
+from paste.registry import Registry
+import pylons
+from pylons.controllers.util import Request, Response
+from pylons.util import AttribSafeContextObj
+from routes.util import URLGenerator
+
+from mediadrop.lib.compat import SEEK_END
+
+
+__all__ = ['ingest_status', 'IngestPipeline', 'STAGES']
+
+log = logging.getLogger(__name__)
+
+STAGES = ('store', 'postprocess', 'thumbnails', 'transcode')
+
+DEFAULT = object()
+
+PENDING = u'pending'
+PROCESSING = u'processing'
+DONE = u'done'
+FAILED = u'failed'
+
+
+class SpooledUpload(object):
+    """File-like stand-in for :class:`cgi.FieldStorage` which the storage
+    engines get for spooled uploads."""
+    def __init__(self, filename, file):
+        self.filename = filename
+        self.file = file
+
+
+class ProgressFile(object):
+    """Wrap a file and call ``callback(bytes_read)`` for every read."""
+    def __init__(self, file, callback):
+        self._file = file
+        self._callback = callback
+        self.bytes_read = 0
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self.bytes_read += len(data)
+        self._callback(self.bytes_read)
+        return data
+
+    def seek(self, *args):
+        self._file.seek(*args)
+        self.bytes_read = self._file.tell()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class IngestPipeline(object):
+    """Run the storage stages for new media files in background threads.
+
+    :param spool_dir: Directory for spooled uploads and job files.
+    :param workers: Number of worker threads (started by :meth:`start`).
+        With ``0`` no threads are started and jobs have to be processed by
+        calling :meth:`process`.
+    :param max_attempts: How often each stage is tried before the job fails.
+    :param retry_delay: Seconds to wait before a failed stage is retried.
+    :param commit_timeout: Seconds to wait for the request which created the
+        media file to commit. If the media file does not show up in the
+        database within that time the request was probably rolled back and
+        the job is dropped.
+    """
+    def __init__(self, spool_dir, workers=2, max_attempts=3, retry_delay=5,
+                 commit_timeout=300):
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.commit_timeout = commit_timeout
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._threads_pid = None
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the configured pipeline or None if media files should be
+        stored within the request."""
+        workers = asint(config.get('storage.pipeline_workers', 0))
+        spool_dir = config.get('storage.spool_dir', None)
+        if spool_dir is None and config.get('pylons.cache_dir'):
+            spool_dir = os.path.join(config['pylons.cache_dir'], 'uploads')
+        if not (workers and spool_dir):
+            return None
+        return cls(spool_dir,
+            workers=workers,
+            max_attempts=asint(config.get('storage.pipeline_max_attempts', 3)),
+            retry_delay=asint(config.get('storage.pipeline_retry_delay', 5)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def _path(self, media_file_id, ext='job'):
+        return os.path.join(self.spool_dir, '%d.%s' % (media_file_id, ext))
+
+    def _claimed_path(self, media_file_id):
+        return self._path(media_file_id, ext='claimed-%d' % os.getpid())
+
+    # --- request side --------------------------------------------------------
+    def submit(self, media_file, file=None, url=None, meta=None):
+        """Spool the upload and queue the remaining stages for the (flushed)
+        ``media_file``.
+
+        :param file: The uploaded file (:class:`cgi.FieldStorage`) or None.
+        :param url: The URL of the media file or None.
+        :param meta: The meta data returned by the storage engine's
+            :meth:`~mediadrop.lib.storage.StorageEngine.parse`.
+        """
+        if not os.path.exists(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        job = dict(
+            media_file_id=media_file.id,
+            # the workers need a host name to generate URLs
+            server_name=_current_server_name(),
+            url=url,
+            filename=None,
+            meta=_json_safe(meta or {}),
+            submitted=self._now(),
+        )
+        if file is not None:
+            job['filename'] = file.filename
+            upload_path = self._path(media_file.id, ext='upload')
+            with open(upload_path, 'wb') as upload_fp:
+                file.file.seek(0)
+                shutil.copyfileobj(file.file, upload_fp)
+        _write_json(self._path(media_file.id), job)
+        media_file.meta[u'ingest_state'] = PENDING
+        self._enqueue(media_file.id)
+
+    def status(self, media_file):
+        """Return the ingest status of ``media_file`` (see
+        :func:`ingest_status`) including the upload progress of jobs running
+        in this process."""
+        status = ingest_status(media_file, pipeline=None)
+        with self._lock:
+            status.update(self._progress.get(media_file.id, {}))
+        return status
+
+    # --- worker side ---------------------------------------------------------
+    def start(self):
+        """Start the worker threads of this process and queue all pending
+        jobs.
+
+        Threads do not survive a fork so this is called for every request
+        (only the first call in each process starts the threads).
+        """
+        if (self.workers < 1) or (self._threads_pid == os.getpid()):
+            return
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            # the queue and threads of the parent process are useless here
+            self._queue = Queue.Queue()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                    name='ingest-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._threads_pid = os.getpid()
+        if os.path.exists(self.spool_dir):
+            for media_file_id in self.pending():
+                self._queue.put(media_file_id)
+
+    def _enqueue(self, media_file_id):
+        if self.workers < 1:
+            return
+        self.start()
+        self._queue.put(media_file_id)
+
+    def _work(self):
+        while True:
+            media_file_id = self._queue.get()
+            if media_file_id is None:
+                return
+            try:
+                self.process(media_file_id)
+            except Exception:
+                log.exception('ingest of media file %d failed', media_file_id)
+
+    def pending(self):
+        """Return the ids of all media files with unfinished jobs."""
+        paths = glob.glob(os.path.join(self.spool_dir, '*.job'))
+        return sorted(int(os.path.basename(path)[:-len('.job')]) for path in paths)
+
+    def replay(self):
+        """Release the jobs claimed by previous processes which exited
+        before the job was done. The pending jobs are queued by
+        :meth:`start`."""
+        if not os.path.exists(self.spool_dir):
+            return
+        for claimed_path in glob.glob(os.path.join(self.spool_dir, '*.claimed-*')):
+            name, ext = os.path.basename(claimed_path).split('.', 1)
+            pid = int(ext[len('claimed-'):])
+            if (pid != os.getpid()) and _is_running(pid):
+                continue
+            _rename(claimed_path, self._path(int(name)))
+
+    def shutdown(self):
+        """Stop the worker threads once the running jobs are done. Queued
+        jobs remain in the spool directory."""
+        if self._threads_pid != os.getpid():
+            return
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+
+    def process(self, media_file_id):
+        """Run all stages for the given media file.
+
+        Returns False if the media file is not committed yet (the job is
+        queued again later on). Nothing happens if the job was claimed by
+        another process (or is done already).
+        """
+        claimed_path = self._claimed_path(media_file_id)
+        try:
+            os.rename(self._path(media_file_id), claimed_path)
+        except OSError:
+            return True
+        registry = Registry()
+        registry.prepare()
+        try:
+            job = _read_json(claimed_path)
+            if job is None:
+                self._remove_job(media_file_id)
+                return True
+            _setup_request(registry, pylons.config,
+                job.get('server_name') or 'localhost')
+            return self._process(media_file_id, job)
+        finally:
+            from mediadrop.model import DBSession
+            DBSession.remove()
+            with self._lock:
+                self._progress.pop(media_file_id, None)
+            registry.cleanup()
+
+    def _process(self, media_file_id, job):
+        from mediadrop.model import DBSession, MediaFile
+        media_file = MediaFile.query.get(media_file_id)
+        if media_file is None:
+            if self._now() - job['submitted'] < self.commit_timeout:
+                _rename(self._claimed_path(media_file_id), self._path(media_file_id))
+                self._retry_later(media_file_id)
+                return False
+            log.warn('dropping ingest job for unknown media file %d', media_file_id)
+            self._remove_job(media_file_id)
+            return True
+
+        meta = media_file.meta
+        timings = json.loads(meta.get(u'ingest_timings', None) or '{}')
+        meta[u'ingest_state'] = PROCESSING
+        DBSession.commit()
+        for stage in STAGES:
+            if stage in timings:
+                # completed before a restart
+                continue
+            meta[u'ingest_stage'] = unicode(stage)
+            DBSession.commit()
+            self._set_progress(media_file_id, stage=stage, progress=None)
+            started = self._now()
+            error = self._run_stage(stage, media_file, job)
+            if error is not None:
+                DBSession.rollback()
+                meta = media_file.meta
+                meta[u'ingest_state'] = FAILED
+                meta[u'ingest_error'] = unicode(error)
+                DBSession.commit()
+                self._remove_job(media_file_id)
+                return True
+            timings[stage] = round(self._now() - started, 3)
+            meta[u'ingest_timings'] = unicode(json.dumps(timings))
+            DBSession.commit()
+
+        media_file.media.update_status()
+        meta[u'ingest_state'] = DONE
+        DBSession.commit()
+        self._remove_job(media_file_id)
+        return True
+
+    def _retry_later(self, media_file_id):
+        if self.workers < 1:
+            return
+        timer = threading.Timer(1, self._queue.put, [media_file_id])
+        timer.daemon = True
+        timer.start()
+
+    def _set_progress(self, media_file_id, **status):
+        with self._lock:
+            self._progress.setdefault(media_file_id, {}).update(status)
+
+    def _run_stage(self, stage, media_file, job):
+        """Run the stage (with retries), return an error message if the stage
+        failed for good."""
+        from mediadrop.model import DBSession
+        stage_function = getattr(self, '_%s' % stage)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                stage_function(media_file, job)
+                DBSession.flush()
+                return None
+            except Exception, e:
+                log.exception('stage %r failed for media file %d (attempt %d)',
+                    stage, media_file.id, attempt)
+                DBSession.rollback()
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_delay)
+        return getattr(e, 'message', None) or repr(e)
+
+    def _store(self, media_file, job):
+        from mediadrop.lib.storage.api import store_media_file
+        upload = None
+        if job['filename'] is not None:
+            upload_fp = open(self._path(media_file.id, ext='upload'), 'rb')
+            upload_fp.seek(0, SEEK_END)
+            size = float(upload_fp.tell() or 1)
+            upload_fp.seek(0)
+            def report(bytes_read):
+                self._set_progress(media_file.id, progress=min(bytes_read / size, 1))
+            upload = SpooledUpload(job['filename'], ProgressFile(upload_fp, report))
+        try:
+            store_media_file(media_file, file=upload, url=job['url'], meta=job['meta'])
+        finally:
+            if upload is not None:
+                upload_fp.close()
+
+    def _postprocess(self, media_file, job):
+        media_file.storage.postprocess(media_file)
+
+    def _thumbnails(self, media_file, job):
+        from mediadrop.lib.storage.api import create_thumbs_from_meta
+        if 'thumbnail_url' in job['meta']:
+            create_thumbs_from_meta(media_file.media, job['meta'])
+
+    def _transcode(self, media_file, job):
+        from mediadrop.lib.storage.api import transcode_media_file
+        transcode_media_file(media_file)
+
+    def _remove_job(self, media_file_id):
+        for path in (self._claimed_path(media_file_id),
+                     self._path(media_file_id, ext='upload')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def ingest_status(media_file, pipeline=DEFAULT):
+    """Return the ingest status of ``media_file``.
+
+    The returned dict contains ``state`` (pending, processing, done or
+    failed), the current ``stage``, the upload ``progress`` (0..1, only for
+    running jobs in this process), the ``timings`` of all completed stages
+    (in seconds) and an ``error`` message for failed jobs.
+
+    :param pipeline: The :class:`IngestPipeline` which provides the progress
+        (defaults to the configured pipeline).
+    """
+    if pipeline is DEFAULT:
+        pipeline = getattr(pylons.app_globals, 'ingest_pipeline', None)
+    if pipeline is not None:
+        return pipeline.status(media_file)
+    meta = media_file.meta
+    return dict(
+        state=meta.get(u'ingest_state', DONE),
+        stage=meta.get(u'ingest_stage', None),
+        progress=None,
+        timings=json.loads(meta.get(u'ingest_timings', None) or '{}'),
+        error=meta.get(u'ingest_error', None),
+    )
+
+def _setup_request(registry, config, server_name):
+    """Register the Pylons globals of a (fake) GET request for
+    ``server_name`` so the storage engines can generate URLs and translate
+    messages in a worker thread."""
+    from mediadrop.lib.i18n import setup_global_translator
+    app_globals = config['pylons.app_globals']
+    registry.register(pylons.app_globals, app_globals)
+    request = Request.blank('http://%s/' % server_name, charset='utf-8')
+    environ = request.environ
+    request.settings = app_globals.settings
+    routes_url = URLGenerator(config['routes.map'], environ)
+    environ.update({
+        'paste.registry': registry,
+        'pylons.pylons': pylons,
+        'routes.url': routes_url,
+    })
+    registry.register(pylons.request, request)
+    registry.register(pylons.response, Response())
+    registry.register(pylons.url, routes_url)
+    registry.register(pylons.tmpl_context, AttribSafeContextObj())
+    setup_global_translator(registry=registry)
+
+def _current_server_name():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(pylons.request):
+        return None
+    return pylons.request.host
+
+def _json_safe(meta):
+    """Return the JSON serializable items of the engine's meta data (e.g.
+    ``thumbnail_file`` is handled within the request)."""
+    safe_types = (basestring, int, long, float, bool, type(None))
+    return dict((key, value) for key, value in meta.items()
+                if isinstance(value, safe_types))
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def _rename(path, new_path):
+    try:
+        os.rename(path, new_path)
+    except OSError:
+        pass
+
+def _read_json(path):
+    try:
+        with open(path, 'rb') as json_fp:
+            return json.load(json_fp)
+    except (IOError, ValueError):
+        return None
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as json_fp:
+        json.dump(data, json_fp)
+    os.rename(tmp_path, path)
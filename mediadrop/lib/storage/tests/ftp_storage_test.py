@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from cStringIO import StringIO
+import os
+import shutil
+import tempfile
+import threading
+
+from paste.registry import Registry
+import pkg_resources
+import pylons
+from pythonic_testcase import *
+
+from mediadrop.lib.paginate import Bunch
+from mediadrop.lib.storage import ftp
+from mediadrop.lib.storage.ftp import (FTP_MAX_INTEGRITY_RETRIES, FTP_PASSWORD,
+    FTP_SERVER, FTP_UPLOAD_DIR, FTP_USERNAME, HTTP_DOWNLOAD_URI,
+    FTPConnectionPool, FTPStorage, FTPUploadError)
+from mediadrop.lib.test.support import setup_translator
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+except ImportError:
+    FTPServer = None
+
+
+class FTPStorageTest(PythonicTestCase):
+    def setUp(self):
+        super(FTPStorageTest, self).setUp()
+        if FTPServer is None:
+            self.skipTest('pyftpdlib is not installed')
+        self.root_dir = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.root_dir, 'uploads')
+        os.mkdir(self.upload_dir)
+        self.logins = []
+        self._start_server()
+        self._global_pool = ftp.ftp_pool
+        self.pool = ftp.ftp_pool = FTPConnectionPool()
+        self.storage = FTPStorage(data={
+            FTP_SERVER: '127.0.0.1:%d' % self.port,
+            FTP_USERNAME: 'user',
+            FTP_PASSWORD: 'secret',
+            FTP_UPLOAD_DIR: 'uploads',
+            FTP_MAX_INTEGRITY_RETRIES: 0,
+            HTTP_DOWNLOAD_URI: 'file://' + self.upload_dir,
+        })
+
+    def tearDown(self):
+        if FTPServer is not None:
+            self.pool.clear()
+            ftp.ftp_pool = self._global_pool
+            self._stop.set()
+            self._thread.join()
+            shutil.rmtree(self.root_dir)
+        super(FTPStorageTest, self).tearDown()
+
+    def _start_server(self):
+        authorizer = DummyAuthorizer()
+        authorizer.add_user('user', 'secret', self.root_dir, perm='elradfmw')
+        logins = self.logins
+        class Handler(FTPHandler):
+            def on_login(self, username):
+                logins.append(username)
+        Handler.authorizer = authorizer
+        server = FTPServer(('127.0.0.1', 0), Handler)
+        self.port = server.address[1]
+        self._stop = threading.Event()
+        def serve():
+            while not self._stop.is_set():
+                server.serve_forever(timeout=0.01, blocking=False)
+            server.close_all()
+        self._thread = threading.Thread(target=serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _store(self, content='some video data', media_id=1):
+        media_file = Bunch(id=media_id, container=u'mp4')
+        upload = Bunch(filename=u'Foo Video.mp4', file=StringIO(content))
+        return self.storage.store(media_file, file=upload)
+
+    # --- tests ---------------------------------------------------------------
+    def test_can_store_and_delete_files(self):
+        file_name = self._store()
+        assert_equals(u'1-foovideo.mp4', file_name)
+        path = os.path.join(self.upload_dir, file_name)
+        assert_equals('some video data', open(path, 'rb').read())
+
+        assert_true(self.storage.delete(file_name))
+        assert_false(os.path.exists(path))
+        assert_false(self.storage.delete(file_name))
+
+    def test_can_store_files_in_login_directory(self):
+        self.storage._data[FTP_UPLOAD_DIR] = None
+        file_name = self._store()
+        assert_true(os.path.exists(os.path.join(self.root_dir, file_name)))
+
+    def test_reuses_connections(self):
+        self._store(media_id=1)
+        self._store(media_id=2)
+        self.storage.delete(u'1-foovideo.mp4')
+        assert_equals(['user'], self.logins)
+
+    def test_uses_one_connection_per_session(self):
+        self.pool.max_idle = 0
+        for media_id in (1, 2, 3):
+            self._store(media_id=media_id)
+        assert_length(3, self.logins)
+
+        with self.storage.session():
+            for media_id in (1, 2, 3):
+                assert_true(self.storage.delete(u'%d-foovideo.mp4' % media_id))
+        assert_length(4, self.logins)
+        assert_equals([], os.listdir(self.upload_dir))
+
+    def test_replaces_broken_idle_connections(self):
+        self._store()
+        (connection, released_at), = self.pool._idle.values()[0]
+        connection.close()
+        self.pool._now = lambda: released_at + self.pool.check_after + 1
+
+        self._store(media_id=2)
+        assert_length(2, self.logins)
+
+    def test_can_verify_uploads_by_downloading_them(self):
+        registry = Registry()
+        registry.prepare()
+        locale_dirs = {'mediadrop': pkg_resources.resource_filename('mediadrop', 'i18n')}
+        setup_translator(registry=registry, locale_dirs=locale_dirs)
+        self.addCleanup(pylons.translator._pop_object)
+        self.storage._data[FTP_MAX_INTEGRITY_RETRIES] = 1
+        file_name = self._store()
+        assert_true(os.path.exists(os.path.join(self.upload_dir, file_name)))
+
+        with self.storage._connection() as connection:
+            self.storage._change_dir(connection)
+            file_url = 'file://' + os.path.join(self.upload_dir, file_name)
+            verify = lambda size, file_hash: self.storage._verify_upload_integrity(
+                connection, file_name, size, file_hash, file_url)
+            # size mismatch (detected without downloading the file)
+            assert_raises(FTPUploadError, lambda: verify(3, None))
+            # hash mismatch
+            assert_raises(FTPUploadError, lambda: verify(15, 'invalid'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FTPStorageTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from cStringIO import StringIO
+import os
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.paginate import Bunch
+from mediadrop.lib.storage import add_new_media_file
+from mediadrop.lib.storage.pipeline import ingest_status, IngestPipeline, STAGES
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media, MediaFile
+
+
+class IngestPipelineTest(DBTestCase):
+    def setUp(self):
+        super(IngestPipelineTest, self).setUp()
+        self.spool_dir = os.path.join(self.env_dir, 'uploads')
+        self.pipeline = IngestPipeline(self.spool_dir, workers=0, retry_delay=0)
+        app_globals.ingest_pipeline = self.pipeline
+        self.media = Media.example()
+
+    def tearDown(self):
+        app_globals.ingest_pipeline = None
+        super(IngestPipelineTest, self).tearDown()
+
+    def _add_file(self):
+        upload = Bunch(filename=u'awesome-movie.mp4', file=StringIO('movie data'))
+        media_file = add_new_media_file(self.media, file=upload)
+        media_file_id = media_file.id
+        DBSession.commit()
+        return media_file_id
+
+    def _stored_files(self):
+        return os.listdir(os.path.join(self.env_dir, 'media'))
+
+    def test_request_only_spools_the_upload(self):
+        upload = Bunch(filename=u'awesome-movie.mp4', file=StringIO('movie data'))
+        media_file = add_new_media_file(self.media, file=upload)
+
+        assert_true(media_file.is_pending)
+        assert_equals([], media_file.get_uris())
+        assert_equals('pending', ingest_status(media_file)['state'])
+        assert_equals([media_file.id], self.pipeline.pending())
+        assert_equals([], self._stored_files())
+
+    def test_stores_pending_files_in_the_background(self):
+        media_file_id = self._add_file()
+        assert_true(self.pipeline.process(media_file_id))
+
+        media_file = MediaFile.query.get(media_file_id)
+        assert_false(media_file.is_pending)
+        assert_equals([media_file.unique_id], self._stored_files())
+        status = ingest_status(media_file)
+        assert_equals('done', status['state'])
+        assert_equals(set(STAGES), set(status['timings']))
+        assert_equals([], self.pipeline.pending())
+        assert_equals([], os.listdir(self.spool_dir))
+
+    def test_marks_file_as_failed_after_retries(self):
+        media_file_id = self._add_file()
+        os.remove(os.path.join(self.spool_dir, '%d.upload' % media_file_id))
+        self.pipeline.max_attempts = 2
+        self.pipeline.process(media_file_id)
+
+        media_file = MediaFile.query.get(media_file_id)
+        status = ingest_status(media_file)
+        assert_equals('failed', status['state'])
+        assert_equals('store', status['stage'])
+        assert_not_none(status['error'])
+        assert_true(media_file.is_pending)
+        assert_equals([], self.pipeline.pending())
+
+    def test_waits_until_media_file_was_committed(self):
+        upload = Bunch(filename=u'awesome-movie.mp4', file=StringIO('movie data'))
+        media_file = add_new_media_file(self.media, file=upload)
+        DBSession.rollback()
+
+        assert_false(self.pipeline.process(media_file.id))
+        assert_equals([media_file.id], self.pipeline.pending())
+
+
+    def test_skips_jobs_claimed_by_other_processes(self):
+        media_file_id = self._add_file()
+        job_path = os.path.join(self.spool_dir, '%d.job' % media_file_id)
+        claimed_path = os.path.join(self.spool_dir, '%d.claimed-1' % media_file_id)
+        os.rename(job_path, claimed_path)
+
+        assert_true(self.pipeline.process(media_file_id))
+        assert_true(MediaFile.query.get(media_file_id).is_pending)
+        assert_true(os.path.exists(claimed_path))
+
+    def test_replays_jobs_of_exited_processes(self):
+        media_file_id = self._add_file()
+        job_path = os.path.join(self.spool_dir, '%d.job' % media_file_id)
+        # pid 1 (init) is always running
+        os.rename(job_path, os.path.join(self.spool_dir, '%d.claimed-1' % media_file_id))
+        self.pipeline.replay()
+        assert_equals([], self.pipeline.pending())
+
+        os.rename(os.path.join(self.spool_dir, '%d.claimed-1' % media_file_id),
+            os.path.join(self.spool_dir, '%d.claimed-%d' % (media_file_id, 2**22 + 1)))
+        self.pipeline.replay()
+        assert_equals([media_file_id], self.pipeline.pending())
+        assert_true(self.pipeline.process(media_file_id))
+        assert_false(MediaFile.query.get(media_file_id).is_pending)
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(IngestPipelineTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pylons import request
+from pythonic_testcase import *
+
+from mediadrop.lib.storage.localfiles import LocalFileStorage
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.test.request_mixin import RequestMixin
+from mediadrop.lib.util import url_for
+from mediadrop.model import DBSession, Media, MediaFile
+
+
+class LocalFileStorageURITest(DBTestCase, RequestMixin):
+    def setUp(self):
+        super(LocalFileStorageURITest, self).setUp()
+        self.init_fake_request(server_name='server.example')
+        self.storage = DBSession.query(LocalFileStorage).first()
+        self.media = Media.example(slug=u'über-movie')
+        self.files = [self._media_file(u'%d.mp4' % i) for i in range(3)]
+        DBSession.commit()
+
+    def _media_file(self, unique_id):
+        media_file = MediaFile()
+        media_file.storage = self.storage
+        media_file.unique_id = unique_id
+        media_file.container = u'mp4'
+        media_file.type = u'video'
+        media_file.display_name = unique_id
+        media_file.media = self.media
+        self.media.files.append(media_file)
+        DBSession.flush()
+        return media_file
+
+    def _serve_url(self, media_file, **kwargs):
+        return url_for(controller='/media', action='serve', id=media_file.id,
+            slug=self.media.slug, container=u'mp4', qualified=True, **kwargs)
+
+    def test_builds_same_urls_as_routes(self):
+        for media_file in self.files:
+            uris = dict((uri.scheme, uri.file_uri) for uri in media_file.get_uris())
+            assert_equals(self._serve_url(media_file), uris['http'])
+            assert_equals(self._serve_url(media_file, download=1), uris['download'])
+        # one template for "serve" and one for "download"
+        assert_length(2, request.environ['mediadrop.cache.url_templates'])
+
+    def test_generates_uris_once_per_request(self):
+        media_file = self.files[0]
+        uris = media_file.get_uris()
+        assert_equals(uris, media_file.get_uris())
+        assert_is(uris[0], media_file.get_uris()[0])
+
+        self.media.slug = u'new-slug'
+        DBSession.flush()
+        assert_contains(u'-new-slug.mp4', media_file.get_uris()[0].file_uri)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LocalFileStorageURITest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -16,6 +16,7 @@ from genshi.template.loader import (directory,
 from pylons import app_globals, config, request, response, tmpl_context, translator
 
 from mediadrop.lib.i18n import N_
+from mediadrop.lib.profiling import timed_section
 
 __all__ = [
     'TemplateLoader',
@@ -124,7 +125,8 @@ def render_stream(stream, method='auto', template_name=None):
     if method == 'xhtml':
         method = XHTMLPlusSerializer
 
-    return Markup(stream.render(method=method, encoding=None))
+    with timed_section('template'):
+        return Markup(stream.render(method=method, encoding=None))
 
 class XHTMLPlusSerializer(XHTMLSerializer):
     """
@@ -18,23 +18,35 @@ from mediadrop.lib.test.support import *
 
 
 def suite():
-    from mediadrop.controllers.tests import login_test, upload_test
+    from mediadrop.benchmarks.tests import benchmark_test
+    from mediadrop.controllers.tests import login_test, sitemaps_test, upload_test
     from mediadrop.lib.auth.tests import (
         cookieplugin_test,
         filtering_restricted_items_test,
         group_based_permissions_policy_test,
         is_logged_in_decorator_test,
         loginform_test,
-        mediadrop_permission_system_test,
+        mediadrop_permission_system_test, permission_cache_test,
         permission_system_test, query_result_proxy_test, static_query_test)
     from mediadrop.lib.tests import (css_delivery_test, current_url_test,
+        fragment_cache_test,
         helpers_test, human_readable_size_test, js_delivery_test,
-        observable_test, players_test, request_mixin_test,
-        translator_test, url_for_test, xhtml_normalization_test)
+        keyset_pagination_test, metrics_test,
+        observable_test, page_cache_test, player_cache_test, players_test,
+        profiling_test,
+        request_mixin_test,
+        random_media_test, thumbnail_queue_test, translator_test, url_for_test,
+        view_counter_test, view_dedup_test, xhtml_normalization_test)
     from mediadrop.lib.services.tests import youtube_client_test
-    from mediadrop.lib.storage.tests import youtube_storage_test
-    from mediadrop.model.tests import (category_example_test, group_example_test, 
-        media_example_test, media_status_test, media_test, user_example_test)
+    from mediadrop.lib.storage.tests import (ftp_storage_test,
+        ingest_pipeline_test, localfiles_storage_test, youtube_storage_test)
+    from mediadrop.model.tests import (category_closure_test, counters_test,
+        category_example_test, category_tree_test,
+        fulltext_capability_test, group_example_test,
+        media_example_test, media_listing_test, media_status_test, media_test,
+        related_media_test,
+        settings_snapshot_test,
+        user_example_test, view_stats_test)
     from mediadrop.plugin.tests import abstract_class_registration_test, events_test, observes_test
     
     from mediadrop.validation.tests import (limit_feed_items_validator_test, 
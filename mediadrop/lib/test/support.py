@@ -188,7 +188,7 @@ def remove_globals():
     # oddly enough popping "pylons.app_globals" was not enough to clear the
     # cached settings in all case (tests) so we do that explicitely.
     if is_object_registered(pylons.app_globals):
-        pylons.app_globals.settings_cache.clear()
+        pylons.app_globals.settings_store.invalidate()
     for name in ('request', 'response', 'session', 'tmpl_context', 'url',
                  'translator', 'app_globals', ):
         global_ = getattr(pylons, name)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from genshi import Markup
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.controllers.categories import CategoriesController
+from mediadrop.lib.fragments import cached_fragment, FragmentCache
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.model import Category, DBSession, Media
+
+
+class FragmentCacheTest(ControllerTestCase):
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        self.cache = FragmentCache(app_globals.cache)
+        self.cache.clear()
+        app_globals.fragment_cache = self.cache
+
+    def _render(self, text):
+        self.rendered.append(text)
+        return Markup(u'<b>%s</b>' % text)
+
+    def test_renders_fragment_once_per_dependencies(self):
+        self.init_fake_request()
+        self.rendered = []
+        fragment = lambda deps, text: cached_fragment('test', deps,
+            lambda: self._render(text))
+
+        assert_equals(Markup(u'<b>foo</b>'), fragment((1, 'a'), u'foo'))
+        assert_equals(Markup(u'<b>foo</b>'), fragment((1, 'a'), u'bar'))
+        assert_equals(Markup(u'<b>bar</b>'), fragment((1, 'b'), u'bar'))
+        assert_equals([u'foo', u'bar'], self.rendered)
+        assert_equals((1, 2), (self.cache.hits, self.cache.misses))
+
+    def _category_page(self):
+        request = self.init_fake_request(request_uri='/categories/fun')
+        response = self.call_controller(CategoriesController, request)
+        assert_equals(200, response.status_int)
+        return response.body
+
+    def test_updates_cached_tiles_when_media_changes(self):
+        category = Category.example(name=u'Fun', slug=u'fun')
+        media = Media.example(title=u'Old Title')
+        media.categories = [category]
+        media.reviewed = media.encoded = media.publishable = True
+        media.publish_on = media.created_on
+        DBSession.commit()
+
+        body = self._category_page()
+        assert_contains('Old Title', body)
+        misses = self.cache.misses
+        assert_equals(body, self._category_page())
+        assert_equals(misses, self.cache.misses)
+
+        media.title = u'New Title'
+        DBSession.commit()
+        assert_contains('New Title', self._category_page())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FragmentCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
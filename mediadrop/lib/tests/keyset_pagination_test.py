@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code in this file is dual licensed under the MIT license or
+# the GPLv3 or (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.auth.query_result_proxy import QueryResultProxy
+from mediadrop.lib.paginate import (cached_count, CountCache, decode_cursor,
+    encode_cursor, KeysetPage)
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media
+
+
+class KeysetPaginationTest(DBTestCase):
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        yesterday = datetime.now() - timedelta(days=1)
+        # some media share the same publish date so the id is needed to
+        # break the ties
+        for i in range(7):
+            self._published_media(u'Media %d' % i, yesterday - timedelta(hours=i // 2))
+        DBSession.commit()
+        self.counts = CountCache()
+        app_globals.pagination_counts = self.counts
+
+    def _published_media(self, title, publish_on):
+        media = Media.example(title=title)
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = publish_on
+        DBSession.flush()
+        return media
+
+    def _latest(self):
+        # ignore the media of the default data
+        query = Media.query.published().filter(Media.title.startswith(u'Media '))
+        return QueryResultProxy(query).keyset(Media.publish_on,
+            descending=True, tiebreaker=Media.id)
+
+    def test_can_encode_and_decode_cursors(self):
+        key = (datetime(2014, 3, 1, 12, 30, 5), 42)
+        cursor = encode_cursor('publish_on', 3, key)
+        assert_equals((3, key), decode_cursor(cursor, 'publish_on'))
+        assert_equals((2, (0, 7)),
+            decode_cursor(encode_cursor('popularity_points', 2, (0, 7)), 'popularity_points'))
+
+        assert_none(decode_cursor(cursor, 'modified_on'))
+        assert_none(decode_cursor(u'invalid', 'publish_on'))
+        assert_none(decode_cursor(cursor[:-3], 'publish_on'))
+        assert_none(encode_cursor('publish_on', 3, (None, 42)))
+
+    def test_pages_with_cursors_return_same_items_as_offset_pages(self):
+        expected = [m.title for m in self._latest()[0:7]]
+        titles = []
+        page = KeysetPage(self._latest(), None, items_per_page=3)
+        pages = [page]
+        while page.next_cursor:
+            titles.extend([m.title for m in page])
+            page = KeysetPage(self._latest(), page.next_cursor, items_per_page=3)
+            pages.append(page)
+        titles.extend([m.title for m in page])
+
+        assert_equals(expected, titles)
+        assert_equals([1, 2, 3], [p.page for p in pages])
+        assert_equals([3, 3, 3], [p.page_count for p in pages])
+        assert_equals((7, 7), (pages[-1].first_item, pages[-1].last_item))
+        assert_none(pages[-1].next_page)
+
+    def test_caches_counts(self):
+        assert_equals(7, cached_count(self._latest()))
+        self._published_media(u'Media 7', datetime.now() - timedelta(minutes=1))
+        DBSession.commit()
+
+        # the current time in .published() does not change the cache key
+        assert_equals(7, cached_count(self._latest()))
+        assert_equals((1, 1), (self.counts.hits, self.counts.misses))
+        self.counts.clear()
+        assert_equals(8, cached_count(self._latest()))
+
+    def test_does_not_cache_counts_of_filtered_queries(self):
+        proxy = QueryResultProxy(self._latest().query,
+            filter_=lambda media: media.title != u'Media 0')
+        assert_equals(6, cached_count(proxy))
+        assert_equals(0, self.counts.misses)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeysetPaginationTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
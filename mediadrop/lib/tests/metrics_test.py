@@ -0,0 +1,141 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from pythonic_testcase import *
+
+from mediadrop.lib.metrics import MetricsMiddleware, MetricsRegistry
+
+
+class MetricsRegistryTest(PythonicTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _registry(self):
+        registry = MetricsRegistry(directory=self.directory)
+        registry.counter('requests_total', 'Requests.', ['status'])
+        registry.gauge('connections', 'Open connections.')
+        registry.histogram('duration_seconds', 'Duration.', buckets=(0.1, 1))
+        return registry
+
+    def test_renders_text_exposition_format(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests.', ['status'])
+        registry.histogram('duration_seconds', 'Duration.', buckets=(0.1, 1))
+        registry['requests_total'].inc(status='200')
+        registry['requests_total'].inc(2, status='404')
+        registry['duration_seconds'].observe(0.05)
+        registry['duration_seconds'].observe(5)
+
+        assert_equals([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{status="200"} 1',
+            'requests_total{status="404"} 2',
+            '# HELP duration_seconds Duration.',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{le="0.1"} 1',
+            'duration_seconds_bucket{le="1.0"} 1',
+            'duration_seconds_bucket{le="+Inf"} 2',
+            'duration_seconds_sum 5.05',
+            'duration_seconds_count 2',
+        ], registry.exposition().splitlines())
+
+    def test_adds_up_values_of_all_processes(self):
+        worker1 = self._registry()
+        worker2 = self._registry()
+        worker1['requests_total'].inc(status='200')
+        worker1['connections'].set(2)
+        worker1['duration_seconds'].observe(0.5)
+        worker1.flush()
+        worker2['requests_total'].inc(3, status='200')
+        worker2['connections'].set(1)
+        worker2['duration_seconds'].observe(0.5)
+
+        totals = worker2.collect()
+        assert_equals({(u'200',): 4}, totals['requests_total'])
+        assert_equals({(): 3}, totals['connections'])
+        assert_equals({(): [0, 2, 0, 1.0]}, totals['duration_seconds'])
+
+    def test_keeps_counters_of_exited_processes(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        filename = os.path.join(self.directory, 'process-%d-0.json' % exited.pid)
+        with open(filename, 'wb') as fp:
+            json.dump({'requests_total': [[['200'], 5]],
+                       'connections': [[[], 4]]}, fp)
+
+        registry = self._registry()
+        for i in range(2):
+            totals = registry.collect()
+            assert_equals({(u'200',): 5}, totals['requests_total'])
+            assert_equals({}, totals['connections'])
+        assert_false(os.path.exists(filename))
+
+
+class MetricsMiddlewareTest(PythonicTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.histogram('mediadrop_request_duration_seconds', '', ['route'])
+        self.registry.counter('mediadrop_requests_total', '', ['route', 'status'])
+
+    def _app(self, environ, start_response):
+        environ['wsgiorg.routing_args'] = ((), {'controller': 'media', 'action': 'view'})
+        start_response('404 Not Found', [])
+        return ['not found']
+
+    def _request(self, app, path, **environ):
+        environ.setdefault('REMOTE_ADDR', '192.0.2.1')
+        environ['PATH_INFO'] = path
+        status = []
+        start_response = lambda status_line, headers, exc_info=None: \
+            status.append(status_line)
+        result = app(environ, start_response)
+        body = ''.join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        return status[0], body
+
+    def test_requires_token(self):
+        app = MetricsMiddleware(self._app, self.registry, token='secret')
+        status, body = self._request(app, '/metrics')
+        assert_equals('401 Unauthorized', status)
+        status, body = self._request(app, '/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+        assert_equals('401 Unauthorized', status)
+
+        self._request(app, '/media/foo')
+        status, body = self._request(app, '/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        assert_equals('200 OK', status)
+        assert_contains('mediadrop_requests_total{route="media/view",status="404"} 1',
+            body.splitlines())
+
+    def test_allows_local_requests_without_token(self):
+        app = MetricsMiddleware(self._app, self.registry)
+        status, body = self._request(app, '/metrics')
+        assert_equals('401 Unauthorized', status)
+        status, body = self._request(app, '/metrics', REMOTE_ADDR='127.0.0.1')
+        assert_equals('200 OK', status)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MetricsRegistryTest))
+    suite.addTest(unittest.makeSuite(MetricsMiddlewareTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,110 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.controllers.media import MediaController
+from mediadrop.lib.page_cache import PageCache, PageCacheMiddleware
+from mediadrop.lib.test import ControllerTestCase
+from mediadrop.model import DBSession, Media
+
+
+class PageCacheTest(ControllerTestCase):
+    def setUp(self):
+        super(PageCacheTest, self).setUp()
+        self.cache = PageCache(app_globals.cache)
+        self.cache.clear()
+        app_globals.page_cache = self.cache
+        self.middleware = PageCacheMiddleware(self._app, self.cache,
+            app_globals.settings_store, app_globals.view_dedup)
+        self.media = Media.example(title=u'Old Title', slug=u'cached')
+        self.media.reviewed = self.media.encoded = self.media.publishable = True
+        self.media.publish_on = self.media.created_on
+        DBSession.commit()
+        self.nr_calls = 0
+        self.purge_while_rendering = False
+
+    def tearDown(self):
+        app_globals.page_cache = None
+        super(PageCacheTest, self).tearDown()
+
+    def _app(self, environ, start_response):
+        self.nr_calls += 1
+        if self.purge_while_rendering:
+            self.purge_while_rendering = False
+            self.cache.purge('media:%d' % self.media.id)
+        response = self.call_controller(MediaController, self.request)
+        start_response(response.status, response.headerlist)
+        return [response.body]
+
+    def _get(self, **headers):
+        self.request = self.init_fake_request(request_uri='/media/cached')
+        for name, value in headers.items():
+            self.request.environ['HTTP_' + name.upper()] = value
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+        body = ''.join(self.middleware(self.request.environ, start_response))
+        return response['status'], response['headers'], body
+
+    def test_serves_page_until_media_changes(self):
+        status, headers, body = self._get()
+        assert_equals('200 OK', status)
+        assert_contains('Old Title', body)
+        assert_equals((body, 1), (self._get()[2], self.nr_calls))
+        assert_equals((1, 1), (self.cache.hits, self.cache.misses))
+
+        self.media.title = u'New Title'
+        DBSession.commit()
+        assert_contains('New Title', self._get()[2])
+        assert_equals(2, self.nr_calls)
+
+    def test_purges_pages_after_commit(self):
+        self._get()
+        self.media.title = u'New Title'
+        DBSession.flush()
+        # another process would still render the old title
+        self._get()
+        assert_equals(1, self.nr_calls)
+
+        DBSession.commit()
+        self._get()
+        assert_equals(2, self.nr_calls)
+
+    def test_does_not_store_page_purged_while_rendering(self):
+        self.purge_while_rendering = True
+        assert_contains('Old Title', self._get()[2])
+        self._get()
+        assert_equals(2, self.nr_calls)
+        self._get()
+        assert_equals(2, self.nr_calls)
+
+    def test_ignores_requests_with_auth_cookie(self):
+        self._get(cookie='authtkt=foo')
+        self._get(cookie='authtkt=foo')
+        assert_equals(2, self.nr_calls)
+        assert_equals((0, 0), (self.cache.hits, self.cache.misses))
+
+    def test_supports_conditional_get(self):
+        etag = self._get()[1]['ETag']
+
+        status, headers, body = self._get(if_none_match=etag)
+        assert_equals('304 Not Modified', status)
+        assert_equals(etag, headers['ETag'])
+        assert_equals('', body)
+        assert_equals(1, self.nr_calls)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PageCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.i18n import setup_global_translator
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media, PlayerPrefs
+from mediadrop.model.players import fetch_enabled_players
+from mediadrop.players import (AbstractFlashPlayer, FlowPlayer,
+    pick_any_media_file, player_resolution)
+from mediadrop.players.cache import PlayerCache
+
+
+class PlayerCacheTest(DBTestCase):
+    def setUp(self):
+        super(PlayerCacheTest, self).setUp()
+        AbstractFlashPlayer.register(FlowPlayer)
+        FlowPlayer.inject_in_db(enable_player=True)
+        setup_global_translator(registry=self.pylons_config['paste.registry'])
+        self.cache = PlayerCache()
+        app_globals.player_cache = self.cache
+
+        self.media = Media.example()
+        add_new_media_file(self.media, url=u'http://site.example/video.mp4')
+        DBSession.commit()
+        DBSession.refresh(self.media)
+
+    def _flowplayer_prefs(self):
+        return PlayerPrefs.query.filter(PlayerPrefs.name == FlowPlayer.name).one()
+
+    def test_reuses_resolution_until_media_files_change(self):
+        resolution = player_resolution(self.media)
+        assert_equals(FlowPlayer, resolution.player_cls)
+        assert_is(resolution, player_resolution(self.media))
+        assert_equals((1, 1), (self.cache.hits, self.cache.misses))
+        uri = pick_any_media_file(self.media)
+        assert_equals(u'http://site.example/video.mp4', unicode(uri))
+        assert_is(self.media.files[0], uri.file)
+
+        self.media.files[0].container = u'flv'
+        # unsaved changes are never cached
+        assert_none(player_resolution(self.media).key)
+        DBSession.commit()
+        assert_is_not(resolution, player_resolution(self.media))
+
+    def test_reloads_players_when_player_preferences_change(self):
+        players = fetch_enabled_players()
+        assert_is(players, fetch_enabled_players())
+        resolution = player_resolution(self.media)
+
+        self._flowplayer_prefs().enabled = False
+        DBSession.commit()
+        assert_not_contains(FlowPlayer, [cls for cls, data in fetch_enabled_players()])
+        new_resolution = player_resolution(self.media)
+        assert_is_not(resolution, new_resolution)
+        assert_none(new_resolution.player_cls)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PlayerCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
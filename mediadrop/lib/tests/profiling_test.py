@@ -0,0 +1,85 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pythonic_testcase import *
+
+from mediadrop.lib.profiling import Histogram, Profiler, ProfilingMiddleware
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media
+
+
+class HistogramTest(PythonicTestCase):
+    def test_returns_upper_bound_of_percentile_bucket(self):
+        histogram = Histogram((10, 100, 1000))
+        for value in (1, 2, 3, 50, 5000):
+            histogram.observe(value)
+        assert_equals([3, 1, 0, 1], histogram.counts)
+        assert_equals(10, histogram.percentile(50))
+        assert_equals(100, histogram.percentile(80))
+        assert_none(histogram.percentile(95))
+        assert_equals(1011.2, histogram.mean)
+
+
+class ProfilingMiddlewareTest(DBTestCase):
+    def setUp(self):
+        super(ProfilingMiddlewareTest, self).setUp()
+        for i in range(3):
+            Media.example()
+        DBSession.commit()
+        self.media_count = Media.query.count()
+        self.profiler = Profiler(repeated_statements=3)
+        self.profiler.instrument(DBSession.bind)
+        # new connections only (created after "listen()") report queries
+        DBSession.close()
+
+    def _app(self, environ, start_response):
+        environ['wsgiorg.routing_args'] = ((), {'controller': 'media', 'action': 'index'})
+        for media in Media.query.all():
+            Media.query.filter(Media.id == media.id).first()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['ok']
+
+    def _request(self, app):
+        result = app({}, lambda status, headers: None)
+        body = ''.join(result)
+        result.close()
+        return body
+
+    def test_aggregates_statements_per_action(self):
+        app = ProfilingMiddleware(self._app, self.profiler)
+        assert_equals('ok', self._request(app))
+        assert_equals('ok', self._request(app))
+
+        stats = self.profiler.actions['media/index']
+        assert_equals(2, stats.requests)
+        assert_equals(1 + self.media_count, stats.sql_count.mean)
+        assert_length(1, stats.repeated_statements)
+        assert_equals([self.media_count], stats.repeated_statements.values())
+
+        report = self.profiler.report()
+        assert_contains('media/index', report)
+        assert_contains('Repeated statements in media/index:', report)
+        assert_none(self.profiler.current)
+
+    def test_ignores_requests_without_route(self):
+        def static_app(environ, start_response):
+            start_response('200 OK', [])
+            return ['static']
+        app = ProfilingMiddleware(static_app, self.profiler)
+        assert_equals('static', self._request(app))
+        assert_equals({}, self.profiler.actions)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(HistogramTest))
+    suite.addTest(unittest.makeSuite(ProfilingMiddlewareTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code in this file is dual licensed under the MIT license or
+# the GPLv3 or (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.random_media import RandomMediaPicker
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media
+
+
+class RandomMediaPickerTest(DBTestCase):
+    def setUp(self):
+        super(RandomMediaPickerTest, self).setUp()
+        self.media = self._published_media(u'Foo Media')
+        self.other = self._published_media(u'Bar Media')
+        self.draft = Media.example(title=u'Draft')
+        DBSession.commit()
+        self.published_ids = set(row[0] for row in Media.query.published().values(Media.id))
+        self.picker = app_globals.random_media
+
+    def _published_media(self, title):
+        media = Media.example(title=title)
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = datetime.now() - timedelta(days=1)
+        DBSession.flush()
+        return media
+
+    def _ids(self):
+        return set(self.picker._ids)
+
+    def _load(self, media_id):
+        return Media.query.published().filter(Media.id == media_id).first()
+
+    def test_loads_only_published_media(self):
+        self.picker.refresh()
+        assert_equals(self.published_ids, self._ids())
+        assert_true(self.media.id in self.picker)
+        assert_false(self.draft.id in self.picker)
+
+    def test_picks_random_published_media(self):
+        self.picker._random.seed(42)
+        picked = set(self.picker.pick(self._load) for i in range(50))
+        assert_equals(self.published_ids, set(media.id for media in picked))
+
+    def test_retries_when_media_was_rejected(self):
+        allowed_id = self.media.id
+        load = lambda media_id: (media_id == allowed_id) and self._load(media_id) or None
+        self.picker = RandomMediaPicker(max_tries=100)
+        assert_equals(self.media, self.picker.pick(load))
+
+        self.picker.max_tries = 1
+        picked = [self.picker.pick(load) for i in range(30)]
+        assert_contains(None, picked)
+
+    def test_updates_ids_when_media_is_published_or_unpublished(self):
+        self.picker.refresh()
+        self.draft.reviewed = True
+        self.draft.encoded = True
+        self.draft.publishable = True
+        self.draft.publish_on = datetime.now() - timedelta(hours=1)
+        DBSession.flush()
+        assert_true(self.draft.id in self.picker)
+
+        self.media.publishable = False
+        DBSession.flush()
+        assert_false(self.media.id in self.picker)
+
+        DBSession.delete(self.other)
+        DBSession.flush()
+        assert_false(self.other.id in self.picker)
+        assert_length(len(self.published_ids) - 1, self.picker._ids)
+
+    def test_refreshes_when_scheduled_media_is_published(self):
+        self.draft.reviewed = True
+        self.draft.encoded = True
+        self.draft.publishable = True
+        self.draft.publish_on = datetime.now() + timedelta(hours=1)
+        DBSession.commit()
+        self.picker.refresh()
+        assert_false(self.picker.needs_refresh())
+        assert_equals(self.draft.publish_on, self.picker._next_change)
+
+        self.picker._next_change = datetime.now() - timedelta(seconds=1)
+        assert_true(self.picker.needs_refresh())
+        self.picker._now = lambda: self.picker._loaded_at + self.picker.refresh_interval
+        assert_true(self.picker.needs_refresh())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RandomMediaPickerTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
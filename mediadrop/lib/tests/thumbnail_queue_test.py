@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from cStringIO import StringIO
+import os
+
+from PIL import Image
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.page_cache import PageCache
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.thumbnail_queue import ThumbnailQueue
+from mediadrop.lib.thumbnails import (create_default_thumbs_for,
+    has_default_thumbs, queue_thumbs_for, thumb_path)
+from mediadrop.model import DBSession, Media
+
+
+class ThumbnailQueueTest(DBTestCase):
+    def setUp(self):
+        super(ThumbnailQueueTest, self).setUp()
+        self.media = Media.example()
+        DBSession.commit()
+        self.queue_dir = os.path.join(self.env_dir, 'thumbs')
+        self.queue = ThumbnailQueue(self.queue_dir, workers=0)
+        app_globals.thumbnail_queue = self.queue
+        self.key = 'media-%d' % self.media.id
+        # copy the default thumbs to the image_dir
+        create_default_thumbs_for(('media', 'new'))
+
+    def tearDown(self):
+        app_globals.thumbnail_queue = None
+        super(ThumbnailQueueTest, self).tearDown()
+
+    def _image(self, size=(1280, 720)):
+        image_file = StringIO()
+        Image.new('RGB', size, (255, 0, 0)).save(image_file, 'JPEG')
+        image_file.seek(0)
+        return image_file
+
+    def _queued_files(self):
+        return sorted(os.listdir(self.queue_dir))
+
+    def test_creates_thumbnails_in_all_sizes(self):
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+
+        assert_equals((560, 315), Image.open(thumb_path(self.media, 'l')).size)
+        assert_equals((128, 72), Image.open(thumb_path(self.media, 's')).size)
+        assert_true(os.path.exists(thumb_path(self.media, 'orig', ext='jpg')))
+        assert_equals([], self._queued_files())
+
+    def test_rejects_invalid_images_right_away(self):
+        assert_raises(IOError,
+            lambda: queue_thumbs_for(self.media, StringIO('foo'), u'foo.jpg'))
+
+    def test_serves_default_thumbnails_until_job_is_done(self):
+        self.queue._running.add(self.key)
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        assert_true(has_default_thumbs(self.media))
+        assert_equals([self.key], self.queue.pending())
+
+        self.queue._running.discard(self.key)
+        self.queue.dispatch(self.key)
+        assert_false(has_default_thumbs(self.media))
+        assert_equals([], self._queued_files())
+
+    def test_keeps_only_latest_job_per_item(self):
+        self.queue._running.add(self.key)
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        queue_thumbs_for(self.media, self._image(size=(640, 360)), u'bar.png')
+        assert_equals([self.key], self.queue.pending())
+        assert_length(2, self._queued_files()) # job + source image
+
+        self.queue._running.discard(self.key)
+        self.queue.dispatch(self.key)
+        assert_true(os.path.exists(thumb_path(self.media, 'orig', ext='png')))
+        assert_false(os.path.exists(thumb_path(self.media, 'orig', ext='jpg')))
+
+    def test_replays_interrupted_jobs(self):
+        self.queue._running.add(self.key)
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        job_path = os.path.join(self.queue_dir, self.key + '.job')
+        os.rename(job_path, os.path.join(self.queue_dir, self.key + '.claimed-1'))
+        assert_equals([], self.queue.pending())
+
+        self.queue._running.discard(self.key)
+        self.queue.replay()
+        assert_false(has_default_thumbs(self.media))
+        assert_equals([], self._queued_files())
+
+    def test_can_process_jobs_in_worker_processes(self):
+        self.queue.workers = 1
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        self.queue.join()
+        assert_false(has_default_thumbs(self.media))
+        assert_equals([], self._queued_files())
+
+
+    def test_purges_cached_pages_of_item_when_job_is_done(self):
+        page_cache = PageCache(app_globals.cache)
+        self.queue.page_cache = page_cache
+        tag = 'media:%d' % self.media.id
+        page_cache.purge(tag)
+        token = page_cache._tags().get(tag)
+
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        assert_not_equals(token, page_cache._tags().get(tag))
+
+    def test_creates_worker_pool_only_when_needed(self):
+        self.queue.workers = 1
+        self.queue._running.add(self.key)
+        queue_thumbs_for(self.media, self._image(), u'foo.jpg')
+        job_path = os.path.join(self.queue_dir, self.key + '.job')
+        os.rename(job_path, os.path.join(self.queue_dir, self.key + '.claimed-1'))
+        self.queue._running.discard(self.key)
+
+        # jobs of previous processes are replayed before a prefork server
+        # forks so the pool must not be created there
+        self.queue.replay()
+        assert_none(self.queue._pool)
+        assert_false(has_default_thumbs(self.media))
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ThumbnailQueueTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code in this file is dual licensed under the MIT license or
+# the GPLv3 or (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.view_counter import BufferedViewCounter
+from mediadrop.model import DBSession, Media
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+class BufferedViewCounterTest(DBTestCase):
+    def setUp(self):
+        super(BufferedViewCounterTest, self).setUp()
+        self.media = Media.example()
+        self.other = Media.example(title=u'Bar Media')
+        DBSession.commit()
+        self.spool_dir = os.path.join(self.env_dir, 'views')
+        self.counter = self._counter()
+
+    def _counter(self, **kwargs):
+        kwargs.setdefault('flush_interval', 3600)
+        kwargs.setdefault('flush_size', 100)
+        kwargs.setdefault('spool_dir', self.spool_dir)
+        return BufferedViewCounter(**kwargs)
+
+    def _views(self, media):
+        DBSession.expire_all()
+        return DBSession.query(Media).get(media.id).views
+
+    def test_buffers_views_until_flush(self):
+        self.counter.record(self.media.id)
+        self.counter.record(self.media.id)
+        self.counter.record(self.other.id)
+        assert_equals(0, self._views(self.media))
+        assert_equals(3, self.counter.pending)
+
+        assert_equals(3, self.counter.flush())
+        assert_equals(2, self._views(self.media))
+        assert_equals(1, self._views(self.other))
+        assert_equals(dict(buffered=3, flushed=3, dropped=0, pending=0),
+            self.counter.stats())
+
+    def test_does_not_change_modification_time(self):
+        modified_on = self.media.modified_on
+        self.counter.record(self.media.id)
+        self.counter.flush()
+        DBSession.expire_all()
+        assert_equals(modified_on, Media.query.get(self.media.id).modified_on)
+
+    def test_discards_views_of_deleted_media(self):
+        self.counter.record(self.media.id)
+        self.counter.record(self.other.id)
+        deleted_id = self.other.id
+        DBSession.delete(self.other)
+        DBSession.commit()
+
+        assert_equals(1, self.counter.flush())
+        assert_equals(1, self._views(self.media))
+        assert_equals(0, self.counter.pending)
+
+    def test_flushes_automatically_when_size_threshold_is_reached(self):
+        self.counter = self._counter(flush_size=2)
+        self.counter.record(self.media.id)
+        assert_equals(0, self._views(self.media))
+
+        self.counter.record(self.media.id)
+        assert_equals(2, self._views(self.media))
+        assert_equals(0, self.counter.pending)
+
+    def test_flushes_automatically_when_interval_is_over(self):
+        self.counter = self._counter(flush_interval=30)
+        self.counter._now = lambda: self.counter._last_flush + 31
+        self.counter.record(self.media.id)
+        assert_equals(1, self._views(self.media))
+
+    def test_writes_every_view_if_buffering_is_disabled(self):
+        self.counter = self._counter(enabled=False)
+        self.counter.record(self.media.id)
+        assert_equals(1, self._views(self.media))
+
+    def test_drops_views_if_buffer_is_full(self):
+        self.counter = self._counter(max_buffered=2)
+        for i in range(3):
+            self.counter.record(self.media.id)
+        assert_equals(2, self.counter.pending)
+        assert_equals(1, self.counter.dropped)
+
+    def test_notifies_observers_after_flush(self):
+        flushed_deltas = []
+        observer = observes(events.ViewCounter.flushed)(flushed_deltas.append)
+        try:
+            self.counter.record(self.media.id, views=3)
+            self.counter.flush()
+        finally:
+            events.ViewCounter.flushed.post_observers.remove(observer)
+        assert_equals([{self.media.id: 3}], flushed_deltas)
+
+    def test_can_spool_and_replay_pending_views(self):
+        self.counter.record(self.media.id)
+        self.counter.record(self.other.id, views=2)
+        spool_file = self.counter.spool()
+        assert_true(os.path.exists(spool_file))
+        assert_equals(0, self.counter.pending)
+
+        restarted_counter = self._counter()
+        assert_equals(3, restarted_counter.replay_spool())
+        assert_false(os.path.exists(spool_file))
+        # written at once, forked workers must not inherit the views
+        assert_equals(0, restarted_counter.pending)
+        assert_equals(1, self._views(self.media))
+        assert_equals(2, self._views(self.other))
+
+        # spooled views must not be replayed twice
+        assert_equals(0, self._counter().replay_spool())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BufferedViewCounterTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+import os
+import sqlite3
+
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.lib.view_dedup import (SQLiteViewStore, TimeSlicedSet,
+    ViewAuditLog, ViewDeduplicator)
+from mediadrop.model import DBSession, Media, Views_Counter
+
+
+class TimeSlicedSetTest(PythonicTestCase):
+    def test_drops_keys_after_ttl(self):
+        keys = TimeSlicedSet(ttl=3600, slices=12)
+        now = [36000.0]
+        keys._now = lambda: now[0]
+        keys.add(1)
+        now[0] += 3000
+        keys.add(2)
+        assert_equals((True, True, 2), (1 in keys, 2 in keys, len(keys)))
+
+        now[0] += 900
+        assert_equals((False, True, 1), (1 in keys, 2 in keys, len(keys)))
+
+
+class ViewDeduplicatorTest(DBTestCase):
+    def setUp(self):
+        super(ViewDeduplicatorTest, self).setUp()
+        self.media = Media.example()
+        DBSession.commit()
+        self.db_path = os.path.join(self.env_dir, 'views', 'dedup.sqlite')
+
+    def test_counts_view_once_after_page_view(self):
+        dedup = ViewDeduplicator()
+        assert_false(dedup.claim(self.media.id, u'visitor'))
+
+        dedup.page_viewed(self.media.id, u'visitor')
+        assert_true(dedup.claim(self.media.id, u'visitor'))
+        assert_false(dedup.claim(self.media.id, u'visitor'))
+        assert_false(dedup.claim(self.media.id, u'other visitor'))
+
+    def test_shares_views_between_processes(self):
+        worker1 = ViewDeduplicator(store=SQLiteViewStore(self.db_path))
+        worker2 = ViewDeduplicator(store=SQLiteViewStore(self.db_path))
+        worker1.page_viewed(self.media.id, u'visitor')
+        assert_true(worker2.claim(self.media.id, u'visitor'))
+        assert_false(worker1.claim(self.media.id, u'visitor'))
+
+    def test_page_view_keeps_counted_view(self):
+        worker1 = ViewDeduplicator(store=SQLiteViewStore(self.db_path))
+        worker2 = ViewDeduplicator(store=SQLiteViewStore(self.db_path))
+        worker1.page_viewed(self.media.id, u'visitor')
+        assert_true(worker1.claim(self.media.id, u'visitor'))
+        worker2.page_viewed(self.media.id, u'visitor')
+        assert_false(worker2.claim(self.media.id, u'visitor'))
+
+    def test_uses_process_state_if_store_is_locked(self):
+        store = SQLiteViewStore(self.db_path, timeout=0.01)
+        dedup = ViewDeduplicator(store=store)
+        store._connection()
+        other = sqlite3.connect(self.db_path, isolation_level=None)
+        other.execute('BEGIN EXCLUSIVE')
+        try:
+            dedup.page_viewed(self.media.id, u'visitor')
+            assert_true(dedup.claim(self.media.id, u'visitor'))
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+
+    def test_writes_counted_views_to_audit_log_in_batches(self):
+        dedup = ViewDeduplicator(audit=ViewAuditLog(batch_size=2))
+        for token in (u'first', u'second', u'third'):
+            dedup.page_viewed(self.media.id, token)
+            dedup.claim(self.media.id, token)
+        rows = Views_Counter.query.filter(Views_Counter.media_id == self.media.id)
+        assert_equals(2, rows.count())
+
+        dedup.shutdown()
+        assert_equals(3, rows.count())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimeSlicedSetTest))
+    suite.addTest(unittest.makeSuite(ViewDeduplicatorTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
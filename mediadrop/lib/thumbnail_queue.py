@@ -0,0 +1,283 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Background thumbnail generation.
+
+Decoding and resizing large images (and downloading remote thumbnails) is too
+slow to do within a request. :func:`mediadrop.lib.thumbnails.queue_thumbs_for`
+stores the image in a local job queue instead and the thumbnails are created
+by a pool of worker processes. Until a job is done the previous thumbnails
+(or copies of the default thumbnails) are served.
+
+Every job is a JSON file named after the item (e.g. ``media-42.job``) so there
+is at most one pending job per item: a newer image simply replaces the pending
+job. Jobs are claimed by renaming the job file so jobs which were queued (or
+claimed) by a process which exited are picked up again on the next start (see
+:meth:`ThumbnailQueue.replay`).
+
+The queue is optional: without ``thumbs.workers`` or ``thumbs.queue_dir``
+thumbnails are created synchronously within the request.
+"""
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from urllib2 import urlopen
+
+from paste.deploy.converters import asint
+
+from mediadrop.lib.page_cache import MEDIA_LISTINGS, tag_for
+
+__all__ = ['ThumbnailQueue']
+
+log = logging.getLogger(__name__)
+
+class ThumbnailQueue(object):
+    """Persistent queue of thumbnail jobs processed by a process pool.
+
+    :param queue_dir: Directory where jobs and the source images are stored.
+    :param workers: Number of worker processes. With ``0`` jobs are
+        processed in the current process as soon as they are queued.
+    :param metrics: Optional :class:`~mediadrop.lib.metrics.MetricsRegistry`
+        which records the time from dispatching a job until it is done.
+    :param page_cache: Optional :class:`~mediadrop.lib.page_cache.PageCache`
+        whose pages of the item are purged when a job is done.
+    :param fragment_cache: Optional
+        :class:`~mediadrop.lib.fragments.FragmentCache` which is cleared when
+        a job is done.
+    """
+    def __init__(self, queue_dir, workers=2, metrics=None, page_cache=None,
+                 fragment_cache=None):
+        self.queue_dir = queue_dir
+        self.workers = workers
+        self.metrics = metrics
+        self.page_cache = page_cache
+        self.fragment_cache = fragment_cache
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._running = set()
+
+    @classmethod
+    def from_config(cls, config, metrics=None, page_cache=None,
+                    fragment_cache=None):
+        """Return the configured queue or None if neither
+        ``thumbs.workers`` nor ``thumbs.queue_dir`` is set (thumbnails are
+        created synchronously then)."""
+        workers = asint(config.get('thumbs.workers', 0))
+        queue_dir = config.get('thumbs.queue_dir', None)
+        if not (workers or queue_dir):
+            return None
+        if queue_dir is None and config.get('pylons.cache_dir'):
+            queue_dir = os.path.join(config['pylons.cache_dir'], 'thumbs')
+        if not queue_dir:
+            return None
+        return cls(queue_dir, workers=workers, metrics=metrics,
+            page_cache=page_cache, fragment_cache=fragment_cache)
+
+    def _path(self, key, ext='job'):
+        return os.path.join(self.queue_dir, '%s.%s' % (key, ext))
+
+    def _claimed_path(self, key):
+        return self._path(key, ext='claimed-%d' % os.getpid())
+
+    def pending(self):
+        """Return the keys of all jobs which were not claimed yet."""
+        paths = glob.glob(os.path.join(self.queue_dir, '*.job'))
+        return sorted(os.path.basename(path)[:-len('.job')] for path in paths)
+
+    def enqueue(self, item, targets, image_file=None, backup_path=None, url=None):
+        """Queue a job to create the thumbnails for ``item``.
+
+        :param item: A Media or Podcast object.
+        :param targets: A list of ``(path, (width, height))`` tuples, see
+            :func:`mediadrop.lib.thumbnails.render_thumbs`.
+        :param image_file: An open file handle for the original image file
+            (will be closed).
+        :param backup_path: Where to store a copy of the original image.
+        :param url: Download the image from this URL instead of using
+            ``image_file``.
+        """
+        if not os.path.exists(self.queue_dir):
+            os.makedirs(self.queue_dir)
+        key = '%s-%s' % (item._thumb_dir, item.id)
+        job = dict(key=key, tag=tag_for(item), targets=targets,
+            backup_path=backup_path, url=url, source=None)
+        if image_file is not None:
+            fd, job['source'] = tempfile.mkstemp(prefix=key + '-',
+                suffix='.src', dir=self.queue_dir)
+            with os.fdopen(fd, 'wb') as source_fp:
+                image_file.seek(0)
+                shutil.copyfileobj(image_file, source_fp)
+            image_file.close()
+
+        with self._lock:
+            replaced_job = _read_job(self._path(key))
+            _write_job(self._path(key), job)
+            if replaced_job is not None:
+                _remove(replaced_job['source'])
+        self.dispatch(key)
+
+    def dispatch(self, key, synchronous=False):
+        """Claim the pending job for ``key`` and hand it to a worker (or
+        process it right away if ``synchronous`` is set).
+
+        Nothing happens if a job for the same item is running already: the
+        pending job is dispatched as soon as the running job finished.
+        """
+        with self._lock:
+            if key in self._running:
+                return
+            claimed_path = self._claimed_path(key)
+            try:
+                os.rename(self._path(key), claimed_path)
+            except OSError:
+                # claimed by another process already
+                return
+            job = _read_job(claimed_path)
+            if job is None:
+                return
+            self._running.add(key)
+            started = time.time()
+            if (self.workers > 0) and not synchronous:
+                callback = lambda error: self._job_done(job, claimed_path, error, started)
+                self._worker_pool().apply_async(process_job, (job,), callback=callback)
+                return
+        self._job_done(job, claimed_path, process_job(job), started)
+
+    def _worker_pool(self):
+        # the pool is created by the process which uses it: a pool created
+        # before a prefork server forks would not work in the children
+        if (self._pool is None) or (self._pool_pid != os.getpid()):
+            self._pool = multiprocessing.Pool(self.workers)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _job_done(self, job, claimed_path, error, started):
+        key = job['key']
+        if error:
+            log.error('unable to create thumbnails for %s:\n%s', key, error)
+        if self.metrics is not None:
+            self.metrics['mediadrop_thumbnail_job_duration_seconds'].observe(
+                time.time() - started, result=error and 'error' or 'ok')
+        _remove(job['source'])
+        _remove(claimed_path)
+        if not error:
+            self._purge_caches(job)
+        with self._lock:
+            self._running.discard(key)
+        if os.path.exists(self._path(key)):
+            self.dispatch(key)
+
+    def _purge_caches(self, job):
+        # pages and fragments of the item were rendered while the default
+        # thumbnails were served
+        if (self.page_cache is not None) and job.get('tag'):
+            self.page_cache.purge(job['tag'], MEDIA_LISTINGS)
+        if self.fragment_cache is not None:
+            self.fragment_cache.clear()
+
+    def replay(self):
+        """Process all jobs left over by previous processes.
+
+        The jobs are processed synchronously: ``make_app`` calls this before
+        a prefork server forks its workers so no worker pool may be created.
+        """
+        if not os.path.exists(self.queue_dir):
+            return
+        for claimed_path in glob.glob(os.path.join(self.queue_dir, '*.claimed-*')):
+            key = os.path.basename(claimed_path).rsplit('.', 1)[0]
+            job_path = self._path(key)
+            with self._lock:
+                if key in self._running:
+                    continue
+                if os.path.exists(job_path):
+                    # a newer job replaces the interrupted one
+                    job = _read_job(claimed_path)
+                    _remove(job and job['source'])
+                    _remove(claimed_path)
+                else:
+                    _rename(claimed_path, job_path)
+        for key in self.pending():
+            self.dispatch(key, synchronous=True)
+
+    def join(self):
+        """Wait until all dispatched jobs are done."""
+        if self._pool_pid != os.getpid():
+            return
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def shutdown(self):
+        """Stop the worker processes. Interrupted jobs stay claimed and will
+        be replayed by the next process."""
+        if (self._pool is not None) and (self._pool_pid == os.getpid()):
+            self._pool.terminate()
+            self._pool = None
+
+
+def process_job(job):
+    """Create the thumbnails for the given job.
+
+    Runs in the worker processes so this function must not depend on the
+    Pylons configuration. Returns a formatted traceback if the job failed.
+    """
+    from mediadrop.lib.thumbnails import render_thumbs
+    source = job['source']
+    try:
+        if job['url']:
+            fd, source = tempfile.mkstemp(suffix='.src',
+                dir=os.path.dirname(job['targets'][0][0]))
+            with os.fdopen(fd, 'wb') as source_fp:
+                remote_fp = urlopen(job['url'])
+                shutil.copyfileobj(remote_fp, source_fp)
+                remote_fp.close()
+        render_thumbs(source, [(path, tuple(xy)) for path, xy in job['targets']])
+        if job['backup_path']:
+            shutil.copyfile(source, job['backup_path'])
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        if job['url']:
+            _remove(source)
+    return None
+
+def _read_job(path):
+    try:
+        with open(path, 'rb') as job_fp:
+            return json.load(job_fp)
+    except (IOError, ValueError):
+        return None
+
+def _write_job(path, job):
+    fd, tmp_path = tempfile.mkstemp(prefix='.job-', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as job_fp:
+        json.dump(job, job_fp)
+    os.rename(tmp_path, path)
+
+def _rename(path, new_path):
+    try:
+        os.rename(path, new_path)
+    except OSError:
+        pass
+
+def _remove(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
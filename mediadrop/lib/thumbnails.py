@@ -9,19 +9,21 @@ import filecmp
 import os
 import re
 import shutil
+from cStringIO import StringIO
+from urllib2 import urlopen
 
 from PIL import Image
 # XXX: note that pylons.url is imported here. Make sure to only use it with
 #      absolute paths (ie. those starting with a /) to avoid differences in
 #      behavior from mediadrop.lib.helpers.url_for
-from pylons import config, url as url_for
+from pylons import app_globals, config, url as url_for
 
 import mediadrop
 from mediadrop.lib.util import delete_files
 
 __all__ = [
     'create_default_thumbs_for', 'create_thumbs_for', 'delete_thumbs',
-    'has_thumbs', 'has_default_thumbs',
+    'has_thumbs', 'has_default_thumbs', 'queue_thumbs_for', 'render_thumbs',
     'ThumbDict', 'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
 ]
 
@@ -198,8 +200,51 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
 
     return img.resize(size, filter)
 
+def render_thumbs(image_file, targets, filter=Image.ANTIALIAS):
+    """Create thumbnails in several sizes from one decoding of the image.
+
+    This function does not depend on the Pylons configuration so it can be
+    used in worker processes (see :mod:`mediadrop.lib.thumbnail_queue`).
+
+    :param image_file: A path or an open file handle for the image.
+    :param targets: A list of ``(path, (width, height))`` tuples.
+    """
+    img = Image.open(image_file)
+    max_x = max([xy[0] for path, xy in targets])
+    max_y = max([xy[1] for path, xy in targets])
+    # Let the (JPEG) decoder scale the image down by 1/2, 1/4 or 1/8 while
+    # decoding as long as it stays larger than the largest thumbnail. This is
+    # a no-op for other image formats.
+    img.draft(img.mode, (max_x, max_y))
+    img.load()
+
+    # TODO: Allow other formats?
+    for path, xy in targets:
+        thumb_img = resize_thumb(img, xy, filter=filter)
+        if thumb_img.mode != "RGB":
+            thumb_img = thumb_img.convert("RGB")
+        thumb_img.save(path, quality=90)
+
 _ext_filter = re.compile(r'^\.([a-z0-9]*)')
 
+def thumb_targets(item):
+    """Return a list of ``(path, (width, height))`` tuples for all thumbnail
+    sizes of the given item (see :func:`render_thumbs`)."""
+    image_dir, item_id = _normalize_thumb_item(item)
+    return [(thumb_path(item, key), xy)
+            for key, xy in config['thumb_sizes'][image_dir].iteritems()]
+
+def backup_path_for(item, image_filename):
+    """Return the path for the backup of the original image (or None if the
+    filename has no usable extension)."""
+    # Ensure there's no odd chars in the ext. Thumbs from DailyMotion include
+    # an extra query string that needs to be stripped off here.
+    ext = os.path.splitext(image_filename)[1].lower()
+    ext_match = _ext_filter.match(ext)
+    if not ext_match:
+        return None
+    return thumb_path(item, 'orig', ext=ext_match.group(1))
+
 def create_thumbs_for(item, image_file, image_filename):
     """Creates thumbnails in all sizes for a given Media or Podcast object.
 
@@ -214,31 +259,48 @@ def create_thumbs_for(item, image_file, image_filename):
     :param image_filename: The original filename of the thumbnail image.
     :type image_filename: unicode
     """
-    image_dir, item_id = _normalize_thumb_item(item)
-    img = Image.open(image_file)
-
-    # TODO: Allow other formats?
-    for key, xy in config['thumb_sizes'][item._thumb_dir].iteritems():
-        path = thumb_path(item, key)
-        thumb_img = resize_thumb(img, xy)
-        if thumb_img.mode != "RGB":
-            thumb_img = thumb_img.convert("RGB")
-        thumb_img.save(path, quality=90)
+    render_thumbs(image_file, thumb_targets(item))
 
-    # Backup the original image, ensuring there's no odd chars in the ext.
-    # Thumbs from DailyMotion include an extra query string that needs to be
-    # stripped off here.
-    ext = os.path.splitext(image_filename)[1].lower()
-    ext_match = _ext_filter.match(ext)
-    if ext_match:
-        backup_type = ext_match.group(1)
-        backup_path = thumb_path(item, 'orig', ext=backup_type)
+    # Backup the original image
+    backup_path = backup_path_for(item, image_filename)
+    if backup_path:
         backup_file = open(backup_path, 'w+b')
         image_file.seek(0)
         shutil.copyfileobj(image_file, backup_file)
         image_file.close()
         backup_file.close()
 
+def queue_thumbs_for(item, image_file=None, image_filename=None, url=None):
+    """Create thumbnails for the given item in a background worker.
+
+    The image type is checked right away (so unsupported images still raise
+    an IOError like :func:`create_thumbs_for`). Until the worker is done the
+    current thumbnails (or copies of the default thumbnails) are served.
+
+    If no thumbnail queue is configured, the thumbnails are created
+    synchronously.
+
+    :param item: A Media or Podcast object.
+    :param image_file: An open file handle for the original image file.
+    :param image_filename: The original filename of the thumbnail image.
+    :param url: Download the image from this URL (in the worker) instead.
+    """
+    queue = getattr(app_globals._current_obj(), 'thumbnail_queue', None)
+    if queue is None:
+        if url is not None:
+            image_file = StringIO(urlopen(url).read())
+            image_filename = os.path.basename(url)
+        return create_thumbs_for(item, image_file, image_filename)
+
+    if image_file is not None:
+        # only reads the header, raises IOError for unsupported files
+        Image.open(image_file)
+        image_file.seek(0)
+    if not has_thumbs(item):
+        create_default_thumbs_for(item)
+    queue.enqueue(item, thumb_targets(item), image_file=image_file,
+        backup_path=backup_path_for(item, image_filename or url), url=url)
+
 def create_default_thumbs_for(item):
     """Create copies of the default thumbs for the given item.
 
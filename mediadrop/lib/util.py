@@ -12,20 +12,26 @@ import math
 import os
 import shutil
 from datetime import datetime
+from urllib import quote
 from urlparse import urlparse
 
-from pylons import app_globals, config, request, url as pylons_url
+from pylons import app_globals, config, request, translator, url as pylons_url
 from webob.exc import HTTPFound
 
 __all__ = [
     'calculate_popularity',
+    'current_locale',
     'current_url',
     'delete_files',
     'merge_dicts',
     'redirect',
+    'request_base',
+    'request_cache',
     'url',
     'url_for',
     'url_for_media',
+    'url_template',
+    'URLTemplate',
 ]
 
 def current_url(with_qs=True, qualified=True):
@@ -111,6 +117,80 @@ def _generate_url(url_func, *args, **kwargs):
 
     return url
 
+def request_cache(name):
+    """Return a dict which is kept until the end of the current request.
+
+    :param name: Unique name of the cache.
+    :returns: A dict or None (outside of a request).
+    """
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(request):
+        return None
+    return request.environ.setdefault('mediadrop.cache.' + name, {})
+
+def request_base():
+    """Return the parts of the current request which are used to build
+    qualified URLs (None outside of a request)."""
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(request):
+        return None
+    environ = request.environ
+    return (environ.get('wsgi.url_scheme'), environ.get('HTTP_HOST'),
+            environ.get('SCRIPT_NAME'))
+
+def current_locale():
+    """Return the locale of the current translator (None if there is no
+    translator)."""
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(translator):
+        return None
+    return str(getattr(translator, 'locale', ''))
+
+class URLTemplate(object):
+    """A URL generated by :func:`url_for` with placeholders for some
+    arguments which can be filled without another Routes generation.
+
+    Values are quoted the same way Routes quotes path arguments.
+    """
+    def __init__(self, url, markers):
+        template = url.replace('%', '%%')
+        for name, marker in markers.items():
+            template = template.replace(marker, '%%(%s)s' % name)
+        self.template = template
+
+    def __call__(self, **values):
+        def quoted(value):
+            if not isinstance(value, basestring):
+                value = unicode(value)
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            return quote(value, '/')
+        return self.template % dict((name, quoted(value))
+                                    for name, value in values.items())
+
+def url_template(names, **kwargs):
+    """Return an :class:`URLTemplate` for ``url_for(**kwargs)`` where the
+    arguments listed in ``names`` are placeholders.
+
+    Generating URLs with Routes is slow so code which needs many similar URLs
+    (e.g. one for each media file in a feed) should use a template. Templates
+    depend on the request (host, script name) so they are cached per request.
+    """
+    cache = request_cache('url_templates')
+    key = (tuple(names), tuple(sorted(kwargs.items())))
+    template = None
+    if cache is not None:
+        template = cache.get(key)
+    if template is None:
+        # numeric markers with the same length satisfy requirements like
+        # '\d+' and no marker is part of another one
+        markers = dict((name, '31415926%02d' % i) for i, name in enumerate(names))
+        kwargs.update(markers)
+        template = URLTemplate(url_for(**kwargs), markers)
+        if cache is not None:
+            cache[key] = template
+    return template
+
 def redirect(*args, **kwargs):
     """Compose a URL using :func:`url_for` and raise a redirect.
 
@@ -180,9 +260,10 @@ def calculate_popularity(publish_date, score):
     :returns: Popularity points.
 
     """
-    settings = request.settings
-    log_base = int(settings['popularity_decay_exponent'])
-    base_life = int(settings['popularity_decay_lifetime']) * 3600
+    from mediadrop.model.settings_snapshot import current_settings
+    settings = current_settings()
+    log_base = settings.as_int('popularity_decay_exponent', 4)
+    base_life = settings.as_int('popularity_decay_lifetime', 36) * 3600
     # FIXME: The current algorithm assumes that the earliest publication
     #        date is January 1, 2000.
     if score > 0:
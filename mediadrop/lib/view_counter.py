@@ -0,0 +1,312 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Buffered, write-behind view counting.
+
+Incrementing ``media.views`` with one UPDATE (and one COMMIT) per playback
+turns popular media rows into lock hotspots. Instead views are aggregated in
+process and written as one batched UPDATE per flush, either when the flush
+interval elapsed or when enough views were buffered. A timer thread (started
+by the first view in each worker process, i.e. after a prefork server forked)
+flushes the buffer of idle workers.
+
+Pending deltas are written to a spool directory on shutdown or when the
+database is not available. Spool files are written to the database by the
+next process which starts up (before it forks any workers) so a worker restart
+loses at most one flush window (only a hard crash can lose buffered views).
+"""
+
+from collections import defaultdict
+import glob
+import logging
+import os
+import threading
+import time
+
+from paste.deploy.converters import asbool, asint
+from sqlalchemy import sql
+
+from mediadrop.plugin import events
+
+
+__all__ = ['BufferedViewCounter']
+
+log = logging.getLogger(__name__)
+
+class BufferedViewCounter(object):
+    """Aggregate media views in memory and flush them in batches.
+
+    :param flush_interval: Maximum number of seconds views are kept in the
+        buffer before they are written to the database.
+    :param flush_size: Flush as soon as this many views were buffered.
+    :param max_buffered: Upper limit for buffered views (e.g. while the
+        database is down). Additional views are counted as dropped.
+    :param spool_dir: Optional directory to persist pending views on shutdown
+        or when a flush failed.
+    :param engine: The SQLAlchemy engine to use. Defaults to the engine bound
+        to the MediaDrop metadata.
+    :param enabled: If False every view is written to the database directly.
+    :param statistics: Optional
+        :class:`mediadrop.model.view_stats.ViewStatistics` instance which
+        records the views in time buckets within the same transaction.
+    """
+    def __init__(self, flush_interval=30, flush_size=500, max_buffered=100000,
+                 spool_dir=None, engine=None, enabled=True, statistics=None):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_buffered = max_buffered
+        self.spool_dir = spool_dir
+        self.enabled = enabled
+        self.statistics = statistics
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_count = 0
+        self._last_flush = self._now()
+        self._timer_pid = None
+        self._stopped = threading.Event()
+
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_config(cls, config):
+        from mediadrop.model.view_stats import ViewStatistics
+        spool_dir = config.get('views.spool_dir', None)
+        if spool_dir is None and config.get('pylons.cache_dir'):
+            spool_dir = os.path.join(config['pylons.cache_dir'], 'views')
+        return cls(
+            flush_interval=asint(config.get('views.flush_interval', 30)),
+            flush_size=asint(config.get('views.flush_size', 500)),
+            max_buffered=asint(config.get('views.max_buffered', 100000)),
+            spool_dir=spool_dir or None,
+            enabled=asbool(config.get('views.buffered', True)),
+            statistics=ViewStatistics.from_config(config),
+        )
+
+    def _now(self):
+        return time.time()
+
+    @property
+    def engine(self):
+        if self._engine is not None:
+            return self._engine
+        from mediadrop.model.meta import metadata
+        return metadata.bind
+
+    @property
+    def pending(self):
+        """The number of views which were not written to the database yet."""
+        return self._pending_count
+
+    def stats(self):
+        """Return the counters for buffered, flushed, dropped and pending views."""
+        return dict(
+            buffered=self.buffered,
+            flushed=self.flushed,
+            dropped=self.dropped,
+            pending=self._pending_count,
+        )
+
+    def record(self, media_id, views=1):
+        """Record ``views`` new views for the media with the given ID.
+
+        The views are written to the database later on (see :meth:`flush`)
+        unless buffering is disabled.
+        """
+        media_id = int(media_id)
+        with self._lock:
+            if self._pending_count + views > self.max_buffered:
+                self.dropped += views
+                log.warning('view buffer is full, dropping %d view(s) for media %d',
+                    views, media_id)
+                return
+            self._pending[media_id] += views
+            self._pending_count += views
+            self.buffered += views
+        if self.should_flush():
+            self.flush()
+        elif self._timer_pid != os.getpid():
+            self._start_timer()
+
+    def _start_timer(self):
+        # threads do not survive a fork so every process starts its own timer
+        with self._lock:
+            if self._timer_pid == os.getpid():
+                return
+            self._timer_pid = os.getpid()
+        timer = threading.Thread(target=self._flush_periodically,
+            name='view-counter-flush')
+        timer.daemon = True
+        timer.start()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(max(self.flush_interval, 1)):
+            if self.should_flush():
+                self.flush()
+
+    def should_flush(self):
+        if not self.enabled:
+            return self._pending_count > 0
+        if self._pending_count >= self.flush_size:
+            return True
+        is_interval_over = (self._now() - self._last_flush) >= self.flush_interval
+        return is_interval_over and (self._pending_count > 0)
+
+    def _take_pending(self):
+        with self._lock:
+            deltas = dict(self._pending)
+            self._pending = defaultdict(int)
+            self._pending_count = 0
+            self._last_flush = self._now()
+        return deltas
+
+    def _restore_pending(self, deltas):
+        with self._lock:
+            for media_id, views in deltas.items():
+                if self._pending_count + views > self.max_buffered:
+                    self.dropped += views
+                    continue
+                self._pending[media_id] += views
+                self._pending_count += views
+
+    def flush(self):
+        """Write all buffered views to the database.
+
+        All deltas are written with one (executemany) UPDATE statement in a
+        separate transaction so the flush does not interfere with the
+        transaction of the current request. If the database is not available
+        the views are kept in the buffer and retried on the next flush. Views
+        of media which were deleted in the meantime are discarded.
+
+        :returns: the number of views written to the database.
+        """
+        deltas = self._take_pending()
+        if not deltas:
+            return 0
+        try:
+            self._write_deltas(deltas)
+        except Exception:
+            log.exception('unable to flush %d buffered view(s)', sum(deltas.values()))
+            self._restore_pending(deltas)
+            return 0
+        nr_views = sum(deltas.values())
+        self.flushed += nr_views
+        events.ViewCounter.flushed(deltas)
+        return nr_views
+
+    def _write_deltas(self, deltas):
+        """Write the views, ``deltas`` of deleted media are removed (so they
+        are not restored if the write fails)."""
+        from mediadrop.model.media import media
+        update = media.update().\
+            where(media.c.id == sql.bindparam('media_id')).\
+            values({
+                media.c.views: media.c.views + sql.bindparam('delta'),
+                # views are no modification, modified_on is part of the
+                # player and fragment cache keys
+                media.c.modified_on: media.c.modified_on,
+            })
+        connection = self.engine.connect()
+        try:
+            transaction = connection.begin()
+            try:
+                # the statistics reference the media: a single deleted item
+                # would fail every flush of the (restored) deltas
+                existing_ids = set(row[0] for row in connection.execute(
+                    sql.select([media.c.id], media.c.id.in_(list(deltas)),
+                        for_update=True)))
+                for media_id in set(deltas) - existing_ids:
+                    del deltas[media_id]
+                if not deltas:
+                    transaction.commit()
+                    return
+                # bind parameter names must not clash with the column names.
+                params = [dict(media_id=media_id, delta=delta)
+                          for media_id, delta in sorted(deltas.items())]
+                connection.execute(update, params)
+                if self.statistics is not None:
+                    self.statistics.record(connection, deltas)
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+        finally:
+            connection.close()
+
+    # --- spooling -------------------------------------------------------------
+    def _spool_filename(self):
+        return os.path.join(self.spool_dir, 'views-%d.spool' % os.getpid())
+
+    def spool(self):
+        """Persist all pending views to the spool directory.
+
+        Used on shutdown when the database can not be reached anymore. Returns
+        the path of the spool file (or None if nothing was written).
+        """
+        if not self.spool_dir:
+            return None
+        deltas = self._take_pending()
+        if not deltas:
+            return None
+        if not os.path.exists(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        filename = self._spool_filename()
+        with open(filename, 'a') as spool_fp:
+            for media_id, views in sorted(deltas.items()):
+                spool_fp.write('%d %d\n' % (media_id, views))
+        return filename
+
+    def replay_spool(self):
+        """Write views spooled by previous processes to the database.
+
+        Each spool file is claimed with an atomic rename so that multiple
+        processes starting at the same time do not count views twice. The
+        views are written at once (views which can not be written are spooled
+        again): a prefork server calls this method before forking so the
+        workers must not inherit them in their buffers.
+        """
+        if (not self.spool_dir) or (not os.path.isdir(self.spool_dir)):
+            return 0
+        nr_views = 0
+        pattern = os.path.join(self.spool_dir, 'views-*.spool')
+        for filename in glob.glob(pattern):
+            claimed_filename = '%s.replay-%d' % (filename, os.getpid())
+            try:
+                os.rename(filename, claimed_filename)
+            except OSError:
+                # another process was faster
+                continue
+            deltas = defaultdict(int)
+            with open(claimed_filename, 'r') as spool_fp:
+                for line in spool_fp:
+                    try:
+                        media_id, views = [int(v) for v in line.split()]
+                    except ValueError:
+                        log.warning('ignoring invalid line in view spool %r: %r',
+                            filename, line)
+                        continue
+                    deltas[media_id] += views
+            self._restore_pending(deltas)
+            nr_views += sum(deltas.values())
+            os.remove(claimed_filename)
+        if nr_views:
+            self.flush()
+            self.spool()
+            log.info('replayed %d spooled view(s)', nr_views)
+        return nr_views
+
+    def shutdown(self):
+        """Flush all pending views, spool whatever could not be written."""
+        self._stopped.set()
+        self.flush()
+        try:
+            self.spool()
+        except Exception:
+            log.exception('unable to spool pending views')
+
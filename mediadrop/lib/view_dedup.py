@@ -0,0 +1,306 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+View Deduplication
+
+A view is counted once per media item and visitor within an hour: the media
+page registers the visitor (``MediaController.view``) and the player reports
+the start of the playback (``MediaController.final_view``). This used to be
+tracked with rows in the ``view_check`` table: every page view loaded all
+rows for the media item and every report queried the table again.
+
+:class:`ViewDeduplicator` keeps ``(media id, visitor token)`` pairs as 60 bit
+hashes in two :class:`TimeSlicedSet` instances (visitors which saw the page
+and views which were counted already). Expired keys are dropped a whole slice
+at a time so there is no per-key bookkeeping.
+
+Worker processes on the same host share their state through a
+:class:`SQLiteViewStore` (a small SQLite file in ``cache_dir``) so the page
+view and the playback report may be handled by different workers.
+
+``view_check`` is only written if ``views.audit`` is enabled: counted views
+are inserted in batches by :class:`ViewAuditLog`.
+"""
+
+from datetime import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals
+
+from mediadrop.lib.compat import md5, sha1
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['SQLiteViewStore', 'TimeSlicedSet', 'ViewAuditLog',
+    'ViewDeduplicator', 'view_key', 'visitor_token']
+
+log = logging.getLogger(__name__)
+
+def view_key(media_id, token):
+    """Return a 60 bit integer for the given media id and visitor token."""
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    return int(md5('%d:%s' % (int(media_id), token)).hexdigest()[:15], 16)
+
+def visitor_token(request):
+    """Return a token which identifies the visitor of the given request.
+
+    The ``csrftoken`` cookie is used if present, otherwise a hash of the
+    remote address and the user agent."""
+    token = request.cookies.get('csrftoken')
+    if token:
+        return token
+    environ = request.environ
+    return sha1('%s|%s' % (environ.get('REMOTE_ADDR', ''),
+        environ.get('HTTP_USER_AGENT', ''))).hexdigest()
+
+
+class TimeSlicedSet(object):
+    """A set of keys which were added within the last ``ttl`` seconds.
+
+    Keys are stored in ``slices`` sets, one per time slice of
+    ``ttl / slices`` seconds. A key expires (at most one slice) after ``ttl``
+    seconds when its slice is dropped.
+    """
+    def __init__(self, ttl=3600, slices=12):
+        self.ttl = ttl
+        self.slices = slices
+        self.slice_seconds = max(float(ttl) / slices, 1)
+        self._lock = threading.Lock()
+        self._slices = {}
+
+    def _now(self):
+        return time.time()
+
+    def _current_slice(self):
+        index = int(self._now() // self.slice_seconds)
+        oldest = index - self.slices
+        if [i for i in self._slices if i <= oldest]:
+            with self._lock:
+                for i in [i for i in self._slices if i <= oldest]:
+                    del self._slices[i]
+        return index
+
+    def add(self, key):
+        index = self._current_slice()
+        with self._lock:
+            self._slices.setdefault(index, set()).add(key)
+
+    def __contains__(self, key):
+        self._current_slice()
+        for keys in self._slices.values():
+            if key in keys:
+                return True
+        return False
+
+    def __len__(self):
+        self._current_slice()
+        return sum(len(keys) for keys in self._slices.values())
+
+
+class SQLiteViewStore(object):
+    """Share the page views and counted views of all worker processes on a
+    host in a SQLite database.
+
+    The store is only an optimization: if the database is locked for longer
+    than ``timeout`` seconds the caller gets a :class:`sqlite3.Error` and
+    falls back to its in-process state instead of blocking the request.
+
+    :param path: Path of the database file (created if needed).
+    :param ttl: Number of seconds a page view (or counted view) is kept.
+    :param timeout: Number of seconds to wait for a lock of another process.
+    """
+    def __init__(self, path, ttl=3600, timeout=0.05):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_purge = 0
+
+    def _now(self):
+        return time.time()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                isolation_level=None)
+            # readers do not block the writer (and vice versa) and commits
+            # are not synced to disk: losing the last views after a power
+            # failure only means that a few views are counted twice
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS views '
+                '(key INTEGER PRIMARY KEY, seen REAL, counted REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS views_seen '
+                'ON views (seen)')
+            self._local.connection = connection
+        return connection
+
+    def page_viewed(self, key):
+        now = self._now()
+        connection = self._connection()
+        # a single statement (and therefore a single write transaction)
+        # which keeps the time the view was counted
+        connection.execute('INSERT OR REPLACE INTO views (key, seen, counted) '
+            'VALUES (?, ?, (SELECT counted FROM views WHERE key = ?))',
+            (key, now, key))
+        self._purge(connection, now)
+
+    def claim(self, key):
+        """Mark the view as counted and return True if the page was viewed
+        but the view was not counted within the last ``ttl`` seconds."""
+        now = self._now()
+        cursor = self._connection().execute('UPDATE views SET counted = ? '
+            'WHERE key = ? AND seen >= ? AND (counted IS NULL OR counted < ?)',
+            (now, key, now - self.ttl, now - self.ttl))
+        return cursor.rowcount == 1
+
+    def _purge(self, connection, now):
+        if now < self._next_purge:
+            return
+        self._next_purge = now + min(self.ttl, 300)
+        connection.execute('DELETE FROM views WHERE seen < ? AND '
+            '(counted IS NULL OR counted < ?)', (now - self.ttl, now - self.ttl))
+
+
+class ViewAuditLog(object):
+    """Write counted views to the ``view_check`` table in batches.
+
+    :param batch_size: Write the buffered views as soon as this many views
+        were buffered (they are also written after every flush of the
+        :class:`~mediadrop.lib.view_counter.BufferedViewCounter`).
+    """
+    def __init__(self, batch_size=100, engine=None):
+        self.batch_size = batch_size
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._rows = []
+
+    @property
+    def engine(self):
+        if self._engine is not None:
+            return self._engine
+        from mediadrop.model.meta import metadata
+        return metadata.bind
+
+    def record(self, media_id, token):
+        with self._lock:
+            self._rows.append(dict(media_id=media_id, csrftoken=token,
+                validated=True, updated_date=datetime.now()))
+            is_full = len(self._rows) >= self.batch_size
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows = self._rows
+            self._rows = []
+        if not rows:
+            return 0
+        from mediadrop.model.media import views
+        try:
+            self.engine.execute(views.insert(), rows)
+        except Exception:
+            log.exception('unable to write %d view(s) to the audit log', len(rows))
+            return 0
+        return len(rows)
+
+
+class ViewDeduplicator(object):
+    """Count a view once per media item and visitor within ``ttl`` seconds.
+
+    :param ttl: Number of seconds a page view stays valid and a counted view
+        blocks further views of the same visitor.
+    :param slices: Number of time slices of the in-process sets.
+    :param store: Optional :class:`SQLiteViewStore` shared with other
+        processes.
+    :param audit: Optional :class:`ViewAuditLog`.
+    """
+    def __init__(self, ttl=3600, slices=12, store=None, audit=None):
+        self.ttl = ttl
+        self.store = store
+        self.audit = audit
+        self.seen = TimeSlicedSet(ttl, slices)
+        self.counted = TimeSlicedSet(ttl, slices)
+
+    @classmethod
+    def from_config(cls, config):
+        ttl = asint(config.get('views.dedup_ttl', 3600))
+        path = config.get('views.dedup_db', None)
+        if path is None and config.get('pylons.cache_dir'):
+            path = os.path.join(config['pylons.cache_dir'], 'views', 'dedup.sqlite')
+        audit = None
+        if asbool(config.get('views.audit', False)):
+            audit = ViewAuditLog(
+                batch_size=asint(config.get('views.audit_batch_size', 100)))
+        return cls(
+            ttl=ttl,
+            slices=asint(config.get('views.dedup_slices', 12)),
+            store=path and SQLiteViewStore(path, ttl=ttl,
+                timeout=asint(config.get('views.dedup_timeout_ms', 50)) / 1000.0)
+                or None,
+            audit=audit,
+        )
+
+    def page_viewed(self, media_id, token):
+        """Remember that the visitor opened the page of the media item."""
+        key = view_key(media_id, token)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        if self.store is not None:
+            try:
+                self.store.page_viewed(key)
+            except sqlite3.Error, e:
+                log.warning('unable to store page view: %s', e)
+
+    def claim(self, media_id, token):
+        """Return True if the view of the visitor should be counted (and mark
+        it as counted)."""
+        key = view_key(media_id, token)
+        if key in self.counted:
+            return False
+        is_new_view = key in self.seen
+        if self.store is not None:
+            try:
+                is_new_view = self.store.claim(key)
+            except sqlite3.Error, e:
+                log.warning('unable to claim view: %s', e)
+        if not is_new_view:
+            return False
+        self.counted.add(key)
+        if self.audit is not None:
+            self.audit.record(int(media_id), token)
+        return True
+
+    def shutdown(self):
+        """Write all buffered views of the audit log."""
+        if self.audit is not None:
+            self.audit.flush()
+
+
+def _current_deduplicator():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'view_dedup', None)
+
+@observes(events.ViewCounter.flushed)
+def _flush_audit_log(deltas):
+    deduplicator = _current_deduplicator()
+    if (deduplicator is not None) and (deduplicator.audit is not None):
+        deduplicator.audit.flush()
@@ -0,0 +1,57 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add media view stats
+
+time-bucketed view statistics which replace the views3..views24 columns (and
+the MySQL event which shifted these columns every three hours).
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: a47bd57dc2ab
+Revises: 4979e106cad8
+Create Date: 2026-10-18 10:12:31.440213
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a47bd57dc2ab'
+down_revision = '4979e106cad8'
+
+from alembic.op import (create_index, create_table, drop_column, drop_table,
+    get_bind)
+from sqlalchemy import Column, ForeignKey
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.types import DateTime, Integer
+
+# columns which were added by migrations.sql (only present in databases which
+# were set up with that script)
+OLD_VIEW_COLUMNS = ('views3', 'views6', 'views9', 'views12', 'views15',
+    'views18', 'views21', 'views24')
+
+
+def upgrade():
+    create_table('media_view_stats',
+        Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+            primary_key=True, autoincrement=False),
+        Column('bucket_start', DateTime, primary_key=True),
+        Column('views', Integer, default=0, nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    create_index('idx_mvs_bucket', 'media_view_stats',
+        ['bucket_start', 'media_id', 'views'])
+
+    bind = get_bind()
+    if bind.dialect.name == 'mysql':
+        bind.execute('DROP EVENT IF EXISTS update_media_views')
+    existing_columns = set(column['name'] for column in
+        Inspector.from_engine(bind).get_columns('media'))
+    for name in OLD_VIEW_COLUMNS:
+        if name in existing_columns:
+            drop_column('media', name)
+
+def downgrade():
+    drop_table('media_view_stats')
@@ -0,0 +1,38 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add media related
+
+precomputed related media ids (see mediadrop.model.related_media)
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: 5c2e8f1d9b3a
+Revises: a47bd57dc2ab
+Create Date: 2026-10-18 11:02:47.918355
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f1d9b3a'
+down_revision = 'a47bd57dc2ab'
+
+from alembic.op import create_table, drop_table
+from sqlalchemy import Column, ForeignKey
+from sqlalchemy.types import DateTime, Integer, UnicodeText
+
+
+def upgrade():
+    create_table('media_related',
+        Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+            primary_key=True, autoincrement=False),
+        Column('related_ids', UnicodeText, nullable=False),
+        Column('computed_on', DateTime, nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+
+def downgrade():
+    drop_table('media_related')
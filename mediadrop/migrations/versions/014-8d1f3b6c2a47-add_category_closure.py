@@ -0,0 +1,68 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add category closure
+
+closure table for the category hierarchy (see mediadrop.model.categories)
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: 8d1f3b6c2a47
+Revises: 5c2e8f1d9b3a
+Create Date: 2026-10-18 14:21:09.604113
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d1f3b6c2a47'
+down_revision = '5c2e8f1d9b3a'
+
+from alembic.op import create_index, create_table, drop_table, get_bind
+from sqlalchemy import Column, ForeignKey, MetaData, Table
+from sqlalchemy.types import Integer
+
+# -- table definition ---------------------------------------------------------
+metadata = MetaData()
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('parent_id', Integer),
+)
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, primary_key=True, autoincrement=False),
+    Column('descendant_id', Integer, primary_key=True, autoincrement=False),
+    Column('depth', Integer, nullable=False),
+)
+
+
+def add_closure_rows(connection):
+    parents = dict(tuple(row) for row in
+        connection.execute(categories.select()))
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth, seen = category_id, 0, set()
+        while ancestor_id in parents and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append(dict(ancestor_id=ancestor_id,
+                descendant_id=category_id, depth=depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    if rows:
+        connection.execute(category_closure.insert(), rows)
+
+def upgrade():
+    create_table('category_closure',
+        Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+            primary_key=True, autoincrement=False),
+        Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+            primary_key=True, autoincrement=False),
+        Column('depth', Integer, nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    create_index('idx_category_closure_descendant', 'category_closure',
+        ['descendant_id', 'depth', 'ancestor_id'])
+    add_closure_rows(get_bind())
+
+def downgrade():
+    drop_table('category_closure')
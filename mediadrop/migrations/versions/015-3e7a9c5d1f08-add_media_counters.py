@@ -0,0 +1,119 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add media counters
+
+counter columns for media/comment counts (see mediadrop.model.counters)
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: 3e7a9c5d1f08
+Revises: 8d1f3b6c2a47
+Create Date: 2026-10-18 15:40:12.331870
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e7a9c5d1f08'
+down_revision = '8d1f3b6c2a47'
+
+from datetime import datetime
+
+from alembic.op import add_column, drop_column, get_bind
+from sqlalchemy import Column, MetaData, sql, Table
+from sqlalchemy.types import Boolean, DateTime, Integer
+
+# -- table definition ---------------------------------------------------------
+metadata = MetaData()
+media = Table('media', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('podcast_id', Integer),
+    Column('reviewed', Boolean),
+    Column('encoded', Boolean),
+    Column('publishable', Boolean),
+    Column('publish_on', DateTime),
+    Column('publish_until', DateTime),
+    Column('comment_count', Integer),
+    Column('comment_count_published', Integer),
+    Column('comment_count_unreviewed', Integer),
+)
+comments = Table('comments', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('media_id', Integer),
+    Column('reviewed', Boolean),
+    Column('publishable', Boolean),
+)
+media_tags = Table('media_tags', metadata,
+    Column('media_id', Integer),
+    Column('tag_id', Integer),
+)
+media_categories = Table('media_categories', metadata,
+    Column('media_id', Integer),
+    Column('category_id', Integer),
+)
+
+def counted_table(name):
+    return Table(name, metadata,
+        Column('id', Integer, primary_key=True),
+        Column('media_count', Integer),
+        Column('media_count_published', Integer),
+    )
+tags = counted_table('tags')
+categories = counted_table('categories')
+podcasts = counted_table('podcasts')
+
+MEDIA_COUNTERS = ('media_count', 'media_count_published')
+COMMENT_COUNTERS = ('comment_count', 'comment_count_published',
+    'comment_count_unreviewed')
+
+
+def count(table, where):
+    return sql.select([sql.func.count(sql.text('*'))], where, from_obj=[table]).as_scalar()
+
+def update_media_counters(connection, table, where):
+    now = datetime.now()
+    published = sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on <= now,
+        sql.or_(media.c.publish_until == None, media.c.publish_until >= now),
+    )
+    connection.execute(table.update().values(
+        media_count=count(media, where),
+        media_count_published=count(media, sql.and_(where, published)),
+    ))
+
+def update_counters(connection):
+    update_media_counters(connection, tags, sql.and_(
+        media_tags.c.tag_id == tags.c.id, media_tags.c.media_id == media.c.id))
+    update_media_counters(connection, categories, sql.and_(
+        media_categories.c.category_id == categories.c.id,
+        media_categories.c.media_id == media.c.id))
+    update_media_counters(connection, podcasts, media.c.podcast_id == podcasts.c.id)
+    of_media = comments.c.media_id == media.c.id
+    connection.execute(media.update().values(
+        comment_count=count(comments, of_media),
+        comment_count_published=count(comments,
+            sql.and_(of_media, comments.c.publishable == True)),
+        comment_count_unreviewed=count(comments,
+            sql.and_(of_media, comments.c.reviewed == False)),
+    ))
+
+def upgrade():
+    for table_name in ('tags', 'categories', 'podcasts'):
+        for name in MEDIA_COUNTERS:
+            add_column(table_name,
+                Column(name, Integer, nullable=False, server_default='0'))
+    for name in COMMENT_COUNTERS:
+        add_column('media', Column(name, Integer, nullable=False, server_default='0'))
+    update_counters(get_bind())
+
+def downgrade():
+    for name in COMMENT_COUNTERS:
+        drop_column('media', name)
+    for table_name in ('tags', 'categories', 'podcasts'):
+        for name in MEDIA_COUNTERS:
+            drop_column(table_name, name)
@@ -0,0 +1,45 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add settings version
+
+version row which is checked by the settings snapshot of every process
+(see mediadrop.model.settings_snapshot)
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: 6b4d2e9a7c13
+Revises: 3e7a9c5d1f08
+Create Date: 2026-10-18 18:52:40.118305
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b4d2e9a7c13'
+down_revision = '3e7a9c5d1f08'
+
+from alembic.op import create_table, drop_table, get_bind
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.types import Integer
+
+# -- table definition ---------------------------------------------------------
+metadata = MetaData()
+settings_version = Table('settings_version', metadata,
+    Column('id', Integer, autoincrement=False, primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+
+def upgrade():
+    create_table('settings_version',
+        Column('id', Integer, autoincrement=False, primary_key=True),
+        Column('version', Integer, nullable=False, server_default='0'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    get_bind().execute(settings_version.insert().values(id=1, version=0))
+
+def downgrade():
+    drop_table('settings_version')
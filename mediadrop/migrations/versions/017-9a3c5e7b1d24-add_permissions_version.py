@@ -0,0 +1,45 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""add permissions version
+
+version row which is checked by the permission cache of every process
+(see mediadrop.lib.auth.permission_cache)
+
+added: 2026-10-18 (v0.11dev)
+
+Revision ID: 9a3c5e7b1d24
+Revises: 6b4d2e9a7c13
+Create Date: 2026-10-18 21:14:05.631207
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a3c5e7b1d24'
+down_revision = '6b4d2e9a7c13'
+
+from alembic.op import create_table, drop_table, get_bind
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.types import Integer
+
+# -- table definition ---------------------------------------------------------
+metadata = MetaData()
+permissions_version = Table('permissions_version', metadata,
+    Column('id', Integer, autoincrement=False, primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+
+def upgrade():
+    create_table('permissions_version',
+        Column('id', Integer, autoincrement=False, primary_key=True),
+        Column('version', Integer, nullable=False, server_default='0'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    get_bind().execute(permissions_version.insert().values(id=1, version=0))
+
+def downgrade():
+    drop_table('permissions_version')
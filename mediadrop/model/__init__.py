@@ -9,7 +9,6 @@
 import re
 
 import webob.exc
-from sqlalchemy import sql, orm
 from sqlalchemy.orm import class_mapper
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import bindparam, ClauseList, ColumnElement
@@ -35,6 +34,9 @@ def init_model(engine, table_prefix=None):
     from mediadrop.model import meta
     meta.metadata.bind = engine
     meta.engine = engine
+    # cached check for MySQL full text search (available as engine.fulltext)
+    from mediadrop.model.media import fulltext_capability
+    fulltext_capability(engine)
     # Change all table names to include the given prefix. This can't be
     # easily done before the models are added to the metadata because
     # that happens on import, before the config is available.
@@ -159,63 +161,6 @@ def get_available_slug(mapped_class, string, ignore=None, slug_attr='slug', slug
 
     return new_slug
 
-def _properties_dict_from_labels(*args):
-    """Produce a dictionary of mapper properties from the given args list.
-
-    Intended to make the process of producing lots of column properties
-    less verbose and painful.
-
-    """
-    properties_dict = {}
-    for property in args:
-        label = property.columns[0].name
-        properties_dict[label] = property
-    return properties_dict
-
-def _mtm_count_property(label, assoc_table,
-                        where=None, deferred=True, **kwargs):
-    """Return a column property for fetching the comment count for some object.
-
-    :param label:
-      A descriptive label for the correlated subquery. Should probably be the
-      same as the name of the property set on the mapper.
-
-    :param assoc_table:
-      The many-to-many table which associates the comments table to the parent
-      table. We expect the primary key to be two columns, one a foreign key to
-      comments, the other a foreign key to the parent table.
-
-    :param where:
-      Optional additional where clauses. If given a list, the elements are
-      wrapped in an AND clause.
-
-    :param deferred:
-      By default the count will be fetched when first accessed. To prefetch
-      during the initial query, use:
-        DBSession.query(ParentObject).options(undefer('comment_count_xyz'))
-    :type deferred: bool
-
-    :param \**kwargs:
-      Any additional arguments are passed to sqlalchemy.orm.column_property
-    """
-    where_clauses = []
-    for assoc_column in assoc_table.primary_key:
-        fk = tuple(assoc_column.foreign_keys)[0]
-        where_clauses.append(fk.column == assoc_column)
-    if isinstance(where, list):
-        where_clauses.extend(where)
-    elif where is not None:
-        where_clauses.append(where)
-
-    subselect = sql.select(
-        [sql.func.coalesce(sql.func.count(sql.text('*')), sql.text('0'))],
-        sql.and_(*where_clauses),
-    )
-    if label is not None:
-        subselect = subselect.label(label)
-
-    return orm.column_property(subselect, deferred=deferred, **kwargs)
-
 class MatchAgainstClause(ColumnElement):
     """
     A MySQL FULLTEXT Search Clause
@@ -250,6 +195,8 @@ __all__ = [
     'Podcast',
     'PlayerPrefs',
     'Views_Counter',
+    'ViewStatistics',
+    'RelatedMediaIndex',
 ]
 
 from mediadrop.model.auth import User, Group, Permission
@@ -262,3 +209,9 @@ from mediadrop.model.media import Media, MediaFile,Views_Counter
 from mediadrop.model.podcasts import Podcast
 from mediadrop.model.players import PlayerPrefs, players, cleanup_players_table
 from mediadrop.model.storage import storage
+from mediadrop.model.view_stats import ViewStatistics
+from mediadrop.model.related_media import RelatedMediaIndex
+# registers the observers which maintain the counter columns
+import mediadrop.model.counters
+# registers the observers which increment the settings version
+import mediadrop.model.settings_snapshot
@@ -62,6 +62,15 @@ permissions = Table('permissions', metadata,
     mysql_charset='utf8',
 )
 
+# incremented whenever a user, group or permission changes so the permission
+# caches of all processes notice (see mediadrop.lib.auth.permission_cache)
+permissions_version = Table('permissions_version', metadata,
+    Column('id', Integer, autoincrement=False, primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
 
 class User(object):
     """
@@ -238,6 +247,7 @@ mapper(
 
 mapper(
     Group, groups,
+    extension=events.MapperObserver(events.Group),
     properties={
         'users': relation(User, secondary=users_groups, backref='groups'),
     },
@@ -245,6 +255,7 @@ mapper(
 
 mapper(
     Permission, permissions,
+    extension=events.MapperObserver(events.Permission),
     properties={
         'groups': relation(Group,
             secondary=groups_permissions,
@@ -5,7 +5,7 @@
 # (at your option) any later version.
 # See LICENSE.txt in the main project directory, for more information.
 
-from sqlalchemy import Table, ForeignKey, Column
+from sqlalchemy import Table, ForeignKey, Column, Index, sql
 from sqlalchemy.types import Unicode, Integer
 from sqlalchemy.orm import mapper, relation, backref, validates, Query
 from sqlalchemy.orm.attributes import set_committed_value
@@ -21,10 +21,30 @@ categories = Table('categories', metadata,
     Column('name', Unicode(50), nullable=False, index=True),
     Column('slug', Unicode(SLUG_LENGTH), nullable=False, unique=True),
     Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    # counters maintained by mediadrop.model.counters
+    Column('media_count', Integer, default=0, nullable=False),
+    Column('media_count_published', Integer, default=0, nullable=False),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
 
+# Closure table: one row for every (ancestor, descendant) pair including a
+# row with depth 0 for each category itself. The rows are maintained by the
+# events.Category observers at the end of this module.
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, autoincrement=False),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, autoincrement=False),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+# ancestors of a category (ordered by depth)
+Index('idx_category_closure_descendant', category_closure.c.descendant_id,
+    category_closure.c.depth, category_closure.c.ancestor_id)
+
 class CategoryNestingException(Exception):
     pass
 
@@ -66,12 +86,11 @@ def populated_tree(cats):
 
     For example, printing the entire tree can be done with one query::
 
-        query = Category.query.options(undefer('media_count'))
-        for cat, depth in query.populated_tree().traverse():
+        for cat, depth in Category.query.populated_tree().traverse():
             print "    " * depth, cat.name, '(%d)' % cat.media_count
 
-    Without this method, especially with the media_count undeferred,
-    this would require a lot of extra queries for nested categories.
+    Without this method this would require a lot of extra queries for
+    nested categories.
 
     NOTE: If the tree contains circular nesting, the circular portion
           of the tree will be silently omitted from the results.
@@ -158,13 +177,10 @@ class Category(object):
     def ancestors(self):
         """Return a list of ancestors, starting with the root node.
 
-        This method is optimized for when all categories have already
-        been fetched in the current DBSession::
+        All ancestors are fetched with one query (using the closure
+        table)::
 
-            >>> Category.query.all()    # run one query
-            >>> row = Category.query.get(50)   # doesn't use a query
-            >>> row.parent    # the DBSession recognized the primary key
-            <Category: parent>
+            >>> row = Category.query.get(50)
             >>> print row.ancestors()
             [...,
              <Category: great-grand-parent>,
@@ -172,6 +188,17 @@ class Category(object):
              <Category: parent>]
 
         """
+        if self.id is None:
+            return self._walk_ancestors()
+        t = category_closure
+        query = Category.query\
+            .join((t, t.c.ancestor_id == Category.id))\
+            .filter(t.c.descendant_id == self.id)\
+            .filter(t.c.depth > 0)\
+            .order_by(None).order_by(t.c.depth.desc())
+        return query.all()
+
+    def _walk_ancestors(self):
         ancestors = CategoryList()
         anc = self.parent
         while anc:
@@ -184,7 +211,11 @@ class Category(object):
 
     def depth(self):
         """Return this category's distance from the root of the tree."""
-        return len(self.ancestors())
+        if self.id is None:
+            return len(self._walk_ancestors())
+        t = category_closure
+        query = sql.select([sql.func.max(t.c.depth)], t.c.descendant_id == self.id)
+        return DBSession.execute(query).scalar() or 0
 
 
 mapper(Category, categories,
@@ -197,3 +228,83 @@ mapper(Category, categories,
             collection_class=CategoryList,
             join_depth=2),
     })
+
+
+# --- closure table maintenance ------------------------------------------------
+def _ancestors_with_depth(connection, category_id):
+    """Return (ancestor_id, depth) tuples for the given category (including
+    the category itself with depth 0)."""
+    if category_id is None:
+        return []
+    t = category_closure
+    query = sql.select([t.c.ancestor_id, t.c.depth], t.c.descendant_id == category_id)
+    return [tuple(row) for row in connection.execute(query)]
+
+def _insert_closure_rows(connection, category_id, parent_id):
+    rows = [dict(ancestor_id=category_id, descendant_id=category_id, depth=0)]
+    for ancestor_id, depth in _ancestors_with_depth(connection, parent_id):
+        rows.append(dict(ancestor_id=ancestor_id, descendant_id=category_id,
+            depth=depth + 1))
+    connection.execute(category_closure.insert(), rows)
+
+def _move_subtree(connection, category_id, parent_id):
+    """Update the closure rows after the category was moved to a new parent
+    (if necessary)."""
+    t = category_closure
+    new_ancestors = [(ancestor_id, depth + 1) for ancestor_id, depth
+                     in _ancestors_with_depth(connection, parent_id)]
+    old_ancestors = [(ancestor_id, depth) for ancestor_id, depth
+                     in _ancestors_with_depth(connection, category_id) if depth > 0]
+    if set(new_ancestors) == set(old_ancestors):
+        return
+
+    query = sql.select([t.c.descendant_id, t.c.depth], t.c.ancestor_id == category_id)
+    subtree = [tuple(row) for row in connection.execute(query)]
+    subtree_ids = [descendant_id for descendant_id, depth in subtree]
+    if parent_id in subtree_ids:
+        raise CategoryNestingException('Category %r can not be moved into '
+            'one of its descendants.' % category_id)
+    if old_ancestors:
+        connection.execute(t.delete().where(sql.and_(
+            t.c.descendant_id.in_(subtree_ids),
+            t.c.ancestor_id.in_([ancestor_id for ancestor_id, d in old_ancestors]),
+        )))
+    rows = [dict(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                 depth=ancestor_depth + depth)
+            for ancestor_id, ancestor_depth in new_ancestors
+            for descendant_id, depth in subtree]
+    if rows:
+        connection.execute(t.insert(), rows)
+
+def rebuild_category_closure(connection):
+    """Recreate all rows of the closure table from the ``parent_id`` column
+    (e.g. after categories were changed without the ORM)."""
+    query = sql.select([categories.c.id, categories.c.parent_id])
+    parents = dict(tuple(row) for row in connection.execute(query))
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth, seen = category_id, 0, set()
+        while ancestor_id in parents and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append(dict(ancestor_id=ancestor_id,
+                descendant_id=category_id, depth=depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    connection.execute(category_closure.delete())
+    if rows:
+        connection.execute(category_closure.insert(), rows)
+
+@events.observes(events.Category.after_insert)
+def _add_closure_rows(instance):
+    _insert_closure_rows(DBSession.connection(), instance.id, instance.parent_id)
+
+@events.observes(events.Category.after_update)
+def _update_closure_rows(instance):
+    _move_subtree(DBSession.connection(), instance.id, instance.parent_id)
+
+@events.observes(events.Category.after_delete)
+def _remove_closure_rows(instance):
+    t = category_closure
+    DBSession.connection().execute(t.delete().where(sql.or_(
+        t.c.ancestor_id == instance.id,
+        t.c.descendant_id == instance.id,
+    )))
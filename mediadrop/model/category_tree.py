@@ -0,0 +1,329 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Precomputed Category Tree
+
+Displaying the category navigation used to load all categories with a
+correlated count subquery per category and then walk the ancestors of every
+category to roll up the counts.
+
+A :class:`CategoryTree` is an immutable snapshot of all categories with parent
+pointers, depth, the ids of all descendants and the published media counts
+(per category and per subtree). It is built with two queries: one for the
+categories and one GROUP BY over the closure table
+(:data:`mediadrop.model.categories.category_closure`) for the counts. Its
+``version`` (a digest of the structure and the counts) can be used as a
+dependency for cached fragments (see :mod:`mediadrop.lib.fragments`).
+
+:class:`CategoryTreeCache` keeps the current snapshot. Changing a category
+(``events.Category``) discards the snapshot. Changing a media item
+(``events.Media``) keeps the structure and only reloads the published media
+counts. The snapshot is rebuilt after ``refresh_interval`` seconds anyway to
+pick up changes from other processes and scheduled publish dates.
+"""
+
+from datetime import datetime
+import threading
+import time
+
+from paste.deploy.converters import asint
+from pylons import app_globals
+from sqlalchemy import sql
+
+from mediadrop.lib.compat import md5
+from mediadrop.model.categories import categories, category_closure
+from mediadrop.model.meta import DBSession
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['category_tree', 'CategoryNode', 'CategoryTree', 'CategoryTreeCache',
+    'current_category_tree']
+
+class CategoryNode(object):
+    """A category in a :class:`CategoryTree`.
+
+    Nodes provide the same attributes as
+    :class:`~mediadrop.model.categories.Category` which are needed to render
+    the category navigation (``id``, ``name``, ``slug``, ``parent``,
+    ``children``) plus the precomputed ``depth``, ``descendant_ids``,
+    ``media_count_published`` and ``count`` (including all descendants).
+    """
+    __slots__ = ('id', 'name', 'slug', 'parent_id', 'parent', 'depth',
+        'children', 'descendant_ids', 'media_count_published', 'count')
+
+    def __init__(self, id, name, slug, parent_id):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.parent = None
+        self.depth = 0
+        self.children = ()
+        self.descendant_ids = ()
+        self.media_count_published = 0
+        self.count = 0
+
+    def __repr__(self):
+        return '<CategoryNode: %r>' % self.name
+
+    def __unicode__(self):
+        return self.name
+
+    def traverse(self):
+        """Iterate over all nested categories in depth-first order."""
+        return _traverse(self.children)
+
+    def descendants(self):
+        """Return a list of descendants in depth-first order."""
+        return [node for node, depth in self.traverse()]
+
+    def ancestors(self):
+        """Return a list of ancestors, starting with the root node."""
+        ancestors = []
+        node = self.parent
+        while node is not None:
+            ancestors.insert(0, node)
+            node = node.parent
+        return ancestors
+
+
+def _traverse(nodes, depth=0):
+    for node in nodes:
+        yield node, depth
+        for child, child_depth in _traverse(node.children, depth + 1):
+            yield child, child_depth
+
+
+class CategoryTree(object):
+    """Immutable snapshot of all categories.
+
+    :param rows: ``(id, name, slug, parent_id)`` tuples ordered by name.
+    :param counts: A dict mapping category ids to a tuple with the number of
+        published media in that category and the number of distinct published
+        media in that category and all its descendants.
+    """
+    def __init__(self, rows, counts):
+        self._structure = md5(repr([tuple(row) for row in rows])).hexdigest()
+        self._nodes = {}
+        self._slugs = {}
+        for id, name, slug, parent_id in rows:
+            node = CategoryNode(id, name, slug, parent_id)
+            self._nodes[id] = node
+            self._slugs[slug] = node
+
+        children = {}
+        for node in self._nodes.itervalues():
+            parent = self._nodes.get(node.parent_id)
+            node.parent = parent
+            children.setdefault(parent and parent.id, []).append(node)
+        by_name = lambda node: node.name
+        for node in self._nodes.itervalues():
+            node.children = tuple(sorted(children.get(node.id, ()), key=by_name))
+        self.roots = tuple(sorted(children.get(None, ()), key=by_name))
+
+        seen = set()
+        for node, depth in self.traverse():
+            seen.add(node.id)
+            node.depth = depth
+        # Categories with circular nesting are not reachable from any root.
+        # They are omitted just like in Category.query.populated_tree().
+        for node_id in set(self._nodes) - seen:
+            node = self._nodes.pop(node_id)
+            self._slugs.pop(node.slug, None)
+
+        for node in self._nodes.itervalues():
+            node.descendant_ids = tuple(n.id for n, depth in node.traverse())
+        self.counts = self._set_counts(counts)
+        self.version = self._version(counts)
+
+    @classmethod
+    def load(cls):
+        rows = DBSession.execute(sql.select(
+            [categories.c.id, categories.c.name, categories.c.slug,
+             categories.c.parent_id],
+        ).order_by(categories.c.name))
+        return cls(list(rows), cls.load_counts())
+
+    @classmethod
+    def load_counts(cls):
+        """Return the number of published media per category id (see the
+        ``counts`` parameter)."""
+        from mediadrop.model.media import media, media_categories
+        t = category_closure
+        now = datetime.now()
+        query = sql.select(
+            [t.c.ancestor_id,
+             sql.func.sum(sql.case([(t.c.depth == 0, 1)], else_=0)),
+             sql.func.count(sql.distinct(media_categories.c.media_id))],
+            sql.and_(
+                media_categories.c.category_id == t.c.descendant_id,
+                media_categories.c.media_id == media.c.id,
+                media.c.reviewed == True,
+                media.c.encoded == True,
+                media.c.publishable == True,
+                media.c.publish_on <= now,
+                sql.or_(media.c.publish_until == None,
+                        media.c.publish_until >= now),
+            ),
+        ).group_by(t.c.ancestor_id)
+        return dict((category_id, (int(own_count), total_count))
+                    for category_id, own_count, total_count in DBSession.execute(query))
+
+    def with_counts(self, counts):
+        """Return a copy of this tree with different published media counts
+        (without rebuilding the parent/children structure)."""
+        tree = CategoryTree.__new__(CategoryTree)
+        tree._structure = self._structure
+        tree._nodes = {}
+        tree._slugs = {}
+        def copy_node(node, parent):
+            new = CategoryNode(node.id, node.name, node.slug, node.parent_id)
+            new.parent = parent
+            new.depth = node.depth
+            new.descendant_ids = node.descendant_ids
+            new.children = tuple(copy_node(child, new) for child in node.children)
+            tree._nodes[new.id] = new
+            tree._slugs[new.slug] = new
+            return new
+        tree.roots = tuple(copy_node(root, None) for root in self.roots)
+        tree.counts = tree._set_counts(counts)
+        tree.version = tree._version(counts)
+        return tree
+
+    def _version(self, counts):
+        return md5(self._structure + repr(sorted(counts.items()))).hexdigest()
+
+    def _set_counts(self, counts):
+        totals = {}
+        for node in self._nodes.itervalues():
+            node.media_count_published, node.count = counts.get(node.id, (0, 0))
+            totals[node.id] = node.count
+        return totals
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def traverse(self):
+        """Iterate over all categories in depth-first order, yielding
+        ``(node, depth)`` tuples."""
+        return _traverse(self.roots)
+
+    def get(self, category_id):
+        return self._nodes.get(category_id)
+
+    def by_slug(self, slug):
+        return self._slugs.get(slug)
+
+    def descendant_ids(self, category_ids):
+        """Return the given ids plus the ids of all their descendants."""
+        ids = []
+        for category_id in category_ids:
+            ids.append(category_id)
+            node = self._nodes.get(category_id)
+            if node is not None:
+                ids.extend(node.descendant_ids)
+        return ids
+
+
+class CategoryTreeCache(object):
+    """Keep the current :class:`CategoryTree` snapshot.
+
+    :param refresh_interval: Number of seconds after which the tree is
+        rebuilt from the database.
+    """
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._tree = None
+        self._loaded_at = None
+        self._counts_changed = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            refresh_interval=asint(config.get('categories.refresh_interval', 300)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def tree(self):
+        """Return the current :class:`CategoryTree` (building it if needed)."""
+        tree = self._tree
+        if (tree is None) or (self._now() - self._loaded_at >= self.refresh_interval):
+            tree = CategoryTree.load()
+            with self._lock:
+                self._tree = tree
+                self._loaded_at = self._now()
+                self._counts_changed = False
+        elif self._counts_changed:
+            with self._lock:
+                self._counts_changed = False
+            tree = tree.with_counts(CategoryTree.load_counts())
+            with self._lock:
+                if self._tree is not None:
+                    self._tree = tree
+        return tree
+
+    def invalidate(self):
+        """Discard the tree (e.g. because a category was changed)."""
+        with self._lock:
+            self._tree = None
+
+    def counts_changed(self):
+        """Reload the published media counts on the next access."""
+        with self._lock:
+            self._counts_changed = True
+
+
+def _current_cache():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'category_tree', None)
+
+def current_category_tree():
+    """Return the current :class:`CategoryTree` or None if no
+    :class:`CategoryTreeCache` is configured."""
+    cache = _current_cache()
+    if cache is None:
+        return None
+    return cache.tree()
+
+def category_tree(slug=None):
+    """Return the current :class:`CategoryTree` (loaded from the database if
+    no :class:`CategoryTreeCache` is configured).
+
+    :param slug: If given and the snapshot does not contain a category with
+        that slug but the database does (e.g. it was just created by another
+        process) the snapshot is rebuilt.
+    """
+    cache = _current_cache()
+    if cache is None:
+        return CategoryTree.load()
+    tree = cache.tree()
+    if (slug is not None) and (tree.by_slug(slug) is None):
+        query = sql.select([categories.c.id], categories.c.slug == slug)
+        if DBSession.execute(query).first() is not None:
+            cache.invalidate()
+            tree = cache.tree()
+    return tree
+
+@observes(events.Category.after_insert, events.Category.after_update,
+    events.Category.after_delete)
+def _category_changed(instance):
+    cache = _current_cache()
+    if cache is not None:
+        cache.invalidate()
+
+@observes(events.Media.after_insert, events.Media.after_update,
+    events.Media.after_delete)
+def _media_changed(instance):
+    cache = _current_cache()
+    if cache is not None:
+        cache.counts_changed()
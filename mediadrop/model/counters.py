@@ -0,0 +1,328 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Denormalized Media and Comment Counters
+
+Listings of tags, categories and podcasts display the number of (published)
+media and media listings display the number of comments. These numbers used
+to be correlated COUNT subqueries for every row. Now they are stored in
+counter columns:
+
+    * ``tags``, ``categories``, ``podcasts``: ``media_count``,
+      ``media_count_published``
+    * ``media``: ``comment_count``, ``comment_count_published``,
+      ``comment_count_unreviewed``
+
+The mapper observers below record which media items (and which old tags,
+categories and podcasts) were affected by a flush. After the flush the
+counters of all affected rows are recomputed with UPDATE statements in the
+same transaction, so the counters are always exact for the rows touched.
+
+The published state of media depends on the current time (``publish_on``,
+``publish_until``). Every process checks at most every
+``counters.publish_check_interval`` seconds (before a controller action is
+called) which media reached their publish date or their end of publication
+since the last check and recounts their tags, categories and podcasts (see
+:class:`PublishDateWatcher`). :func:`recount_all` repairs all counters (see
+``batch-scripts/recount_media_counters.py``).
+"""
+
+from datetime import datetime
+import threading
+import time
+import weakref
+
+from paste.deploy.converters import asint
+from pylons import app_globals
+from sqlalchemy import event, sql
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+
+from mediadrop.model.categories import Category, categories
+from mediadrop.model.comments import Comment, comments
+from mediadrop.model.media import Media, media, media_categories, media_tags
+from mediadrop.model.meta import DBSession
+from mediadrop.model.podcasts import Podcast, podcasts
+from mediadrop.model.tags import Tag, tags
+from mediadrop.plugin import events
+
+
+__all__ = ['check_publish_dates', 'PublishDateWatcher', 'recount_all', 'recount_categories',
+    'recount_comments', 'recount_podcasts', 'recount_publish_dates',
+    'recount_tags']
+
+def _published(now=None):
+    now = now or datetime.now()
+    return sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on <= now,
+        sql.or_(media.c.publish_until == None,
+                media.c.publish_until >= now),
+    )
+
+def _count(table, where):
+    return sql.select([sql.func.count(sql.text('*'))], where, from_obj=[table]).as_scalar()
+
+def _recount_media(connection, table, assoc_where, ids):
+    stmt = table.update().values(
+        media_count=_count(media, assoc_where),
+        media_count_published=_count(media, sql.and_(assoc_where, _published())),
+    )
+    if 'modified_on' in table.c:
+        # counter changes are no modification by the user
+        stmt = stmt.values(modified_on=table.c.modified_on)
+    if ids is not None:
+        if not ids:
+            return
+        stmt = stmt.where(table.c.id.in_(list(ids)))
+    connection.execute(stmt)
+
+def recount_tags(connection, tag_ids=None):
+    """Recompute the media counters of the given tags (all if None)."""
+    _recount_media(connection, tags, sql.and_(
+        media_tags.c.tag_id == tags.c.id,
+        media_tags.c.media_id == media.c.id,
+    ), tag_ids)
+
+def recount_categories(connection, category_ids=None):
+    """Recompute the media counters of the given categories (all if None)."""
+    _recount_media(connection, categories, sql.and_(
+        media_categories.c.category_id == categories.c.id,
+        media_categories.c.media_id == media.c.id,
+    ), category_ids)
+
+def recount_podcasts(connection, podcast_ids=None):
+    """Recompute the media counters of the given podcasts (all if None)."""
+    _recount_media(connection, podcasts, media.c.podcast_id == podcasts.c.id,
+        podcast_ids)
+
+def recount_comments(connection, media_ids=None):
+    """Recompute the comment counters of the given media (all if None)."""
+    of_media = comments.c.media_id == media.c.id
+    stmt = media.update().values(
+        comment_count=_count(comments, of_media),
+        comment_count_published=_count(comments,
+            sql.and_(of_media, comments.c.publishable == True)),
+        comment_count_unreviewed=_count(comments,
+            sql.and_(of_media, comments.c.reviewed == False)),
+        modified_on=media.c.modified_on,
+    )
+    if media_ids is not None:
+        if not media_ids:
+            return
+        stmt = stmt.where(media.c.id.in_(list(media_ids)))
+    connection.execute(stmt)
+
+def recount_all(connection):
+    """Recompute all counters (e.g. after data was changed without the ORM or
+    to pick up scheduled publish dates)."""
+    recount_tags(connection)
+    recount_categories(connection)
+    recount_podcasts(connection)
+    recount_comments(connection)
+
+def _container_ids(connection, media_ids):
+    """Return the ids of the tags, categories and podcasts of the media."""
+    tag_ids = set(row[0] for row in connection.execute(sql.select(
+        [media_tags.c.tag_id], media_tags.c.media_id.in_(media_ids))))
+    category_ids = set(row[0] for row in connection.execute(sql.select(
+        [media_categories.c.category_id], media_categories.c.media_id.in_(media_ids))))
+    podcast_ids = set(row[0] for row in connection.execute(sql.select(
+        [media.c.podcast_id], media.c.id.in_(media_ids))))
+    return tag_ids, category_ids, podcast_ids
+
+def recount_publish_dates(connection, since, now=None):
+    """Recompute the media counters of the tags, categories and podcasts of
+    all media which were published (``publish_on``) or unpublished
+    (``publish_until``) after ``since``. Return the number of these media."""
+    now = now or datetime.now()
+    media_ids = [row[0] for row in connection.execute(sql.select([media.c.id],
+        sql.or_(
+            sql.and_(media.c.publish_on > since, media.c.publish_on <= now),
+            sql.and_(media.c.publish_until >= since, media.c.publish_until < now),
+        )))]
+    if not media_ids:
+        return 0
+    tag_ids, category_ids, podcast_ids = _container_ids(connection, media_ids)
+    podcast_ids.discard(None)
+    recount_tags(connection, tag_ids)
+    recount_categories(connection, category_ids)
+    recount_podcasts(connection, podcast_ids)
+    return len(media_ids)
+
+
+class PublishDateWatcher(object):
+    """Recount the media counters of media which crossed their publish dates
+    (see :func:`recount_publish_dates`).
+
+    :param check_interval: Number of seconds between two checks.
+    :param initial_period: Number of seconds before the start of the process
+        which are checked the first time (to repair changes which were missed
+        while the site was not running).
+    """
+    def __init__(self, check_interval=60, initial_period=24*60*60, engine=None):
+        self.check_interval = check_interval
+        self.initial_period = initial_period
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._checked_until = None
+        self._next_check = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            check_interval=asint(config.get('counters.publish_check_interval', 60)),
+        )
+
+    @property
+    def engine(self):
+        if self._engine is not None:
+            return self._engine
+        from mediadrop.model.meta import metadata
+        return metadata.bind
+
+    def _now(self):
+        return time.time()
+
+    def check(self):
+        """Recount the counters if the check interval has passed."""
+        if self._now() < self._next_check:
+            return 0
+        with self._lock:
+            now = self._now()
+            if now < self._next_check:
+                # another thread is checking right now
+                return 0
+            self._next_check = now + self.check_interval
+            since = self._checked_until
+            if since is None:
+                since = datetime.fromtimestamp(now - self.initial_period)
+            until = datetime.fromtimestamp(now)
+            connection = self.engine.connect()
+            try:
+                transaction = connection.begin()
+                try:
+                    nr_media = recount_publish_dates(connection, since, until)
+                    transaction.commit()
+                except:
+                    transaction.rollback()
+                    raise
+            finally:
+                connection.close()
+            self._checked_until = until
+        return nr_media
+
+def _current_watcher():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'publish_dates', None)
+
+def check_publish_dates():
+    """Recount the counters of media which crossed their publish dates since
+    the last check (if a :class:`PublishDateWatcher` is configured)."""
+    watcher = _current_watcher()
+    if watcher is not None:
+        watcher.check()
+
+
+class _AffectedRows(object):
+    def __init__(self):
+        self.media_ids = set()
+        self.tag_ids = set()
+        self.category_ids = set()
+        self.podcast_ids = set()
+        self.comment_media_ids = set()
+
+_affected_rows = weakref.WeakKeyDictionary()
+
+def _affected(instance):
+    session = object_session(instance) or DBSession()
+    rows = _affected_rows.get(session)
+    if rows is None:
+        rows = _affected_rows[session] = _AffectedRows()
+    return rows
+
+def _old_values(instance, name):
+    return get_history(instance, name).deleted or ()
+
+# changes to these attributes change the media counters
+_COUNTED_MEDIA_ATTRIBUTES = ('reviewed', 'encoded', 'publishable',
+    'publish_on', 'publish_until', 'podcast_id', 'podcast', 'tags', 'categories')
+
+@events.observes(events.Media.after_insert)
+def _media_inserted(instance):
+    _affected(instance).media_ids.add(instance.id)
+
+@events.observes(events.Media.after_update)
+def _media_updated(instance):
+    for name in _COUNTED_MEDIA_ATTRIBUTES:
+        if get_history(instance, name).has_changes():
+            break
+    else:
+        return
+    rows = _affected(instance)
+    rows.media_ids.add(instance.id)
+    rows.tag_ids.update(tag.id for tag in _old_values(instance, 'tags'))
+    rows.category_ids.update(cat.id for cat in _old_values(instance, 'categories'))
+    rows.podcast_ids.update(_old_values(instance, 'podcast_id'))
+    rows.podcast_ids.update(p.id for p in _old_values(instance, 'podcast') if p is not None)
+
+@events.observes(events.Media.before_delete)
+def _media_deleted(instance):
+    connection = DBSession.connection()
+    rows = _affected(instance)
+    rows.tag_ids.update(row[0] for row in connection.execute(sql.select(
+        [media_tags.c.tag_id], media_tags.c.media_id == instance.id)))
+    rows.category_ids.update(row[0] for row in connection.execute(sql.select(
+        [media_categories.c.category_id], media_categories.c.media_id == instance.id)))
+    rows.podcast_ids.add(instance.podcast_id)
+
+@events.observes(events.Comment.after_insert, events.Comment.after_update,
+    events.Comment.after_delete)
+def _comment_changed(instance):
+    rows = _affected(instance)
+    rows.comment_media_ids.add(instance.media_id)
+    rows.comment_media_ids.update(_old_values(instance, 'media_id'))
+
+
+def _update_counters(session, flush_context):
+    rows = _affected_rows.pop(session, None)
+    if rows is None:
+        return
+    connection = session.connection()
+    media_ids = list(rows.media_ids)
+    if media_ids:
+        tag_ids, category_ids, podcast_ids = _container_ids(connection, media_ids)
+        rows.tag_ids.update(tag_ids)
+        rows.category_ids.update(category_ids)
+        rows.podcast_ids.update(podcast_ids)
+    for ids in (rows.tag_ids, rows.category_ids, rows.podcast_ids,
+                rows.comment_media_ids):
+        ids.discard(None)
+
+    recount_tags(connection, rows.tag_ids)
+    recount_categories(connection, rows.category_ids)
+    recount_podcasts(connection, rows.podcast_ids)
+    recount_comments(connection, rows.comment_media_ids)
+
+    # loaded instances must not display the old counters
+    _expire(session, Tag, rows.tag_ids, ('media_count', 'media_count_published'))
+    _expire(session, Category, rows.category_ids, ('media_count', 'media_count_published'))
+    _expire(session, Podcast, rows.podcast_ids, ('media_count', 'media_count_published'))
+    _expire(session, Media, rows.comment_media_ids, ('comment_count',
+        'comment_count_published', 'comment_count_unreviewed'))
+
+def _expire(session, cls, ids, attribute_names):
+    for id_ in ids:
+        instance = session.identity_map.get(session.identity_key(cls, id_))
+        if instance is not None:
+            session.expire(instance, attribute_names)
+
+event.listen(DBSession, 'after_flush_postexec', _update_counters)
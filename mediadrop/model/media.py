@@ -20,12 +20,13 @@ belongs to a :class:`mediadrop.model.podcasts.Podcast`.
 
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
+import time
 
 from sqlalchemy import Table, ForeignKey, Column, event, sql, Index
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import (attributes, backref, class_mapper, column_property,
-    composite, dynamic_loader, mapper, Query, relation, validates)
+from sqlalchemy.orm import (attributes, backref, composite, dynamic_loader,
+    mapper, Query, relation, validates)
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.schema import DDL
 from sqlalchemy.types import Boolean, DateTime, Integer, Unicode, UnicodeText
@@ -35,13 +36,13 @@ from mediadrop.lib.compat import any
 from mediadrop.lib.filetypes import AUDIO, AUDIO_DESC, VIDEO, guess_mimetype
 from mediadrop.lib.util import calculate_popularity
 from mediadrop.lib.xhtml import line_break_xhtml, strip_xhtml
-from mediadrop.model import (get_available_slug, SLUG_LENGTH,
-    _mtm_count_property, _properties_dict_from_labels, MatchAgainstClause)
+from mediadrop.model import get_available_slug, SLUG_LENGTH, MatchAgainstClause
 from mediadrop.model.meta import DBSession, metadata
 from mediadrop.model.authors import Author
-from mediadrop.model.categories import Category, CategoryList
-from mediadrop.model.comments import Comment, CommentQuery, comments
+from mediadrop.model.categories import Category, CategoryList, category_closure
+from mediadrop.model.comments import Comment, CommentQuery
 from mediadrop.model.tags import Tag, TagList, extract_tags, fetch_and_create_tags
+from mediadrop.model.view_stats import recent_views_query
 from mediadrop.lib.thumbnails import thumb
 from mediadrop.players import pick_any_media_file, pick_podcast_media_file
 from mediadrop.plugin import events
@@ -113,30 +114,6 @@ media = Table('media', metadata,
     Column('views', Integer, default=0, nullable=False, doc=\
         """The number of times the public media page has been viewed total."""),
 
-    Column('views3', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed last 3 hours."""),
-
-    Column('views6', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 6 hours."""),
-
-    Column('views9', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 9 hours."""),
-
-    Column('views12', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 12 hours."""),
-
-    Column('views15', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 15 hours."""),
-
-    Column('views18', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 18 hours."""),
-
-    Column('views21', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 21 hours."""),
-
-    Column('views24', Integer, default=0, nullable=False, doc=\
-        """The number of times the public media page has been viewed on the prior 24 hours."""),
-
     Column('likes', Integer, default=0, nullable=False, doc=\
         """The number of users who clicked 'i like this'."""),
 
@@ -167,6 +144,15 @@ media = Table('media', metadata,
         bring the newest most liked items to the top. `More info
         <http://amix.dk/blog/post/19588>`_."""),
 
+    Column('comment_count', Integer, default=0, nullable=False, doc=\
+        """The total number of comments (see :mod:`mediadrop.model.counters`)."""),
+
+    Column('comment_count_published', Integer, default=0, nullable=False, doc=\
+        """The number of published comments (see :mod:`mediadrop.model.counters`)."""),
+
+    Column('comment_count_unreviewed', Integer, default=0, nullable=False, doc=\
+        """The number of comments awaiting review (see :mod:`mediadrop.model.counters`)."""),
+
     Column('author_name', Unicode(50), nullable=False),
     Column('author_email', Unicode(255), nullable=False),
 
@@ -305,6 +291,70 @@ def _setup_mysql_fulltext_indexes():
         )
 _setup_mysql_fulltext_indexes()
 
+class FullTextCapability(object):
+    """Check (once per engine) if full text searching is available.
+
+    Full text search requires MySQL and the triggers from ``setup_triggers.sql``
+    which keep the ``media_fulltext`` table up to date. Checking this on every
+    search would cost an extra query for every page which displays related
+    media so the result is cached.
+
+    A positive result is cached until :meth:`invalidate` is called (e.g. after
+    the triggers were removed). A negative result is rechecked after
+    ``negative_ttl`` seconds or when new media was added so that installing
+    the triggers does not require a restart.
+
+    The instance for an engine is available as ``engine.fulltext``, see
+    :func:`fulltext_capability`.
+    """
+    negative_ttl = 300
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._enabled = None
+        self._checked_at = None
+
+    @property
+    def enabled(self):
+        is_negative_result_expired = (self._enabled is False) and \
+            (time.time() - self._checked_at >= self.negative_ttl)
+        if (self._enabled is None) or is_negative_result_expired:
+            self._enabled = self._probe()
+            self._checked_at = time.time()
+        return self._enabled
+
+    def invalidate(self):
+        """Forget the cached result, the next access checks the database."""
+        self._enabled = None
+
+    def _probe(self):
+        if self.engine.dialect.name != 'mysql':
+            return False
+        # use a fun trick to see if the media_fulltext table is being used
+        # thanks to this guy: http://data.agaric.com/node/2241#comment-544
+        select = sql.select(['1']).select_from(media_fulltext).limit(1)
+        connection = self.engine.connect()
+        try:
+            return connection.execute(select).scalar() is not None
+        finally:
+            connection.close()
+
+def fulltext_capability(engine):
+    """Return the :class:`FullTextCapability` for the given engine."""
+    capability = getattr(engine, 'fulltext', None)
+    if capability is None:
+        capability = engine.fulltext = FullTextCapability(engine)
+    return capability
+
+@events.observes(events.Media.after_insert)
+def _recheck_fulltext_capability(instance):
+    # the first media item inserted after installing the triggers populates
+    # the media_fulltext table.
+    engine = DBSession.bind
+    capability = getattr(engine, 'fulltext', None)
+    if (capability is not None) and (capability._enabled is False):
+        capability.invalidate()
+
 class MediaQuery(Query):
     def reviewed(self, flag=True):
         return self.filter(Media.reviewed == flag)
@@ -345,6 +395,14 @@ class MediaQuery(Query):
     def order_by_popularity(self):
         return self.order_by(Media.popularity_points.desc())
 
+    def order_by_trending(self, window=timedelta(hours=24), now=None):
+        """Order by the number of views within the given time window.
+
+        See :class:`mediadrop.model.view_stats.ViewStatistics`."""
+        recent = recent_views_query(window, now=now).alias('recent_views')
+        return self.outerjoin((recent, recent.c.media_id == Media.id)).\
+            order_by(sql.func.coalesce(recent.c.views, 0).desc())
+
     def search(self, search, bool=False, order_by=True):
         search_cols = _fulltext_indexes['public']
         return self._search(search_cols, search, bool, order_by)
@@ -374,15 +432,7 @@ class MediaQuery(Query):
         return query
 
     def _fulltext_enabled(self):
-        connection = self.session.connection()
-        if connection.dialect.name == 'mysql':
-            # use a fun trick to see if the media_fulltext table is being used
-            # thanks to this guy: http://data.agaric.com/node/2241#comment-544
-            select = sql.select('1').select_from(media_fulltext).limit(1)
-            result = connection.execute(select)
-            if result.scalar() is not None:
-                return True
-        return False
+        return fulltext_capability(self.session.bind).enabled
 
     def in_category(self, cat):
         """Filter results to Media in the given category"""
@@ -393,14 +443,12 @@ class MediaQuery(Query):
         if len(cats) == 0:
             # SQLAlchemy complains about an empty IN-predicate
             return self.filter(media_categories.c.media_id == -1)
-        all_cats = cats[:]
-        for cat in cats:
-            all_cats.extend(cat.descendants())
-        all_ids = [c.id for c in all_cats]
+        # the closure table contains a row for each category itself, too
         return self.filter(sql.exists(sql.select(
             [media_categories.c.media_id],
             sql.and_(media_categories.c.media_id == Media.id,
-                     media_categories.c.category_id.in_(all_ids))
+                     media_categories.c.category_id == category_closure.c.descendant_id,
+                     category_closure.c.ancestor_id.in_([cat.id for cat in cats]))
         )))
 
     def exclude(self, *args):
@@ -590,26 +638,6 @@ class Media(object):
         attributes.set_committed_value(self, 'views', self.views + 1)
         return self.views
 
-    def increment_views3(self):
-        """Increment the number of views in the database.
-
-        We avoid concurrency issues by incrementing JUST the views and
-        not allowing modified_on to be updated automatically.
-
-        """
-        if self.id is None:
-            self.views3 += 1
-            return self.views3
-
-        DBSession.execute(media.update()\
-            .values(views3=media.c.views3 + 1)\
-            .where(media.c.id == self.id))
-
-        # Increment the views by one for the rest of the request,
-        # but don't allow the ORM to increment the views too.
-        attributes.set_committed_value(self, 'views3', self.views3 + 1)
-        return self.views3
-
     def increment_likes(self):
         self.likes += 1
         self.update_popularity()
@@ -660,10 +688,12 @@ class Media(object):
         uris = []
         for file in self.files:
             uri = file.get_uris()
+            if not uri:
+                continue
             element = {
-                "url": str(uri[0])
-                "mimeType": str(file.mimetype)
-                "size": str(int(file.size))
+                "url": str(uri[0]),
+                "mimeType": str(file.mimetype),
+                "size": str(int(file.size)),
                 "title": str(file.media.title)
             }
             uris.append(element)
@@ -711,7 +741,15 @@ class MediaFile(object):
         :returns: :class:`mediadrop.lib.storage.StorageURI` instances.
 
         """
-        return self.storage.get_uris(self)
+        if self.is_pending:
+            return []
+        return self.storage.cached_uris(self)
+
+    @property
+    def is_pending(self):
+        """True if the file was not stored yet by its storage engine (see
+        :mod:`mediadrop.lib.storage.pipeline`)."""
+        return self.unique_id is None
 
 class MediaFullText(object):
     query = DBSession.query_property()
@@ -787,57 +825,8 @@ _media_mapper = mapper(
             doc="""A query pre-filtered for associated comments.
                    Returns :class:`mediadrop.model.comments.CommentQuery`."""
         ),
-        'comment_count': column_property(
-            sql.select(
-                [sql.func.count(comments.c.id)],
-                media.c.id == comments.c.media_id,
-            ).label('comment_count'),
-            deferred=True,
-        ),
-        'comment_count_published': column_property(
-            sql.select(
-                [sql.func.count(comments.c.id)],
-                sql.and_(
-                    comments.c.media_id == media.c.id,
-                    comments.c.publishable == True,
-                )
-            ).label('comment_count_published'),
-            deferred=True,
-        )
 })
 
-# Add properties for counting how many media items have a given Tag
-_tags_mapper = class_mapper(Tag, compile=False)
-_tags_mapper.add_properties(_properties_dict_from_labels(
-    _mtm_count_property('media_count', media_tags),
-    _mtm_count_property('media_count_published', media_tags, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= sql.func.current_timestamp(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= sql.func.current_timestamp(),
-        ),
-    ]),
-))
-
-# Add properties for counting how many media items have a given Category
-_categories_mapper = class_mapper(Category, compile=False)
-_categories_mapper.add_properties(_properties_dict_from_labels(
-    _mtm_count_property('media_count', media_categories),
-    _mtm_count_property('media_count_published', media_categories, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= sql.func.current_timestamp(),
-        sql.or_(
-            media.c.publish_until == None,
-            media.c.publish_until >= sql.func.current_timestamp(),
-        ),
-    ]),
-))
-
 mapper(
     Views_Counter, views,
     extension=events.MapperObserver(events.Views_Counter)
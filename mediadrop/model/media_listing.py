@@ -0,0 +1,161 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Batch Loading for Media Listings
+
+Feeds and the API touch the files, tags, categories and podcast of every
+listed media item. Lazy loading issues one query per item and relation.
+
+:func:`load_media_relations` fetches each relation for a whole list of media
+with one ``IN`` query (per chunk of ids) and stores the results with
+``set_committed_value`` - just like
+:func:`~mediadrop.model.categories.populated_tree` does for categories.
+Relations which are loaded already are not touched.
+"""
+
+from itertools import islice
+
+from sqlalchemy import sql
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+
+from mediadrop.lib.compat import defaultdict
+from mediadrop.lib.storage import StorageEngine
+from mediadrop.model.categories import Category, CategoryList
+from mediadrop.model.media import (Media, MediaFile, media_categories,
+    media_files, media_tags)
+from mediadrop.model.meta import DBSession
+from mediadrop.model.podcasts import Podcast
+from mediadrop.model.tags import Tag, TagList
+
+
+__all__ = [
+    'FEED_RELATIONS',
+    'iter_with_relations',
+    'latest_episode_ids',
+    'LISTING_RELATIONS',
+    'load_media_relations',
+]
+
+LISTING_RELATIONS = ('files', 'tags', 'categories', 'podcast')
+# relations used by the mRSS and sitemap templates
+FEED_RELATIONS = ('files', 'tags', 'categories')
+
+def load_media_relations(media, relations=LISTING_RELATIONS, chunk_size=500):
+    """Load the given relations of all media with one query per relation
+    (and chunk of ``chunk_size`` media).
+
+    :param media: A list of :class:`~mediadrop.model.media.Media` instances.
+    :param relations: Names of the relations to load (see
+        :data:`LISTING_RELATIONS`). Loading ``files`` loads their storage
+        engines as well.
+    :returns: The list of media.
+    """
+    media = list(media)
+    for start in range(0, len(media), chunk_size):
+        chunk = media[start:start + chunk_size]
+        for relation in relations:
+            unloaded = _unloaded(chunk, relation)
+            if unloaded:
+                _loaders[relation](unloaded)
+    return media
+
+def iter_with_relations(media, relations=LISTING_RELATIONS, chunk_size=100):
+    """Iterate over the given media and load the relations of each chunk of
+    ``chunk_size`` items with :func:`load_media_relations`.
+
+    Use this for long listings (e.g. feeds) which should not keep all items
+    in memory."""
+    if hasattr(media, 'fetch'):
+        # QueryResultProxy: fetch a whole chunk with one query
+        next_chunk = lambda: media.fetch(chunk_size)
+    else:
+        iterator = iter(media)
+        next_chunk = lambda: list(islice(iterator, chunk_size))
+    while True:
+        items = load_media_relations(next_chunk(), relations)
+        for item in items:
+            yield item
+        if len(items) < chunk_size:
+            return
+
+def latest_episode_ids(podcast_ids, limit):
+    """Return the ids of the latest ``limit`` published episodes of each
+    podcast with one query.
+
+    :returns: A dict which maps podcast ids to a list of media ids.
+    """
+    selects = []
+    for podcast_id in podcast_ids:
+        episodes = Media.query.published()\
+            .with_entities(Media.podcast_id, Media.id)\
+            .filter(Media.podcast_id == podcast_id)\
+            .order_by(Media.publish_on.desc())\
+            .limit(limit)\
+            .subquery()
+        selects.append(sql.select([episodes.c.podcast_id, episodes.c.id]))
+    episode_ids = dict((podcast_id, []) for podcast_id in podcast_ids)
+    if not selects:
+        return episode_ids
+    for podcast_id, media_id in DBSession.execute(sql.union_all(*selects)):
+        episode_ids[podcast_id].append(media_id)
+    return episode_ids
+
+
+def _unloaded(media, key):
+    return dict((m.id, m) for m in media
+                if (m.id is not None) and (key not in instance_state(m).dict))
+
+def _load_files(media):
+    files = defaultdict(list)
+    query = MediaFile.query\
+        .filter(MediaFile.media_id.in_(media.keys()))\
+        .order_by(media_files.c.type.asc())
+    for media_file in query:
+        files[media_file.media_id].append(media_file)
+    storage_ids = set(f.storage_id for fs in files.values() for f in fs)
+    engines = {}
+    if storage_ids:
+        query = DBSession.query(StorageEngine).filter(StorageEngine.id.in_(storage_ids))
+        engines = dict((engine.id, engine) for engine in query)
+    for media_id, item in media.items():
+        set_committed_value(item, 'files', files[media_id])
+        for media_file in files[media_id]:
+            set_committed_value(media_file, 'media', item)
+            set_committed_value(media_file, 'storage', engines.get(media_file.storage_id))
+
+def _secondary_loader(key, cls, secondary, column, collection_class, order_by):
+    def load(media):
+        items = defaultdict(collection_class)
+        # the mapper's order_by is not applied to queries for several entities
+        query = DBSession.query(secondary.c.media_id, cls)\
+            .filter(cls.id == column)\
+            .filter(secondary.c.media_id.in_(media.keys()))\
+            .order_by(order_by)
+        for media_id, item in query:
+            items[media_id].append(item)
+        for media_id, item in media.items():
+            set_committed_value(item, key, items[media_id])
+    return load
+
+def _load_podcasts(media):
+    podcast_ids = set(m.podcast_id for m in media.values())
+    podcast_ids.discard(None)
+    podcasts = {}
+    if podcast_ids:
+        query = Podcast.query.filter(Podcast.id.in_(podcast_ids))
+        podcasts = dict((podcast.id, podcast) for podcast in query)
+    for item in media.values():
+        set_committed_value(item, 'podcast', podcasts.get(item.podcast_id))
+
+_loaders = {
+    'files': _load_files,
+    'tags': _secondary_loader('tags', Tag, media_tags,
+        media_tags.c.tag_id, TagList, Tag.name),
+    'categories': _secondary_loader('categories', Category, media_categories,
+        media_categories.c.category_id, CategoryList, Category.name),
+    'podcast': _load_podcasts,
+}
@@ -6,17 +6,60 @@
 # See LICENSE.txt in the main project directory, for more information.
 
 """SQLAlchemy Metadata and Session object"""
-from sqlalchemy import MetaData
+import logging
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event, MetaData
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 __all__ = [
+    'after_commit',
     'DBSession',
     'metadata',
 ]
 
+log = logging.getLogger(__name__)
+
 # SQLAlchemy session manager. Updated by model.init_model()
 # DBSession() returns the session object appropriate for the current request.
 maker = sessionmaker()
 DBSession = scoped_session(maker)
 
 metadata = MetaData()
+
+# callbacks which are called after the transaction of a session was committed
+_after_commit = WeakKeyDictionary()
+
+def after_commit(session, callback, *args):
+    """Call ``callback(*args)`` once the current transaction of ``session``
+    was committed (mapper events are triggered by the flush, other processes
+    would still see the old data).
+
+    The same callback (with the same arguments) is only called once per
+    transaction. Callbacks are discarded if the transaction is rolled back.
+
+    :returns: The registered callback (which may be an equal callback
+        registered earlier in the same transaction).
+    """
+    callbacks = _after_commit.setdefault(session, [])
+    for registered_callback, registered_args in callbacks:
+        if (registered_callback, registered_args) == (callback, args):
+            return registered_callback
+    callbacks.append((callback, args))
+    return callback
+
+@event.listens_for(maker, 'after_commit')
+def _call_after_commit(session):
+    if (session.transaction is not None) and session.transaction.nested:
+        # only the SAVEPOINT was released
+        return
+    for callback, args in _after_commit.pop(session, ()):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception('error in after commit callback %r', callback)
+
+@event.listens_for(maker, 'after_soft_rollback')
+def _discard_after_commit(session, previous_transaction):
+    if not previous_transaction.nested:
+        _after_commit.pop(session, None)
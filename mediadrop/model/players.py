@@ -23,8 +23,11 @@ from sqlalchemy.types import Boolean, DateTime, Integer, Unicode
 from mediadrop.lib.decorators import memoize
 from mediadrop.lib.i18n import _
 from mediadrop.model.meta import DBSession, metadata
+from mediadrop.model.settings_snapshot import increment_version
 from mediadrop.model.util import JSONType
 from mediadrop.players import AbstractPlayer
+from mediadrop.players.cache import current_player_cache, player_config_version
+from mediadrop.plugin import events
 
 log = logging.getLogger(__name__)
 
@@ -112,6 +115,7 @@ class PlayerPrefs(object):
 
 mapper(
     PlayerPrefs, players,
+    extension=events.MapperObserver(events.PlayerPrefs),
     order_by=(
         players.c.enabled.desc(),
         players.c.priority,
@@ -131,6 +135,12 @@ def fetch_enabled_players():
         and the configured data associated with them.
 
     """
+    cache = current_player_cache()
+    if cache is None:
+        return _load_enabled_players()
+    return cache.enabled_players(player_config_version(), _load_enabled_players)
+
+def _load_enabled_players():
     player_classes = dict((p.name, p) for p in AbstractPlayer)
     query = sql.select((players.c.name, players.c.data))\
         .where(players.c.enabled == True)\
@@ -177,6 +187,7 @@ def cleanup_players_table(enabled=False):
     existing_player_names = [p['name'] for p in existing_player_rows]
 
     # Ensure all priorities are monotonically increasing from 1..n
+    changed = False
     priority = 0
     for player_row in existing_player_rows:
         priority += 1
@@ -185,6 +196,7 @@ def cleanup_players_table(enabled=False):
                        .where(players.c.id == player_row['id'])\
                        .values(priority=priority)
             DBSession.execute(u)
+            changed = True
 
     # Ensure that all available players are in the database
     for player_cls in all_players:
@@ -197,3 +209,9 @@ def cleanup_players_table(enabled=False):
                 data=player_cls.default_data,
                 priority=priority,
             ))
+            changed = True
+
+    if changed:
+        # the rows were changed without the ORM so the player configuration
+        # version must be incremented explicitly
+        increment_version(DBSession.connection())
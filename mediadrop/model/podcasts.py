@@ -18,7 +18,7 @@ SQLAlchemy ORM definitions for:
 from datetime import datetime
 from sqlalchemy import Table, ForeignKey, Column, sql, Index
 from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, Float
-from sqlalchemy.orm import mapper, relation, backref, synonym, composite, validates, dynamic_loader, column_property
+from sqlalchemy.orm import mapper, relation, backref, synonym, composite, validates, dynamic_loader
 from pylons import request
 
 from mediadrop.model import Author, SLUG_LENGTH, slugify, get_available_slug
@@ -81,6 +81,14 @@ podcasts = Table('podcasts', metadata,
         this address -- unless, of course, the request is coming from
         Feedburner."""),
 
+    Column('media_count', Integer, default=0, nullable=False, doc=\
+        """The total number of :class:`mediadrop.model.media.Media` episodes
+        (see :mod:`mediadrop.model.counters`)."""),
+
+    Column('media_count_published', Integer, default=0, nullable=False, doc=\
+        """The number of :class:`mediadrop.model.media.Media` episodes that
+        are currently published (see :mod:`mediadrop.model.counters`)."""),
+
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -118,33 +126,4 @@ mapper(Podcast, podcasts, order_by=podcasts.c.title, extension=events.MapperObse
     'media': dynamic_loader(Media, backref='podcast', query_class=MediaQuery, passive_deletes=True, doc=\
         """A query pre-filtered to media published under this podcast.
         Returns :class:`mediadrop.model.media.MediaQuery`."""),
-
-    'media_count':
-        column_property(
-            sql.select(
-                [sql.func.count(media.c.id)],
-                media.c.podcast_id == podcasts.c.id,
-            ).label('media_count'),
-            deferred=True,
-            doc="The total number of :class:`mediadrop.model.media.Media` episodes."
-        ),
-    'media_count_published':
-        column_property(
-            sql.select(
-                [sql.func.count(media.c.id)],
-                sql.and_(
-                    media.c.podcast_id == podcasts.c.id,
-                    media.c.reviewed == True,
-                    media.c.encoded == True,
-                    media.c.publishable == True,
-                    media.c.publish_on <= sql.func.current_timestamp(),
-                    sql.or_(
-                        media.c.publish_until == None,
-                        media.c.publish_until >= sql.func.current_timestamp(),
-                    ),
-                )
-            ).label('media_count_published'),
-            deferred=True,
-            doc="The number of :class:`mediadrop.model.media.Media` episodes that are currently published."
-        )
 })
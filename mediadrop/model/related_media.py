@@ -0,0 +1,166 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Precomputed Related Media
+
+Finding related media requires two full text MATCH operations (or a join over
+all categories) which is too expensive to do for every media page view. The
+ids of the top related media are stored per media item instead so that
+displaying related media only needs one primary key lookup (plus the query
+for the media items themselves).
+
+Entries are computed on first access (see :meth:`RelatedMediaIndex.query`),
+by the batch script ``batch-scripts/rebuild_related_media.py`` and they are
+removed when the title, tags or categories of a media item change. Entries
+older than :attr:`RelatedMediaIndex.max_age` are recomputed so newly
+published media shows up eventually.
+"""
+
+from datetime import datetime, timedelta
+import logging
+
+from paste.deploy.converters import asint
+from sqlalchemy import Column, ForeignKey, sql, Table
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.types import DateTime, Integer, UnicodeText
+
+from mediadrop.model.meta import DBSession, metadata
+from mediadrop.plugin import events
+
+
+__all__ = ['media_related', 'RelatedMediaIndex']
+
+log = logging.getLogger(__name__)
+
+media_related = Table('media_related', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, autoincrement=False, doc=\
+        """The media item for which related media was computed."""),
+
+    Column('related_ids', UnicodeText, nullable=False, doc=\
+        """Comma separated list of related media ids (most related first)."""),
+
+    Column('computed_on', DateTime, nullable=False, doc=\
+        """When the related media was computed."""),
+
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+
+class RelatedMediaIndex(object):
+    """Store and look up the ids of related media.
+
+    :param size: The number of related media ids stored per media item.
+    :param max_age: Entries older than this (:class:`datetime.timedelta`)
+        are recomputed.
+    """
+    def __init__(self, size=12, max_age=timedelta(days=1)):
+        self.size = size
+        self.max_age = max_age
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            size=asint(config.get('related_media.index_size', 12)),
+            max_age=timedelta(hours=asint(config.get('related_media.max_age_hours', 24))),
+        )
+
+    def compute_ids(self, media):
+        """Return the ids of the most related media using the full query
+        (see :meth:`mediadrop.model.media.MediaQuery.related`)."""
+        from mediadrop.model.media import Media
+        related_query = Media.query.related(media).limit(self.size)
+        return [row[0] for row in related_query.values(Media.id)]
+
+    def related_ids(self, connection, media_id, now=None):
+        """Return the list of stored related ids for the given media (or None
+        if the media was not indexed yet or the entry is outdated)."""
+        t = media_related
+        row = connection.execute(
+            sql.select([t.c.related_ids, t.c.computed_on], t.c.media_id == media_id)
+        ).fetchone()
+        if row is None:
+            return None
+        related_ids, computed_on = row
+        if computed_on < (now or datetime.now()) - self.max_age:
+            return None
+        return [int(id_) for id_ in related_ids.split(',') if id_]
+
+    def store(self, connection, media_id, related_ids, now=None):
+        t = media_related
+        connection.execute(t.delete().where(t.c.media_id == media_id))
+        connection.execute(t.insert(), dict(
+            media_id=media_id,
+            related_ids=u','.join([unicode(id_) for id_ in related_ids]),
+            computed_on=now or datetime.now(),
+        ))
+
+    def invalidate(self, connection, media_id):
+        _remove_entry(connection, media_id)
+
+    def update(self, media, engine=None):
+        """Recompute and store the related media ids for ``media``.
+
+        The ids are written using a separate connection so this works in any
+        request (also when the current transaction is rolled back later on).
+        """
+        related_ids = self.compute_ids(media)
+        connection = (engine or DBSession.bind).connect()
+        try:
+            transaction = connection.begin()
+            try:
+                self.store(connection, media.id, related_ids)
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+        finally:
+            connection.close()
+        return related_ids
+
+    def query(self, media):
+        """Return a query for the related media of ``media`` (ordered by
+        relevance).
+
+        If the media was not indexed yet the related media is computed (and
+        stored) using the full related media query.
+        """
+        from mediadrop.model.media import Media
+        related_ids = self.related_ids(DBSession.connection(), media.id)
+        if related_ids is None:
+            try:
+                related_ids = self.update(media)
+            except Exception:
+                log.exception('unable to index related media for media %d', media.id)
+                return Media.query.related(media)
+        if not related_ids:
+            # SQLAlchemy complains about an empty IN-predicate
+            return Media.query.filter(Media.id == -1)
+        rank = sql.case([(Media.id == id_, i) for i, id_ in enumerate(related_ids)])
+        return Media.query.published().\
+            filter(Media.id.in_(related_ids)).\
+            order_by(None).order_by(rank)
+
+
+def _remove_entry(connection, media_id):
+    t = media_related
+    connection.execute(t.delete().where(t.c.media_id == media_id))
+
+# changes to these attributes change the related media of a media item
+_INDEXED_ATTRIBUTES = ('title', 'tags', 'categories')
+
+@events.observes(events.Media.after_update)
+def _invalidate_related_media(instance):
+    for name in _INDEXED_ATTRIBUTES:
+        if get_history(instance, name).has_changes():
+            _remove_entry(DBSession.connection(), instance.id)
+            return
+
+@events.observes(events.Media.before_delete)
+def _remove_related_media(instance):
+    _remove_entry(DBSession.connection(), instance.id)
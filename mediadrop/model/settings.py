@@ -42,6 +42,16 @@ multisettings = Table('settings_multi', metadata,
     mysql_charset='utf8',
 )
 
+# A single row which is incremented whenever a setting is changed so other
+# processes can check cheaply if their settings are outdated
+# (see mediadrop.model.settings_snapshot).
+settings_version = Table('settings_version', metadata,
+    Column('id', Integer, autoincrement=False, primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
 class Setting(object):
     """
     A Single Setting
@@ -0,0 +1,208 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Per-process Settings Snapshot
+
+All settings used to be cached in a beaker memory cache which expired after
+an hour. Changes made in one process were not visible in other processes
+until then, and every process reloaded all settings at the same time once the
+cache expired.
+
+Every process now keeps a :class:`SettingsSnapshot` (all settings plus the
+version they were loaded with) in its :class:`SettingsStore`. Every flush
+which changes a setting (or the player preferences) increments the version in
+the ``settings_version`` table. The store checks that single row at most once
+every ``settings.check_interval`` seconds and replaces the whole snapshot when
+the version changed. Changes made in this process replace the snapshot at
+once.
+"""
+
+import threading
+import time
+import weakref
+
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals
+from sqlalchemy import event, sql
+from sqlalchemy.orm import object_session
+
+from mediadrop.model.meta import DBSession
+from mediadrop.model.settings import settings, settings_version
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = ['current_settings', 'SettingsSnapshot', 'SettingsStore']
+
+class SettingsSnapshot(object):
+    """All settings at one version.
+
+    ``values`` is the plain dict of raw (unicode) setting values which is also
+    available as ``request.settings``. It must be treated as read-only: a
+    changed setting produces a new snapshot.
+
+    :meth:`as_int` and :meth:`as_bool` parse a value only once per snapshot.
+    """
+    def __init__(self, values, version):
+        self.values = values
+        self.version = version
+        self._parsed = {}
+
+    def __repr__(self):
+        return '<SettingsSnapshot: version %r>' % self.version
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def as_int(self, key, default=0):
+        return self._parse(key, int, default)
+
+    def as_bool(self, key, default=False):
+        return self._parse(key, asbool, default)
+
+    def _parse(self, key, parse, default):
+        raw = self.values.get(key)
+        cached = self._parsed.get((key, parse))
+        # compare the raw value so (test) code which modifies "values"
+        # never sees stale parsed values
+        if (cached is not None) and (cached[0] is raw):
+            return cached[1]
+        try:
+            value = parse(raw)
+        except (TypeError, ValueError):
+            value = default
+        self._parsed[(key, parse)] = (raw, value)
+        return value
+
+
+def load_version(connection=None):
+    """Return the current settings version (0 if there is no version row)."""
+    connection = connection or DBSession
+    version = connection.execute(
+        sql.select([settings_version.c.version], settings_version.c.id == 1)
+    ).scalar()
+    return version or 0
+
+def load_snapshot():
+    """Load all settings from the database."""
+    version = load_version()
+    values = dict(DBSession.execute(
+        sql.select([settings.c.key, settings.c.value])).fetchall())
+    return SettingsSnapshot(values, version)
+
+def increment_version(connection):
+    result = connection.execute(settings_version.update().
+        where(settings_version.c.id == 1).
+        values(version=settings_version.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(settings_version.insert().values(id=1, version=1))
+
+
+class SettingsStore(object):
+    """Keep the current :class:`SettingsSnapshot` of this process.
+
+    :param check_interval: Number of seconds between two checks of the
+        settings version (``0`` checks on every access).
+    """
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._next_check = 0
+        # number of accesses served by the current snapshot/which loaded a
+        # new snapshot (see mediadrop.lib.metrics)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            check_interval=asint(config.get('settings.check_interval', 5)),
+        )
+
+    def _now(self):
+        return time.time()
+
+    def snapshot(self):
+        """Return the current :class:`SettingsSnapshot`."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self._reload(None)
+        now = self._now()
+        if now < self._next_check:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            if now < self._next_check:
+                # another thread is checking the version right now
+                self.hits += 1
+                return self._snapshot
+            self._next_check = now + self.check_interval
+        if load_version() != snapshot.version:
+            return self._reload(snapshot)
+        self.hits += 1
+        return snapshot
+
+    def _reload(self, outdated):
+        with self._lock:
+            # only the first thread which noticed the change loads the settings
+            if (self._snapshot is not None) and (self._snapshot is not outdated):
+                return self._snapshot
+            snapshot = load_snapshot()
+            self._snapshot = snapshot
+            self.misses += 1
+            self._next_check = self._now() + self.check_interval
+        return snapshot
+
+    def invalidate(self):
+        """Load the settings again on the next access."""
+        with self._lock:
+            self._snapshot = None
+
+
+def _current_store():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'settings_store', None)
+
+def current_settings():
+    """Return the current :class:`SettingsSnapshot` (loaded from the database
+    if no :class:`SettingsStore` is configured)."""
+    store = _current_store()
+    if store is None:
+        return load_snapshot()
+    return store.snapshot()
+
+
+# sessions which changed settings in their current flush
+_changed_sessions = weakref.WeakKeyDictionary()
+
+# player preferences share the settings version (see
+# mediadrop.players.cache.player_config_version)
+@observes(events.Setting.after_insert, events.Setting.after_update,
+    events.Setting.after_delete, events.PlayerPrefs.after_insert,
+    events.PlayerPrefs.after_update, events.PlayerPrefs.after_delete)
+def _setting_changed(instance):
+    session = object_session(instance) or DBSession()
+    _changed_sessions[session] = True
+
+def _increment_version(session, flush_context):
+    if _changed_sessions.pop(session, None) is None:
+        return
+    increment_version(session.connection())
+    store = _current_store()
+    if store is not None:
+        store.invalidate()
+
+event.listen(DBSession, 'after_flush_postexec', _increment_version)
@@ -28,6 +28,9 @@ tags = Table('tags', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True),
     Column('name', Unicode(50), unique=True, nullable=False),
     Column('slug', Unicode(SLUG_LENGTH), unique=True, nullable=False),
+    # counters maintained by mediadrop.model.counters
+    Column('media_count', Integer, default=0, nullable=False),
+    Column('media_count_published', Integer, default=0, nullable=False),
     mysql_engine='InnoDB',
     mysql_charset='utf8'
 )
@@ -0,0 +1,77 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pythonic_testcase import *
+from sqlalchemy import sql
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import Category, DBSession, Media
+from mediadrop.model.categories import (category_closure,
+    CategoryNestingException, rebuild_category_closure)
+
+
+class CategoryClosureTest(DBTestCase):
+    def setUp(self):
+        super(CategoryClosureTest, self).setUp()
+        self.food = Category.example(name=u'Food')
+        self.cooking = Category.example(name=u'Cooking', parent_id=self.food.id)
+        self.baking = Category.example(name=u'Baking', parent_id=self.cooking.id)
+        self.sports = Category.example(name=u'Sports')
+        DBSession.commit()
+
+    def _closure_rows(self):
+        t = category_closure
+        query = sql.select([t.c.ancestor_id, t.c.descendant_id, t.c.depth])
+        return set(tuple(row) for row in DBSession.execute(query))
+
+    def test_returns_ancestors_from_root(self):
+        assert_equals([self.food, self.cooking], self.baking.ancestors())
+        assert_equals([], self.food.ancestors())
+        assert_equals(2, self.baking.depth())
+
+    def test_updates_closure_when_subtree_is_moved(self):
+        self.cooking.parent = self.sports
+        DBSession.commit()
+
+        assert_equals([self.sports, self.cooking], self.baking.ancestors())
+        rows = self._closure_rows()
+        rebuild_category_closure(DBSession.connection())
+        assert_equals(self._closure_rows(), rows)
+
+    def test_rejects_moving_category_into_its_descendants(self):
+        self.food.parent = self.baking
+        assert_raises(CategoryNestingException, DBSession.flush)
+        DBSession.rollback()
+
+    def test_removes_rows_of_deleted_categories(self):
+        DBSession.delete(self.baking)
+        DBSession.commit()
+
+        baking_id = self.baking.id
+        for ancestor_id, descendant_id, depth in self._closure_rows():
+            assert_not_equals(baking_id, ancestor_id)
+            assert_not_equals(baking_id, descendant_id)
+
+    def test_finds_media_in_descendant_categories(self):
+        cake = Media.example(title=u'Cake')
+        cake.categories = [self.baking]
+        soup = Media.example(title=u'Soup')
+        soup.categories = [self.food]
+        DBSession.flush()
+
+        assert_equals(set([cake, soup]), set(Media.query.in_category(self.food)))
+        assert_equals([cake], Media.query.in_categories([self.baking, self.sports]).all())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CategoryClosureTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,109 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import Category, DBSession, Media
+from mediadrop.model.categories import categories
+from mediadrop.model.category_tree import category_tree, CategoryTreeCache
+
+
+class CategoryTreeTest(DBTestCase):
+    def setUp(self):
+        super(CategoryTreeTest, self).setUp()
+        self.food = Category.example(name=u'Food')
+        self.cooking = Category.example(name=u'Cooking', parent_id=self.food.id)
+        self.baking = Category.example(name=u'Baking', parent_id=self.cooking.id)
+        self.sports = Category.example(name=u'Sports')
+        self.media = self._published_media(u'Cake', [self.baking])
+        self._published_media(u'Soup', [self.cooking])
+        DBSession.commit()
+        self.cache = CategoryTreeCache()
+        app_globals.category_tree = self.cache
+
+    def tearDown(self):
+        app_globals.category_tree = None
+        super(CategoryTreeTest, self).tearDown()
+
+    def _published_media(self, title, categories):
+        media = Media.example(title=title)
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = datetime.now() - timedelta(days=1)
+        media.categories = categories
+        DBSession.flush()
+        return media
+
+    def test_precomputes_structure_and_counts(self):
+        tree = self.cache.tree()
+        root_names = [node.name for node in tree.roots]
+        assert_equals(sorted(root_names), root_names)
+        assert_contains(u'Sports', root_names)
+        baking = tree.by_slug(self.baking.slug)
+        assert_equals(2, baking.depth)
+        assert_equals([u'Food', u'Cooking'], [node.name for node in baking.ancestors()])
+        assert_equals((self.cooking.id, self.baking.id),
+            tree.get(self.food.id).descendant_ids)
+        assert_equals(2, tree.counts[self.food.id])
+        assert_equals(2, tree.counts[self.cooking.id])
+        assert_equals(1, tree.counts[self.baking.id])
+        assert_equals(0, tree.counts[self.sports.id])
+
+    def test_rebuilds_tree_when_categories_change(self):
+        tree = self.cache.tree()
+        assert_is(tree, self.cache.tree())
+
+        pastry = Category.example(name=u'Pastry', parent_id=self.baking.id)
+        DBSession.commit()
+        new_tree = self.cache.tree()
+        assert_length(len(tree) + 1, new_tree)
+        assert_equals((self.cooking.id, self.baking.id, pastry.id),
+            new_tree.get(self.food.id).descendant_ids)
+
+    def test_reloads_tree_for_categories_of_other_processes(self):
+        tree = category_tree()
+        assert_is(tree, category_tree(u'unknown'))
+        # inserted without mapper events like another process would do
+        DBSession.execute(categories.insert().values(name=u'Pastry',
+            slug=u'pastry', parent_id=None))
+        DBSession.commit()
+        assert_is(tree, category_tree())
+
+        new_tree = category_tree(u'pastry')
+        assert_equals(u'Pastry', new_tree.by_slug(u'pastry').name)
+
+    def test_updates_counts_when_media_changes(self):
+        tree = self.cache.tree()
+        self.media.publishable = False
+        DBSession.commit()
+
+        new_tree = self.cache.tree()
+        assert_equals(1, new_tree.counts[self.food.id])
+        assert_equals(0, new_tree.counts[self.baking.id])
+        # old snapshots are not modified
+        assert_equals(2, tree.counts[self.food.id])
+
+    def test_finds_media_in_descendant_categories(self):
+        media = Media.query.published().in_category(self.food)
+        assert_equals(set([u'Cake', u'Soup']), set([m.title for m in media]))
+        media = Media.query.published().in_category(self.cache.tree().get(self.baking.id))
+        assert_equals([u'Cake'], [m.title for m in media])
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CategoryTreeTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,132 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import (Author, AuthorWithIP, Category, Comment,
+    DBSession, Media, Podcast, Tag)
+from mediadrop.model.counters import PublishDateWatcher, recount_all
+from mediadrop.model.media import media
+
+
+class CountersTest(DBTestCase):
+    def setUp(self):
+        super(CountersTest, self).setUp()
+        self.tag = Tag(u'cooking')
+        self.category = Category.example(name=u'Food')
+        self.podcast = Podcast()
+        self.podcast.slug = u'cooking-show'
+        self.podcast.title = u'Cooking Show'
+        self.podcast.author = Author(u'Joe', u'joe@site.example')
+        self.media = Media.example()
+        self.media.tags = [self.tag]
+        self.media.categories = [self.category]
+        self.media.podcast = self.podcast
+        DBSession.commit()
+
+    def _comment(self, publishable=False, reviewed=False):
+        comment = Comment()
+        comment.subject = u'Re: Foo'
+        comment.author = AuthorWithIP(name=u'John Doe', ip=2130706433)
+        comment.body = u'<p>Hello!</p>'
+        comment.publishable = publishable
+        comment.reviewed = reviewed
+        comment.media = self.media
+        DBSession.add(comment)
+        return comment
+
+    def _publish(self, media):
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = datetime.now() - timedelta(days=1)
+
+    def assert_media_counts(self, total, published):
+        for item in (self.tag, self.category, self.podcast):
+            assert_equals((total, published),
+                (item.media_count, item.media_count_published), message=repr(item))
+
+    def test_counts_media_of_tags_categories_and_podcasts(self):
+        self.assert_media_counts(1, 0)
+
+        self._publish(self.media)
+        DBSession.commit()
+        self.assert_media_counts(1, 1)
+
+        # loaded instances are refreshed after a flush already
+        self.media.publishable = False
+        DBSession.flush()
+        self.assert_media_counts(1, 0)
+
+    def test_updates_counters_of_old_tags_and_podcasts(self):
+        self._publish(self.media)
+        self.media.tags = []
+        self.media.podcast = None
+        DBSession.commit()
+
+        assert_equals((0, 0), (self.tag.media_count, self.tag.media_count_published))
+        assert_equals(0, self.podcast.media_count)
+        assert_equals((1, 1),
+            (self.category.media_count, self.category.media_count_published))
+
+    def test_updates_counters_when_media_is_deleted(self):
+        DBSession.delete(self.media)
+        DBSession.commit()
+        self.assert_media_counts(0, 0)
+
+    def test_counts_comments(self):
+        comment = self._comment()
+        self._comment(publishable=True, reviewed=True)
+        DBSession.commit()
+        assert_equals((2, 1, 1), (self.media.comment_count,
+            self.media.comment_count_published, self.media.comment_count_unreviewed))
+
+        DBSession.delete(comment)
+        DBSession.commit()
+        assert_equals((1, 1, 0), (self.media.comment_count,
+            self.media.comment_count_published, self.media.comment_count_unreviewed))
+
+    def test_recounts_media_after_publish_dates(self):
+        self._publish(self.media)
+        self.media.publish_on = datetime.now() + timedelta(minutes=1)
+        DBSession.commit()
+        self.assert_media_counts(1, 0)
+        # the publish date was reached in the meantime
+        DBSession.execute(media.update().where(media.c.id == self.media.id).
+            values(publish_on=datetime.now() - timedelta(minutes=1)))
+        DBSession.commit()
+
+        watcher = PublishDateWatcher(check_interval=60, engine=DBSession.bind)
+        assert_equals(1, watcher.check())
+        DBSession.expire_all()
+        self.assert_media_counts(1, 1)
+        # checked again after the check interval only
+        assert_equals(0, watcher.check())
+
+    def test_can_repair_counters(self):
+        media_id = self.media.id
+        DBSession.execute(media.update().values(comment_count=42))
+        self.tag.media_count = 23
+        DBSession.commit()
+
+        recount_all(DBSession.connection())
+        DBSession.commit()
+        assert_equals(1, Tag.query.get(self.tag.id).media_count)
+        assert_equals(0, Media.query.get(media_id).comment_count)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CountersTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
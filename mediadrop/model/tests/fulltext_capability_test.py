@@ -0,0 +1,74 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pythonic_testcase import *
+
+from mediadrop.lib.attribute_dict import AttrDict
+from mediadrop.model.media import fulltext_capability, FullTextCapability
+
+
+class FakeEngine(object):
+    def __init__(self, dialect_name='mysql', has_fulltext_rows=True):
+        self.dialect = AttrDict(name=dialect_name)
+        self.has_fulltext_rows = has_fulltext_rows
+        self.nr_queries = 0
+
+    def connect(self):
+        engine = self
+        class FakeConnection(object):
+            def execute(self, query):
+                engine.nr_queries += 1
+                return AttrDict(scalar=lambda: engine.has_fulltext_rows and 1 or None)
+            def close(self):
+                pass
+        return FakeConnection()
+
+
+class FullTextCapabilityTest(PythonicTestCase):
+    def test_is_disabled_for_non_mysql_databases(self):
+        engine = FakeEngine(dialect_name='sqlite')
+        assert_false(fulltext_capability(engine).enabled)
+        assert_equals(0, engine.nr_queries)
+
+    def test_probes_database_only_once(self):
+        engine = FakeEngine()
+        capability = fulltext_capability(engine)
+        assert_true(capability.enabled)
+        assert_true(capability.enabled)
+        assert_equals(1, engine.nr_queries)
+        assert_is(capability, engine.fulltext)
+        assert_is(capability, fulltext_capability(engine))
+
+    def test_can_invalidate_cached_result(self):
+        engine = FakeEngine()
+        capability = FullTextCapability(engine)
+        assert_true(capability.enabled)
+
+        engine.has_fulltext_rows = False
+        capability.invalidate()
+        assert_false(capability.enabled)
+        assert_equals(2, engine.nr_queries)
+
+    def test_rechecks_negative_result_after_ttl(self):
+        engine = FakeEngine(has_fulltext_rows=False)
+        capability = FullTextCapability(engine)
+        assert_false(capability.enabled)
+
+        engine.has_fulltext_rows = True
+        assert_false(capability.enabled)
+        capability._checked_at -= capability.negative_ttl
+        assert_true(capability.enabled)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FullTextCapabilityTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
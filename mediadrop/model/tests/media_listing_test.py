@@ -0,0 +1,131 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pythonic_testcase import *
+from sqlalchemy import event
+
+from mediadrop.lib.storage.api import add_new_media_file
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import Author, Category, DBSession, Media, Podcast, Tag
+from mediadrop.model.media_listing import (iter_with_relations,
+    latest_episode_ids, load_media_relations)
+
+
+class MediaListingTest(DBTestCase):
+    def setUp(self):
+        super(MediaListingTest, self).setUp()
+        self.podcast = self._podcast(u'Cooking Show')
+        category = Category.example(name=u'Food')
+        for i in range(5):
+            media = self._published_media(u'Episode %d' % i, days_ago=i)
+            add_new_media_file(media, url=u'http://site.example/%d.mp4' % i)
+            media.tags = [Tag(u'tag %d' % i)]
+            media.categories = [category]
+            media.podcast = self.podcast
+        DBSession.commit()
+        self.podcast_id = self.podcast.id
+        query = Media.query.filter(Media.podcast_id == self.podcast_id)
+        self.ids = [m.id for m in query.order_by(Media.id)]
+        # new connections only (created after "listen()") report queries
+        DBSession.close()
+
+        self.queries = []
+        event.listen(DBSession.bind, 'before_cursor_execute', self._count_query)
+
+    def tearDown(self):
+        # SQLAlchemy 0.7 can not remove engine listeners (event.remove does
+        # not support them) so the listener is disabled instead
+        self.queries = None
+        super(MediaListingTest, self).tearDown()
+
+    def _count_query(self, *args):
+        if self.queries is not None:
+            self.queries.append(args[2])
+
+    def _podcast(self, title):
+        podcast = Podcast()
+        podcast.slug = title.lower().replace(u' ', u'-')
+        podcast.title = title
+        podcast.author = Author(u'Joe', u'joe@site.example')
+        DBSession.add(podcast)
+        DBSession.flush()
+        return podcast
+
+    def _published_media(self, title, days_ago):
+        media = Media.example(title=title)
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = datetime.now() - timedelta(days=1 + days_ago)
+        return media
+
+    def _touch_relations(self, media):
+        return [(len(m.files), m.files[0].storage.id, m.files[0].media.id,
+                 m.tags[0].name, len(m.categories), m.podcast.slug)
+                for m in media]
+
+    def test_loads_relations_with_fixed_number_of_queries(self):
+        media = Media.query.filter(Media.id.in_(self.ids)).all()
+        self.queries = []
+        assert_is(media[0], load_media_relations(media)[0])
+        # files, storage engines, tags, categories and podcasts
+        assert_length(5, self.queries)
+
+        self.queries = []
+        relations = self._touch_relations(media)
+        assert_equals([], self.queries)
+        assert_equals((1, u'cooking-show'), (relations[0][0], relations[0][-1]))
+
+        # loaded relations are not loaded again
+        load_media_relations(media)
+        assert_equals([], self.queries)
+
+    def test_loads_tags_and_categories_ordered_by_name(self):
+        media = Media.query.get(self.ids[0])
+        media.tags = []
+        for name in (u'zebra', u'apple', u'mango'):
+            media.tags.append(Tag(name))
+            DBSession.flush()
+        for name in (u'Drinks', u'Water'):
+            media.categories.append(Category.example(name=name))
+        DBSession.commit()
+        DBSession.close()
+
+        media = load_media_relations(Media.query.filter(Media.id == self.ids[0]).all())[0]
+        assert_equals([u'apple', u'mango', u'zebra'], [tag.name for tag in media.tags])
+        assert_equals([u'Drinks', u'Food', u'Water'], [c.name for c in media.categories])
+
+    def test_loads_relations_of_each_chunk(self):
+        query = Media.query.filter(Media.id.in_(self.ids)).order_by(Media.id)
+        self.queries = []
+        media = list(iter_with_relations(query, ('files', 'tags'), chunk_size=2))
+        assert_equals(self.ids, [m.id for m in media])
+        assert_equals([u'tag %d' % i for i in range(5)],
+            [m.tags[0].name for m in media])
+        [m.files[0].storage for m in media]
+        # one query for all media, files + storage engines + tags for 3 chunks
+        assert_length(1 + 3 * 3, self.queries)
+
+    def test_returns_latest_episodes_with_one_query(self):
+        other_id = self._podcast(u'Empty Show').id
+        DBSession.commit()
+        self.queries = []
+        episode_ids = latest_episode_ids([self.podcast_id, other_id], 2)
+        assert_length(1, self.queries)
+        assert_equals({self.podcast_id: self.ids[:2], other_id: []}, episode_ids)
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MediaListingTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,81 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import Category, DBSession, Media, RelatedMediaIndex
+
+
+class RelatedMediaIndexTest(DBTestCase):
+    def setUp(self):
+        super(RelatedMediaIndexTest, self).setUp()
+        self.category = Category.example(name=u'Cooking')
+        self.media = self._published_media(u'Foo Media', [self.category])
+        self.related = self._published_media(u'Bar Media', [self.category])
+        self.unrelated = self._published_media(u'Baz Media', [])
+        DBSession.commit()
+        self.index = RelatedMediaIndex(size=5)
+        self.connection = DBSession.connection()
+
+    def _published_media(self, title, categories):
+        media = Media.example(title=title)
+        media.reviewed = True
+        media.encoded = True
+        media.publishable = True
+        media.publish_on = datetime.now() - timedelta(days=1)
+        media.categories = categories
+        DBSession.flush()
+        return media
+
+    def test_computes_and_stores_related_media_on_first_access(self):
+        assert_none(self.index.related_ids(self.connection, self.media.id))
+
+        assert_equals([self.related], self.index.query(self.media).all())
+        assert_equals([self.related.id],
+            self.index.related_ids(self.connection, self.media.id))
+
+    def test_uses_stored_ids_in_stored_order(self):
+        related_ids = [self.unrelated.id, self.related.id]
+        self.index.store(self.connection, self.media.id, related_ids)
+        assert_equals([self.unrelated, self.related], self.index.query(self.media).all())
+
+    def test_returns_only_published_media(self):
+        self.index.store(self.connection, self.media.id, [self.related.id])
+        self.related.publishable = False
+        DBSession.flush()
+        assert_equals([], self.index.query(self.media).all())
+
+    def test_recomputes_outdated_entries(self):
+        computed_on = datetime.now() - timedelta(days=2)
+        self.index.store(self.connection, self.media.id, [self.unrelated.id],
+            now=computed_on)
+        assert_none(self.index.related_ids(self.connection, self.media.id))
+        assert_equals([self.related], self.index.query(self.media).all())
+
+    def test_removes_entry_when_categories_change(self):
+        self.index.store(self.connection, self.media.id, [self.related.id])
+        self.media.title = u'New Title'
+        DBSession.flush()
+        assert_none(self.index.related_ids(self.connection, self.media.id))
+
+        self.index.store(self.connection, self.media.id, [self.related.id])
+        self.media.categories = []
+        DBSession.flush()
+        assert_none(self.index.related_ids(self.connection, self.media.id))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RelatedMediaIndexTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,76 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from pylons import app_globals
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Setting
+from mediadrop.model.settings import settings
+from mediadrop.model.settings_snapshot import (increment_version,
+    load_version, SettingsSnapshot, SettingsStore)
+
+
+class SettingsSnapshotTest(DBTestCase):
+    def setUp(self):
+        super(SettingsSnapshotTest, self).setUp()
+        self.now = 1000
+        self.store = SettingsStore(check_interval=5)
+        self.store._now = lambda: self.now
+        app_globals.settings_store = self.store
+
+    def _setting(self, key):
+        return DBSession.query(Setting).filter(Setting.key == key).one()
+
+    def test_uses_changes_of_this_process_at_once(self):
+        snapshot = self.store.snapshot()
+        assert_is(snapshot, self.store.snapshot())
+        version = load_version()
+
+        self._setting(u'popularity_decay_exponent').value = u'7'
+        DBSession.commit()
+        assert_equals(version + 1, load_version())
+        new_snapshot = self.store.snapshot()
+        assert_equals(7, new_snapshot.as_int('popularity_decay_exponent'))
+        assert_equals(u'7', app_globals.settings['popularity_decay_exponent'])
+        assert_equals(u'4', snapshot['popularity_decay_exponent'])
+
+    def test_checks_version_for_changes_of_other_processes(self):
+        snapshot = self.store.snapshot()
+        # another process changes a setting
+        DBSession.execute(settings.update().
+            where(settings.c.key == u'rss_display').values(value=u'False'))
+        increment_version(DBSession.connection())
+        DBSession.commit()
+
+        self.now += 4
+        assert_is(snapshot, self.store.snapshot())
+        self.now += 1
+        new_snapshot = self.store.snapshot()
+        assert_not_equals(snapshot.version, new_snapshot.version)
+        assert_false(new_snapshot.as_bool('rss_display'))
+        assert_true(snapshot.as_bool('rss_display'))
+
+    def test_parses_values_once(self):
+        snapshot = SettingsSnapshot({'limit': u'42', 'broken': u'abc'}, version=3)
+        assert_equals(42, snapshot.as_int('limit'))
+        assert_equals(10, snapshot.as_int('broken', default=10))
+        assert_equals(0, snapshot.as_int('missing'))
+        assert_false(snapshot.as_bool('missing'))
+
+        snapshot.values['limit'] = u'21'
+        assert_equals(21, snapshot.as_int('limit'))
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SettingsSnapshotTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
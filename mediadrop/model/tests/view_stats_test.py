@@ -0,0 +1,90 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+
+from datetime import datetime, timedelta
+
+from pythonic_testcase import *
+
+from mediadrop.lib.test.db_testcase import DBTestCase
+from mediadrop.model import DBSession, Media, ViewStatistics
+from mediadrop.model.view_stats import media_view_stats
+
+
+class ViewStatisticsTest(DBTestCase):
+    def setUp(self):
+        super(ViewStatisticsTest, self).setUp()
+        self.media = Media.example()
+        self.other = Media.example(title=u'Bar Media')
+        DBSession.commit()
+        self.stats = ViewStatistics(bucket_size=timedelta(hours=1),
+                                    retention=timedelta(days=2))
+        self.now = datetime(2026, 10, 18, 14, 25)
+        self.connection = DBSession.connection()
+
+    def _record(self, deltas, hours_ago=0):
+        now = self.now - timedelta(hours=hours_ago)
+        self.stats.record(self.connection, deltas, now=now)
+
+    def _nr_buckets(self):
+        query = media_view_stats.count()
+        return self.connection.execute(query).scalar()
+
+    def test_can_compute_bucket_start(self):
+        assert_equals(datetime(2026, 10, 18, 14, 0), self.stats.bucket_for(self.now))
+        stats = ViewStatistics(bucket_size=timedelta(minutes=15))
+        assert_equals(datetime(2026, 10, 18, 14, 15), stats.bucket_for(self.now))
+
+    def test_aggregates_views_within_the_same_bucket(self):
+        self._record({self.media.id: 2, self.other.id: 1})
+        self._record({self.media.id: 3})
+        assert_equals(2, self._nr_buckets())
+        assert_equals(5, self.stats.views_for(self.connection, self.media.id,
+            timedelta(hours=1), now=self.now))
+
+    def test_can_query_views_for_arbitrary_windows(self):
+        self._record({self.media.id: 1}, hours_ago=0)
+        self._record({self.media.id: 2}, hours_ago=5)
+        self._record({self.media.id: 4}, hours_ago=20)
+
+        views_for = lambda hours: self.stats.views_for(self.connection,
+            self.media.id, timedelta(hours=hours), now=self.now)
+        assert_equals(1, views_for(3))
+        assert_equals(3, views_for(6))
+        assert_equals(7, views_for(24))
+
+    def test_can_return_top_media(self):
+        self._record({self.media.id: 1, self.other.id: 2})
+        self._record({self.media.id: 5}, hours_ago=30)
+
+        top_today = self.stats.top_media_ids(self.connection,
+            timedelta(hours=24), now=self.now)
+        assert_equals([(self.other.id, 2), (self.media.id, 1)], top_today)
+        top_two_days = self.stats.top_media_ids(self.connection,
+            timedelta(hours=48), limit=1, now=self.now)
+        assert_equals([(self.media.id, 6)], top_two_days)
+
+    def test_can_order_media_by_trending(self):
+        self._record({self.media.id: 1, self.other.id: 2})
+        trending = Media.query.order_by(None).\
+            order_by_trending(timedelta(hours=24), now=self.now)[:2]
+        assert_equals([self.other, self.media], trending)
+
+    def test_removes_expired_buckets_when_a_new_bucket_starts(self):
+        self._record({self.media.id: 1}, hours_ago=72)
+        assert_equals(1, self._nr_buckets())
+        self._record({self.media.id: 1})
+        assert_equals(1, self._nr_buckets())
+
+
+import unittest
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ViewStatisticsTest))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
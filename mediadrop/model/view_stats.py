@@ -0,0 +1,177 @@
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Rolling-window View Statistics
+
+Views are stored in time buckets (one row per media item and bucket) so
+"views in the last N hours" is a range aggregation over an index instead of
+a set of columns in the media table which are shifted periodically.
+
+Old buckets are removed incrementally: every time a new bucket is started all
+buckets older than the retention period are deleted (usually just the single
+bucket which just expired).
+
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, ForeignKey, Index, sql, Table
+from sqlalchemy.types import DateTime, Integer
+
+from mediadrop.model.meta import metadata
+
+
+__all__ = ['media_view_stats', 'ViewStatistics']
+
+media_view_stats = Table('media_view_stats', metadata,
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True, autoincrement=False, doc=\
+        """The media item which was viewed."""),
+
+    Column('bucket_start', DateTime, primary_key=True, doc=\
+        """Start of the time bucket, see :attr:`ViewStatistics.bucket_size`."""),
+
+    Column('views', Integer, default=0, nullable=False, doc=\
+        """The number of views within the bucket."""),
+
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+# covering index for range aggregations ("top media since ...")
+Index('idx_mvs_bucket', media_view_stats.c.bucket_start,
+      media_view_stats.c.media_id, media_view_stats.c.views)
+
+
+# concurrent flushes of several worker processes must not insert the same
+# (media_id, bucket_start) row twice. The table name is only known after
+# init_model() added the configured table prefix.
+UPSERT_STATEMENTS = {
+    'mysql': 'INSERT INTO %(table)s (media_id, bucket_start, views) '
+        'VALUES (:media_id, :bucket_start, :views) '
+        'ON DUPLICATE KEY UPDATE views = views + VALUES(views)',
+    'postgresql': 'INSERT INTO %(table)s (media_id, bucket_start, views) '
+        'VALUES (:media_id, :bucket_start, :views) '
+        'ON CONFLICT (media_id, bucket_start) '
+        'DO UPDATE SET views = %(table)s.views + EXCLUDED.views',
+}
+
+def recent_views_query(window, now=None):
+    """Return a query for the number of views per media within ``window``.
+
+    The query selects two columns: ``media_id`` and ``views``.
+
+    :param window: A :class:`datetime.timedelta`
+    :param now: Optional reference time (defaults to :meth:`datetime.now`)
+    """
+    since = (now or datetime.now()) - window
+    return sql.select(
+        [media_view_stats.c.media_id,
+         sql.func.sum(media_view_stats.c.views).label('views')],
+        media_view_stats.c.bucket_start >= since,
+    ).group_by(media_view_stats.c.media_id)
+
+
+class ViewStatistics(object):
+    """Record views in time buckets and answer rolling-window queries.
+
+    :param bucket_size: The granularity of the statistics
+        (:class:`datetime.timedelta`, defaults to one hour).
+    :param retention: How long buckets are kept (defaults to 30 days).
+    """
+    def __init__(self, bucket_size=timedelta(hours=1), retention=timedelta(days=30)):
+        self.bucket_size = bucket_size
+        self.retention = retention
+        self._last_compacted_bucket = None
+
+    @classmethod
+    def from_config(cls, config):
+        bucket_minutes = int(config.get('views.stats_bucket_minutes', 60))
+        retention_days = int(config.get('views.stats_retention_days', 30))
+        return cls(
+            bucket_size=timedelta(minutes=bucket_minutes),
+            retention=timedelta(days=retention_days),
+        )
+
+    def bucket_for(self, timestamp):
+        """Return the start of the bucket which contains ``timestamp``."""
+        bucket_seconds = int(self.bucket_size.days * 86400 + self.bucket_size.seconds)
+        day_start = datetime(timestamp.year, timestamp.month, timestamp.day)
+        seconds = (timestamp - day_start).seconds
+        return day_start + timedelta(seconds=seconds - (seconds % bucket_seconds))
+
+    def record(self, connection, deltas, now=None):
+        """Add the given views to the current bucket.
+
+        All views are written using the given connection (usually within the
+        transaction which also updated ``media.views``).
+
+        :param deltas: A dict which maps media ids to the number of new views.
+            All media items must exist (see
+            :meth:`~mediadrop.lib.view_counter.BufferedViewCounter.flush`).
+        """
+        if not deltas:
+            return
+        now = now or datetime.now()
+        bucket_start = self.bucket_for(now)
+        rows = [dict(media_id=media_id, bucket_start=bucket_start, views=views)
+                for media_id, views in sorted(deltas.items())]
+        upsert = UPSERT_STATEMENTS.get(connection.dialect.name)
+        if upsert is not None:
+            table_name = connection.dialect.identifier_preparer.\
+                format_table(media_view_stats)
+            connection.execute(sql.text(upsert % dict(table=table_name),
+                bindparams=[sql.bindparam('bucket_start', type_=DateTime)]), rows)
+        else:
+            self._update_or_insert(connection, rows)
+        if bucket_start != self._last_compacted_bucket:
+            self.compact(connection, now=now)
+            self._last_compacted_bucket = bucket_start
+
+    def _update_or_insert(self, connection, rows):
+        # Databases without an upsert statement (SQLite): the UPDATE of
+        # media.views earlier in the same transaction already holds the write
+        # lock so no other process can insert the row in between.
+        t = media_view_stats
+        # bind parameters need explicit types so the datetime is serialized
+        # exactly like the stored value (important for SQLite).
+        update = t.update().\
+            where(sql.and_(
+                t.c.media_id == sql.bindparam('m_id', type_=Integer),
+                t.c.bucket_start == sql.bindparam('bucket', type_=DateTime))).\
+            values({t.c.views: t.c.views + sql.bindparam('delta', type_=Integer)})
+        for row in rows:
+            result = connection.execute(update, m_id=row['media_id'],
+                bucket=row['bucket_start'], delta=row['views'])
+            if result.rowcount == 0:
+                connection.execute(t.insert(), row)
+
+    def compact(self, connection, now=None):
+        """Delete all buckets which are older than the retention period."""
+        cutoff = self.bucket_for((now or datetime.now()) - self.retention)
+        result = connection.execute(
+            media_view_stats.delete().\
+                where(media_view_stats.c.bucket_start < cutoff)
+        )
+        return result.rowcount
+
+    def views_for(self, connection, media_id, window, now=None):
+        """Return the number of views for the given media within ``window``."""
+        since = (now or datetime.now()) - window
+        t = media_view_stats
+        query = sql.select([sql.func.coalesce(sql.func.sum(t.c.views), 0)],
+            sql.and_(t.c.media_id == media_id, t.c.bucket_start >= since))
+        return int(connection.execute(query).scalar())
+
+    def top_media_ids(self, connection, window, limit=10, now=None):
+        """Return a list of (media_id, views) tuples for the most viewed
+        media within ``window`` (most views first)."""
+        recent = recent_views_query(window, now=now).alias('recent')
+        query = sql.select([recent.c.media_id, recent.c.views]).\
+            order_by(recent.c.views.desc(), recent.c.media_id).\
+            limit(limit)
+        return [(row[0], int(row[1])) for row in connection.execute(query)]
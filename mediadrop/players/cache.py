@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# This file is a part of MediaDrop (https://www.mediadrop.video),
+# Copyright 2009-2018 MediaDrop contributors
+# For the exact contribution history, see the git revision log.
+# The source code contained in this file is licensed under the GPLv3 or
+# (at your option) any later version.
+# See LICENSE.txt in the main project directory, for more information.
+"""
+Player Resolution Cache
+
+Choosing the player for a media item used to query the enabled players, build
+all storage URIs of all files and ask every enabled player if it can play
+them - on every media page and for every embedded player. The player markup
+was rendered again afterwards.
+
+:class:`PlayerCache` keeps the result (the player class, its data and the
+playable URIs) per media id together with the key it was computed for: the
+media's ``modified_on``, its files and the player configuration version (see
+:func:`player_config_version`). The rendered player markup is stored alongside
+the resolution so it is dropped together with it.
+
+Changes to media or media files in this process invalidate the entries at
+once (see the observers below), changes in other processes are detected by
+the key.
+"""
+
+import threading
+
+from paste.deploy.converters import asint
+from pylons import app_globals
+from sqlalchemy.orm.attributes import instance_state
+
+from mediadrop.lib.uri import StorageURI
+from mediadrop.lib.util import current_locale, request_base
+from mediadrop.plugin import events
+from mediadrop.plugin.events import observes
+
+
+__all__ = [
+    'current_player_cache',
+    'PlayerCache',
+    'PlayerResolution',
+    'player_config_version',
+    'resolution_key',
+]
+
+class PlayerResolution(object):
+    """The player chosen for a media item and the URIs it can play.
+
+    URIs are kept as plain tuples so the cache does not keep references to
+    ``MediaFile`` instances (and their sessions). Use :meth:`playable_uris` to
+    get :class:`~mediadrop.lib.uri.StorageURI` instances for a media item.
+    """
+    __slots__ = ('key', 'player_cls', 'player_data', 'uris', 'markup')
+
+    def __init__(self, key, player_cls, player_data, uris):
+        self.key = key
+        self.player_cls = player_cls
+        self.player_data = player_data
+        self.uris = tuple((uri.file.id, uri.scheme, uri.file_uri, uri.server_uri)
+                          for uri in uris)
+        # rendered player markup per set of render arguments
+        self.markup = {}
+
+    def playable_uris(self, media):
+        files = dict((file.id, file) for file in media.files)
+        return [StorageURI(files[file_id], scheme, file_uri, server_uri)
+                for file_id, scheme, file_uri, server_uri in self.uris]
+
+
+class PlayerCache(object):
+    """Cache the enabled players and the :class:`PlayerResolution` of media.
+
+    :param max_entries: Maximum number of cached media (``0`` disables the
+        cache for media, the enabled players are always cached).
+    :param max_markup: Maximum number of rendered variants per media.
+    """
+    def __init__(self, max_entries=1000, max_markup=10):
+        self.max_entries = max_entries
+        self.max_markup = max_markup
+        self._lock = threading.Lock()
+        self._players = None
+        self._resolutions = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_entries=asint(config.get('players.cache_size', 1000)),
+        )
+
+    def enabled_players(self, version, load):
+        """Return the enabled players for the given configuration version
+        (calling ``load`` only if that version was not loaded before)."""
+        cached = self._players
+        if (cached is not None) and (cached[0] == version):
+            return cached[1]
+        players = load()
+        self._players = (version, players)
+        return players
+
+    def get(self, media_id, key):
+        """Return the cached :class:`PlayerResolution` for the media if it was
+        computed for the given key (None otherwise)."""
+        resolution = self._resolutions.get(media_id)
+        if (resolution is None) or (resolution.key != key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return resolution
+
+    def store(self, media_id, resolution):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if (len(self._resolutions) >= self.max_entries) and \
+                    (media_id not in self._resolutions):
+                self._resolutions.clear()
+            self._resolutions[media_id] = resolution
+
+    def store_markup(self, resolution, render_key, markup):
+        if len(resolution.markup) >= self.max_markup:
+            resolution.markup.clear()
+        resolution.markup[render_key] = markup
+
+    def invalidate(self, media_id):
+        with self._lock:
+            self._resolutions.pop(media_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._players = None
+            self._resolutions.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def current_player_cache():
+    from mediadrop.lib.app_globals import is_object_registered
+    if not is_object_registered(app_globals):
+        return None
+    return getattr(app_globals, 'player_cache', None)
+
+def player_config_version():
+    """Return the version of the player configuration.
+
+    Player preferences share the version of the settings (every change of
+    the ``players`` table increments it) as the rendered markup depends on
+    the appearance settings anyway."""
+    from mediadrop.model.settings_snapshot import current_settings
+    return current_settings().version
+
+def _is_modified(instance):
+    return (instance.id is None) or instance_state(instance).modified
+
+def resolution_key(media):
+    """Return the key of the :class:`PlayerResolution` for the given media
+    or None if the media (or one of its files) has unsaved changes."""
+    if _is_modified(media):
+        return None
+    files = []
+    for file in media.files:
+        if _is_modified(file):
+            return None
+        files.append((file.id, file.modified_on, file.unique_id))
+    return (media.modified_on, tuple(files), player_config_version(),
+            request_base())
+
+
+@observes(events.Media.after_update, events.Media.after_delete)
+def _media_changed(instance):
+    cache = current_player_cache()
+    if cache is not None:
+        cache.invalidate(instance.id)
+
+@observes(events.MediaFile.after_insert, events.MediaFile.after_update,
+    events.MediaFile.after_delete)
+def _media_file_changed(instance):
+    cache = current_player_cache()
+    if cache is not None:
+        cache.invalidate(instance.media_id)
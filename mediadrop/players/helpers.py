@@ -10,8 +10,10 @@ from itertools import izip
 
 from genshi.builder import Element
 
-from mediadrop.lib.templating import render
+from mediadrop.lib.templating import render, render_stream
 from mediadrop.lib.util import url_for
+from mediadrop.players.cache import (current_locale, current_player_cache,
+    PlayerResolution, resolution_key)
 
 
 __all__ = [
@@ -20,11 +22,14 @@ __all__ = [
     'media_player',
     'pick_any_media_file',
     'pick_podcast_media_file',
+    'player_resolution',
     'preferred_player_for_media',
     'update_enabled_players',
 ]
 
-def preferred_player_for_media(media, **kwargs):
+def _resolve_player(media):
+    """Return the first enabled player class which can play any uri of the
+    given media, its data and the uris it can play."""
     uris = media.get_uris()
 
     from mediadrop.model.players import fetch_enabled_players
@@ -34,12 +39,31 @@ def preferred_player_for_media(media, **kwargs):
         if any(can_play):
             break
     else:
-        return None
+        return None, None, ()
 
     # Grab just the uris that the chosen player can play
     playable_uris = [uri for uri, plays in izip(uris, can_play) if plays]
-    kwargs['data'] = player_data
-    return player_cls(media, playable_uris, **kwargs)
+    return player_cls, player_data, playable_uris
+
+def player_resolution(media):
+    """Return the (cached) :class:`~mediadrop.players.cache.PlayerResolution`
+    for the given media."""
+    cache = current_player_cache()
+    key = (cache is not None) and resolution_key(media)
+    if not key:
+        return PlayerResolution(None, *_resolve_player(media))
+    resolution = cache.get(media.id, key)
+    if resolution is None:
+        resolution = PlayerResolution(key, *_resolve_player(media))
+        cache.store(media.id, resolution)
+    return resolution
+
+def preferred_player_for_media(media, **kwargs):
+    resolution = player_resolution(media)
+    if resolution.player_cls is None:
+        return None
+    kwargs['data'] = resolution.player_data
+    return resolution.player_cls(media, resolution.playable_uris(media), **kwargs)
 
 
 
@@ -71,10 +95,26 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
     :param \*\*kwargs: Extra kwargs for :meth:`AbstractPlayer.__init__`.
 
     :rtype: `str` or `None`
-    :returns: A rendered player.
+    :returns: A rendered player. The rendered markup is cached together with
+        the player resolution of the media (see :mod:`mediadrop.players.cache`).
     """
+    resolution = player_resolution(media)
+    render_key = None
+    if resolution.key is not None:
+        render_key = (is_widescreen, show_like, show_dislike, show_download,
+            show_embed, show_playerbar, show_popout, show_resize, show_share,
+            js_init, tuple(sorted(kwargs.items())), current_locale())
+        try:
+            markup = resolution.markup.get(render_key)
+        except TypeError:
+            # unhashable player arguments, do not cache the markup
+            render_key = None
+            markup = None
+        if markup is not None:
+            return markup
+
     player = preferred_player_for_media(media, **kwargs)
-    return render('players/html5_or_flash.html', {
+    stream = render('players/html5_or_flash.html', {
         'player': player,
         'media': media,
         'uris': media.get_uris(),
@@ -89,6 +129,11 @@ def media_player(media, is_widescreen=False, show_like=True, show_dislike=True,
         'show_resize': show_resize and (player and player.supports_resizing),
         'show_share': show_share,
     })
+    if render_key is None:
+        return stream
+    markup = render_stream(stream, method='xhtml')
+    current_player_cache().store_markup(resolution, render_key, markup)
+    return markup
 
 def pick_podcast_media_file(media):
     """Return a file playable in the most podcasting client: iTunes.
@@ -109,13 +154,10 @@ def pick_any_media_file(media):
     :param media: A :class:`~mediadrop.model.media.Media` instance.
     :returns: A :class:`~mediadrop.model.media.MediaFile` object or None
     """
-    uris = media.get_uris()
-    from mediadrop.model.players import fetch_enabled_players
-    for player_cls, player_data in fetch_enabled_players():
-        for i, plays in enumerate(player_cls.can_play(uris)):
-            if plays:
-                return uris[i]
-    return None
+    playable_uris = player_resolution(media).playable_uris(media)
+    if not playable_uris:
+        return None
+    return playable_uris[0]
 
 def update_enabled_players():
     """Ensure that the encoding status of all media is up to date with the new
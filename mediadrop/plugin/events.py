@@ -180,6 +180,7 @@ class Admin(object):
         save = Event(['**kwargs'])
         add_file = Event(['**kwargs'])
         edit_file = Event(['**kwargs'])
+        file_status = Event(['**kwargs'])
         merge_stubs = Event(['**kwargs'])
         save_thumb = Event(['**kwargs'])
         update_status = Event(['**kwargs'])
@@ -303,6 +304,7 @@ class PodcastsController(object):
 class SitemapsController(object):
     # observers (if they are not marked as "run_before=True") must support pure
     # string output (from beaker cache) instead of a dict with template variables.
+    # "google" and "mrss" return a streaming response (an iterable of chunks).
     google = Event(['page', 'limit', '**kwargs'])
     mrss = Event(['**kwargs'])
     latest = Event(['limit', 'skip', '**kwargs'])
@@ -312,6 +314,7 @@ class UploadController(object):
     index = Event(['**kwargs'])
     submit = Event(['**kwargs'])
     submit_async = Event(['**kwargs'])
+    status = Event(['**kwargs'])
     success = Event(['**kwargs'])
     failure = Event(['**kwargs'])
 
@@ -362,6 +365,14 @@ class Category(object):
     before_update = Event(['instance'])
     after_update = Event(['instance'])
 
+class PlayerPrefs(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
 class Views_Counter(object):
     before_delete = Event(['instance'])
     after_delete = Event(['instance'])
@@ -402,6 +413,27 @@ class User(object):
     before_update = Event(['instance'])
     after_update = Event(['instance'])
 
+class Group(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
+class Permission(object):
+    before_delete = Event(['instance'])
+    after_delete = Event(['instance'])
+    before_insert = Event(['instance'])
+    after_insert = Event(['instance'])
+    before_update = Event(['instance'])
+    after_update = Event(['instance'])
+
+class ViewCounter(object):
+    # buffered views were written to the database, the only argument is a dict
+    # which maps media ids to the number of new views.
+    flushed = Event(['deltas'])
+
 ###############################################################################
 # Forms
 
@@ -21,29 +21,6 @@ ON SCHEDULE EVERY 10 MINUTE
 DO
 DELETE FROM view_check WHERE updated_date < (CURRENT_TIMESTAMP - INTERVAL 1 HOUR);
 
-ALTER TABLE media
-ADD views3 INT DEFAULT 0,
-ADD views6 INT DEFAULT 0,
-ADD views9 INT DEFAULT 0,
-ADD views12 INT DEFAULT 0,
-ADD views15 INT DEFAULT 0,
-ADD views18 INT DEFAULT 0,
-ADD views21 INT DEFAULT 0,
-ADD views24 INT DEFAULT 0;
-
-update media
-SET views3 = 0,
-views6 = 0,
-views9 = 0,
-views12 = 0,
-views15 = 0,
-views18 = 0,
-views21 = 0,
-views24 = 0;
-
-DROP EVENT update_media_views;
-CREATE EVENT update_media_views
-ON SCHEDULE EVERY 3 HOUR
-DO
-update media SET views24 = views21, views21 = views18, views18 = views15, views15 = views12, views12 = views9, views9 = views6, views6 = views3, views3 = 0;
-
+-- The views3 ... views24 columns (and the "update_media_views" event which
+-- shifted them every 3 hours) were replaced by the "media_view_stats" table.
+-- Alembic revision a47bd57dc2ab removes them if they exist.
@@ -2,6 +2,11 @@
 -- XXX: If your config.ini file has a db_table_prefix set, you'll have to
 --      manually prepend it to all table names in this class. This is far
 --      from ideal, it's true, and we hope to improve this in the future.
+--
+-- NOTE: MediaDrop checks only once per process whether full text search is
+--       available. Newly installed triggers are detected within 5 minutes (or
+--       when the next media item is added) but after removing the triggers
+--       you need to restart MediaDrop.
 
 
 DELIMITER //